@@ -0,0 +1,411 @@
+"""
+Backup repository: deduplicated, compressed storage snapshots
+Files are cut into content-defined chunks (gear-hash CDC, as in FastCDC), so an insert in a
+large file changes only the chunks around it. Each chunk is stored once, keyed by its sha256,
+zlib-compressed into packfiles of about PACK_SIZE bytes; the chunk index (SQLite) maps a chunk
+to its pack and offset. A snapshot is a manifest of files and their chunk lists. forget()
+applies the hourly/daily/weekly retention policy; prune() deletes packs nothing references
+any more and rewrites packs that are mostly garbage, so the space is reclaimed.
+
+One process uses a repository at a time: Repository() takes an exclusive lock on its lock file
+and holds it until close(), so a manual prune cannot delete packs and index rows a running
+backup has already deduplicated against (or the pack it is writing).
+
+Layout under the repository root:
+  lock                       flock()ed by the process using the repository
+  index.db                   chunk id -> (pack, offset, length, size)
+  packs/<id>.pack            blobs back to back: 1 codec byte (0 raw, 1 zlib) + data
+  snapshots/<name>.chunks    the snapshot's chunk ids, 32 bytes each (what prune reads)
+  snapshots/<name>.files.gz  "size<TAB>mtime_ns<TAB>id,id,...<TAB>path" per file, written last
+"""
+
+import fcntl
+import gzip
+import hashlib
+import os
+import sqlite3
+import threading
+import uuid
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+CHUNK_MIN = int(os.environ.get("BACKUP_CHUNK_MIN", str(256 * 1024)))  # no cut point before this many bytes
+CHUNK_AVG = int(os.environ.get("BACKUP_CHUNK_AVG", str(1024 * 1024)))  # expected chunk size (a power of two)
+CHUNK_MAX = int(os.environ.get("BACKUP_CHUNK_MAX", str(4 * 1024 * 1024)))  # forced cut point
+PACK_SIZE = int(os.environ.get("BACKUP_PACK_SIZE", str(16 * 1024 * 1024)))  # bytes per packfile before a new one
+COMPRESSION_LEVEL = int(os.environ.get("BACKUP_COMPRESSION_LEVEL", "6"))  # zlib level, 0 stores chunks raw
+PRUNE_REPACK_RATIO = float(os.environ.get("BACKUP_PRUNE_REPACK_RATIO", "0.3"))  # garbage share that gets a pack rewritten
+
+# 64-bit gear values, fixed so that the same content is always cut at the same places
+GEAR = [int.from_bytes(hashlib.sha256(bytes([i])).digest()[:8], "big") for i in range(256)]
+_BITS = CHUNK_AVG.bit_length() - 1
+# normalized chunking: a stricter mask before the average size and a looser one after it keeps
+# chunk sizes close to the average; the masks use the top bits, which depend on the last 64 bytes
+MASK_STRICT = ((1 << (_BITS + 1)) - 1) << (64 - _BITS - 1)
+MASK_LOOSE = ((1 << (_BITS - 1)) - 1) << (64 - _BITS + 1)
+
+RAW, ZLIB = 0, 1
+
+
+def cut_point(data):
+    """Length of the first content-defined chunk at the start of data"""
+    end = min(len(data), CHUNK_MAX)
+    if end <= CHUNK_MIN:
+        return end
+    normal = min(end, CHUNK_AVG)
+    gear = GEAR
+    h = 0
+    for i in range(CHUNK_MIN, normal):
+        h = ((h << 1) + gear[data[i]]) & 0xFFFFFFFFFFFFFFFF
+        if not h & MASK_STRICT:
+            return i + 1
+    for i in range(normal, end):
+        h = ((h << 1) + gear[data[i]]) & 0xFFFFFFFFFFFFFFFF
+        if not h & MASK_LOOSE:
+            return i + 1
+    return end
+
+
+def iter_chunks(f, throttle=None):
+    """Content-defined chunks of an open binary file (reads are charged to throttle)"""
+    buffer = b""
+    eof = False
+    while True:
+        if not eof and len(buffer) < CHUNK_MAX:
+            more = f.read(CHUNK_MAX * 2)
+            if throttle:
+                throttle.consume(len(more))
+            eof = not more
+            buffer += more
+        if not buffer:
+            return
+        length = cut_point(buffer) if not eof or len(buffer) > CHUNK_MIN else len(buffer)
+        yield buffer[:length]
+        buffer = buffer[length:]
+
+
+def keep_by_policy(names, hourly, daily, weekly):
+    """Snapshots kept: the newest of each of the last `hourly` hours, `daily` days and `weekly` weeks"""
+    kept = set(names[-1:])
+    for count, period in ((hourly, "%Y%m%d%H"), (daily, "%Y%m%d"), (weekly, "%G%V")):
+        seen = set()
+        for name in reversed(names):
+            key = datetime.strptime(name, "%Y%m%d_%H%M%S").strftime(period)
+            if key in seen:
+                continue
+            if len(seen) >= count:
+                break
+            seen.add(key)
+            kept.add(name)
+    return kept
+
+
+class RepositoryLocked(RuntimeError):
+    """Another process holds the repository (Repository(..., wait=False))"""
+
+
+class Repository:
+    def __init__(self, root, throttle=None, wait=True):
+        self.root = root
+        self.throttle = throttle  # Throttle charged with backup and prune I/O, or None
+        self.packs_dir = os.path.join(root, "packs")
+        self.snapshots_dir = os.path.join(root, "snapshots")
+        os.makedirs(self.packs_dir, exist_ok=True)
+        os.makedirs(self.snapshots_dir, exist_ok=True)
+        # exclusive until close(): waits for (or with wait=False, refuses) another process's backup or prune
+        self._lock_file = open(os.path.join(root, "lock"), "a")
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | (0 if wait else fcntl.LOCK_NB))
+        except BlockingIOError:
+            self._lock_file.close()
+            raise RepositoryLocked(f"{root} is in use by another process (a backup, prune or restore is running)")
+        # shared by the backup workers: the index and the pack being written are used under _lock
+        self.db = sqlite3.connect(os.path.join(root, "index.db"), check_same_thread=False)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS chunks (
+            id BLOB PRIMARY KEY,
+            pack TEXT NOT NULL,
+            offset INTEGER NOT NULL,
+            length INTEGER NOT NULL,
+            size INTEGER NOT NULL)""")
+        self.db.execute("CREATE INDEX IF NOT EXISTS chunks_pack ON chunks (pack)")
+        self.pack = None  # (id, file) of the pack being written
+        self.pending = {}  # chunk id -> index row, for chunks in the pack being written
+        self.readers = {}  # pack id -> open file, for restores and repacks
+        self._lock = threading.RLock()
+
+    def close(self):
+        self._finish_pack()
+        for f in self.readers.values():
+            f.close()
+        self.db.close()
+        self._lock_file.close()  # releases the lock
+
+    # ---------------- Chunks and packs ----------------
+    def _pack_path(self, pack):
+        return os.path.join(self.packs_dir, f"{pack}.pack")
+
+    def has_chunk(self, chunk_id):
+        with self._lock:
+            return chunk_id in self.pending or self.db.execute(
+                "SELECT 1 FROM chunks WHERE id = ?", (chunk_id,)).fetchone() is not None
+
+    def _write_blob(self, chunk_id, blob, size):
+        with self._lock:
+            if self.pack is None:
+                pack = uuid.uuid4().hex
+                self.pack = (pack, open(self._pack_path(pack) + ".tmp", "wb"))
+            pack, f = self.pack
+            self.pending[chunk_id] = (chunk_id, pack, f.tell(), len(blob), size)
+            f.write(blob)
+            if f.tell() >= PACK_SIZE:
+                self._finish_pack()
+
+    def _finish_pack(self):
+        """Make the pack durable, then index its chunks (a pack without index rows is removed by prune)"""
+        with self._lock:
+            if self.pack is None:
+                return
+            pack, f = self.pack
+            f.flush()
+            os.fsync(f.fileno())
+            f.close()
+            os.replace(self._pack_path(pack) + ".tmp", self._pack_path(pack))
+            with self.db:
+                self.db.executemany("INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?, ?)", self.pending.values())
+            self.pack = None
+            self.pending = {}
+
+    def put_chunk(self, data):
+        """Store a chunk unless the repository has it; returns (id, bytes added to packs)"""
+        # hashing and compression release the GIL, so workers run them in parallel
+        chunk_id = hashlib.sha256(data).digest()
+        if self.has_chunk(chunk_id):
+            return chunk_id, 0
+        compressed = zlib.compress(data, COMPRESSION_LEVEL) if COMPRESSION_LEVEL else data
+        blob = bytes([ZLIB]) + compressed if len(compressed) < len(data) else bytes([RAW]) + data
+        with self._lock:
+            if self.has_chunk(chunk_id):
+                return chunk_id, 0  # another worker stored it meanwhile
+            self._write_blob(chunk_id, blob, len(data))
+        if self.throttle:
+            self.throttle.consume(len(blob))
+        return chunk_id, len(blob)
+
+    def _read_blob(self, chunk_id):
+        with self._lock:
+            row = self.pending.get(chunk_id) or self.db.execute(
+                "SELECT id, pack, offset, length, size FROM chunks WHERE id = ?", (chunk_id,)).fetchone()
+            if row is None:
+                raise KeyError(f"chunk {chunk_id.hex()} is not in the repository")
+            _, pack, offset, length, _ = row
+            if self.pack and pack == self.pack[0]:
+                self.pack[1].flush()
+            if pack not in self.readers:
+                path = self._pack_path(pack)
+                self.readers[pack] = open(path if os.path.exists(path) else path + ".tmp", "rb")
+            f = self.readers[pack]
+            f.seek(offset)
+            blob = f.read(length)
+        if self.throttle:
+            self.throttle.consume(length)
+        return blob
+
+    def read_chunk(self, chunk_id):
+        blob = self._read_blob(chunk_id)
+        data = zlib.decompress(blob[1:]) if blob[0] == ZLIB else blob[1:]
+        if hashlib.sha256(data).digest() != chunk_id:
+            raise ValueError(f"chunk {chunk_id.hex()} is corrupt")
+        return data
+
+    # ---------------- Snapshots ----------------
+    def snapshots(self):
+        """Names of the complete snapshots, oldest first"""
+        return sorted(name[:-len(".files.gz")] for name in os.listdir(self.snapshots_dir)
+                      if name.endswith(".files.gz"))
+
+    def read_files(self, name):
+        """(path, size, mtime_ns, comma-separated hex chunk ids) of every file in a snapshot"""
+        with gzip.open(os.path.join(self.snapshots_dir, f"{name}.files.gz"), "rt", encoding="utf-8",
+                       errors="surrogateescape") as f:
+            for line in f:
+                size, mtime_ns, chunks, path = line.rstrip("\n").split("\t", 3)
+                yield path, int(size), int(mtime_ns), chunks
+
+    def backup(self, name, source, files, workers=1):
+        """
+        Snapshot `files` ((relative path, stat) pairs under source) as `name`, reading and
+        chunking up to `workers` files at a time. A file with the same size and mtime as in the
+        newest snapshot reuses its chunk list without being read
+        Returns {"files", "read", "reused", "read_bytes", "added_bytes"}
+        """
+        names = self.snapshots()
+        previous = {path: (size, mtime_ns, chunks) for path, size, mtime_ns, chunks
+                    in self.read_files(names[-1])} if names else {}
+        stats = {"files": 0, "read": 0, "reused": 0, "read_bytes": 0, "added_bytes": 0}
+        chunk_ids = set()
+        files_path = os.path.join(self.snapshots_dir, f"{name}.files.gz")
+        # files in walk order: (rel, stat, chunk list) or (rel, stat, future of store_file); the
+        # manifest is written from the front, and at most workers * 4 files are in the window
+        window = deque()
+
+        def write_front(manifest):
+            rel, stat, chunks = window.popleft()
+            if not isinstance(chunks, str):
+                try:
+                    ids, read_bytes, added_bytes = chunks.result()
+                except FileNotFoundError:
+                    return  # deleted since the walk saw it
+                chunk_ids.update(ids)
+                chunks = ",".join(i.hex() for i in ids)
+                stats["read"] += 1
+                stats["read_bytes"] += read_bytes
+                stats["added_bytes"] += added_bytes
+            stats["files"] += 1
+            # the stat from before the read: a file changed while it was read is read again next time
+            manifest.write(f"{stat.st_size}\t{stat.st_mtime_ns}\t{chunks}\t{rel}\n")
+
+        with ThreadPoolExecutor(max_workers=workers) as pool, \
+                gzip.open(files_path + ".tmp", "wt", encoding="utf-8", errors="surrogateescape") as manifest:
+            for rel, stat in files:
+                if "\n" in rel or "\t" in rel:
+                    print(f"Backup skips {rel!r}: tabs and newlines are not allowed in names")
+                    continue
+                entry = previous.get(rel)
+                if entry and entry[:2] == (stat.st_size, stat.st_mtime_ns):
+                    chunk_ids.update(bytes.fromhex(c) for c in entry[2].split(",") if c)
+                    stats["reused"] += 1
+                    window.append((rel, stat, entry[2]))
+                else:
+                    window.append((rel, stat, pool.submit(self.store_file, os.path.join(source, rel))))
+                while window and (len(window) > workers * 4 or isinstance(window[0][2], str)
+                                  or window[0][2].done()):
+                    write_front(manifest)
+            while window:
+                write_front(manifest)
+        self._finish_pack()
+        with open(os.path.join(self.snapshots_dir, f"{name}.chunks"), "wb") as f:
+            f.write(b"".join(sorted(chunk_ids)))
+        os.replace(files_path + ".tmp", files_path)
+        return stats
+
+    def store_file(self, path):
+        """Chunk and store one file; returns (chunk ids, bytes read, bytes added to packs)"""
+        ids = []
+        read_bytes = added_bytes = 0
+        with open(path, "rb") as f:
+            if self.throttle:
+                self.throttle.consume(0)  # the open
+            for data in iter_chunks(f, self.throttle):
+                chunk_id, added = self.put_chunk(data)
+                ids.append(chunk_id)
+                read_bytes += len(data)
+                added_bytes += added
+        return ids, read_bytes, added_bytes
+
+    def checksums(self, name, paths):
+        """sha256 (hex) of the content of the given files in snapshot name; files it lacks are left out"""
+        wanted = set(paths)
+        digests = {}
+        for path, _, _, chunks in self.read_files(name):
+            if path in wanted:
+                digest = hashlib.sha256()
+                for chunk in chunks.split(","):
+                    if chunk:
+                        digest.update(self.read_chunk(bytes.fromhex(chunk)))
+                digests[path] = digest.hexdigest()
+        return digests
+
+    def restore(self, name, target):
+        """Write snapshot `name` into the directory target; returns the number of files"""
+        count = 0
+        for path, _, mtime_ns, chunks in self.read_files(name):
+            destination = os.path.join(target, path)
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            with open(destination, "wb") as f:
+                for chunk in chunks.split(","):
+                    if chunk:
+                        f.write(self.read_chunk(bytes.fromhex(chunk)))
+            os.utime(destination, ns=(mtime_ns, mtime_ns))
+            count += 1
+        return count
+
+    # ---------------- Retention ----------------
+    def forget(self, hourly, daily, weekly):
+        """Delete the snapshots the retention policy does not keep (their chunks stay until prune); returns their names"""
+        names = self.snapshots()
+        kept = keep_by_policy(names, hourly, daily, weekly)
+        forgotten = [name for name in names if name not in kept]
+        for name in forgotten:
+            os.remove(os.path.join(self.snapshots_dir, f"{name}.files.gz"))
+            try:
+                os.remove(os.path.join(self.snapshots_dir, f"{name}.chunks"))
+            except FileNotFoundError:
+                pass
+        return forgotten
+
+    def prune(self, repack_ratio=PRUNE_REPACK_RATIO):
+        """
+        Reclaim the space of chunks no snapshot references: packs with no live chunk are deleted,
+        packs whose garbage share is at least repack_ratio have their live chunks copied into new
+        packs and are then deleted. Returns {"deleted_packs", "repacked_packs", "freed_bytes"}
+        """
+        self._finish_pack()
+        live = set()
+        for name in self.snapshots():
+            with open(os.path.join(self.snapshots_dir, f"{name}.chunks"), "rb") as f:
+                data = f.read()
+            live.update(data[i:i + 32] for i in range(0, len(data), 32))
+
+        packs = {}
+        for chunk_id, pack, length in self.db.execute("SELECT id, pack, length FROM chunks"):
+            live_ids, live_bytes, dead_bytes = packs.setdefault(pack, ([], [0], [0]))
+            if chunk_id in live:
+                live_ids.append(chunk_id)
+                live_bytes[0] += length
+            else:
+                dead_bytes[0] += length
+        stats = {"deleted_packs": 0, "repacked_packs": 0, "freed_bytes": 0}
+        retired = []
+        for pack, (live_ids, live_bytes, dead_bytes) in packs.items():
+            if not live_ids:
+                retired.append(pack)
+                stats["deleted_packs"] += 1
+            elif dead_bytes[0] >= repack_ratio * (live_bytes[0] + dead_bytes[0]):
+                for chunk_id in live_ids:
+                    size = self.db.execute("SELECT size FROM chunks WHERE id = ?", (chunk_id,)).fetchone()[0]
+                    blob = self._read_blob(chunk_id)
+                    self._write_blob(chunk_id, blob, size)
+                    if self.throttle:
+                        self.throttle.consume(len(blob))
+                retired.append(pack)
+                stats["repacked_packs"] += 1
+        # live chunks now point at their new packs; only then are the old packs dropped
+        self._finish_pack()
+        for pack in retired:
+            with self.db:
+                self.db.execute("DELETE FROM chunks WHERE pack = ?", (pack,))
+            self._remove_pack(pack, stats)
+        # packs left behind by an interrupted backup (written but never indexed)
+        indexed = {row[0] for row in self.db.execute("SELECT DISTINCT pack FROM chunks")}
+        for name in os.listdir(self.packs_dir):
+            pack = name.split(".")[0]
+            if pack not in indexed:
+                self._remove_pack(pack, stats)
+        return stats
+
+    def _remove_pack(self, pack, stats):
+        reader = self.readers.pop(pack, None)
+        if reader:
+            reader.close()
+        for path in (self._pack_path(pack), self._pack_path(pack) + ".tmp"):
+            try:
+                stats["freed_bytes"] += os.path.getsize(path)
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def size(self):
+        """Bytes the packs take"""
+        return sum(entry.stat().st_size for entry in os.scandir(self.packs_dir))
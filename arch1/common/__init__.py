@@ -0,0 +1 @@
+"""Code shared by the arch1 services (mounted into each container at /app/common)"""
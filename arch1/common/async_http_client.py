@@ -0,0 +1,136 @@
+"""
+Async counterpart of common/http_client.py for the asyncio gateways (app_async.py)
+One aiohttp keepalive pool per process, deadlines on getting a response, bounded
+retries with jitter for idempotent requests and the same per-host circuit breaker
+"""
+
+import asyncio
+import logging
+import os
+import random
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from common.http_client import (CircuitBreaker, CircuitOpenError, HTTP_CONNECT_TIMEOUT, HTTP_DEADLINE,
+                                HTTP_READ_TIMEOUT, HTTP_RETRIES, HTTP_RETRY_BACKOFF, IDEMPOTENT_METHODS,
+                                RETRYABLE_STATUS)
+
+logger = logging.getLogger(__name__)
+
+# An async gateway keeps one connection per in-flight transfer, so its pool is much larger
+HTTP_ASYNC_POOL_SIZE = int(os.environ.get('HTTP_ASYNC_POOL_SIZE', '4096'))  # connections kept per host
+
+
+class AsyncInternalHTTPClient:
+    """
+    aiohttp.ClientSession wrapper used for every call between services from an async gateway
+    The session is created on first use inside the running event loop; call close() on shutdown
+    """
+
+    def __init__(self, pool_size=HTTP_ASYNC_POOL_SIZE, connect_timeout=HTTP_CONNECT_TIMEOUT,
+                 read_timeout=HTTP_READ_TIMEOUT, deadline=HTTP_DEADLINE, retries=HTTP_RETRIES,
+                 retry_backoff=HTTP_RETRY_BACKOFF):
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.deadline = deadline
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self._session = None
+        self._breakers = {}
+
+    @property
+    def session(self):
+        if self._session is None or self._session.closed:
+            # No total timeout: a streamed body may take as long as it needs, as long as bytes keep arriving
+            timeout = aiohttp.ClientTimeout(total=None, connect=self.connect_timeout, sock_read=self.read_timeout)
+            connector = aiohttp.TCPConnector(limit=0, limit_per_host=self.pool_size)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+    def _breaker(self, host):
+        # Single event loop thread, so no lock is needed
+        if host not in self._breakers:
+            self._breakers[host] = CircuitBreaker()
+        return self._breakers[host]
+
+    async def _backoff(self, attempt, remaining):
+        await asyncio.sleep(min(max(remaining, 0), random.uniform(0, self.retry_backoff * (2 ** attempt))))
+
+    async def request(self, method, url, deadline=None, retries=None, **kwargs):
+        """
+        Send a request and return the aiohttp.ClientResponse once its headers have arrived
+        The caller reads the body (json()/read() release the connection, or iterate
+        resp.content and call release()). The deadline covers getting the response,
+        retries included; idempotent methods are retried on connection errors, timeouts
+        and 502/503/504. Raises CircuitOpenError while the host's breaker is open
+        """
+        method = method.upper()
+        host = urlsplit(url).netloc
+        breaker = self._breaker(host)
+        loop = asyncio.get_running_loop()
+        deadline_at = loop.time() + (deadline or self.deadline)
+        if retries is None:
+            retries = self.retries if method in IDEMPOTENT_METHODS else 0
+
+        for attempt in range(retries + 1):
+            last_attempt = attempt == retries
+            if not breaker.allow_request():
+                raise CircuitOpenError(f"Circuit breaker open for {host}")
+            remaining = deadline_at - loop.time()
+            if remaining <= 0:
+                breaker.release()
+                raise asyncio.TimeoutError(f"Deadline exceeded calling {method} {url}")
+            try:
+                resp = await asyncio.wait_for(self.session.request(method, url, **kwargs), remaining)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                breaker.record_failure()
+                if last_attempt:
+                    raise
+                logger.warning(f"{method} {url} failed ({e!r}), retrying")
+                await self._backoff(attempt, deadline_at - loop.time())
+                continue
+            except BaseException:
+                breaker.release()
+                raise
+
+            if resp.status in RETRYABLE_STATUS:
+                breaker.record_failure()
+                if not last_attempt:
+                    resp.release()
+                    await self._backoff(attempt, deadline_at - loop.time())
+                    continue
+            else:
+                breaker.record_success()
+            return resp
+
+    async def get(self, url, **kwargs):
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request("POST", url, **kwargs)
+
+    async def delete(self, url, **kwargs):
+        return await self.request("DELETE", url, **kwargs)
+
+
+async def iter_field_chunks(field, chunk_size):
+    """Chunks of one part of an incoming aiohttp multipart body, read as the client sends them"""
+    while True:
+        chunk = await field.read_chunk(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def multipart_body(field, filename, mimetype, chunks):
+    """Outgoing multipart/form-data body with one file field streamed from an async chunk iterator"""
+    writer = aiohttp.MultipartWriter("form-data")
+    part = writer.append(chunks, {"Content-Type": mimetype or "application/octet-stream"})
+    part.set_content_disposition("form-data", name=field, filename=filename)
+    return writer
@@ -0,0 +1,133 @@
+"""
+Auth hot-path helpers shared by the gateways
+- VerifiedTokenCache: bounded LRU of already verified JWTs (keyed by token digest, honours exp)
+- PasswordHasher: bounded worker pool with admission control for password hashing
+- UserCache: short-TTL cache of user records fetched from the metadata service at login
+"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+AUTH_TOKEN_CACHE_SIZE = int(os.environ.get('AUTH_TOKEN_CACHE_SIZE', '10000'))  # verified tokens kept, 0 disables
+AUTH_HASH_WORKERS = int(os.environ.get('AUTH_HASH_WORKERS', '2'))  # threads hashing passwords at once
+AUTH_HASH_QUEUE = int(os.environ.get('AUTH_HASH_QUEUE', '32'))  # hash jobs admitted (running + waiting)
+AUTH_RETRY_AFTER = int(os.environ.get('AUTH_RETRY_AFTER', '1'))  # seconds clients are told to wait when shed
+AUTH_USER_CACHE_TTL = float(os.environ.get('AUTH_USER_CACHE_TTL', '30'))  # seconds a user record is reused, 0 disables
+
+
+def token_digest(token):
+    return hashlib.sha256(token.encode()).digest()
+
+
+class VerifiedTokenCache:
+    """
+    LRU of tokens whose signature has already been verified: digest -> (username, exp)
+    Only successful verifications are stored, and an entry stops matching once exp passes
+    """
+
+    def __init__(self, max_entries=AUTH_TOKEN_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token):
+        """Username of a cached, unexpired token, else None"""
+        if not self.max_entries:
+            return None
+        key = token_digest(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            username, exp = entry
+            if exp is not None and exp <= time.time():
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return username
+
+    def put(self, token, username, exp):
+        if not self.max_entries:
+            return
+        key = token_digest(token)
+        with self._lock:
+            self._entries[key] = (username, exp)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class HashPoolFull(Exception):
+    """Raised instead of queueing when AUTH_HASH_QUEUE hash jobs are already admitted"""
+
+    def __init__(self, retry_after=AUTH_RETRY_AFTER):
+        super().__init__("Too many password checks in progress")
+        self.retry_after = retry_after
+
+
+class PasswordHasher:
+    """
+    Password hashing on a small dedicated pool, so a login storm uses at most
+    AUTH_HASH_WORKERS cores and never more than AUTH_HASH_QUEUE waiting requests;
+    the rest are shed with HashPoolFull (the gateways answer 503 + Retry-After)
+    """
+
+    def __init__(self, workers=AUTH_HASH_WORKERS, max_pending=AUTH_HASH_QUEUE):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="auth-hash")
+        self._admitted = threading.BoundedSemaphore(max_pending)
+        self.rejected = 0
+
+    def submit(self, fn, *args):
+        """Run fn on the hash pool; returns a concurrent.futures.Future or raises HashPoolFull"""
+        if not self._admitted.acquire(blocking=False):
+            self.rejected += 1
+            raise HashPoolFull()
+        future = self.executor.submit(fn, *args)
+        future.add_done_callback(lambda _: self._admitted.release())
+        return future
+
+    def check(self, stored_hash, password):
+        return self.submit(check_password_hash, stored_hash, password).result()
+
+    def generate(self, password):
+        return self.submit(generate_password_hash, password).result()
+
+
+class UserCache:
+    """Short-TTL LRU of user records from the metadata service (saves a round trip per login)"""
+
+    def __init__(self, ttl=AUTH_USER_CACHE_TTL, max_entries=AUTH_TOKEN_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, username):
+        if self.ttl <= 0:
+            return None
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is None or entry[1] <= time.monotonic():
+                self._entries.pop(username, None)
+                return None
+            return entry[0]
+
+    def put(self, username, user):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[username] = (user, time.monotonic() + self.ttl)
+            self._entries.move_to_end(username)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
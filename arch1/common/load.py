@@ -0,0 +1,62 @@
+"""
+Load report for background jobs (GET /load)
+Counts the requests a service is working on, until their response body has been sent (so
+downloads count while they stream), and combines that with the 1-minute load average, which on
+Linux includes tasks waiting for the disk. The backup service polls it and slows down while
+the service reports busy.
+"""
+
+import os
+import threading
+
+from flask import jsonify
+from werkzeug.wsgi import ClosingIterator
+
+LOAD_BUSY_REQUESTS = int(os.environ.get('LOAD_BUSY_REQUESTS', '16'))  # requests in progress that count as busy
+LOAD_BUSY_LOADAVG = float(os.environ.get('LOAD_BUSY_LOADAVG', '0')) or float(os.cpu_count() or 1)  # busy load average
+
+_UNCOUNTED = ("/load", "/health", "/metrics")  # polls, not work
+
+
+class RequestsInProgress:
+    """WSGI middleware counting requests in progress"""
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def _done(self):
+        with self._lock:
+            self.count -= 1
+
+    def __call__(self, environ, start_response):
+        if environ.get("PATH_INFO") in _UNCOUNTED:
+            return self.wsgi_app(environ, start_response)
+        with self._lock:
+            self.count += 1
+        try:
+            body = self.wsgi_app(environ, start_response)
+        except BaseException:
+            self._done()
+            raise
+        return ClosingIterator(body, self._done)
+
+
+def install_load_report(app, extra=None):
+    """
+    Count the Flask app's requests and serve GET /load. extra() may return more work in progress
+    (e.g. 2PC transactions), as {name: count}; it is reported and added to the request count
+    """
+    in_progress = RequestsInProgress(app.wsgi_app)
+    app.wsgi_app = in_progress
+
+    def load():
+        counts = dict(extra() if extra else {})
+        work = in_progress.count + sum(counts.values())
+        loadavg = os.getloadavg()[0]
+        return jsonify({"busy": work >= LOAD_BUSY_REQUESTS or loadavg >= LOAD_BUSY_LOADAVG,
+                        "requests": in_progress.count, **counts, "loadavg": loadavg})
+
+    app.add_url_rule("/load", "load", load, methods=["GET"])
+    return in_progress
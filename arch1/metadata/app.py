@@ -1,7 +1,13 @@
-from flask import Flask, request, jsonify
+import gzip
+import json
+import os
+import time
+from flask import Flask, request, jsonify, Response
 
 app = Flask(__name__)
 
+METADATA_RESTORE = os.environ.get('METADATA_RESTORE', '')  # snapshot (GET /snapshot output, may be gzipped) loaded at startup
+
 # In-memory metadata store
 FILES = {}
 USERS = {}
@@ -53,6 +59,42 @@ def delete_file(filename):
 def list_files():
     return jsonify(list(FILES.values())), 200
 
+# ---------------- Snapshot (backups) ----------------
+@app.route("/snapshot", methods=["GET"])
+def snapshot():
+    # Point-in-time dump as NDJSON: a header line, then one line per file and per user. Records are
+    # replaced, never changed in place, so copying the references (one step under the GIL) is a
+    # consistent view; encoding and sending happen after it, without holding up writers
+    records = list(FILES.values())
+    users = list(USERS.items())
+
+    def lines():
+        yield json.dumps({"snapshot": {"cursor": None, "taken_at": time.time(), "files": len(records),
+                                       "users": len(users)}}) + "\n"
+        batch = []
+        for record in records:
+            batch.append(json.dumps({"file": record}))
+            if len(batch) == 1000:
+                yield "\n".join(batch) + "\n"
+                batch = []
+        batch += [json.dumps({"user": username, "password": password}) for username, password in users]
+        if batch:
+            yield "\n".join(batch) + "\n"
+
+    return Response(lines(), mimetype="application/x-ndjson")
+
+
+def load_snapshot(path):
+    """Fill FILES and USERS from a snapshot file (a backup's metadata_<timestamp>.ndjson.gz)"""
+    with (gzip.open if path.endswith(".gz") else open)(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            entry = json.loads(line)
+            if "file" in entry:
+                FILES[entry["file"]["filename"]] = entry["file"]
+            elif "user" in entry:
+                USERS[entry["user"]] = entry["password"]
+    print(f"Restored {len(FILES)} files and {len(USERS)} users from {path}")
+
 # ---------------- User Registration ----------------
 @app.route("/users", methods=["POST"])
 def add_user():
@@ -81,4 +123,6 @@ def get_user(username):
 if __name__ == "__main__":
     import sys
     sys.stdout.reconfigure(line_buffering=True)  # flush prints immediately
+    if METADATA_RESTORE:
+        load_snapshot(METADATA_RESTORE)
     app.run(host="0.0.0.0", port=5001, debug=True)
@@ -1,15 +1,22 @@
 import os
 import jwt
 import datetime
-from werkzeug.security import generate_password_hash, check_password_hash
+import sys
 from flask import Flask, request, jsonify, Response
-import requests, os
+from common.auth import HashPoolFull, PasswordHasher, UserCache, VerifiedTokenCache
+from common.http_client import InternalHTTPClient
+from common.streaming import MultipartBody, MultipartFileReader
 
 app = Flask(__name__)
 
 STORAGE_API = "http://storage:5002" # storage service URL
 METADATA_API = "http://metadata:5001" # metadata service URL
 SECRET_KEY = os.environ.get("SECRET_KEY", "supersecretkey") # secret key for JWT - in more secure setup, use env variable
+http_client = InternalHTTPClient() # pooled keepalive client for calls to other services
+token_cache = VerifiedTokenCache() # tokens whose signature was already verified
+password_hasher = PasswordHasher() # bounded pool for password hashing, sheds login storms
+user_cache = UserCache() # short-TTL cache of user records looked up at login
+GATEWAY_SERVER_MODE = os.environ.get("GATEWAY_SERVER_MODE", "flask") # "flask" or "async" (aiohttp, see app_async.py)
 
 
 # --- JWT Helpers ---
@@ -23,8 +30,13 @@ def encode_token(username):
     return jwt.encode(payload, SECRET_KEY, algorithm="HS256")
 
 def decode_token(token):
+    # tokens verified before are answered from the cache until they expire
+    username = token_cache.get(token)
+    if username:
+        return username
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
+        token_cache.put(token, payload["sub"], payload.get("exp"))
         return payload["sub"]
     except Exception:
         return None
@@ -42,11 +54,11 @@ def signup():
     if not username or not password:
         return jsonify({"error": "Missing username or password"}), 400
 
-    # hash password before sending to metadata service
-    hashed_password = generate_password_hash(password)
     try:
+        # hash password before sending to metadata service (on the bounded hash pool)
+        hashed_password = password_hasher.generate(password)
         # send to metadata service
-        resp = requests.post(f"{METADATA_API}/users", json={
+        resp = http_client.post(f"{METADATA_API}/users", json={
             "username": username,
             "password": hashed_password
         })
@@ -58,6 +70,9 @@ def signup():
             return jsonify({"error": "Username already exists"}), 409
         else:
             return jsonify({"error": "Metadata service error"}), 500
+    except HashPoolFull as e:
+        # hash pool saturated (login storm): shed instead of queueing
+        return jsonify({"error": str(e)}), 503, {"Retry-After": str(e.retry_after)}
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -73,23 +88,29 @@ def login():
         return jsonify({"error": "Missing username or password"}), 400
 
     try:
-        # fetch user from metadata service
-        resp = requests.get(f"{METADATA_API}/users/{username}")
-
-        # check the response
-        if resp.status_code != 200:
-            return jsonify({"error": "Invalid credentials"}), 401
-
-        # if user is found, check password
-        user = resp.json()
+        # fetch user from metadata service (records are reused for AUTH_USER_CACHE_TTL seconds)
+        user = user_cache.get(username)
+        if user is None:
+            resp = http_client.get(f"{METADATA_API}/users/{username}")
+
+            # check the response
+            if resp.status_code != 200:
+                return jsonify({"error": "Invalid credentials"}), 401
+            user = resp.json()
+            user_cache.put(username, user)
+
+        # if user is found, check password (on the bounded hash pool)
         stored_hash = user.get("password")
-        if stored_hash and check_password_hash(stored_hash, password):
+        if stored_hash and password_hasher.check(stored_hash, password):
             token = encode_token(username)
 
             # store the token in the user's session
             return jsonify({"token": token})
         else:
             return jsonify({"error": "Invalid credentials"}), 401
+    except HashPoolFull as e:
+        # hash pool saturated (login storm): shed instead of queueing
+        return jsonify({"error": str(e)}), 503, {"Retry-After": str(e.retry_after)}
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -117,15 +138,15 @@ def require_auth(f):
 @app.route("/files/upload", methods=["POST"])
 @require_auth
 def upload():
-    if "file" not in request.files:
+    # read the file part off the request stream chunk by chunk (never buffered whole)
+    try:
+        file = MultipartFileReader(request.stream, request.mimetype_params.get("boundary"))
+    except ValueError:
         return jsonify({"error": "No file part"}), 400
-    
-    # get the file
-    file = request.files["file"]
-    files = {'file': (file.filename, file.stream, file.mimetype)}
+    body = MultipartBody("file", file.filename, file.mimetype, file)
 
-    # forward the file to the storage service via POST
-    resp = requests.post(f"{STORAGE_API}/upload", files=files)
+    # stream the file to the storage service via POST
+    resp = http_client.post(f"{STORAGE_API}/upload", data=body, headers={"Content-Type": body.content_type})
 
     # check response from storage service
     if resp.status_code != 200:
@@ -147,7 +168,7 @@ def download():
 
     # forward request to storage service via GET
     params = {"filename": filename}
-    resp = requests.get(f"{STORAGE_API}/download", params=params, stream=True)
+    resp = http_client.get(f"{STORAGE_API}/download", params=params, stream=True)
 
     # check response from storage service
     if resp.status_code == 200:
@@ -167,7 +188,7 @@ def download():
 @require_auth
 def list_files():
     # forward request to metadata service via GET
-    resp = requests.get(f"{METADATA_API}/files")
+    resp = http_client.get(f"{METADATA_API}/files")
 
     # check response from metadata service
     if resp.status_code == 200:
@@ -186,7 +207,7 @@ def delete_file():
     
     # forward request to storage service via DELETE
     params = {"filename": filename}
-    resp = requests.delete(f"{STORAGE_API}/delete", params=params)
+    resp = http_client.delete(f"{STORAGE_API}/delete", params=params)
     # check response from metadata service
     if resp.status_code == 200:
         return resp.json(), resp.status_code
@@ -194,4 +215,10 @@ def delete_file():
         return jsonify({"error": "Delete error - " + resp.text}), 500
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000)
\ No newline at end of file
+    # app_async imports this module as "app": share it rather than load a second copy
+    sys.modules["app"] = sys.modules[__name__]
+    if GATEWAY_SERVER_MODE == "async":
+        import app_async
+        app_async.main()
+    else:
+        app.run(host="0.0.0.0", port=5000)
\ No newline at end of file
@@ -0,0 +1,232 @@
+"""
+API gateway - asyncio serving mode (aiohttp)
+Same routes and auth as app.py, but each in-flight upload or download is a coroutine
+instead of a thread: bodies are relayed to and from storage chunk by chunk over a
+pooled async client. Started by app.py when GATEWAY_SERVER_MODE=async
+"""
+
+import asyncio
+
+from aiohttp import web
+from werkzeug.security import generate_password_hash, check_password_hash
+
+from app import (METADATA_API, STORAGE_API, decode_token, encode_token, password_hasher,
+                 user_cache) # same settings, token cache and hash pool as the Flask app
+from common.auth import HashPoolFull
+from common.async_http_client import AsyncInternalHTTPClient, iter_field_chunks, multipart_body
+from common.streaming import UPLOAD_CHUNK_SIZE
+
+DOWNLOAD_CHUNK_SIZE = 64 * 1024 # bytes relayed per write
+http_client = AsyncInternalHTTPClient() # pooled keepalive client for calls to other services
+
+
+# --- Routes ---
+async def signup(request):
+    # grab the username and password
+    data = await request.json()
+    username = data.get("username")
+    password = data.get("password")
+
+    # validate input
+    if not username or not password:
+        return web.json_response({"error": "Missing username or password"}, status=400)
+
+    try:
+        # hash password before sending to metadata service (on the bounded hash pool, off the event loop)
+        hashed_password = await asyncio.wrap_future(password_hasher.submit(generate_password_hash, password))
+        # send to metadata service
+        resp = await http_client.post(f"{METADATA_API}/users", json={
+            "username": username,
+            "password": hashed_password
+        })
+        resp.release()
+
+        # check response from metadata service
+        if resp.status == 201:
+            return web.json_response({"message": "Signup successful!"}, status=201)
+        elif resp.status == 409:
+            return web.json_response({"error": "Username already exists"}, status=409)
+        else:
+            return web.json_response({"error": "Metadata service error"}, status=500)
+    except HashPoolFull as e:
+        # hash pool saturated (login storm): shed instead of queueing
+        return web.json_response({"error": str(e)}, status=503, headers={"Retry-After": str(e.retry_after)})
+    except Exception as e:
+        return web.json_response({"error": str(e)}, status=500)
+
+async def login(request):
+    # grab the username and password
+    data = await request.json()
+    username = data.get("username")
+    password = data.get("password")
+
+    # validate input
+    if not username or not password:
+        return web.json_response({"error": "Missing username or password"}, status=400)
+
+    try:
+        # fetch user from metadata service (records are reused for AUTH_USER_CACHE_TTL seconds)
+        user = user_cache.get(username)
+        if user is None:
+            resp = await http_client.get(f"{METADATA_API}/users/{username}")
+
+            # check the response
+            if resp.status != 200:
+                resp.release()
+                return web.json_response({"error": "Invalid credentials"}, status=401)
+            user = await resp.json()
+            user_cache.put(username, user)
+
+        # if user is found, check password (on the bounded hash pool, off the event loop)
+        stored_hash = user.get("password")
+        if stored_hash and await asyncio.wrap_future(
+                password_hasher.submit(check_password_hash, stored_hash, password)):
+            return web.json_response({"token": encode_token(username)})
+        else:
+            return web.json_response({"error": "Invalid credentials"}, status=401)
+    except HashPoolFull as e:
+        # hash pool saturated (login storm): shed instead of queueing
+        return web.json_response({"error": str(e)}, status=503, headers={"Retry-After": str(e.retry_after)})
+    except Exception as e:
+        return web.json_response({"error": str(e)}, status=500)
+
+# auth decorator
+def require_auth(handler):
+    async def wrapper(request):
+        # grab the header
+        auth_header = request.headers.get("Authorization")
+
+        # check if auth header is present and valid
+        if not auth_header or not auth_header.startswith("Bearer "):
+            return web.json_response({"error": "Missing or invalid token"}, status=401)
+
+        # decode the token
+        token = auth_header.split(" ", 1)[1]
+        username = decode_token(token)
+        if not username:
+            return web.json_response({"error": "Invalid or expired token"}, status=401)
+        request["username"] = username
+        return await handler(request)
+    wrapper.__name__ = handler.__name__
+    return wrapper
+
+async def file_part(request):
+    """The 'file' part of a multipart upload, positioned at the start of its body (None if missing)"""
+    try:
+        reader = await request.multipart()
+        part = await reader.next()
+        while part is not None and part.name != "file":
+            part = await reader.next()
+    except Exception:
+        return None
+    if part is None or not part.filename:
+        return None
+    return part
+
+# upload file endpoint (file streamed on to storage, never held whole in memory)
+@require_auth
+async def upload(request):
+    field = await file_part(request)
+    if field is None:
+        return web.json_response({"error": "No file part"}, status=400)
+
+    # stream the file to the storage service via POST
+    body = multipart_body("file", field.filename, field.headers.get("Content-Type"),
+                          iter_field_chunks(field, UPLOAD_CHUNK_SIZE))
+    resp = await http_client.post(f"{STORAGE_API}/upload", data=body)
+
+    # check response from storage service
+    if resp.status != 200:
+        resp.release()
+        return web.json_response({"error": "Storage error"}, status=500)
+
+    try:
+        return web.json_response(await resp.json(content_type=None), status=resp.status)
+    except Exception:
+        return web.json_response({"error": "Non-JSON response from storage", "raw": await resp.text()},
+                                 status=resp.status)
+
+# download file endpoint
+@require_auth
+async def download(request):
+    # get the filename from query parameters
+    filename = request.query.get("filename")
+    if not filename:
+        return web.json_response({"error": "No filename provided"}, status=400)
+
+    # forward request to storage service via GET
+    params = {"filename": filename}
+    resp = await http_client.get(f"{STORAGE_API}/download", params=params)
+
+    # check response from storage service
+    if resp.status == 200:
+        response = web.StreamResponse(headers={
+            "Content-Type": resp.headers.get("Content-Type", "application/octet-stream"),
+            "Content-Disposition": f"attachment; filename={filename}"
+        })
+        await response.prepare(request)
+        try:
+            async for chunk in resp.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                await response.write(chunk)
+        finally:
+            resp.release()
+        await response.write_eof()
+        return response
+    else:
+        try:
+            return web.json_response(await resp.json(content_type=None), status=resp.status)
+        except Exception:
+            return web.json_response({"error": "File not found - " + await resp.text()}, status=404)
+
+# list files endpoint
+@require_auth
+async def list_files(request):
+    # forward request to metadata service via GET
+    resp = await http_client.get(f"{METADATA_API}/files")
+
+    # check response from metadata service
+    if resp.status == 200:
+        return web.json_response(await resp.json(content_type=None), status=resp.status)
+    else:
+        return web.json_response({"error": "Metadata error - " + await resp.text()}, status=500)
+
+# delete file endpoint
+@require_auth
+async def delete_file(request):
+    # get the filename from query parameters
+    filename = request.query.get("filename")
+    if not filename:
+        return web.json_response({"error": "No filename provided"}, status=400)
+
+    # forward request to storage service via DELETE
+    params = {"filename": filename}
+    resp = await http_client.delete(f"{STORAGE_API}/delete", params=params)
+    # check response from storage service
+    if resp.status == 200:
+        return web.json_response(await resp.json(content_type=None), status=resp.status)
+    else:
+        return web.json_response({"error": "Delete error - " + await resp.text()}, status=500)
+
+
+async def close_http_client(app):
+    await http_client.close()
+
+
+def create_app():
+    app = web.Application()
+    app.router.add_post("/auth/signup", signup)
+    app.router.add_post("/auth/login", login)
+    app.router.add_post("/files/upload", upload)
+    app.router.add_get("/files/download", download)
+    app.router.add_get("/files", list_files)
+    app.router.add_delete("/files/delete", delete_file)
+    app.on_cleanup.append(close_http_client)
+    return app
+
+
+def main():
+    web.run_app(create_app(), host="0.0.0.0", port=5000)
+
+
+if __name__ == "__main__":
+    main()
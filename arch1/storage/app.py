@@ -1,11 +1,13 @@
 from flask import Flask, request, jsonify, send_file
 import os
-import requests
+from common.http_client import InternalHTTPClient
+from common.load import install_load_report
 
 app = Flask(__name__)
 
 STORAGE_PATH = "/storage"
 METADATA_API = "http://metadata:5001/files"
+http_client = InternalHTTPClient() # pooled keepalive client for calls to other services
 
 os.makedirs(STORAGE_PATH, exist_ok=True)
 
@@ -46,7 +48,7 @@ def upload_file():
 
     # Send metadata to metadata container
     try:
-        r = requests.post(METADATA_API, json=metadata)
+        r = http_client.post(METADATA_API, json=metadata)
         r.raise_for_status()
     except Exception as e:
         return jsonify({"error": f"Failed to save metadata: {e}"}), 500
@@ -65,7 +67,7 @@ def download_file():
 
     # Fetch metadata
     try:
-        r = requests.get(f"{METADATA_API}/{filename}")
+        r = http_client.get(f"{METADATA_API}/{filename}")
         r.raise_for_status()
         metadata = r.json()
     except Exception as e:
@@ -94,7 +96,7 @@ def delete_file():
 
     # Fetch metadata
     try:
-        r = requests.get(f"{METADATA_API}/{filename}")
+        r = http_client.get(f"{METADATA_API}/{filename}")
         r.raise_for_status()
         metadata = r.json()
     except Exception as e:
@@ -114,13 +116,16 @@ def delete_file():
 
     # Delete metadata
     try:
-        r = requests.delete(f"{METADATA_API}/{filename}")
+        r = http_client.delete(f"{METADATA_API}/{filename}")
         r.raise_for_status()
     except Exception as e:
         return jsonify({"error": f"Failed to delete metadata: {e}"}), 500
 
     return jsonify({"status": "deleted"}), 200
 
+# ---------------- Load (GET /load, polled by the backup service to throttle itself) ----------------
+install_load_report(app)
+
 # ---------------- Main ----------------
 if __name__ == "__main__":
     import sys
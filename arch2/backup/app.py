@@ -1,23 +1,264 @@
-import shutil, time, os
+import gzip, json, sys, threading, time, os
+import urllib.parse, urllib.request
 from datetime import datetime
 
-DB_PATH = "/metadata/metadata.db"
-STORAGE_PATH = "/storage"
-BACKUP_PATH = "/backup"
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+from repository import Repository, RepositoryLocked
+from throttle import Throttle
+
+METADATA_URL = os.environ.get("METADATA_URL", "http://metadata:5005")  # metadata service (GET /snapshot)
+METADATA_TIMEOUT = float(os.environ.get("METADATA_TIMEOUT", "60"))  # seconds without data before a metadata request fails
+STORAGE_PATH = os.environ.get("STORAGE_PATH", "/storage")
+BACKUP_PATH = os.environ.get("BACKUP_PATH", "/backup")
+BACKUP_INTERVAL = int(os.environ.get("BACKUP_INTERVAL", "3600"))  # seconds between backups
+BACKUP_KEEP_HOURLY = int(os.environ.get("BACKUP_KEEP_HOURLY", "24"))  # hours that keep their newest snapshot
+BACKUP_KEEP_DAILY = int(os.environ.get("BACKUP_KEEP_DAILY", "7"))  # days that keep their newest snapshot
+BACKUP_KEEP_WEEKLY = int(os.environ.get("BACKUP_KEEP_WEEKLY", "4"))  # weeks that keep their newest snapshot
+BACKUP_PRUNE_INTERVAL = int(os.environ.get("BACKUP_PRUNE_INTERVAL", "86400"))  # seconds between prune passes
+BACKUP_WORKERS = int(os.environ.get("BACKUP_WORKERS", "4"))  # files read and chunked at a time
+BACKUP_BYTES_PER_SEC = float(os.environ.get("BACKUP_BYTES_PER_SEC", str(50 * 1024 * 1024)))  # all workers, 0 = unlimited
+BACKUP_IOPS = float(os.environ.get("BACKUP_IOPS", "500"))  # reads, writes and opens per second, 0 = unlimited
+BACKUP_BUSY_FACTOR = float(os.environ.get("BACKUP_BUSY_FACTOR", "0.1"))  # share of the rates used while storage is busy
+BACKUP_NICE = int(os.environ.get("BACKUP_NICE", "10"))  # CPU niceness (best-effort I/O priority follows it)
+BACKUP_METRICS_PORT = int(os.environ.get("BACKUP_METRICS_PORT", "5007"))  # Prometheus /metrics, 0 = off
+STORAGE_URL = os.environ.get("STORAGE_URL", "http://storage:5006")  # storage service (GET /load)
+STORAGE_LOAD_POLL = float(os.environ.get("STORAGE_LOAD_POLL", "2"))  # seconds between load polls during a backup
 
 os.makedirs(BACKUP_PATH, exist_ok=True)
+REPOSITORY_PATH = os.path.join(BACKUP_PATH, "repository")
+
+# Metrics (served on BACKUP_METRICS_PORT)
+DURATION = Histogram("backup_duration_seconds", "Time backup phases take", ["phase"],
+                     buckets=(1, 5, 15, 60, 300, 900, 1800, 3600, 7200, 14400))
+RUNS = Counter("backup_runs_total", "Backup runs", ["outcome"])
+BYTES = Counter("backup_bytes_total", "Storage bytes read by backups and bytes they added to the repository", ["kind"])
+FILES = Counter("backup_files_total", "Files visited by backups", ["result"])
+THROUGHPUT = Gauge("backup_throughput_bytes_per_second", "Storage bytes read per second by the last backup")
+THROTTLE_WAIT = Counter("backup_throttle_wait_seconds_total", "Time backup workers slept in the I/O throttle")
+STORAGE_BUSY = Gauge("backup_storage_busy", "1 while storage reports busy and the backup runs at the reduced rates")
+LAST_SUCCESS = Gauge("backup_last_success_timestamp_seconds", "When the last backup completed")
+
+# One throttle for all backup and prune I/O, slowed down while storage reports busy
+THROTTLE = Throttle(BACKUP_BYTES_PER_SEC, BACKUP_IOPS)
+
+# Storage snapshots go into a deduplicated repository (see repository.py): files are split into
+# content-defined chunks, each chunk is stored once, compressed, in a packfile, and a snapshot is
+# a manifest of chunk lists. A file with the same size and mtime as in the previous snapshot is
+# not read at all, so a backup costs time and space in proportion to what changed. After every
+# backup the retention policy forgets old snapshots (and their metadata dumps); the space their
+# chunks took is reclaimed by the next prune.
+#
+# Every storage snapshot is paired with metadata_<timestamp>.ndjson.gz, a point-in-time dump of
+# the metadata service taken just before the storage walk. Files changed while storage was walked
+# are reconciled afterwards (see reconcile_metadata), so a restore of both matches file for file.
+#
+# Backup I/O is spread over BACKUP_WORKERS threads and throttled to BACKUP_BYTES_PER_SEC and
+# BACKUP_IOPS in total; while storage's GET /load reports busy, the rates drop to
+# BACKUP_BUSY_FACTOR of that, so hourly backups do not compete with serving traffic.
+
+def walk_files(root):
+    """Every regular file under root as (relative path, stat), without following symlinks"""
+    pending = [""]
+    while pending:
+        rel = pending.pop()
+        with os.scandir(os.path.join(root, rel)) as entries:
+            for entry in entries:
+                path = os.path.join(rel, entry.name)
+                if entry.is_dir(follow_symlinks=False):
+                    if path != ".staging":  # uploads not committed yet
+                        pending.append(path)
+                elif entry.is_file(follow_symlinks=False):
+                    yield path, entry.stat(follow_symlinks=False)
+
+def metadata_path(name):
+    return os.path.join(BACKUP_PATH, f"metadata_{name}.ndjson.gz")
+
+def dump_metadata(path):
+    """Stream GET /snapshot of the metadata service into path (gzipped); returns its header"""
+    with urllib.request.urlopen(f"{METADATA_URL}/snapshot", timeout=METADATA_TIMEOUT) as resp, \
+            gzip.open(path, "wb") as f:
+        header = json.loads(resp.readline())["snapshot"]
+        f.write(json.dumps({"snapshot": header}).encode() + b"\n")
+        while True:
+            data = resp.read(1024 * 1024)
+            if not data:
+                return header
+            f.write(data)
 
-def backup():
+def reconcile_metadata(repository, name, source, target, header):
+    """
+    Write target: the dump in source made coherent with storage snapshot name. A file changed
+    or deleted during the storage walk (the delta listing since the dump's cursor) keeps the
+    record, old or new, whose sha256 matches the content the snapshot stored, and is left out
+    if neither does. Returns how many records were reconciled
+    """
+    changed, deleted = {}, set()
+    if header.get("cursor"):
+        query = urllib.parse.urlencode({"since": header["cursor"]})
+        with urllib.request.urlopen(f"{METADATA_URL}/files?{query}", timeout=METADATA_TIMEOUT) as resp:
+            delta = json.load(resp)
+        if delta["reset"]:
+            raise RuntimeError("metadata service restarted during the backup")
+        changed = {record["filename"]: record for record in delta["files"]}
+        deleted = set(delta["deleted"])
+        header = dict(header, cursor=delta["cursor"])
+    in_flux = set(changed) | deleted
+    stored = repository.checksums(name, in_flux)
+
+    def pick(*records):
+        for record in records:
+            if record and record["filename"] in stored and \
+                    record.get("sha256") in (None, stored[record["filename"]]):
+                return record
+        return None
+
+    count = len(in_flux)
+    with gzip.open(source, "rt", encoding="utf-8") as old, gzip.open(target, "wt", encoding="utf-8") as new:
+        new.write(json.dumps({"snapshot": dict(header, reconciled=count)}) + "\n")
+        next(old)  # header
+        for line in old:
+            filename = json.loads(line).get("file", {}).get("filename") if in_flux else None
+            if filename in in_flux:
+                in_flux.discard(filename)
+                record = pick(changed.get(filename), json.loads(line)["file"])
+                line = json.dumps({"file": record}) + "\n" if record else ""
+            new.write(line)
+        for filename in in_flux:  # created during the walk
+            record = pick(changed.get(filename))
+            if record:
+                new.write(json.dumps({"file": record}) + "\n")
+    return count
+
+def watch_storage_load(stop):
+    """Poll storage's GET /load until stop is set, slowing the throttle down while storage is busy"""
+    busy = False
+    while True:
+        try:
+            with urllib.request.urlopen(f"{STORAGE_URL}/load", timeout=STORAGE_LOAD_POLL) as resp:
+                now_busy = bool(json.load(resp)["busy"])
+        except (OSError, ValueError, KeyError):
+            now_busy = False  # no report: run at the configured rates
+        if now_busy != busy:
+            busy = now_busy
+            THROTTLE.slow_down(BACKUP_BUSY_FACTOR if busy else 1.0)
+            STORAGE_BUSY.set(int(busy))
+            print(f"Storage is {'busy, backup slows down' if busy else 'no longer busy, backup at full rate'}")
+        if stop.wait(STORAGE_LOAD_POLL):
+            THROTTLE.slow_down(1.0)
+            STORAGE_BUSY.set(0)
+            return
+
+def backup(prune=False):
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    # Backup database
-    if os.path.exists(DB_PATH):
-        shutil.copy(DB_PATH, os.path.join(BACKUP_PATH, f"metadata_{timestamp}.db"))
-    # Backup storage files
-    storage_backup = os.path.join(BACKUP_PATH, f"storage_{timestamp}")
-    shutil.copytree(STORAGE_PATH, storage_backup)
-    print(f"Backup completed at {timestamp}")
+    start = time.time()
+    # Backup metadata (point-in-time dump), then storage files (deduplicated snapshot)
+    dump, partial = metadata_path(timestamp) + ".tmp", metadata_path(timestamp) + ".partial"
+    try:
+        with DURATION.labels(phase="metadata").time():
+            header = dump_metadata(dump)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Backup skipped at {timestamp}: no metadata snapshot ({e})")
+        RUNS.labels(outcome="skipped").inc()
+        if os.path.exists(dump):
+            os.remove(dump)
+        return
+    repository = Repository(REPOSITORY_PATH, THROTTLE)  # waits while a manual prune or restore holds it
+    stop = threading.Event()
+    monitor = threading.Thread(target=watch_storage_load, args=(stop,), daemon=True)
+    monitor.start()
+    waited = THROTTLE.waited
+    try:
+        storage_start = time.time()
+        stats = repository.backup(timestamp, STORAGE_PATH, walk_files(STORAGE_PATH), BACKUP_WORKERS)
+        storage_seconds = time.time() - storage_start
+        DURATION.labels(phase="storage").observe(storage_seconds)
+        THROUGHPUT.set(stats["read_bytes"] / max(storage_seconds, 1e-6))
+        BYTES.labels(kind="read").inc(stats["read_bytes"])
+        BYTES.labels(kind="added").inc(stats["added_bytes"])
+        FILES.labels(result="read").inc(stats["read"])
+        FILES.labels(result="unchanged").inc(stats["reused"])
+        try:
+            reconciled = reconcile_metadata(repository, timestamp, dump, partial, header)
+            os.replace(partial, metadata_path(timestamp))
+        except (OSError, ValueError, KeyError, RuntimeError) as e:
+            # the storage snapshot stays (it is still a storage backup), but it has no metadata to restore with
+            print(f"Metadata of backup {timestamp} not reconciled ({e}); snapshot kept without metadata")
+            reconciled = None
+        for path in (dump, partial):
+            if os.path.exists(path):
+                os.remove(path)
+        print(f"Backup completed at {timestamp}: {header['files']} metadata records "
+              f"({reconciled} changed during the backup), {stats['files']} files, {stats['read']} read "
+              f"({stats['read_bytes']} bytes, {stats['added_bytes']} bytes added to the repository), "
+              f"{stats['reused']} unchanged in {time.time() - start:.1f}s "
+              f"({stats['read_bytes'] / max(storage_seconds, 1e-6) / 1e6:.1f} MB/s read, "
+              f"{THROTTLE.waited - waited:.1f}s throttled)")
+        DURATION.labels(phase="total").observe(time.time() - start)
+        RUNS.labels(outcome="completed").inc()
+        LAST_SUCCESS.set_to_current_time()
+        forgotten = repository.forget(BACKUP_KEEP_HOURLY, BACKUP_KEEP_DAILY, BACKUP_KEEP_WEEKLY)
+        for name in forgotten:
+            try:
+                os.remove(metadata_path(name))
+            except FileNotFoundError:
+                pass
+        if forgotten:
+            print(f"Retention forgot {len(forgotten)} snapshots: {', '.join(forgotten)}")
+        if prune:
+            run_prune(repository)
+    finally:
+        stop.set()
+        monitor.join()
+        THROTTLE_WAIT.inc(THROTTLE.waited - waited)
+        repository.close()
+
+def run_prune(repository):
+    start = time.time()
+    with DURATION.labels(phase="prune").time():
+        stats = repository.prune()
+    print(f"Prune deleted {stats['deleted_packs']} packs, rewrote {stats['repacked_packs']}, "
+          f"freed {stats['freed_bytes']} bytes in {time.time() - start:.1f}s")
+
+def main(argv):
+    # python app.py                       back up every BACKUP_INTERVAL seconds
+    # python app.py snapshots             list the snapshots in the repository
+    # python app.py restore <name> <dir>  write a snapshot's storage files into dir
+    # python app.py prune                 reclaim the space of forgotten snapshots now
+    if not argv:
+        sys.stdout.reconfigure(line_buffering=True)  # flush prints immediately
+        os.nice(BACKUP_NICE)
+        if BACKUP_METRICS_PORT:
+            start_http_server(BACKUP_METRICS_PORT)
+        last_prune = time.time()
+        while True:
+            prune = time.time() - last_prune >= BACKUP_PRUNE_INTERVAL
+            try:
+                backup(prune)
+            except Exception as e:
+                print(f"Backup failed: {e}")
+                RUNS.labels(outcome="failed").inc()
+            if prune:
+                last_prune = time.time()
+            time.sleep(BACKUP_INTERVAL)
+    try:
+        repository = Repository(REPOSITORY_PATH, wait=False)
+    except RepositoryLocked as e:
+        sys.exit(f"{e}; try again when it has finished")
+    try:
+        if argv == ["snapshots"]:
+            for name in repository.snapshots():
+                print(name)
+        elif argv[0] == "restore" and len(argv) == 3:
+            count = repository.restore(argv[1], argv[2])
+            print(f"Restored {count} files of snapshot {argv[1]} into {argv[2]}; start the metadata "
+                  f"service with METADATA_RESTORE={metadata_path(argv[1])} to restore its metadata")
+        elif argv == ["prune"]:
+            run_prune(repository)
+        else:
+            sys.exit("usage: app.py [snapshots | restore <name> <dir> | prune]")
+    finally:
+        repository.close()
 
 if __name__ == "__main__":
-    while True:
-        backup()
-        time.sleep(3600)  # Run every hour
+    main(sys.argv[1:])
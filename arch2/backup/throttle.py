@@ -0,0 +1,45 @@
+"""
+I/O throttle shared by the backup workers
+Rate limits for bytes and I/O operations per second (GCRA, the virtual-time form of a token
+bucket). Workers report every read and write after doing it; each report books the time that
+I/O is worth at the configured rate and sleeps until its booking is due, so all workers
+together stay at the rates on average, with up to burst_seconds of unused time spent at once.
+slow_down() scales both rates; the backup service does it while storage reports busy.
+"""
+
+import threading
+import time
+
+
+class Throttle:
+    def __init__(self, bytes_per_sec=0, iops=0, burst_seconds=0.25):
+        self.bytes_per_sec = bytes_per_sec  # 0 = unlimited
+        self.iops = iops  # 0 = unlimited
+        self.burst_seconds = burst_seconds
+        self.factor = 1.0
+        self.waited = 0.0  # seconds workers have slept, in total
+        self._lock = threading.Lock()
+        self._bytes_due = 0.0  # when the bytes booked so far are paid for (monotonic clock)
+        self._ops_due = 0.0
+
+    def slow_down(self, factor):
+        """Run at factor times the configured rates (1.0 restores them)"""
+        self.factor = factor
+
+    def consume(self, nbytes, ops=1):
+        """Book one I/O of nbytes and sleep until it is due"""
+        if self.bytes_per_sec <= 0 and self.iops <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            due = now
+            if self.bytes_per_sec > 0:
+                self._bytes_due = max(self._bytes_due, now - self.burst_seconds) + \
+                    nbytes / (self.bytes_per_sec * self.factor)
+                due = max(due, self._bytes_due)
+            if self.iops > 0:
+                self._ops_due = max(self._ops_due, now - self.burst_seconds) + ops / (self.iops * self.factor)
+                due = max(due, self._ops_due)
+            self.waited += due - now
+        if due > now:
+            time.sleep(due - now)
@@ -0,0 +1,174 @@
+"""
+Benchmark: auth cost on the upload service's hot path
+
+1. Per-request token check: decode_token with the verified-token cache disabled
+   (a full jwt.decode per request) vs enabled.
+2. Login storm: the upload service runs in a child process on the threaded Flask
+   server against a stand-in metadata service. --logins clients log in at once while
+   one client keeps listing files with a valid token. The hash pool is either
+   unbounded (one hash per request thread, the old behaviour) or bounded
+   (AUTH_HASH_WORKERS / AUTH_HASH_QUEUE defaults, excess logins shed with 503).
+   Reports file-request latency during the storm and how the logins ended.
+
+Usage: python benchmarks/bench_auth.py [--decodes N] [--logins N] [--storm-seconds S]
+"""
+
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import socket
+import time
+
+import aiohttp
+from aiohttp import web
+from werkzeug.security import generate_password_hash
+
+from bench_common import load_module, print_table
+
+PASSWORD = "correct horse battery staple"
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+def metadata_process(port, password_hash):
+    """Stand-in for metadata's /users/<name> and /files"""
+    async def get_user(request):
+        return web.json_response({"username": request.match_info["username"], "password": password_hash})
+
+    async def list_files(request):
+        return web.json_response([])
+
+    app = web.Application()
+    app.router.add_get("/users/{username}", get_user)
+    app.router.add_get("/files", list_files)
+    web.run_app(app, host="localhost", port=port, backlog=4096, print=None, access_log=None)
+
+
+def gateway_process(port, metadata_port, hash_env):
+    logging.disable(logging.WARNING)
+    os.environ.update(hash_env)
+    gateway = load_module("app", "services/upload/app.py")
+    gateway.METADATA_API = f"http://localhost:{metadata_port}"
+    # each login is a distinct user in a real storm, so the user-record cache is not in play
+    gateway.user_cache.ttl = 0
+    from werkzeug.serving import make_server
+    server = make_server("localhost", port, gateway.app, threaded=True)
+    server.socket.listen(4096)
+    server.serve_forever()
+
+
+async def wait_for_port(port):
+    while True:
+        try:
+            _, writer = await asyncio.open_connection("localhost", port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.1)
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] if values else None
+
+
+def bench_decode(decodes):
+    logging.disable(logging.WARNING)
+    gateway = load_module("upload_app", "services/upload/app.py")
+    token = gateway.encode_token("bench")
+    rows = []
+    for label, max_entries in (("jwt.decode every request", 0), ("verified-token cache", 10000)):
+        gateway.token_cache.max_entries = max_entries
+        gateway.decode_token(token)
+        start = time.perf_counter()
+        for _ in range(decodes):
+            gateway.decode_token(token)
+        per_call = (time.perf_counter() - start) / decodes
+        rows.append([label, f"{per_call * 1e6:.1f}", f"{1 / per_call:,.0f}"])
+    print(f"\nToken check per request ({decodes} calls)")
+    print_table(["decode_token", "us/call", "calls/s"], rows)
+
+
+async def run_storm(port, logins, storm_seconds):
+    base = f"http://localhost:{port}"
+    connector = aiohttp.TCPConnector(limit=0)
+    timeout = aiohttp.ClientTimeout(total=300)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        async with session.post(f"{base}/auth/login", json={"username": "probe", "password": PASSWORD}) as resp:
+            token = (await resp.json())["token"]
+        headers = {"Authorization": f"Bearer {token}"}
+
+        async def list_files():
+            start = time.perf_counter()
+            async with session.get(f"{base}/files", headers=headers) as resp:
+                await resp.read()
+            return time.perf_counter() - start
+
+        quiet = [await list_files() for _ in range(20)]
+
+        async def login(n):
+            start = time.perf_counter()
+            async with session.post(f"{base}/auth/login",
+                                    json={"username": f"user{n}", "password": PASSWORD}) as resp:
+                await resp.read()
+                return resp.status, time.perf_counter() - start
+
+        storm = [asyncio.create_task(login(n)) for n in range(logins)]
+        during = []
+        deadline = time.perf_counter() + storm_seconds
+        while time.perf_counter() < deadline and not all(task.done() for task in storm):
+            during.append(await list_files())
+        results = await asyncio.gather(*storm)
+
+    statuses = [status for status, _ in results]
+    ok_latencies = [latency for status, latency in results if status == 200]
+    return quiet, during, statuses.count(200), statuses.count(503), percentile(ok_latencies, 0.5)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--decodes", type=int, default=50000)
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--storm-seconds", type=float, default=10, help="how long file requests are sampled")
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    bench_decode(args.decodes)
+
+    metadata_port = free_port()
+    metadata = multiprocessing.Process(target=metadata_process,
+                                       args=(metadata_port, generate_password_hash(PASSWORD)), daemon=True)
+    metadata.start()
+    asyncio.run(wait_for_port(metadata_port))
+
+    rows = []
+    modes = (("unbounded (hash per request thread)", {"AUTH_HASH_WORKERS": str(args.logins + 1),
+                                                      "AUTH_HASH_QUEUE": str(args.logins + 1)}),
+             ("bounded pool + admission", {}))
+    for label, hash_env in modes:
+        port = free_port()
+        gateway = multiprocessing.get_context("spawn").Process(target=gateway_process,
+                                                               args=(port, metadata_port, hash_env), daemon=True)
+        gateway.start()
+        asyncio.run(wait_for_port(port))
+        quiet, during, ok, shed, login_p50 = asyncio.run(run_storm(port, args.logins, args.storm_seconds))
+        gateway.terminate()
+        gateway.join()
+        rows.append([label, f"{percentile(quiet, 0.5) * 1000:.1f}", len(during),
+                     f"{percentile(during, 0.5) * 1000:.1f}", f"{percentile(during, 0.99) * 1000:.1f}",
+                     ok, shed, f"{login_p50:.2f}" if login_p50 is not None else "-"])
+
+    metadata.terminate()
+    print(f"\nGET /files with a valid token while {args.logins} clients log in at once")
+    print_table(["hash pool", "quiet p50 (ms)", "requests in storm", "storm p50 (ms)", "storm p99 (ms)",
+                 "logins ok", "logins shed (503)", "login p50 (s)"], rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Benchmark: backup storage growth, full copytree vs the deduplicated backup repository
+
+Creates a storage directory of --small-files compressible 256 KB files (text records) and
+--large-files random 16 MB files, then backs it up three times: the initial state; after
+editing --churn of the small files and inserting 100 bytes into the middle of every large
+file; and with nothing changed. For each backup reports the time and the bytes it added: to a
+full copytree, to hard-linked snapshots (every changed file copied whole) and to the
+repository's packfiles. Finally forgets the first two snapshots and prunes (packs with at
+least --repack-ratio garbage are rewritten), and reports the space reclaimed and that the
+remaining snapshot restores byte for byte.
+
+Usage: python benchmarks/bench_backup_repository.py [--small-files N] [--large-files N] [--churn FRACTION]
+       [--repack-ratio R]
+"""
+
+import argparse
+import filecmp
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from bench_common import human_bytes, load_module, print_table
+
+SNAPSHOTS = ["20260101_000000", "20260101_010000", "20260101_020000"]
+
+
+def text_file(path, seed, size=256 * 1024):
+    rng = random.Random(seed)
+    lines, length = [], 0
+    while length < size:
+        lines.append(f"{rng.randrange(10 ** 9):09d},user{rng.randrange(1000)},{rng.choice(['ok', 'retry', 'fail'])},"
+                     f"{rng.random():.6f}\n")
+        length += len(lines[-1])
+    with open(path, "w") as f:
+        f.write("".join(lines)[:size])
+
+
+def dir_bytes(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--small-files", type=int, default=500)
+    parser.add_argument("--large-files", type=int, default=8)
+    parser.add_argument("--churn", type=float, default=0.02, help="fraction of small files edited between backups")
+    parser.add_argument("--repack-ratio", type=float, default=0.05, help="garbage share at which prune rewrites a pack")
+    parser.add_argument("--dir", default=None, help="scratch directory")
+    args = parser.parse_args()
+
+    rows = []
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        storage = os.path.join(tmp, "storage")
+        os.environ.update(STORAGE_PATH=storage, BACKUP_PATH=os.path.join(tmp, "backup"))
+        backup = load_module("backup_app", "backup/app.py")
+        repository = backup.Repository(backup.REPOSITORY_PATH)
+        os.makedirs(os.path.join(storage, "logs"))
+        os.makedirs(os.path.join(storage, "media"))
+        for n in range(args.small_files):
+            text_file(os.path.join(storage, "logs", f"log_{n:05d}.csv"), n)
+        for n in range(args.large_files):
+            with open(os.path.join(storage, "media", f"video_{n}.bin"), "wb") as f:
+                f.write(os.urandom(16 * 1024 * 1024))
+
+        changed = []
+        for step, name in enumerate(SNAPSHOTS):
+            if step == 1:
+                changed = [os.path.join("logs", f"log_{n:05d}.csv")
+                           for n in range(0, args.small_files, max(1, int(1 / args.churn)))]
+                for n, rel in enumerate(changed):
+                    text_file(os.path.join(storage, rel), -1 - n)
+                for n in range(args.large_files):
+                    rel = os.path.join("media", f"video_{n}.bin")
+                    with open(os.path.join(storage, rel), "rb") as f:
+                        data = f.read()
+                    with open(os.path.join(storage, rel), "wb") as f:
+                        f.write(data[:len(data) // 2] + os.urandom(100) + data[len(data) // 2:])
+                    changed.append(rel)
+            elif step == 2:
+                changed = []
+            changed_bytes = dir_bytes(storage) if step == 0 else sum(
+                os.path.getsize(os.path.join(storage, rel)) for rel in changed)
+
+            start = time.perf_counter()
+            shutil.copytree(storage, os.path.join(tmp, f"full_{step}"))
+            copy_seconds = time.perf_counter() - start
+            start = time.perf_counter()
+            stats = repository.backup(name, storage, backup.walk_files(storage))
+            seconds = time.perf_counter() - start
+            label = ["initial", f"{len(changed) - args.large_files} edits + 100 B inserts", "no change"][step]
+            rows.append([label, f"{copy_seconds:.1f}", human_bytes(dir_bytes(storage)), human_bytes(changed_bytes),
+                         f"{seconds:.1f}", human_bytes(stats["added_bytes"])])
+
+        before = repository.size()
+        forgotten = repository.forget(0, 0, 0)
+        start = time.perf_counter()
+        pruned = repository.prune(args.repack_ratio)
+        prune_seconds = time.perf_counter() - start
+        repository.restore(SNAPSHOTS[-1], os.path.join(tmp, "restore"))
+        match, mismatch, errors = filecmp.cmpfiles(storage, os.path.join(tmp, "restore"),
+                                                   [rel for rel, _ in backup.walk_files(storage)], shallow=False)
+        assert not mismatch and not errors, (mismatch, errors)
+        after = repository.size()
+        repository.close()
+
+    print(f"\nBacking up {args.small_files} x 256 KB text files and {args.large_files} x 16 MB random files")
+    print_table(["backup", "copytree s", "copytree adds", "hard links add", "repository s", "repository adds"], rows)
+    print(f"forget {len(forgotten)} snapshots + prune ({pruned['deleted_packs']} packs deleted, "
+          f"{pruned['repacked_packs']} rewritten) in {prune_seconds:.1f}s: {human_bytes(before)} -> "
+          f"{human_bytes(after)}; {len(match)} files restored identical")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+Benchmark: serving latency during a backup, unthrottled vs the throttled parallel backup runner
+
+Starts a stand-in storage service (GET /download of small hot files, GET /load with a busy
+flag the benchmark sets, and the metadata GET /snapshot the backup pairs with) in a child
+process, and a client that keeps downloading from it. Then runs backup.backup() over a store of
+--store-mb MB of random data: unthrottled with one worker (as the backup loop used to run),
+throttled to --rate-mb MB/s with --workers workers, and throttled again while storage reports
+busy (rates scaled by BACKUP_BUSY_FACTOR); the throttled phases run at BACKUP_NICE, as the
+service does. Reports the client's download latency and the backup's read rate in each phase
+(the throttle counts pack writes too, so incompressible data is read at about half the rate).
+
+Usage: python benchmarks/bench_backup_throttle.py [--store-mb MB] [--rate-mb MB] [--workers N]
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import multiprocessing
+import os
+import socket
+import tempfile
+import time
+
+import requests
+from aiohttp import web
+
+from bench_common import load_module, print_table
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+def storage_service_process(port, hot_dir):
+    """Stand-in for storage (downloads, GET /load) and metadata (GET /snapshot)"""
+    busy = {"busy": False}
+
+    async def download(request):
+        with open(os.path.join(hot_dir, request.query["name"]), "rb") as f:
+            return web.Response(body=f.read())
+
+    async def load(request):
+        return web.json_response({"busy": busy["busy"], "requests": 0, "loadavg": os.getloadavg()[0]})
+
+    async def set_busy(request):
+        busy["busy"] = request.query["busy"] == "1"
+        return web.json_response(busy)
+
+    async def snapshot(request):
+        return web.Response(text='{"snapshot": {"cursor": null, "files": 0, "users": 0}}\n')
+
+    app = web.Application()
+    app.router.add_get("/download", download)
+    app.router.add_get("/load", load)
+    app.router.add_post("/bench/busy", set_busy)
+    app.router.add_get("/snapshot", snapshot)
+    web.run_app(app, host="localhost", port=port, print=None, access_log=None)
+
+
+async def wait_for_port(port):
+    while True:
+        try:
+            _, writer = await asyncio.open_connection("localhost", port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.1)
+
+
+def client_process(url, running, results):
+    """
+    Download hot files while running is set and report each phase's latencies when it is
+    cleared. Started before the benchmark renices itself, so it shares neither GIL nor niceness
+    """
+    session = requests.Session()
+    n = 0
+    while True:
+        running.wait()
+        latencies = []
+        while running.is_set():
+            start = time.perf_counter()
+            session.get(f"{url}/download", params={"name": f"hot_{n % 20}.bin"}).content
+            latencies.append(time.perf_counter() - start)
+            n += 1
+            time.sleep(0.01)
+        results.put(latencies)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--store-mb", type=int, default=32)
+    parser.add_argument("--rate-mb", type=float, default=2)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--busy-factor", type=float, default=0.5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        storage, hot = os.path.join(tmp, "storage"), os.path.join(tmp, "hot")
+        os.makedirs(storage)
+        os.makedirs(hot)
+        for n in range(args.store_mb // 4):
+            with open(os.path.join(storage, f"file_{n:03d}.bin"), "wb") as f:
+                f.write(os.urandom(4 * 1024 * 1024))
+        for n in range(20):
+            with open(os.path.join(hot, f"hot_{n}.bin"), "wb") as f:
+                f.write(os.urandom(256 * 1024))
+
+        port = free_port()
+        url = f"http://localhost:{port}"
+        server = multiprocessing.Process(target=storage_service_process, args=(port, hot), daemon=True)
+        server.start()
+        asyncio.run(wait_for_port(port))
+        os.environ.update(STORAGE_PATH=storage, BACKUP_PATH=os.path.join(tmp, "backup"), METADATA_URL=url,
+                          STORAGE_URL=url, STORAGE_LOAD_POLL="0.5", BACKUP_BUSY_FACTOR=str(args.busy_factor))
+        backup = load_module("backup_app", "backup/app.py")
+        throttle = load_module("backup_throttle", "backup/throttle.py")
+
+        running, results = multiprocessing.Event(), multiprocessing.Queue()
+        client = multiprocessing.Process(target=client_process, args=(url, running, results), daemon=True)
+        client.start()
+        rows = []
+        phases = [("no backup", None, 0, 1, False),
+                  ("unthrottled, 1 worker", "plain", 0, 1, False),
+                  (f"{args.rate_mb:g} MB/s, {args.workers} workers", "throttled", args.rate_mb, args.workers, False),
+                  (f"{args.rate_mb:g} MB/s, storage busy", "busy", args.rate_mb, args.workers, True)]
+        for label, repository, rate_mb, workers, busy in phases:
+            if rate_mb and os.nice(0) < backup.BACKUP_NICE:
+                os.nice(backup.BACKUP_NICE)
+            requests.post(f"{url}/bench/busy", params={"busy": int(busy)})
+            backup.THROTTLE = throttle.Throttle(rate_mb * 1024 * 1024, 0)
+            backup.BACKUP_WORKERS = workers
+            running.set()
+            time.sleep(0.5)
+            start = time.perf_counter()
+            if repository:
+                backup.REPOSITORY_PATH = os.path.join(tmp, "backup", repository)
+                with contextlib.redirect_stdout(io.StringIO()):
+                    backup.backup()
+            else:
+                time.sleep(5)
+            elapsed = time.perf_counter() - start
+            running.clear()
+            latencies = results.get()
+            rows.append([label, f"{percentile(latencies, 0.5) * 1000:.1f}", f"{percentile(latencies, 0.99) * 1000:.1f}",
+                         f"{elapsed:.1f}" if repository else "", f"{args.store_mb / elapsed:.1f}" if repository else ""])
+        for process in (client, server):
+            process.terminate()
+            process.join()
+
+    print(f"\nDownloads of 256 KB files while backing up {args.store_mb} MB (busy factor {args.busy_factor:g})")
+    print_table(["backup", "download p50 (ms)", "p99 (ms)", "backup s", "read MB/s"], rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""
+Benchmark: download throughput over 1 vs N storage replicas, and latency with a dead replica
+
+Starts --replicas stand-in storage replicas, each able to serve --slots downloads at a time
+taking --service-ms each (the replica's disk/CPU capacity), a stand-in metadata service,
+and the download service in a child process (async mode, disk cache off) with
+STORAGE_ENDPOINTS listing one replica, then all of them. In the last run one replica is
+killed just before the load starts. --concurrency clients download distinct files for
+--seconds. Reports downloads/s, latency and failed downloads.
+
+Usage: python benchmarks/bench_balancer.py [--replicas N] [--concurrency N] [--seconds S]
+"""
+
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import socket
+import time
+
+import aiohttp
+import jwt
+from aiohttp import web
+
+from bench_common import load_module, print_table
+
+PAYLOAD = b"x" * (16 * 1024)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+def replica_process(port, slots, service_ms):
+    """Stand-in storage replica: /download is served --slots at a time, /health always answers"""
+    capacity = asyncio.Semaphore(slots)
+
+    async def download(request):
+        async with capacity:
+            await asyncio.sleep(service_ms / 1000)
+        return web.Response(body=PAYLOAD, content_type="application/octet-stream")
+
+    async def health(request):
+        return web.json_response({"status": "ok"})
+
+    app = web.Application()
+    app.router.add_get("/download", download)
+    app.router.add_get("/health", health)
+    web.run_app(app, host="localhost", port=port, backlog=4096, print=None, access_log=None)
+
+
+def metadata_process(port):
+    """Stand-in metadata service: every file exists, at version 1"""
+    async def get_file(request):
+        return web.json_response({"filename": request.match_info["filename"], "version": 1})
+
+    app = web.Application()
+    app.router.add_get("/files/{filename}", get_file)
+    web.run_app(app, host="localhost", port=port, backlog=4096, print=None, access_log=None)
+
+
+def gateway_process(port, metadata_port, endpoints):
+    logging.disable(logging.WARNING)
+    os.environ.update({"STORAGE_ENDPOINTS": endpoints, "DOWNLOAD_CACHE_MAX_BYTES": "0",
+                       "BALANCER_HEALTH_INTERVAL": "0.5", "BALANCER_HEALTH_TIMEOUT": "0.5"})
+    api = f"http://localhost:{metadata_port}"
+    # Registered as "app" so app_async's `from app import ...` shares it
+    gateway = load_module("app", "services/download/app.py")
+    gateway.METADATA_API = api
+    # plain import: load_module would unregister the download_ metrics app.py just registered
+    import app_async as gateway_async
+    gateway_async.METADATA_API = api
+    web.run_app(gateway_async.create_app(), host="localhost", port=port, backlog=4096, print=None,
+                access_log=None)
+
+
+async def wait_for_port(port):
+    while True:
+        try:
+            _, writer = await asyncio.open_connection("localhost", port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.1)
+
+
+async def run_load(port, token, concurrency, seconds):
+    url = f"http://localhost:{port}/files/download"
+    headers = {"Authorization": f"Bearer {token}"}
+    latencies = []
+    failed = 0
+    deadline = time.perf_counter() + seconds
+
+    async def client(session, n):
+        nonlocal failed
+        count = 0
+        while time.perf_counter() < deadline:
+            # distinct file per request, so downloads are never coalesced
+            count += 1
+            start = time.perf_counter()
+            async with session.get(url, params={"filename": f"c{n}-{count}.bin"}, headers=headers) as resp:
+                await resp.read()
+                ok = resp.status == 200
+            if ok:
+                latencies.append(time.perf_counter() - start)
+            else:
+                failed += 1
+
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        start = time.perf_counter()
+        await asyncio.gather(*(client(session, n) for n in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    latencies.sort()
+    return [f"{len(latencies) / elapsed:.0f}", f"{latencies[len(latencies) // 2] * 1000:.0f}",
+            f"{latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000:.0f}", failed]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--replicas", type=int, default=3)
+    parser.add_argument("--slots", type=int, default=4, help="downloads one replica serves at a time")
+    parser.add_argument("--service-ms", type=float, default=20, help="time one replica takes per download")
+    parser.add_argument("--concurrency", type=int, default=48)
+    parser.add_argument("--seconds", type=float, default=5)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    token = jwt.encode({"sub": "bench", "exp": int(time.time()) + 3600},
+                       os.environ.get("SECRET_KEY", "supersecretkey"), algorithm="HS256")
+    metadata_port = free_port()
+    metadata = multiprocessing.Process(target=metadata_process, args=(metadata_port,), daemon=True)
+    metadata.start()
+    asyncio.run(wait_for_port(metadata_port))
+
+    rows = []
+    for label, count, kill_one in (("1 replica", 1, False), (f"{args.replicas} replicas", args.replicas, False),
+                                   (f"{args.replicas} replicas, 1 dead", args.replicas, True)):
+        ports = [free_port() for _ in range(count)]
+        replicas = [multiprocessing.Process(target=replica_process, args=(p, args.slots, args.service_ms),
+                                            daemon=True) for p in ports]
+        for replica in replicas:
+            replica.start()
+        for p in ports:
+            asyncio.run(wait_for_port(p))
+        port = free_port()
+        endpoints = ",".join(f"http://localhost:{p}" for p in ports)
+        gateway = multiprocessing.get_context("spawn").Process(target=gateway_process,
+                                                               args=(port, metadata_port, endpoints), daemon=True)
+        gateway.start()
+        asyncio.run(wait_for_port(port))
+        if kill_one:
+            replicas[0].kill()
+            replicas[0].join()
+        rows.append([label] + asyncio.run(run_load(port, token, args.concurrency, args.seconds)))
+        gateway.terminate()
+        gateway.join()
+        for replica in replicas:
+            replica.terminate()
+            replica.join()
+    metadata.terminate()
+    metadata.join()
+
+    print(f"\n{args.concurrency} concurrent downloads for {args.seconds:.0f}s, "
+          f"each replica serves {args.slots} at a time x {args.service_ms:.0f} ms")
+    print_table(["storage", "downloads/s", "p50 (ms)", "p99 (ms)", "failed"], rows)
+
+
+if __name__ == "__main__":
+    main()
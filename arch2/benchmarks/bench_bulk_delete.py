@@ -0,0 +1,64 @@
+"""
+Benchmark: bulk cleanup throughput, one 2PC transaction per file vs one batch transaction
+
+Starts in-process storage and metadata participants (gRPC on localhost) and the
+upload service's coordinator, creates N files with metadata, then deletes them
+either with N `execute_2pc_delete` calls or a single `execute_2pc_batch` call.
+
+Usage: python benchmarks/bench_bulk_delete.py [--files N]
+"""
+
+import argparse
+import logging
+import os
+import tempfile
+import time
+
+from bench_common import start_participants, load_coordinator, print_table
+
+
+def populate(storage_path, metadata_store, count):
+    filenames = []
+    for i in range(count):
+        filename = f"cleanup_{i:06d}.txt"
+        with open(os.path.join(storage_path, filename), "w") as f:
+            f.write("x")
+        metadata_store[filename] = {"filename": filename, "path": f"/storage/{filename}", "size": 1, "version": 1}
+        filenames.append(filename)
+    return filenames
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--files", type=int, default=2000)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as storage_path:
+        _, _, metadata_store, storage_endpoint, metadata_endpoint, servers = start_participants(storage_path)
+        coordinator = load_coordinator(storage_endpoint, metadata_endpoint).TwoPhaseCommitCoordinator()
+
+        rows = []
+        filenames = populate(storage_path, metadata_store, args.files)
+        start = time.perf_counter()
+        for filename in filenames:
+            assert coordinator.execute_2pc_delete(filename)['success']
+        elapsed = time.perf_counter() - start
+        rows.append(["per-file 2PC", args.files, args.files, f"{elapsed:.2f}", f"{args.files / elapsed:.0f}"])
+
+        filenames = populate(storage_path, metadata_store, args.files)
+        start = time.perf_counter()
+        result = coordinator.execute_2pc_batch([{"operation": "delete", "filename": f} for f in filenames])
+        elapsed = time.perf_counter() - start
+        assert result['success'] and not metadata_store and os.listdir(storage_path) == ['.staging']
+        rows.append(["batch 2PC", args.files, 1, f"{elapsed:.2f}", f"{args.files / elapsed:.0f}"])
+
+        for server in servers:
+            server.stop(0)
+
+    print("Bulk delete throughput")
+    print_table(["mode", "files", "transactions", "seconds", "files/s"], rows)
+
+
+if __name__ == "__main__":
+    main()
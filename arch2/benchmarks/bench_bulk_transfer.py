@@ -0,0 +1,121 @@
+"""
+Benchmark: CLI bulk upload of many small files, one request per file vs upload-many
+
+Starts a stand-in upload service that answers each upload after --rtt-ms (network round
+trip plus server time) and serves at most --server-slots uploads at once (its capacity).
+Uploads --files files of --file-kb KB: first the way a script calling `cli.py upload` per
+file does (a fresh requests call each, sequentially), then with the CLI's upload-many
+pool at several worker counts. Reports files/s.
+
+Usage: python benchmarks/bench_bulk_transfer.py [--files N] [--rtt-ms MS] [--server-slots N]
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import socket
+import sys
+import tempfile
+import time
+
+import requests
+from aiohttp import web
+
+from bench_common import ARCH2_ROOT, print_table
+
+sys.path.insert(0, os.path.join(ARCH2_ROOT, "client"))
+import cli  # noqa: E402
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+def upload_service_process(port, rtt_ms, server_slots):
+    """Stand-in for POST /files/upload with a fixed latency and a limited number of uploads at once"""
+    slots = asyncio.Semaphore(server_slots)
+
+    async def upload(request):
+        await request.read()
+        async with slots:
+            await asyncio.sleep(rtt_ms / 1000)
+        return web.json_response({"message": "ok"}, status=201)
+
+    app = web.Application(client_max_size=1024 ** 3)
+    app.router.add_post("/files/upload", upload)
+    web.run_app(app, host="localhost", port=port, backlog=4096, print=None, access_log=None)
+
+
+async def wait_for_port(port):
+    while True:
+        try:
+            _, writer = await asyncio.open_connection("localhost", port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.1)
+
+
+def per_file_requests(paths):
+    """What a loop over `cli.py upload <file>` amounts to, minus the interpreter start per file"""
+    for path in paths:
+        with open(path, "rb") as f:
+            requests.post(f"{cli.UPLOAD_URL}/files/upload", files={"file": f})
+
+
+def upload_many(paths, workers):
+    session = cli.bulk_session(workers)
+    progress, failures = cli.run_many("Uploaded", paths, lambda path: cli.upload_one(
+        session, path, os.path.basename(path), cli.BULK_RETRIES), workers)
+    assert not failures, failures[:3]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--files", type=int, default=2000)
+    parser.add_argument("--file-kb", type=int, default=4)
+    parser.add_argument("--rtt-ms", type=float, default=10)
+    parser.add_argument("--server-slots", type=int, default=16)
+    parser.add_argument("--workers", default="1,8,32", help="comma-separated upload-many worker counts")
+    args = parser.parse_args()
+
+    port = free_port()
+    server = multiprocessing.Process(target=upload_service_process, args=(port, args.rtt_ms, args.server_slots),
+                                     daemon=True)
+    server.start()
+    asyncio.run(wait_for_port(port))
+    cli.UPLOAD_URL = f"http://localhost:{port}"
+    cli.TOKEN_FILE = os.devnull
+    cli.UPLOAD_DEDUP = False  # every file is new content; measure the transfers alone
+
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = []
+        for n in range(args.files):
+            path = os.path.join(tmp, f"f{n:05d}.bin")
+            with open(path, "wb") as f:
+                f.write(os.urandom(args.file_kb * 1024))
+            paths.append(path)
+
+        runs = [("upload per file", lambda: per_file_requests(paths))]
+        runs += [(f"upload-many, {w} workers", lambda w=w: upload_many(paths, w))
+                 for w in map(int, args.workers.split(","))]
+        for label, run in runs:
+            start = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - start
+            rows.append([label, f"{elapsed:.1f}", f"{args.files / elapsed:.0f}"])
+    server.terminate()
+    server.join()
+
+    print(f"\n{args.files} files x {args.file_kb} KB, {args.rtt_ms:.0f} ms per upload, "
+          f"server capacity {args.server_slots} uploads at once "
+          f"(ceiling {args.server_slots * 1000 / args.rtt_ms:.0f} files/s)")
+    print_table(["client", "seconds", "files/s"], rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Benchmark: CLI upload of one large file, requests' in-memory multipart body vs the streaming encoder
+
+Starts a stand-in upload service that reads and discards the request body, then uploads a
+--file-mb MB file from a fresh child process per mode: first with `files=` (requests builds
+the whole multipart body in memory), then with the CLI's MultipartUpload (file read in
+chunks, sha256 computed on the way and sent as a trailing field). Reports the client's peak
+RSS and throughput.
+
+Usage: python benchmarks/bench_client_upload.py [--file-mb MB]
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import resource
+import socket
+import sys
+import tempfile
+import time
+
+from aiohttp import web
+
+from bench_common import ARCH2_ROOT, print_table
+
+sys.path.insert(0, os.path.join(ARCH2_ROOT, "client"))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+def upload_service_process(port):
+    """Stand-in for POST /files/upload that reads the body and discards it"""
+    async def upload(request):
+        async for _ in request.content.iter_chunked(1024 * 1024):
+            pass
+        return web.json_response({"message": "ok"}, status=201)
+
+    app = web.Application(client_max_size=1024 ** 4)
+    app.router.add_post("/files/upload", upload)
+    web.run_app(app, host="localhost", port=port, print=None, access_log=None)
+
+
+async def wait_for_port(port):
+    while True:
+        try:
+            _, writer = await asyncio.open_connection("localhost", port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.1)
+
+
+def client_process(mode, url, path, results):
+    import requests
+    import cli
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    if mode == "in-memory (files=)":
+        with open(path, "rb") as f:
+            resp = requests.post(url, files={"file": f})
+    else:
+        body = cli.MultipartUpload(path)
+        resp = requests.post(url, data=body, headers={"Content-Type": body.content_type})
+    elapsed = time.perf_counter() - start
+    assert resp.status_code == 201, resp.status_code
+    # ru_maxrss is in KB on Linux; the baseline is the interpreter with requests imported
+    results.put((mode, elapsed, (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline) * 1024))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--file-mb", type=int, default=1024)
+    args = parser.parse_args()
+
+    port = free_port()
+    server = multiprocessing.Process(target=upload_service_process, args=(port,), daemon=True)
+    server.start()
+    asyncio.run(wait_for_port(port))
+
+    spawn = multiprocessing.get_context("spawn")
+    results = spawn.Queue()
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "big.bin")
+        with open(path, "wb") as f:
+            for _ in range(args.file_mb):
+                f.write(os.urandom(1024 * 1024))
+        for mode in ("in-memory (files=)", "streaming encoder"):
+            client = spawn.Process(target=client_process,
+                                   args=(mode, f"http://localhost:{port}/files/upload", path, results))
+            client.start()
+            mode, elapsed, peak = results.get()
+            client.join()
+            rows.append([mode, f"{peak / 1e6:.0f}", f"{elapsed:.1f}", f"{args.file_mb / elapsed:.0f}"])
+    server.terminate()
+    server.join()
+
+    print(f"\nUploading one {args.file_mb} MB file")
+    print_table(["client", "peak RSS growth (MB)", "seconds", "MB/s"], rows)
+
+
+if __name__ == "__main__":
+    main()
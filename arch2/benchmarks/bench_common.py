@@ -0,0 +1,95 @@
+"""
+Shared helpers for the arch2 benchmark scripts
+Loads service modules straight from their directories (every service has its own
+app.py / twopc_participant.py, so they cannot all be imported by name)
+"""
+
+import importlib.util
+import os
+import sys
+
+ARCH2_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Generated twopc_pb2 / twopc_pb2_grpc live in the arch2 root
+if ARCH2_ROOT not in sys.path:
+    sys.path.insert(0, ARCH2_ROOT)
+
+
+def _unregister_service_metrics():
+    """Services register same-named Prometheus metrics; in production each runs in its own process"""
+    try:
+        from prometheus_client import REGISTRY
+    except ImportError:
+        return
+    for collector, names in list(REGISTRY._collector_to_names.items()):
+        if any(n.startswith(("twopc_", "gateway_", "download_", "backup_", "http_client_")) for n in names):
+            REGISTRY.unregister(collector)
+
+
+def load_module(name, relative_path):
+    """Import a service module from a path relative to arch2/ under a unique name"""
+    _unregister_service_metrics()
+    path = os.path.join(ARCH2_ROOT, relative_path)
+    module_dir = os.path.dirname(path)
+    if module_dir not in sys.path:
+        sys.path.insert(0, module_dir)
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def human_bytes(n):
+    for unit in ("B", "KB", "MB", "GB"):
+        if n < 1024 or unit == "GB":
+            return f"{n:.0f}{unit}" if unit == "B" else f"{n:.1f}{unit}"
+        n /= 1024
+
+
+def print_table(headers, rows):
+    """Print rows as a fixed-width text table"""
+    widths = [max(len(str(h)), *(len(str(r[i])) for r in rows)) for i, h in enumerate(headers)]
+    print("  ".join(str(h).ljust(w) for h, w in zip(headers, widths)))
+    print("  ".join("-" * w for w in widths))
+    for row in rows:
+        print("  ".join(str(c).ljust(w) for c, w in zip(row, widths)))
+
+
+def start_participants(storage_path, options=None):
+    """
+    Start in-process storage and metadata participant gRPC servers on ephemeral ports
+    `options` are extra gRPC server options (e.g. a larger max receive message size)
+    Returns (storage_module, metadata_module, metadata_store, storage_endpoint, metadata_endpoint, servers)
+    """
+    import grpc
+    from concurrent import futures
+    import twopc_pb2_grpc
+
+    os.environ['STORAGE_PATH'] = storage_path
+    storage = load_module("storage_twopc_participant", "storage/twopc_participant.py")
+    metadata = load_module("metadata_twopc_participant", "metadata/twopc_participant.py")
+    metadata_store = {}
+    metadata.metadata_store = metadata_store
+
+    servers = []
+    endpoints = []
+    for vote_service, decision_service, heartbeat_service in (
+            (storage.StorageVotePhaseService(), storage.StorageDecisionPhaseService(), storage.StorageHeartbeatService()),
+            (metadata.MetadataVotePhaseService(), metadata.MetadataDecisionPhaseService(), metadata.MetadataHeartbeatService())):
+        server = grpc.server(futures.ThreadPoolExecutor(max_workers=10), options=options)
+        twopc_pb2_grpc.add_VotePhaseServiceServicer_to_server(vote_service, server)
+        twopc_pb2_grpc.add_DecisionPhaseServiceServicer_to_server(decision_service, server)
+        twopc_pb2_grpc.add_HeartbeatServiceServicer_to_server(heartbeat_service, server)
+        port = server.add_insecure_port('localhost:0')
+        server.start()
+        servers.append(server)
+        endpoints.append(f"localhost:{port}")
+    return storage, metadata, metadata_store, endpoints[0], endpoints[1], servers
+
+
+def load_coordinator(storage_endpoint, metadata_endpoint):
+    """Load the upload service's 2PC coordinator pointed at the given participants"""
+    os.environ['STORAGE_NODES'] = storage_endpoint
+    os.environ['METADATA_NODES'] = metadata_endpoint
+    return load_module("twopc_coordinator", "services/upload/twopc_coordinator.py")
@@ -0,0 +1,212 @@
+"""
+Benchmark: download-service disk cache under a skewed (Zipf) download mix
+
+Starts a stand-in storage + metadata service holding --files files of --file-kb KB and the
+download service in a child process (async mode) with the disk cache off, then on
+(capacity --cache-pct percent of the corpus). --requests downloads are drawn from a Zipf
+distribution over the files, --concurrency at a time. Halfway through, the hottest file is
+overwritten (its version and sha256 bumped) and every later download of it is checked to return the
+new bytes. Reports cache hit ratio, storage bytes, bytes saved and client latency.
+
+Usage: python benchmarks/bench_download_cache.py [--files N] [--requests N] [--cache-pct P]
+"""
+
+import argparse
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+import os
+import random
+import socket
+import tempfile
+import time
+
+import aiohttp
+import jwt
+from aiohttp import web
+
+from bench_common import human_bytes, load_module, print_table
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+def file_bytes(filename, version, size):
+    """Deterministic contents for a file version (first bytes name the version)"""
+    header = f"{filename}@{version};".encode()
+    return header + b"x" * (size - len(header))
+
+
+def storage_process(port, file_size, delay):
+    """Stand-in for storage's /download and metadata's /files/<name>; /bump overwrites a file"""
+    versions = {}
+    stats = {"streams": 0, "bytes": 0}
+
+    async def download(request):
+        filename = request.query["filename"]
+        body = file_bytes(filename, versions.get(filename, 1), file_size)
+        stats["streams"] += 1
+        stats["bytes"] += len(body)
+        await asyncio.sleep(delay)
+        return web.Response(body=body, content_type="application/octet-stream")
+
+    async def get_file(request):
+        filename = request.match_info["filename"]
+        version = versions.get(filename, 1)
+        sha256 = hashlib.sha256(file_bytes(filename, version, file_size)).hexdigest()
+        return web.json_response({"filename": filename, "version": version, "sha256": sha256})
+
+    async def bump(request):
+        filename = request.query["filename"]
+        versions[filename] = versions.get(filename, 1) + 1
+        return web.json_response({"version": versions[filename]})
+
+    async def get_stats(request):
+        return web.json_response(stats)
+
+    app = web.Application()
+    app.router.add_get("/download", download)
+    app.router.add_get("/files/{filename}", get_file)
+    app.router.add_post("/bump", bump)
+    app.router.add_get("/stats", get_stats)
+    web.run_app(app, host="localhost", port=port, backlog=4096, print=None, access_log=None)
+
+
+def gateway_process(port, storage_port, cache_env):
+    logging.disable(logging.WARNING)
+    os.environ.update(cache_env)
+    api = f"http://localhost:{storage_port}"
+    # Registered as "app" so app_async's `from app import ...` shares it
+    gateway = load_module("app", "services/download/app.py")
+    gateway.STORAGE_API = gateway.METADATA_API = api
+    # plain import: load_module would unregister the download_ metrics app.py just registered
+    import app_async as gateway_async
+    gateway_async.STORAGE_API = gateway_async.METADATA_API = api
+    web.run_app(gateway_async.create_app(), host="localhost", port=port, backlog=4096, print=None,
+                access_log=None)
+
+
+async def wait_for_port(port):
+    while True:
+        try:
+            _, writer = await asyncio.open_connection("localhost", port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.1)
+
+
+def parse_metrics(text):
+    values = {}
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            name, _, value = line.rpartition(" ")
+            values[name] = float(value)
+    return values
+
+
+async def run_workload(port, storage_port, token, names, requests, concurrency, seed):
+    base = f"http://localhost:{port}"
+    storage = f"http://localhost:{storage_port}"
+    headers = {"Authorization": f"Bearer {token}"}
+    rng = random.Random(seed)
+    weights = [1 / (rank + 1) for rank in range(len(names))]
+    picks = rng.choices(names, weights=weights, k=requests)
+    hottest = names[0]
+    latencies = []
+    stale = 0
+    bumped = False
+    queue = asyncio.Queue()
+    for n, name in enumerate(picks):
+        queue.put_nowait((n, name))
+
+    async with aiohttp.ClientSession() as session:
+        async def worker():
+            nonlocal stale, bumped
+            while not queue.empty():
+                n, name = queue.get_nowait()
+                if n >= requests // 2 and not bumped:
+                    bumped = True
+                    async with session.post(f"{storage}/bump", params={"filename": hottest}) as resp:
+                        await resp.read()
+                start = time.perf_counter()
+                async with session.get(f"{base}/files/download", params={"filename": name},
+                                       headers=headers) as resp:
+                    body = await resp.read()
+                latencies.append(time.perf_counter() - start)
+                if name == hottest and n > requests // 2 and not body.startswith(f"{hottest}@2;".encode()):
+                    stale += 1
+
+        async with session.get(f"{storage}/stats") as resp:
+            before = await resp.json()
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        async with session.get(f"{storage}/stats") as resp:
+            after = await resp.json()
+        async with session.get(f"{base}/metrics") as resp:
+            metrics = parse_metrics(await resp.text())
+
+    latencies.sort()
+    hits = metrics.get('download_cache_requests_total{result="hit"}', 0)
+    misses = metrics.get('download_cache_requests_total{result="miss"}', 0)
+    return [f"{hits / (hits + misses):.0%}" if hits + misses else "-",
+            after["streams"] - before["streams"], human_bytes(after["bytes"] - before["bytes"]),
+            human_bytes(metrics.get("download_cache_hit_bytes_total", 0)),
+            f"{latencies[len(latencies) // 2] * 1000:.1f}", f"{latencies[int(len(latencies) * 0.99)] * 1000:.1f}",
+            f"{requests / elapsed:.0f}", stale]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--files", type=int, default=200)
+    parser.add_argument("--file-kb", type=int, default=256)
+    parser.add_argument("--requests", type=int, default=4000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--cache-pct", type=float, default=20, help="cache capacity as a percent of the corpus")
+    parser.add_argument("--delay", type=float, default=0.01, help="seconds storage takes per download")
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    token = jwt.encode({"sub": "bench", "exp": int(time.time()) + 3600},
+                       os.environ.get("SECRET_KEY", "supersecretkey"), algorithm="HS256")
+    names = [f"file{n:05d}.bin" for n in range(args.files)]
+    file_size = args.file_kb * 1024
+    cache_bytes = int(args.files * file_size * args.cache_pct / 100)
+
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, cache_env in (("off", {"DOWNLOAD_CACHE_MAX_BYTES": "0"}),
+                                 (f"SLRU, {human_bytes(cache_bytes)}",
+                                  {"DOWNLOAD_CACHE_MAX_BYTES": str(cache_bytes),
+                                   "DOWNLOAD_CACHE_DIR": os.path.join(tmp, "cache")})):
+            # a fresh storage per run, so both start with every file at version 1
+            storage_port = free_port()
+            storage = multiprocessing.Process(target=storage_process, args=(storage_port, file_size, args.delay),
+                                              daemon=True)
+            storage.start()
+            asyncio.run(wait_for_port(storage_port))
+            port = free_port()
+            gateway = multiprocessing.get_context("spawn").Process(target=gateway_process,
+                                                                   args=(port, storage_port, cache_env), daemon=True)
+            gateway.start()
+            asyncio.run(wait_for_port(port))
+            rows.append([label] + asyncio.run(run_workload(port, storage_port, token, names, args.requests,
+                                                           args.concurrency, seed=1)))
+            gateway.terminate()
+            gateway.join()
+            storage.terminate()
+            storage.join()
+
+    print(f"\n{args.requests} Zipf downloads over {args.files} x {args.file_kb} KB files, "
+          f"{args.concurrency} at a time, hottest file overwritten halfway")
+    print_table(["cache", "hit ratio", "storage streams", "storage bytes", "bytes saved", "p50 (ms)", "p99 (ms)",
+                 "downloads/s", "stale after overwrite"], rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""
+Benchmark: many clients downloading the same hot file through one download-service process
+
+Starts a stand-in storage service that sends the file slowly (--chunks chunks, --delay
+seconds apart, like a large file on a busy disk) and counts the streams it serves, a
+stand-in metadata service that reports the file's version and sha256, and the download service in
+a child process (--mode flask or async). For each concurrency level, that many clients
+download the file at once, first with one storage fetch per request (coalescing keyed
+per request, the old behaviour) and then with single-flight coalescing on
+(filename, sha256). Reports storage streams and bytes, and client latency.
+
+Usage: python benchmarks/bench_download_coalescing.py [--levels 1,10,100,...] [--mode flask|async]
+"""
+
+import argparse
+import asyncio
+import itertools
+import logging
+import multiprocessing
+import os
+import socket
+import time
+
+import aiohttp
+import jwt
+from aiohttp import web
+
+from bench_common import human_bytes, load_module, print_table
+
+CHUNK = os.urandom(64 * 1024)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+def storage_process(port, chunks, delay):
+    """Stand-in for storage's /download: streams `chunks` chunks, `delay` seconds apart, and counts streams"""
+    stats = {"streams": 0, "bytes": 0}
+
+    async def download(request):
+        stats["streams"] += 1
+        response = web.StreamResponse(headers={"Content-Type": "application/octet-stream"})
+        await response.prepare(request)
+        for n in range(chunks):
+            if n:
+                await asyncio.sleep(delay)
+            await response.write(CHUNK)
+            stats["bytes"] += len(CHUNK)
+        await response.write_eof()
+        return response
+
+    async def get_stats(request):
+        return web.json_response(stats)
+
+    async def get_file(request):
+        return web.json_response({"filename": request.match_info["filename"], "version": 1, "sha256": "0" * 64})
+
+    app = web.Application()
+    app.router.add_get("/download", download)
+    app.router.add_get("/stats", get_stats)
+    app.router.add_get("/files/{filename}", get_file)
+    web.run_app(app, host="localhost", port=port, backlog=4096, print=None, access_log=None)
+
+
+def gateway_process(mode, coalesce, port, storage_port):
+    logging.disable(logging.WARNING)
+    # measure coalescing alone: with the disk cache on, repeat levels would never reach storage
+    os.environ["DOWNLOAD_CACHE_MAX_BYTES"] = "0"
+    # the stand-in storage process also answers the metadata lookup
+    api = f"http://localhost:{storage_port}"
+    # Registered as "app" so app_async's `from app import ...` shares it
+    gateway = load_module("app", "services/download/app.py")
+    gateway.STORAGE_API = gateway.METADATA_API = api
+    if mode == "async":
+        gateway_async = load_module("download_app_async", "services/download/app_async.py")
+        gateway_async.STORAGE_API = gateway_async.METADATA_API = api
+        if not coalesce:
+            ids = itertools.count()
+
+            async def per_request_content(filename):
+                return {"sha256": f"{next(ids):064x}"}
+            gateway_async.current_metadata = per_request_content
+        web.run_app(gateway_async.create_app(), host="localhost", port=port, backlog=4096, print=None,
+                    access_log=None)
+    else:
+        if not coalesce:
+            ids = itertools.count()
+            gateway.current_metadata = lambda filename: {"sha256": f"{next(ids):064x}"}
+        from werkzeug.serving import make_server
+        server = make_server("localhost", port, gateway.app, threaded=True)
+        server.socket.listen(4096)
+        server.serve_forever()
+
+
+async def wait_for_port(port):
+    while True:
+        try:
+            _, writer = await asyncio.open_connection("localhost", port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.1)
+
+
+async def storage_stats(session, storage_port):
+    async with session.get(f"http://localhost:{storage_port}/stats") as resp:
+        return await resp.json()
+
+
+async def run_level(port, storage_port, token, clients, expected_size):
+    url = f"http://localhost:{port}/files/download?filename=hot.bin"
+    headers = {"Authorization": f"Bearer {token}"}
+
+    async def fetch(session):
+        start = time.perf_counter()
+        try:
+            async with session.get(url, headers=headers) as resp:
+                ok = resp.status == 200 and len(await resp.read()) == expected_size
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            ok = False
+        return ok, time.perf_counter() - start
+
+    connector = aiohttp.TCPConnector(limit=0)
+    timeout = aiohttp.ClientTimeout(total=300)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        before = await storage_stats(session, storage_port)
+        start = time.perf_counter()
+        results = await asyncio.gather(*(fetch(session) for _ in range(clients)))
+        elapsed = time.perf_counter() - start
+        after = await storage_stats(session, storage_port)
+
+    latencies = sorted(latency for ok, latency in results if ok)
+    completed = len(latencies)
+    p50 = f"{latencies[completed // 2]:.2f}" if latencies else "-"
+    p99 = f"{latencies[min(completed - 1, int(completed * 0.99))]:.2f}" if latencies else "-"
+    return [clients, completed, after["streams"] - before["streams"],
+            human_bytes(after["bytes"] - before["bytes"]), p50, p99, f"{elapsed:.2f}"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--levels", default="1,10,100,500")
+    parser.add_argument("--mode", choices=("flask", "async"), default="async")
+    parser.add_argument("--chunks", type=int, default=32, help="64 KB chunks in the file")
+    parser.add_argument("--delay", type=float, default=0.05, help="seconds between chunks sent by storage")
+    args = parser.parse_args()
+    levels = [int(level) for level in args.levels.split(",")]
+    logging.disable(logging.WARNING)
+
+    token = jwt.encode({"sub": "bench", "exp": int(time.time()) + 3600},
+                       os.environ.get("SECRET_KEY", "supersecretkey"), algorithm="HS256")
+
+    storage_port = free_port()
+    storage = multiprocessing.Process(target=storage_process, args=(storage_port, args.chunks, args.delay),
+                                      daemon=True)
+    storage.start()
+    asyncio.run(wait_for_port(storage_port))
+
+    for label, coalesce in (("one storage fetch per request", False), ("single-flight coalescing", True)):
+        port = free_port()
+        gateway = multiprocessing.get_context("spawn").Process(target=gateway_process,
+                                                               args=(args.mode, coalesce, port, storage_port),
+                                                               daemon=True)
+        gateway.start()
+        asyncio.run(wait_for_port(port))
+        rows = [asyncio.run(run_level(port, storage_port, token, clients, args.chunks * len(CHUNK)))
+                for clients in levels]
+        gateway.terminate()
+        gateway.join()
+
+        print(f"\n{args.mode} download service, {label} "
+              f"({human_bytes(args.chunks * len(CHUNK))} file, {args.delay}s between chunks)")
+        print_table(["clients", "completed", "storage streams", "storage bytes", "p50 (s)", "p99 (s)",
+                     "wall (s)"], rows)
+
+    storage.terminate()
+
+
+if __name__ == "__main__":
+    main()
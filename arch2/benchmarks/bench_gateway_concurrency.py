@@ -0,0 +1,168 @@
+"""
+Benchmark: concurrent slow downloads through one download-service process, flask vs async mode
+
+Starts a stand-in storage service that sends each file slowly (--chunks chunks, --delay
+seconds apart, like a large file on a busy disk) and the download service in a child
+process, either on the threaded Flask server (app.py) or the aiohttp server
+(app_async.py). For each concurrency level, that many clients download at once.
+Reports completed downloads, errors, p50/p99 latency, throughput and the gateway's
+peak threads and RSS - the concurrency curve of one gateway process.
+
+Usage: python benchmarks/bench_gateway_concurrency.py [--levels 10,100,...] [--chunks K] [--delay SECONDS]
+"""
+
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import socket
+import time
+
+import aiohttp
+import jwt
+from aiohttp import web
+
+from bench_common import load_module, print_table
+
+CHUNK = os.urandom(16 * 1024)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+def storage_process(port, chunks, delay):
+    """Stand-in for storage's /download: streams `chunks` chunks, `delay` seconds apart"""
+    async def download(request):
+        response = web.StreamResponse(headers={"Content-Type": "application/octet-stream"})
+        await response.prepare(request)
+        for n in range(chunks):
+            if n:
+                await asyncio.sleep(delay)
+            await response.write(CHUNK)
+        await response.write_eof()
+        return response
+
+    app = web.Application()
+    app.router.add_get("/download", download)
+    web.run_app(app, host="localhost", port=port, backlog=4096, print=None, access_log=None)
+
+
+def gateway_process(mode, port, storage_port):
+    logging.disable(logging.WARNING)
+    storage_api = f"http://localhost:{storage_port}"
+    # Registered as "app" so app_async's `from app import ...` shares it
+    gateway = load_module("app", "services/download/app.py")
+    gateway.STORAGE_API = storage_api
+    if mode == "async":
+        gateway_async = load_module("download_app_async", "services/download/app_async.py")
+        gateway_async.STORAGE_API = storage_api
+        web.run_app(gateway_async.create_app(), host="localhost", port=port, backlog=4096, print=None,
+                    access_log=None)
+    else:
+        from werkzeug.serving import make_server
+        server = make_server("localhost", port, gateway.app, threaded=True)
+        server.socket.listen(4096)
+        server.serve_forever()
+
+
+def proc_status(pid, field):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(field):
+                    return int(line.split()[1])
+    except OSError:
+        return 0
+
+
+async def wait_for_port(port):
+    while True:
+        try:
+            _, writer = await asyncio.open_connection("localhost", port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.1)
+
+
+async def run_level(port, token, clients, pid):
+    url = f"http://localhost:{port}/files/download?filename=report.pdf"
+    headers = {"Authorization": f"Bearer {token}"}
+    peak = {"threads": 0, "rss": 0}
+
+    async def sample():
+        while True:
+            peak["threads"] = max(peak["threads"], proc_status(pid, "Threads:"))
+            peak["rss"] = max(peak["rss"], proc_status(pid, "VmRSS:"))
+            await asyncio.sleep(0.05)
+
+    async def fetch(session):
+        start = time.perf_counter()
+        try:
+            async with session.get(url, headers=headers) as resp:
+                await resp.read()
+                ok = resp.status == 200
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            ok = False
+        return ok, time.perf_counter() - start
+
+    connector = aiohttp.TCPConnector(limit=0)
+    timeout = aiohttp.ClientTimeout(total=120)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        sampler = asyncio.create_task(sample())
+        start = time.perf_counter()
+        results = await asyncio.gather(*(fetch(session) for _ in range(clients)))
+        elapsed = time.perf_counter() - start
+        sampler.cancel()
+
+    latencies = sorted(latency for ok, latency in results if ok)
+    completed = len(latencies)
+    p50 = f"{latencies[completed // 2]:.2f}" if latencies else "-"
+    p99 = f"{latencies[min(completed - 1, int(completed * 0.99))]:.2f}" if latencies else "-"
+    return [clients, completed, clients - completed, p50, p99, f"{completed / elapsed:.0f}",
+            peak["threads"], f"{peak['rss'] / 1024:.0f}"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--levels", default="10,100,500,1000,2000")
+    parser.add_argument("--chunks", type=int, default=10)
+    parser.add_argument("--delay", type=float, default=0.2, help="seconds between chunks of one download")
+    args = parser.parse_args()
+    levels = [int(level) for level in args.levels.split(",")]
+    logging.disable(logging.WARNING)
+
+    token = jwt.encode({"sub": "bench", "exp": int(time.time()) + 3600},
+                       os.environ.get("SECRET_KEY", "supersecretkey"), algorithm="HS256")
+
+    storage_port = free_port()
+    storage = multiprocessing.Process(target=storage_process, args=(storage_port, args.chunks, args.delay),
+                                      daemon=True)
+    storage.start()
+    asyncio.run(wait_for_port(storage_port))
+
+    for mode in ("flask", "async"):
+        port = free_port()
+        # Spawned, not forked, so the gateway's RSS does not include pages inherited from this process
+        gateway = multiprocessing.get_context("spawn").Process(target=gateway_process, args=(mode, port, storage_port),
+                                                               daemon=True)
+        gateway.start()
+        asyncio.run(wait_for_port(port))
+        rows = [asyncio.run(run_level(port, token, clients, gateway.pid)) for clients in levels]
+        gateway.terminate()
+        gateway.join()
+
+        print(f"\n{mode} download service ({args.chunks} x {len(CHUNK) // 1024} KB chunks, {args.delay}s apart, "
+              f"ideal latency {(args.chunks - 1) * args.delay:.1f}s)")
+        print_table(["clients", "completed", "errors", "p50 (s)", "p99 (s)", "downloads/s", "gateway peak threads",
+                     "gateway peak RSS (MB)"], rows)
+
+    storage.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+"""
+Benchmark: client file transfers over REST (multipart upload, HTTP download) vs the gRPC FileService
+
+Starts a stand-in storage + metadata service, the upload service (async mode, with its gRPC
+FileService) and the download service (async mode, disk cache off) in child processes. The
+2PC coordinator is a stand-in that reads the streamed body and hashes it. --concurrency
+clients upload, then download, --files files of --file-kb KB each, first with aiohttp over
+REST, then with grpc.aio over one channel. Reports MB/s and per-file latency.
+
+Usage: python benchmarks/bench_grpc_api.py [--files N] [--file-kb KB] [--concurrency N]
+"""
+
+import argparse
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+import os
+import socket
+import time
+
+import aiohttp
+import grpc
+import jwt
+from aiohttp import web
+
+from bench_common import load_module, print_table
+
+import fileservice_pb2
+import fileservice_pb2_grpc
+
+CHUNK_SIZE = 256 * 1024
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+def storage_process(port, file_size):
+    """Stand-in for storage's /download and metadata's /files/<name>: every file exists"""
+    body = os.urandom(file_size)
+    sha256 = hashlib.sha256(body).hexdigest()
+
+    async def download(request):
+        return web.Response(body=body, content_type="application/octet-stream")
+
+    async def get_file(request):
+        return web.json_response({"filename": request.match_info["filename"], "version": 1, "size": file_size,
+                                  "sha256": sha256})
+
+    app = web.Application()
+    app.router.add_get("/download", download)
+    app.router.add_get("/files/{filename}", get_file)
+    web.run_app(app, host="localhost", port=port, backlog=4096, print=None, access_log=None)
+
+
+def upload_process(port, grpc_port, storage_port):
+    logging.disable(logging.WARNING)
+    # the benchmark user uploads far more than one user's byte bucket allows
+    os.environ["UPLOAD_USER_BYTES_PER_SEC"] = "0"
+
+    class StandInCoordinator:
+        def execute_2pc_upload_stream(self, filename, chunks, metadata):
+            digest = hashlib.sha256()
+            size = 0
+            for chunk in chunks:
+                digest.update(chunk)
+                size += len(chunk)
+            # like the real coordinator: the streamed size and hash come back in the result
+            return {"success": True, "transaction_id": "bench", "message": "", "size": size,
+                    "sha256": digest.hexdigest()}
+
+    def load_coordinator():
+        return StandInCoordinator
+
+    api = f"http://localhost:{storage_port}"
+    # Registered as "app" so app_async's and file_service's `from app import ...` share it
+    gateway = load_module("app", "services/upload/app.py")
+    gateway.load_coordinator = load_coordinator
+    gateway.METADATA_API = gateway.STORAGE_API = api
+    import app_async
+    import file_service
+    app_async.load_coordinator = file_service.load_coordinator = load_coordinator
+    file_service.METADATA_API = file_service.STORAGE_API = api
+    server = file_service.serve(grpc_port)
+    web.run_app(app_async.create_app(), host="localhost", port=port, backlog=4096, print=None, access_log=None)
+    server.stop(None)
+
+
+def download_process(port, storage_port):
+    logging.disable(logging.WARNING)
+    os.environ["DOWNLOAD_CACHE_MAX_BYTES"] = "0"
+    api = f"http://localhost:{storage_port}"
+    gateway = load_module("app", "services/download/app.py")
+    gateway.STORAGE_API = gateway.METADATA_API = api
+    # plain import: load_module would unregister the download_ metrics app.py just registered
+    import app_async as gateway_async
+    gateway_async.STORAGE_API = gateway_async.METADATA_API = api
+    web.run_app(gateway_async.create_app(), host="localhost", port=port, backlog=4096, print=None,
+                access_log=None)
+
+
+async def wait_for_port(port):
+    while True:
+        try:
+            _, writer = await asyncio.open_connection("localhost", port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.1)
+
+
+async def run_clients(concurrency, files, transfer):
+    """Run transfer(n) for n in range(files), concurrency at a time; returns (seconds, sorted latencies)"""
+    queue = asyncio.Queue()
+    for n in range(files):
+        queue.put_nowait(n)
+    latencies = []
+
+    async def worker():
+        while not queue.empty():
+            n = queue.get_nowait()
+            start = time.perf_counter()
+            await transfer(n)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return time.perf_counter() - start, sorted(latencies)
+
+
+async def bench_rest(upload_port, download_port, token, payload, files, concurrency):
+    headers = {"Authorization": f"Bearer {token}"}
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0)) as session:
+        async def upload(n):
+            form = aiohttp.FormData()
+            form.add_field("file", payload, filename=f"f{n}.bin")
+            async with session.post(f"http://localhost:{upload_port}/files/upload", data=form,
+                                    headers=headers) as resp:
+                await resp.read()
+                assert resp.status == 201, resp.status
+
+        async def download(n):
+            async with session.get(f"http://localhost:{download_port}/files/download",
+                                   params={"filename": f"f{n}.bin"}, headers=headers) as resp:
+                async for _ in resp.content.iter_chunked(CHUNK_SIZE):
+                    pass
+                assert resp.status == 200, resp.status
+
+        return (await run_clients(concurrency, files, upload), await run_clients(concurrency, files, download))
+
+
+async def bench_grpc(grpc_port, token, payload, files, concurrency):
+    auth = (("authorization", f"Bearer {token}"),)
+    async with grpc.aio.insecure_channel(f"localhost:{grpc_port}") as channel:
+        stub = fileservice_pb2_grpc.FileServiceStub(channel)
+
+        async def upload(n):
+            def chunks():
+                yield fileservice_pb2.UploadChunk(filename=f"f{n}.bin", data=payload[:CHUNK_SIZE])
+                for offset in range(CHUNK_SIZE, len(payload), CHUNK_SIZE):
+                    yield fileservice_pb2.UploadChunk(data=payload[offset:offset + CHUNK_SIZE])
+            await stub.Upload(chunks(), metadata=auth)
+
+        async def download(n):
+            async for _ in stub.Download(fileservice_pb2.DownloadRequest(filename=f"f{n}.bin"), metadata=auth):
+                pass
+
+        return (await run_clients(concurrency, files, upload), await run_clients(concurrency, files, download))
+
+
+def row(api, direction, result, files, file_size):
+    elapsed, latencies = result
+    return [api, direction, f"{files * file_size / elapsed / 1e6:.0f}",
+            f"{latencies[len(latencies) // 2] * 1000:.1f}",
+            f"{latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000:.1f}"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--files", type=int, default=200)
+    parser.add_argument("--file-kb", type=int, default=4096)
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    token = jwt.encode({"sub": "bench", "exp": int(time.time()) + 3600},
+                       os.environ.get("SECRET_KEY", "supersecretkey"), algorithm="HS256")
+    file_size = args.file_kb * 1024
+    payload = os.urandom(file_size)
+    storage_port, upload_port, grpc_port, download_port = (free_port() for _ in range(4))
+    spawn = multiprocessing.get_context("spawn")
+    processes = [multiprocessing.Process(target=storage_process, args=(storage_port, file_size), daemon=True),
+                 spawn.Process(target=upload_process, args=(upload_port, grpc_port, storage_port), daemon=True),
+                 spawn.Process(target=download_process, args=(download_port, storage_port), daemon=True)]
+    for process in processes:
+        process.start()
+    for port in (storage_port, upload_port, grpc_port, download_port):
+        asyncio.run(wait_for_port(port))
+
+    rest_up, rest_down = asyncio.run(bench_rest(upload_port, download_port, token, payload, args.files,
+                                                args.concurrency))
+    grpc_up, grpc_down = asyncio.run(bench_grpc(grpc_port, token, payload, args.files, args.concurrency))
+    for process in processes:
+        process.terminate()
+        process.join()
+
+    print(f"\n{args.files} files x {args.file_kb} KB each way, {args.concurrency} at a time")
+    print_table(["api", "transfer", "MB/s", "p50 (ms)", "p99 (ms)"],
+                [row("REST", "upload", rest_up, args.files, file_size),
+                 row("gRPC", "upload", grpc_up, args.files, file_size),
+                 row("REST", "download", rest_down, args.files, file_size),
+                 row("gRPC", "download", grpc_down, args.files, file_size)])
+
+
+if __name__ == "__main__":
+    main()
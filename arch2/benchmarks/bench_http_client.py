@@ -0,0 +1,93 @@
+"""
+Benchmark: service-to-service request latency, module-level requests vs the shared pooled client
+
+Starts a local HTTP/1.1 keepalive server that answers like the metadata service
+(a small JSON body) and sends N GET requests to it, either with module-level
+`requests.get` (a new TCP connection per call, the old behaviour of every service)
+or with `common.http_client.InternalHTTPClient` (per-host keepalive pool). Runs
+sequentially and from several threads; reports p50/p99 latency and requests/s.
+
+Usage: python benchmarks/bench_http_client.py [--requests N] [--threads T]
+"""
+
+import argparse
+import json
+import logging
+import threading
+import time
+from concurrent import futures
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+import bench_common  # noqa: F401  (puts arch2/ on sys.path)
+from bench_common import print_table
+from common.http_client import InternalHTTPClient
+
+BODY = json.dumps({"filename": "report.pdf", "path": "/storage/report.pdf", "size": 1024, "version": 1}).encode()
+
+
+class MetadataLikeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True  # headers and body are separate writes; avoid delayed-ACK stalls on keepalive
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+
+def run(get, url, count, threads):
+    def timed_calls(n):
+        latencies = []
+        for _ in range(n):
+            start = time.perf_counter()
+            resp = get(url)
+            resp.json()
+            latencies.append(time.perf_counter() - start)
+        return latencies
+
+    start = time.perf_counter()
+    with futures.ThreadPoolExecutor(max_workers=threads) as pool:
+        parts = list(pool.map(timed_calls, [count // threads] * threads))
+    elapsed = time.perf_counter() - start
+    latencies = [l for part in parts for l in part]
+    return [f"{percentile(latencies, 0.5) * 1000:.2f}", f"{percentile(latencies, 0.99) * 1000:.2f}",
+            f"{len(latencies) / elapsed:.0f}"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--threads", type=int, default=8)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    server = ThreadingHTTPServer(("localhost", 0), MetadataLikeHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://localhost:{server.server_port}/metadata/report.pdf"
+
+    client = InternalHTTPClient()
+    rows = []
+    for threads in (1, args.threads):
+        rows.append(["requests.get (new connection)", threads, *run(requests.get, url, args.requests, threads)])
+        rows.append(["InternalHTTPClient (keepalive)", threads, *run(client.get, url, args.requests, threads)])
+    server.shutdown()
+
+    print(f"GET latency against a local keepalive server ({args.requests} requests per run)")
+    print_table(["client", "threads", "p50 (ms)", "p99 (ms)", "requests/s"], rows)
+
+
+if __name__ == "__main__":
+    main()
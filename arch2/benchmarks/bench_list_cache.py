@@ -0,0 +1,129 @@
+"""
+Benchmark: listing a large namespace, full GET /files vs delta listings and the CLI metadata cache
+
+Starts the metadata service in a child process with --files file records. Measures the
+latency and response size of a full listing, of a delta listing (GET /files?since=<cursor>)
+with nothing changed and with --changes files changed, and of the CLI's `list --prefix`
+(cache refresh plus local query). The CLI talks to metadata directly, which serves the same
+/files route the upload service forwards.
+
+Usage: python benchmarks/bench_list_cache.py [--files N] [--changes N]
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import logging
+import multiprocessing
+import os
+import socket
+import sys
+import tempfile
+import time
+import types
+
+import requests
+from werkzeug.serving import make_server
+
+from bench_common import ARCH2_ROOT, human_bytes, load_module, print_table
+
+sys.path.insert(0, os.path.join(ARCH2_ROOT, "client"))
+import cli  # noqa: E402
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+def metadata_process(port, files):
+    logging.disable(logging.WARNING)
+    metadata = load_module("metadata_app", "metadata/app.py")
+    for n in range(files):
+        filename = f"dir{n % 100:02d}/file_{n:07d}.txt"
+        metadata.FILES[filename] = {"filename": filename, "path": f"/storage/{filename}", "size": n, "version": 1,
+                                    "sha256": f"{n:064x}", "modified_at": time.time()}
+
+    # POST /bench/touch?count=N changes N records, as N committed uploads would
+    def touch():
+        for n in range(int(metadata.request.args["count"])):
+            filename = f"dir{n % 100:02d}/file_{n:07d}.txt"
+            metadata.FILES[filename] = dict(metadata.FILES[filename], version=2, modified_at=time.time())
+        return {"touched": int(metadata.request.args["count"])}
+
+    metadata.app.add_url_rule("/bench/touch", "touch", touch, methods=["POST"])
+    make_server("localhost", port, metadata.app, threaded=True).serve_forever()
+
+
+async def wait_for_port(port):
+    while True:
+        try:
+            _, writer = await asyncio.open_connection("localhost", port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.1)
+
+
+def timed(request, repeat=5):
+    """Best of repeat: (seconds, response)"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        resp = request()
+        elapsed = time.perf_counter() - start
+        best = min(best or elapsed, elapsed)
+    return best, resp
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--files", type=int, default=200000)
+    parser.add_argument("--changes", type=int, default=100)
+    args = parser.parse_args()
+
+    port = free_port()
+    url = f"http://localhost:{port}"
+    server = multiprocessing.get_context("spawn").Process(target=metadata_process, args=(port, args.files),
+                                                          daemon=True)
+    server.start()
+    asyncio.run(wait_for_port(port))
+
+    rows = []
+    session = requests.Session()
+    elapsed, resp = timed(lambda: session.get(f"{url}/files"), repeat=3)
+    rows.append(["full listing", f"{elapsed * 1000:.0f}", human_bytes(len(resp.content))])
+
+    cursor = session.get(f"{url}/files", params={"since": ""}).json()["cursor"]
+    elapsed, resp = timed(lambda: session.get(f"{url}/files", params={"since": cursor}))
+    rows.append(["delta, nothing changed", f"{elapsed * 1000:.1f}", human_bytes(len(resp.content))])
+
+    session.post(f"{url}/bench/touch", params={"count": args.changes})
+    elapsed, resp = timed(lambda: session.get(f"{url}/files", params={"since": cursor}))
+    assert len(resp.json()["files"]) == args.changes
+    rows.append([f"delta, {args.changes} changed", f"{elapsed * 1000:.1f}", human_bytes(len(resp.content))])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cli.UPLOAD_URL = url
+        cli.TOKEN_FILE = os.devnull
+        cli.METADATA_CACHE_FILE = os.path.join(tmp, "metadata.db")
+        list_args = types.SimpleNamespace(grpc=False, prefix="dir42/", sort="size", reverse=True, limit=0,
+                                          offline=False, json=False)
+        for label in ("CLI list --prefix, first run (fills cache)", "CLI list --prefix, cache warm"):
+            out = io.StringIO()
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(out):
+                cli.list_files(list_args)
+            rows.append([label, f"{(time.perf_counter() - start) * 1000:.1f}", ""])
+        assert out.getvalue().count("\n") == args.files // 100
+    server.terminate()
+    server.join()
+
+    print(f"\nListing {args.files} files")
+    print_table(["request", "latency (ms)", "response"], rows)
+
+
+if __name__ == "__main__":
+    main()
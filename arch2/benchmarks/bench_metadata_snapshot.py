@@ -0,0 +1,131 @@
+"""
+Benchmark: write latency on the metadata service while a consistent snapshot is taken
+
+Starts the metadata service in a child process with --files file records and a writer thread
+that keeps adding records (POST /files, as committed uploads do). Measures the writes' latency
+with no snapshot running, while a consistent dump is encoded under the store lock (what a
+point-in-time dump costs without the reference copy), and while GET /snapshot streams one.
+Reports write latency p50/p99/max and the longest gap between two completed writes.
+
+Usage: python benchmarks/bench_metadata_snapshot.py [--files N]
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import socket
+import threading
+import time
+
+import requests
+from werkzeug.serving import make_server
+
+from bench_common import human_bytes, load_module, print_table
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+def metadata_process(port, files):
+    logging.disable(logging.WARNING)
+    metadata = load_module("metadata_app", "metadata/app.py")
+    for n in range(files):
+        filename = f"dir{n % 100:02d}/file_{n:07d}.txt"
+        metadata.FILES[filename] = {"filename": filename, "path": f"/storage/{filename}", "size": n, "version": 1,
+                                    "sha256": f"{n:064x}", "modified_at": time.time()}
+
+    # GET /bench/locked-dump: the same dump, encoded while holding the store lock
+    def locked_dump():
+        with metadata.FILES.atomic():
+            body = "\n".join(json.dumps({"file": record}) for record in metadata.FILES.values())
+        return metadata.Response(body, mimetype="application/x-ndjson")
+
+    metadata.app.add_url_rule("/bench/locked-dump", "locked_dump", locked_dump)
+    make_server("localhost", port, metadata.app, threaded=True).serve_forever()
+
+
+async def wait_for_port(port):
+    while True:
+        try:
+            _, writer = await asyncio.open_connection("localhost", port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.1)
+
+
+def measure_writes(url, during):
+    """Run during() while a thread writes records; returns (latencies, longest gap, during's result)"""
+    latencies, done = [], []
+    stop = threading.Event()
+
+    def writer():
+        session = requests.Session()
+        n = 0
+        while not stop.is_set():
+            start = time.perf_counter()
+            session.post(f"{url}/files", json={"filename": f"writes/w_{n:07d}", "size": 1, "sha256": "0" * 64})
+            latencies.append(time.perf_counter() - start)
+            done.append(time.perf_counter())
+            n += 1
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    time.sleep(0.5)
+    first = len(done)
+    result = during()
+    stop.set()
+    thread.join()
+    window = done[first:]
+    gaps = [b - a for a, b in zip(window, window[1:])]
+    return sorted(latencies[first:]), max(gaps, default=0), result
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--files", type=int, default=500000)
+    args = parser.parse_args()
+
+    port = free_port()
+    url = f"http://localhost:{port}"
+    server = multiprocessing.get_context("spawn").Process(target=metadata_process, args=(port, args.files),
+                                                          daemon=True)
+    server.start()
+    asyncio.run(wait_for_port(port))
+
+    def download(path):
+        def run():
+            start = time.perf_counter()
+            size = 0
+            with requests.get(f"{url}{path}", stream=True) as resp:
+                for chunk in resp.iter_content(1024 * 1024):
+                    size += len(chunk)
+            return time.perf_counter() - start, size
+        return run
+
+    rows = []
+    for label, during in (("no snapshot", lambda: time.sleep(3)),
+                          ("dump encoded under the lock", download("/bench/locked-dump")),
+                          ("GET /snapshot (reference copy)", download("/snapshot"))):
+        latencies, gap, result = measure_writes(url, during)
+        dump = [f"{result[0]:.1f}", human_bytes(result[1])] if result else ["", ""]
+        rows.append([label, f"{percentile(latencies, 0.5) * 1000:.1f}", f"{percentile(latencies, 0.99) * 1000:.1f}",
+                     f"{latencies[-1] * 1000:.0f}", f"{gap * 1000:.0f}"] + dump)
+    server.terminate()
+    server.join()
+
+    print(f"\nWrites to a metadata service holding {args.files} records")
+    print_table(["while", "write p50 (ms)", "p99 (ms)", "max (ms)", "longest gap (ms)", "dump s", "dump size"], rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Benchmark: in-flight streamed prepares on one storage participant, thread vs aio server mode
+
+Starts the storage participant in a child process (thread mode with PARTICIPANT_MAX_WORKERS
+threads, or aio mode with a bounded disk executor) and opens N concurrent VoteStream
+prepares from a grpc.aio client. Each prepare sends its chunks slowly, like a
+coordinator relaying a slow client upload, and chunks are as large as the HTTP/2
+flow-control window. The thread server runs PARTICIPANT_MAX_WORKERS handlers at a
+time and leaves the chunks of queued prepares buffered in the gRPC transport; the
+aio server reads every stream as it arrives and spools it to the staging area
+through the bounded disk executor. Reports throughput and the participant's peak
+RSS. Every prepare is aborted afterwards.
+
+Usage: python benchmarks/bench_participant_concurrency.py [--prepares N] [--chunks K] [--chunk-size BYTES] [--delay SECONDS]
+"""
+
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent import futures
+
+import grpc
+
+from bench_common import load_module, print_table
+
+import twopc_pb2
+import twopc_pb2_grpc
+
+CHANNELS = 16
+
+
+def run_thread_server(storage, ready):
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=storage.PARTICIPANT_MAX_WORKERS))
+    twopc_pb2_grpc.add_VotePhaseServiceServicer_to_server(storage.StorageVotePhaseService(), server)
+    twopc_pb2_grpc.add_DecisionPhaseServiceServicer_to_server(storage.StorageDecisionPhaseService(), server)
+    ready.put(server.add_insecure_port('localhost:0'))
+    server.start()
+    server.wait_for_termination()
+
+
+def run_aio_server(storage, ready):
+    async def run():
+        io_executor = futures.ThreadPoolExecutor(max_workers=storage.PARTICIPANT_IO_WORKERS)
+        server = grpc.aio.server(maximum_concurrent_rpcs=storage.PARTICIPANT_MAX_CONCURRENT_RPCS)
+        twopc_pb2_grpc.add_VotePhaseServiceServicer_to_server(storage.AsyncStorageVotePhaseService(io_executor), server)
+        twopc_pb2_grpc.add_DecisionPhaseServiceServicer_to_server(storage.AsyncStorageDecisionPhaseService(io_executor), server)
+        ready.put(server.add_insecure_port('localhost:0'))
+        await server.start()
+        await server.wait_for_termination()
+
+    asyncio.run(run())
+
+
+def participant_process(mode, storage_path, ready):
+    """Child process hosting the storage participant (keeps server and client event loops apart)"""
+    logging.disable(logging.WARNING)
+    os.environ['STORAGE_PATH'] = storage_path
+    storage = load_module("storage_twopc_participant", "storage/twopc_participant.py")
+    (run_aio_server if mode == "aio" else run_thread_server)(storage, ready)
+
+
+def peak_rss_mb(pid):
+    """Peak resident set size of a process (Linux /proc)"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return f"{int(line.split()[1]) / 1024:.0f}"
+    except OSError:
+        pass
+    return "n/a"
+
+
+async def run_prepares(port, prepares, chunks, chunk_size, delay):
+    channels = [grpc.aio.insecure_channel(f'localhost:{port}') for _ in range(CHANNELS)]
+    payload = os.urandom(chunk_size)
+
+    async def prepare(i):
+        channel = channels[i % CHANNELS]
+        transaction_id = f"bench-{i}"
+
+        async def chunk_stream():
+            for n in range(chunks):
+                if n:
+                    await asyncio.sleep(delay)
+                yield twopc_pb2.VoteChunk(transaction_id=transaction_id, filename=f"bench_{i}.bin",
+                                          node_id="bench", data=payload)
+
+        response = await twopc_pb2_grpc.VotePhaseServiceStub(channel).VoteStream(chunk_stream())
+        await twopc_pb2_grpc.DecisionPhaseServiceStub(channel).Decision(
+            twopc_pb2.DecisionRequest(transaction_id=transaction_id, global_commit=False, node_id="bench"))
+        return response.vote_commit
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(prepare(i) for i in range(prepares)))
+    elapsed = time.perf_counter() - start
+    for channel in channels:
+        await channel.close()
+    return sum(results), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--prepares", type=int, default=2000)
+    parser.add_argument("--chunks", type=int, default=4)
+    parser.add_argument("--chunk-size", type=int, default=64 * 1024,
+                        help="bytes per chunk; at least the HTTP/2 window so unread chunks hold back the sender")
+    parser.add_argument("--delay", type=float, default=0.05, help="seconds between chunks of one prepare")
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as storage_path:
+        rows = []
+        for mode in ("thread", "aio"):
+            ready = multiprocessing.Queue()
+            process = multiprocessing.Process(target=participant_process, args=(mode, storage_path, ready), daemon=True)
+            process.start()
+            port = ready.get()
+            committed, elapsed = asyncio.run(run_prepares(port, args.prepares, args.chunks, args.chunk_size, args.delay))
+            peak_rss = peak_rss_mb(process.pid)
+            process.terminate()
+            process.join()
+            rows.append([mode, args.prepares, committed, f"{elapsed:.2f}", f"{args.prepares / elapsed:.0f}", peak_rss])
+
+    print(f"Streamed prepares against one storage participant ({args.chunks} x {args.chunk_size} byte chunks, {args.delay}s apart)")
+    print_table(["mode", "prepares", "vote-commit", "seconds", "prepares/s", "participant peak RSS (MB)"], rows)
+
+
+if __name__ == "__main__":
+    main()
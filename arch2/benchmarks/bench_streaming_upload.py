@@ -0,0 +1,121 @@
+"""
+Benchmark: upload service memory per upload, buffered vs streamed 2PC upload pipeline
+
+Starts storage and metadata participants in one child process and, for each mode, the
+upload service in a fresh child process. One upload of --size-mb is posted to
+/files/upload through the Flask test client, reading the multipart body from a file.
+"buffered" is the old pipeline: the whole file is read, base64-encoded and sent in
+one Vote. "streamed" is the current route: the file is read in UPLOAD_CHUNK_SIZE chunks
+and relayed to the storage node's VoteStream. Reports the upload service's peak RSS
+growth during the upload.
+
+Usage: python benchmarks/bench_streaming_upload.py [--size-mb N]
+"""
+
+import argparse
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+
+from bench_common import load_module, print_table, start_participants
+
+BLOCK = os.urandom(1024 * 1024)
+BOUNDARY = "benchboundary"
+
+
+def write_multipart_body(path, size):
+    """Write a multipart/form-data body with one `size`-byte file field; returns its length"""
+    with open(path, "wb") as f:
+        f.write((f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="file"; filename="upload.bin"\r\n'
+                 f'Content-Type: application/octet-stream\r\n\r\n').encode())
+        for offset in range(0, size, len(BLOCK)):
+            f.write(BLOCK[:size - offset])
+        f.write(f'\r\n--{BOUNDARY}--\r\n'.encode())
+        return f.tell()
+
+
+def proc_status(field):
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field):
+                return int(line.split()[1]) / 1024
+
+
+def reset_peak_rss():
+    """Reset VmHWM to the current RSS (Linux 4.0+), so the peak covers only the upload"""
+    with open("/proc/self/clear_refs", "w") as f:
+        f.write("5")
+
+
+def participants_process(storage_path, ready, stop):
+    logging.disable(logging.WARNING)
+    # The buffered pipeline sends the whole file in one Vote, above gRPC's default 4 MB message limit
+    _, _, _, storage_endpoint, metadata_endpoint, servers = start_participants(
+        storage_path, options=[('grpc.max_receive_message_length', -1)])
+    ready.put((storage_endpoint, metadata_endpoint))
+    stop.wait()
+    for server in servers:
+        server.stop(0)
+
+
+def upload_process(mode, endpoints, body_path, results):
+    logging.disable(logging.WARNING)
+    os.environ['STORAGE_NODES'], os.environ['METADATA_NODES'] = endpoints
+    os.environ['HEARTBEAT_INTERVAL'] = '0'
+    upload = load_module("upload_app", "services/upload/app.py")
+    coordinator = upload.load_coordinator()()
+
+    if mode == "buffered":
+        def buffered_upload(filename, chunks, metadata):
+            file_data = b"".join(chunks)
+            return coordinator.execute_2pc_upload(filename, file_data, dict(metadata, size=len(file_data)))
+        coordinator.execute_2pc_upload_stream = buffered_upload
+    upload.load_coordinator = lambda: (lambda: coordinator)
+
+    client = upload.app.test_client()
+    token = upload.encode_token("bench")
+    with open(body_path, "rb") as body:
+        baseline = proc_status("VmRSS:")
+        reset_peak_rss()
+        start = time.perf_counter()
+        resp = client.post("/files/upload", input_stream=body,
+                           content_type=f"multipart/form-data; boundary={BOUNDARY}",
+                           headers={"Authorization": f"Bearer {token}"})
+        elapsed = time.perf_counter() - start
+    results.put((resp.status_code, elapsed, proc_status("VmHWM:") - baseline))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--size-mb", type=int, default=256)
+    args = parser.parse_args()
+    size = args.size_mb * 1024 * 1024
+
+    with tempfile.TemporaryDirectory() as storage_path:
+        ready, stop = multiprocessing.Queue(), multiprocessing.Event()
+        participants = multiprocessing.Process(target=participants_process, args=(storage_path, ready, stop))
+        participants.start()
+        endpoints = ready.get()
+        body_path = os.path.join(storage_path, "body.multipart")
+        write_multipart_body(body_path, size)
+
+        rows = []
+        for mode in ("buffered", "streamed"):
+            results = multiprocessing.Queue()
+            process = multiprocessing.Process(target=upload_process, args=(mode, endpoints, body_path, results))
+            process.start()
+            status, elapsed, peak_growth = results.get()
+            process.join()
+            rows.append([mode, args.size_mb, status, f"{elapsed:.2f}", f"{peak_growth:.0f}"])
+
+        stop.set()
+        participants.join()
+
+    print(f"One {args.size_mb} MB upload through the upload service")
+    print_table(["pipeline", "file (MB)", "status", "seconds", "upload service peak RSS growth (MB)"], rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Benchmark: upload latency for normal users while one user floods the upload service
+
+The upload service runs in a child process (--mode async or flask) with a stand-in 2PC
+coordinator that reads the streamed body and then holds one of --participant-slots
+slots for --service-ms (the participants' worker pools). One abusive user keeps
+--abusers uploads in flight at once while --users normal users upload one file at a
+time. Runs with admission control effectively off (limits far above the load) and with
+the default limits. Reports completed uploads, 429s and latency per class of user.
+
+Usage: python benchmarks/bench_upload_admission.py [--abusers N] [--users N] [--seconds S]
+"""
+
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import socket
+import threading
+import time
+
+import aiohttp
+import jwt
+
+from bench_common import load_module, print_table
+
+PAYLOAD = os.urandom(64 * 1024)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+def gateway_process(mode, port, admission_env, participant_slots, service_ms):
+    logging.disable(logging.WARNING)
+    os.environ.update(admission_env)
+    participants = threading.BoundedSemaphore(participant_slots)
+
+    class StandInCoordinator:
+        def execute_2pc_upload_stream(self, filename, chunks, metadata):
+            for _ in chunks:
+                pass
+            with participants:
+                time.sleep(service_ms / 1000)
+            return {"success": True, "transaction_id": "bench", "message": ""}
+
+    def load_coordinator():
+        return StandInCoordinator
+
+    # Registered as "app" so app_async's `from app import ...` shares it
+    gateway = load_module("app", "services/upload/app.py")
+    gateway.load_coordinator = load_coordinator
+    if mode == "async":
+        from aiohttp import web
+        import app_async
+        app_async.load_coordinator = load_coordinator
+        web.run_app(app_async.create_app(), host="localhost", port=port, backlog=4096, print=None,
+                    access_log=None)
+    else:
+        from werkzeug.serving import make_server
+        server = make_server("localhost", port, gateway.app, threaded=True)
+        server.socket.listen(4096)
+        server.serve_forever()
+
+
+async def wait_for_port(port):
+    while True:
+        try:
+            _, writer = await asyncio.open_connection("localhost", port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.1)
+
+
+def token_for(user):
+    return jwt.encode({"sub": user, "exp": int(time.time()) + 3600},
+                      os.environ.get("SECRET_KEY", "supersecretkey"), algorithm="HS256")
+
+
+async def run_load(port, abusers, users, seconds):
+    url = f"http://localhost:{port}/files/upload"
+    stats = {"abuser": {"latencies": [], "rejected": 0}, "normal": {"latencies": [], "rejected": 0}}
+    deadline = time.perf_counter() + seconds
+
+    async def client(session, kind, user):
+        headers = {"Authorization": f"Bearer {token_for(user)}"}
+        while time.perf_counter() < deadline:
+            form = aiohttp.FormData()
+            form.add_field("file", PAYLOAD, filename=f"{user}.bin")
+            start = time.perf_counter()
+            async with session.post(url, data=form, headers=headers) as resp:
+                await resp.read()
+                status, retry_after = resp.status, resp.headers.get("Retry-After")
+            if status == 429:
+                # a well-behaved client backs off for Retry-After
+                stats[kind]["rejected"] += 1
+                await asyncio.sleep(float(retry_after or 1))
+            elif status == 201:
+                stats[kind]["latencies"].append(time.perf_counter() - start)
+
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=300)) as session:
+        await asyncio.gather(*[client(session, "abuser", "abuser") for _ in range(abusers)],
+                             *[client(session, "normal", f"user{n}") for n in range(users)])
+    return stats
+
+
+def summarize(label, kind, stats):
+    latencies = sorted(stats[kind]["latencies"])
+    if not latencies:
+        return [label, kind, 0, stats[kind]["rejected"], "-", "-"]
+    return [label, kind, len(latencies), stats[kind]["rejected"],
+            f"{latencies[len(latencies) // 2] * 1000:.0f}",
+            f"{latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000:.0f}"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--mode", choices=("async", "flask"), default="async")
+    parser.add_argument("--abusers", type=int, default=64, help="uploads the abusive user keeps in flight")
+    parser.add_argument("--users", type=int, default=4, help="normal users, one upload at a time each")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--participant-slots", type=int, default=10)
+    parser.add_argument("--service-ms", type=float, default=50)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    rows = []
+    for label, admission_env in (("off", {"UPLOAD_MAX_INFLIGHT": "100000", "UPLOAD_MAX_INFLIGHT_PER_USER": "100000"}),
+                                 ("defaults", {})):
+        port = free_port()
+        gateway = multiprocessing.get_context("spawn").Process(
+            target=gateway_process, args=(args.mode, port, admission_env, args.participant_slots, args.service_ms),
+            daemon=True)
+        gateway.start()
+        asyncio.run(wait_for_port(port))
+        stats = asyncio.run(run_load(port, args.abusers, args.users, args.seconds))
+        gateway.terminate()
+        gateway.join()
+        rows.append(summarize(label, "abuser", stats))
+        rows.append(summarize(label, "normal", stats))
+
+    print(f"\n{args.mode} upload service, 1 user with {args.abusers} uploads in flight + {args.users} normal users, "
+          f"{args.participant_slots} participant slots x {args.service_ms:.0f} ms, {args.seconds:.0f}s")
+    print_table(["admission", "user", "uploads", "429s", "p50 (ms)", "p99 (ms)"], rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Benchmark: re-uploading content the server already stores, full upload vs upload by content hash
+
+Starts in-process storage and metadata participants (gRPC on localhost) and the upload
+service's coordinator, and uploads --files files of --file-kb KB. The same content is then
+uploaded again under new names, first streamed in full through `execute_2pc_upload_stream`,
+then the way upload-by-hash does it: hash the file, then one `execute_2pc_link` transaction.
+Reports files/s, bytes sent to storage and the disk space the copies take.
+
+Usage: python benchmarks/bench_upload_dedup.py [--files N] [--file-kb KB]
+"""
+
+import argparse
+import hashlib
+import logging
+import os
+import tempfile
+import time
+
+from bench_common import human_bytes, load_coordinator, print_table, start_participants
+
+CHUNK_SIZE = 256 * 1024
+
+
+def chunks(payload):
+    for offset in range(0, len(payload), CHUNK_SIZE):
+        yield payload[offset:offset + CHUNK_SIZE]
+
+
+def disk_usage(path):
+    """Bytes of disk actually allocated under path (hard links counted once)"""
+    seen, total = set(), 0
+    for directory, _, names in os.walk(path):
+        for name in names:
+            stat = os.stat(os.path.join(directory, name))
+            if stat.st_ino not in seen:
+                seen.add(stat.st_ino)
+                total += stat.st_blocks * 512
+    return total
+
+
+def upload(coordinator, filename, payload):
+    metadata = {"filename": filename, "path": f"/storage/{filename}", "version": 1}
+    assert coordinator.execute_2pc_upload_stream(filename, chunks(payload), metadata)['success']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--files", type=int, default=100)
+    parser.add_argument("--file-kb", type=int, default=4096)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    payloads = [os.urandom(args.file_kb * 1024) for _ in range(args.files)]
+    with tempfile.TemporaryDirectory() as storage_path:
+        _, _, metadata_store, storage_endpoint, metadata_endpoint, servers = start_participants(storage_path)
+        coordinator = load_coordinator(storage_endpoint, metadata_endpoint).TwoPhaseCommitCoordinator()
+        for n, payload in enumerate(payloads):
+            upload(coordinator, f"orig_{n:04d}.bin", payload)
+        baseline = disk_usage(storage_path)
+
+        rows = []
+        start = time.perf_counter()
+        for n, payload in enumerate(payloads):
+            upload(coordinator, f"full_{n:04d}.bin", payload)
+        elapsed = time.perf_counter() - start
+        used = disk_usage(storage_path)
+        rows.append(["full upload", f"{elapsed:.2f}", f"{args.files / elapsed:.0f}",
+                     human_bytes(sum(map(len, payloads))), human_bytes(used - baseline)])
+
+        start = time.perf_counter()
+        for n, payload in enumerate(payloads):
+            sha256 = hashlib.sha256(payload).hexdigest()
+            assert coordinator.execute_2pc_link(f"orig_{n:04d}.bin", f"dedup_{n:04d}.bin", sha256)['success']
+        elapsed = time.perf_counter() - start
+        rows.append(["upload by hash", f"{elapsed:.2f}", f"{args.files / elapsed:.0f}", human_bytes(0),
+                     human_bytes(disk_usage(storage_path) - used)])
+        assert metadata_store[f"dedup_{args.files - 1:04d}.bin"]["sha256"] == sha256
+
+        for server in servers:
+            server.stop(0)
+
+    print(f"\nRe-uploading {args.files} already-stored files x {args.file_kb} KB")
+    print_table(["mode", "seconds", "files/s", "bytes sent", "extra disk"], rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""
+Benchmark: propagation latency and idle cost of `cli.py watch`
+
+Starts a stand-in upload service (upload, list, batch delete; it records when each file
+arrives) and runs `cli.py watch <dir> --delete` in a child process with its own HOME (token
+and manifest). Then measures: latency from a local write to the file's arrival, one file
+every --interval seconds; time until a burst of --burst files has all arrived; latency of a
+batched delete; the watcher's CPU time while idle; and, after a restart, that files changed
+while it was stopped are reconciled.
+
+Usage: python benchmarks/bench_watch.py [--files N] [--burst N] [--idle-seconds S]
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+from aiohttp import web
+
+from bench_common import ARCH2_ROOT, print_table
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+def upload_service_process(port):
+    """Stand-in for the upload service routes the watcher uses; GET /arrivals reports receipt times"""
+    files, arrivals, deletions = {}, {}, {}
+
+    async def upload(request):
+        reader = await request.multipart()
+        part = await reader.next()
+        name = part.filename
+        await part.read()
+        files[name] = None
+        arrivals[name] = time.time()
+        return web.json_response({"message": "ok"}, status=201)
+
+    async def upload_by_hash(request):
+        return web.json_response({"error": "Content not found"}, status=404)
+
+    async def list_files(request):
+        # always a full delta listing (reset), as metadata answers an unknown cursor
+        return web.json_response({"cursor": "", "reset": True, "deleted": [],
+                                  "files": [{"filename": name, "sha256": sha256} for name, sha256 in files.items()]})
+
+    async def batch(request):
+        for op in (await request.json())["operations"]:
+            files.pop(op["filename"], None)
+            deletions[op["filename"]] = time.time()
+        return web.json_response({"status": "committed"})
+
+    async def report(request):
+        return web.json_response({"arrivals": arrivals, "deletions": deletions})
+
+    app = web.Application(client_max_size=1024 ** 3)
+    app.router.add_post("/files/upload", upload)
+    app.router.add_post("/files/upload-by-hash", upload_by_hash)
+    app.router.add_get("/files", list_files)
+    app.router.add_post("/files/batch", batch)
+    app.router.add_get("/arrivals", report)
+    web.run_app(app, host="localhost", port=port, print=None, access_log=None)
+
+
+async def wait_for_port(port):
+    while True:
+        try:
+            _, writer = await asyncio.open_connection("localhost", port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.1)
+
+
+def start_watcher(directory, home, url):
+    env = dict(os.environ, HOME=home, UPLOAD_URL=url, DOWNLOAD_URL=url)
+    process = subprocess.Popen([sys.executable, os.path.join(ARCH2_ROOT, "client", "cli.py"), "watch", directory,
+                                "--delete"], env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    for line in process.stdout:
+        if line.startswith("Watching"):
+            return process
+
+
+def cpu_seconds(pid):
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def write(path, size=4096):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(os.urandom(size))
+    return time.time()
+
+
+def wait_for(url, key, names, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        seen = requests.get(f"{url}/arrivals").json()[key]
+        if all(name in seen for name in names):
+            return seen
+        time.sleep(0.01)
+    raise TimeoutError(f"{len(names)} changes did not arrive within {timeout}s")
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--files", type=int, default=20)
+    parser.add_argument("--interval", type=float, default=0.5)
+    parser.add_argument("--burst", type=int, default=500)
+    parser.add_argument("--idle-seconds", type=float, default=10)
+    args = parser.parse_args()
+
+    port = free_port()
+    url = f"http://localhost:{port}"
+    server = multiprocessing.Process(target=upload_service_process, args=(port,), daemon=True)
+    server.start()
+    asyncio.run(wait_for_port(port))
+
+    rows = []
+    with tempfile.TemporaryDirectory() as home, tempfile.TemporaryDirectory() as directory:
+        watcher = start_watcher(directory, home, url)
+
+        latencies = []
+        for n in range(args.files):
+            written = write(os.path.join(directory, "single", f"edit_{n:03d}.txt"))
+            name = f"single/edit_{n:03d}.txt"
+            latencies.append(wait_for(url, "arrivals", [name])[name] - written)
+            time.sleep(args.interval)
+        rows.append([f"single edits ({args.files})", f"{percentile(latencies, 0.5) * 1000:.0f}",
+                     f"{max(latencies) * 1000:.0f}"])
+
+        start = time.time()
+        names = [f"burst/part_{n:04d}.bin" for n in range(args.burst)]
+        for name in names:
+            write(os.path.join(directory, name))
+        arrived = wait_for(url, "arrivals", names)
+        rows.append([f"burst of {args.burst} files (last arrival)", "",
+                     f"{(max(arrived[name] for name in names) - start) * 1000:.0f}"])
+
+        start = time.time()
+        gone = names[:50]
+        for name in gone:
+            os.remove(os.path.join(directory, name))
+        deleted = wait_for(url, "deletions", gone)
+        rows.append(["delete 50 files (batched)", "", f"{(max(deleted[name] for name in gone) - start) * 1000:.0f}"])
+
+        time.sleep(1)
+        before = cpu_seconds(watcher.pid)
+        time.sleep(args.idle_seconds)
+        idle_cpu = cpu_seconds(watcher.pid) - before
+
+        watcher.terminate()
+        watcher.wait()
+        changed = [f"offline/change_{n}.txt" for n in range(5)]
+        for name in changed:
+            write(os.path.join(directory, name))
+        start = time.time()
+        watcher = start_watcher(directory, home, url)
+        reconciled = time.time() - start
+        wait_for(url, "arrivals", changed, timeout=1)
+        watcher.terminate()
+        watcher.wait()
+    server.terminate()
+    server.join()
+
+    print("\nWatch mode: local change -> arrival at the upload service")
+    print_table(["change", "p50 (ms)", "max (ms)"], rows)
+    print(f"idle CPU: {idle_cpu:.3f}s over {args.idle_seconds:.0f}s; "
+          f"restart reconciled {len(changed)} offline changes in {reconciled:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
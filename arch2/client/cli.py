@@ -1,14 +1,71 @@
 import argparse
+import ctypes
+import ctypes.util
+import errno
+import glob
+import hashlib
+import json
 import os
+import select
+import sqlite3
+import stat as stat_mode
+import struct
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import requests
+from requests.adapters import HTTPAdapter
 
 # api url for the services
 UPLOAD_URL = os.environ.get("UPLOAD_URL", "http://upload:5003")
 DOWNLOAD_URL = os.environ.get("DOWNLOAD_URL", "http://download:5004")
 
+# gRPC FileService of the upload service (--grpc)
+GRPC_TARGET = os.environ.get("GRPC_TARGET", "upload:6003")
+
+# the committed fileservice_pb2*.py stubs live in arch2/, next to this file's directory (mounted into /app in docker)
+CLIENT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# bytes per gRPC upload message
+GRPC_CHUNK_SIZE = 256 * 1024
+
 # token file to store JWT token
 TOKEN_FILE = os.path.expanduser("~/.mini_dropbox_token")
 
+# validator store: ETag / Last-Modified of downloaded files and the last listing, for conditional GETs
+VALIDATORS_FILE = os.path.expanduser("~/.mini_dropbox_validators.json")
+
+# local cache of remote file metadata for `list` (and sync), refreshed with delta listings
+METADATA_CACHE_FILE = os.path.expanduser("~/.mini_dropbox_metadata.db")
+
+# sync manifest: path, size, mtime and content hash of every file synced from each local directory
+MANIFEST_FILE = os.path.expanduser("~/.mini_dropbox_sync.db")
+
+# files modified this recently are hashed again on the next sync (their mtime may not have settled)
+SYNC_RACY_SECONDS = 2
+
+# watch: quiet time that ends a burst of file events, and the longest a change waits for its burst to end
+WATCH_DEBOUNCE_MS = int(os.environ.get("WATCH_DEBOUNCE_MS", "200"))
+WATCH_MAX_DELAY_MS = int(os.environ.get("WATCH_MAX_DELAY_MS", "1000"))
+
+# watch: seconds before files whose upload or delete failed are pushed again
+WATCH_RETRY_SECONDS = 5
+
+# bulk transfers (upload-many, download-many, delete-many, sync): transfers in flight and retries per file
+BULK_WORKERS = int(os.environ.get("BULK_WORKERS", "8"))
+BULK_RETRIES = int(os.environ.get("BULK_RETRIES", "3"))
+
+# bytes read from disk per chunk of a streamed upload
+UPLOAD_CHUNK_SIZE = int(os.environ.get("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+
+# uploads first ask whether the server already stores the file's content (by sha256) and skip the transfer if so
+UPLOAD_DEDUP = os.environ.get("UPLOAD_DEDUP", "1") != "0"
+
+# responses worth another attempt (429 and 503 carry Retry-After)
+RETRY_STATUS = (429, 502, 503, 504)
+
 # saving the token into the TOKEN_FILE
 def save_token(token):
     with open(TOKEN_FILE, "w") as f:
@@ -21,6 +78,338 @@ def load_token():
             return f.read().strip()
     return None
 
+# loading the validator store ({"downloads": {...}})
+def load_validators():
+    try:
+        with open(VALIDATORS_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"downloads": {}}
+
+# saving the validator store
+def save_validators(validators):
+    tmp = VALIDATORS_FILE + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(validators, f)
+    os.replace(tmp, VALIDATORS_FILE)
+
+# conditional headers for a download, only if the local copy is the one that was downloaded
+def download_conditions(entry, outname):
+    if not entry or not os.path.exists(outname):
+        return {}
+    stat = os.stat(outname)
+    if stat.st_size != entry.get("size") or stat.st_mtime != entry.get("mtime"):
+        return {}
+    headers = {}
+    if entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+    if entry.get("last_modified"):
+        headers["If-Modified-Since"] = entry["last_modified"]
+    return headers
+
+# import the committed FileService stubs (imported lazily: REST commands work without grpc installed)
+def load_grpc_stubs():
+    arch2_dir = os.path.dirname(CLIENT_DIR)
+    if arch2_dir not in sys.path:
+        sys.path.append(arch2_dir)
+    try:
+        from protos import fileservice_pb2
+        from protos import fileservice_pb2_grpc
+    except ImportError:
+        import fileservice_pb2
+        import fileservice_pb2_grpc
+    return fileservice_pb2, fileservice_pb2_grpc
+
+# FileService stub over one HTTP/2 channel, plus the auth metadata for its calls
+def grpc_client():
+    import grpc
+    pb2, pb2_grpc = load_grpc_stubs()
+    stub = pb2_grpc.FileServiceStub(grpc.insecure_channel(GRPC_TARGET))
+    token = load_token()
+    auth = [("authorization", f"Bearer {token}")] if token else []
+    return pb2, stub, auth
+
+# open the sync manifest, creating its table on first use
+def open_manifest():
+    db = sqlite3.connect(MANIFEST_FILE)
+    db.execute("""CREATE TABLE IF NOT EXISTS files (
+        root TEXT NOT NULL,
+        path TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        mtime_ns INTEGER NOT NULL,
+        sha256 TEXT NOT NULL,
+        PRIMARY KEY (root, path))""")
+    return db
+
+# open the metadata cache, creating its tables on first use
+def open_metadata_cache():
+    db = sqlite3.connect(METADATA_CACHE_FILE)
+    db.execute("""CREATE TABLE IF NOT EXISTS remote_files (
+        filename TEXT PRIMARY KEY,
+        size INTEGER,
+        version INTEGER,
+        sha256 TEXT,
+        modified_at REAL)""")
+    db.execute("CREATE INDEX IF NOT EXISTS remote_files_size ON remote_files (size)")
+    db.execute("CREATE INDEX IF NOT EXISTS remote_files_modified ON remote_files (modified_at)")
+    db.execute("CREATE TABLE IF NOT EXISTS cache_state (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+    return db
+
+# bring the metadata cache up to date with one GET /files?since=<cursor>: only files changed or deleted
+# since the last refresh are transferred (everything on the first call, or when the server asks for a reset)
+def refresh_metadata_cache(db, session):
+    state = dict(db.execute("SELECT key, value FROM cache_state"))
+    cursor = state.get("cursor", "") if state.get("server") == UPLOAD_URL else ""
+    resp = session.get(f"{UPLOAD_URL}/files", params={"since": cursor})
+    if resp.status_code != 200:
+        raise RuntimeError(f"{resp.status_code} {resp.text.strip()}")
+    delta = resp.json()
+    with db:
+        if delta["reset"]:
+            db.execute("DELETE FROM remote_files")
+        db.executemany("INSERT OR REPLACE INTO remote_files VALUES (?, ?, ?, ?, ?)",
+                       [(f["filename"], f.get("size"), f.get("version"), f.get("sha256"), f.get("modified_at"))
+                        for f in delta["files"]])
+        db.executemany("DELETE FROM remote_files WHERE filename = ?", [(name,) for name in delta["deleted"]])
+        db.executemany("INSERT OR REPLACE INTO cache_state VALUES (?, ?)",
+                       [("server", UPLOAD_URL), ("cursor", delta["cursor"]), ("refreshed_at", str(time.time()))])
+    return delta
+
+# remote files as {filename: sha256}, from the refreshed metadata cache
+def remote_hashes(session):
+    db = open_metadata_cache()
+    try:
+        refresh_metadata_cache(db, session)
+        return dict(db.execute("SELECT filename, sha256 FROM remote_files"))
+    finally:
+        db.close()
+
+# every regular file under root as (relative posix path, stat), without following symlinks
+def walk_files(root, rel=""):
+    with os.scandir(os.path.join(root, rel)) as entries:
+        for entry in entries:
+            path = f"{rel}/{entry.name}" if rel else entry.name
+            if entry.is_dir(follow_symlinks=False):
+                yield from walk_files(root, path)
+            elif entry.is_file(follow_symlinks=False):
+                yield path, entry.stat(follow_symlinks=False)
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# one pooled session for a bulk command: a keepalive connection per worker and the token read once
+def bulk_session(workers):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=workers)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    token = load_token()
+    if token:
+        session.headers["Authorization"] = f"Bearer {token}"
+    return session
+
+# send() retried on connection errors and RETRY_STATUS, waiting for Retry-After or an exponential backoff
+def send_with_retry(send, retries):
+    for attempt in range(retries + 1):
+        try:
+            resp = send()
+        except requests.exceptions.ConnectionError:
+            if attempt == retries:
+                raise
+            time.sleep(min(10, 0.2 * 2 ** attempt))
+            continue
+        if resp.status_code in RETRY_STATUS and attempt < retries:
+            delay = resp.headers.get("Retry-After")
+            resp.close()
+            time.sleep(float(delay) if delay and delay.isdigit() else min(10, 0.2 * 2 ** attempt))
+            continue
+        return resp
+
+def human_bytes(n):
+    for unit in ("B", "KB", "MB", "GB"):
+        if n < 1024 or unit == "GB":
+            return f"{n:.1f} {unit}" if unit != "B" else f"{n} B"
+        n /= 1024
+
+# multipart/form-data body for one file, read from disk a chunk at a time while requests sends it, so memory
+# stays constant whatever the file size. The file's sha256 is computed on the way and sent as a trailing
+# "sha256" field; the upload service checks it before committing. len() is the exact body size, so the
+# upload has a Content-Length. progress(sent, total) is called after every chunk
+class MultipartUpload:
+    def __init__(self, path, filename=None, progress=None, chunk_size=UPLOAD_CHUNK_SIZE):
+        self.path = path
+        self.progress = progress
+        self.chunk_size = chunk_size
+        self.boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={self.boundary}"
+        self.size = os.path.getsize(path)
+        self.sha256 = None
+        self.head = (f'--{self.boundary}\r\n'
+                     f'Content-Disposition: form-data; name="file"; filename="{filename or os.path.basename(path)}"\r\n'
+                     f'Content-Type: application/octet-stream\r\n\r\n').encode()
+
+    def trailer(self, sha256):
+        return (f'\r\n--{self.boundary}\r\n'
+                f'Content-Disposition: form-data; name="sha256"\r\n\r\n'
+                f'{sha256}\r\n--{self.boundary}--\r\n').encode()
+
+    def __len__(self):
+        return len(self.head) + self.size + len(self.trailer("0" * 64))
+
+    def __iter__(self):
+        digest = hashlib.sha256()
+        sent = 0
+        yield self.head
+        with open(self.path, "rb") as f:
+            # exactly the size announced in Content-Length, even if the file grows meanwhile
+            while sent < self.size:
+                chunk = f.read(min(self.chunk_size, self.size - sent))
+                if not chunk:
+                    raise IOError(f"{self.path} shrank while it was being uploaded")
+                digest.update(chunk)
+                sent += len(chunk)
+                if self.progress:
+                    self.progress(sent, self.size)
+                yield chunk
+        self.sha256 = digest.hexdigest()
+        yield self.trailer(self.sha256)
+
+# progress callback for one large transfer: a status line on stderr, redrawn at most 10 times a second
+def transfer_progress(label):
+    start = time.time()
+    last = [0.0]
+    def progress(sent, total):
+        now = time.time()
+        if now - last[0] < 0.1 and sent < total:
+            return
+        last[0] = now
+        elapsed = max(now - start, 1e-6)
+        print(f"\r{label}: {100 * sent / max(total, 1):.0f}% {human_bytes(sent)} of {human_bytes(total)}, "
+              f"{human_bytes(sent / elapsed)}/s", end="" if sent < total else "\n", file=sys.stderr)
+    return progress
+
+# aggregate progress of a bulk command, one status line on stderr
+class Progress:
+    def __init__(self, label, total):
+        self.label = label
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.bytes = 0
+        self.start = time.time()
+        self.lock = threading.Lock()
+
+    def add(self, nbytes=0, ok=True):
+        with self.lock:
+            self.done += 1
+            self.failed += not ok
+            self.bytes += nbytes
+            elapsed = max(time.time() - self.start, 1e-6)
+            print(f"\r{self.label}: {self.done}/{self.total} files, {self.done / elapsed:.0f} files/s"
+                  + (f", {human_bytes(self.bytes)}, {human_bytes(self.bytes / elapsed)}/s" if self.bytes else ""),
+                  end="", file=sys.stderr)
+
+    def summary(self):
+        elapsed = max(time.time() - self.start, 1e-6)
+        if self.total:
+            print(file=sys.stderr)
+        rate = f"{self.done / elapsed:.0f} files/s"
+        if self.bytes:
+            rate = f"{human_bytes(self.bytes)}, {rate}, {human_bytes(self.bytes / elapsed)}/s"
+        return (f"{self.done - self.failed}/{self.total} files {self.label.lower()}, {self.failed} failed "
+                f"in {elapsed:.1f}s ({rate})")
+
+# run transfer(item) -> bytes moved for every item on a bounded worker pool; returns (progress, failures)
+def run_many(label, items, transfer, workers):
+    progress = Progress(label, len(items))
+    failures = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(transfer, item): item for item in items}
+        for future in as_completed(futures):
+            try:
+                progress.add(future.result())
+            except Exception as e:
+                progress.add(ok=False)
+                failures.append((futures[future], e))
+    return progress, failures
+
+def print_failures(failures):
+    for item, error in failures:
+        print(f"  {item}: {error}")
+
+# store remote_name as a link to content the server already has; returns the response, or None when the
+# bytes have to be uploaded (unknown content, dedup disabled, or the link failed)
+def upload_by_hash(session, remote_name, sha256, retries=0):
+    if not UPLOAD_DEDUP:
+        return None
+    resp = send_with_retry(lambda: session.post(f"{UPLOAD_URL}/files/upload-by-hash",
+                                                json={"filename": remote_name, "sha256": sha256}), retries)
+    return resp if resp.status_code in (200, 201) else None
+
+# one file of a bulk upload (reopened for each attempt), stored as remote_name; returns the bytes sent
+# (0 when the server already had the content); sync passes the sha256 it already computed
+def upload_one(session, path, remote_name, retries, sha256=None):
+    if UPLOAD_DEDUP and upload_by_hash(session, remote_name, sha256 or hash_file(path), retries):
+        return 0
+    def send():
+        body = MultipartUpload(path, remote_name)
+        return session.post(f"{UPLOAD_URL}/files/upload", data=body, headers={"Content-Type": body.content_type})
+    resp = send_with_retry(send, retries)
+    if resp.status_code != 201:
+        raise RuntimeError(f"{resp.status_code} {resp.text.strip()}")
+    return os.path.getsize(path)
+
+# one file of a bulk download, written next to its final name and renamed into place when complete
+def download_one(session, name, outname, retries):
+    os.makedirs(os.path.dirname(outname) or ".", exist_ok=True)
+    part = outname + ".part"
+    try:
+        for attempt in range(retries + 1):
+            resp = send_with_retry(lambda: session.get(f"{DOWNLOAD_URL}/files/download", params={"filename": name},
+                                                       stream=True), retries - attempt)
+            if resp.status_code != 200:
+                raise RuntimeError(f"{resp.status_code} {resp.text.strip()}")
+            size = 0
+            try:
+                with open(part, "wb") as f:
+                    for chunk in resp.iter_content(chunk_size=64 * 1024):
+                        f.write(chunk)
+                        size += len(chunk)
+            except (requests.exceptions.ChunkedEncodingError, requests.exceptions.ConnectionError):
+                # the body broke off mid-stream: download the file again from the start
+                if attempt == retries:
+                    raise
+                time.sleep(min(10, 0.2 * 2 ** attempt))
+                continue
+            finally:
+                resp.close()
+            os.replace(part, outname)
+            return size
+    finally:
+        # a failed download leaves the previous copy (if any) and no partial file
+        if os.path.exists(part):
+            os.remove(part)
+
+# one file of a bulk delete
+def delete_one(session, name, retries):
+    resp = send_with_retry(lambda: session.delete(f"{DOWNLOAD_URL}/files/delete", params={"filename": name}),
+                           retries)
+    if resp.status_code != 200:
+        raise RuntimeError(f"{resp.status_code} {resp.text.strip()}")
+    return 0
+
+# local files named by the arguments (globs are expanded here too, for shells that do not)
+def expand_paths(patterns):
+    paths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern, recursive=True)) if glob.has_magic(pattern) else [pattern]
+        paths.extend(p for p in matches if os.path.isfile(p))
+    return paths
+
 # create a post request to sign up user
 def signup(args):
     username = args.username
@@ -48,38 +437,143 @@ def print_response(resp):
         print("Raw response:", resp.text)
         print("Status code:", resp.status_code)
 
+# upload file over the gRPC FileService (client-streamed chunks, no multipart encoding)
+def grpc_upload(args):
+    import grpc
+    pb2, stub, auth = grpc_client()
+
+    def chunks():
+        with open(args.file, "rb") as f:
+            yield pb2.UploadChunk(filename=os.path.basename(args.file), data=f.read(GRPC_CHUNK_SIZE))
+            for data in iter(lambda: f.read(GRPC_CHUNK_SIZE), b""):
+                yield pb2.UploadChunk(data=data)
+    try:
+        resp = stub.Upload(chunks(), metadata=auth)
+        print({"message": "File uploaded successfully using 2PC", "transaction_id": resp.transaction_id,
+               "filename": resp.filename, "size": resp.size, "sha256": resp.sha256})
+    except grpc.RpcError as e:
+        print("Upload failed:", e.code().name, e.details())
+
+# download file over the gRPC FileService (server-streamed chunks, checked against the file's sha256)
+def grpc_download(args):
+    import grpc
+    pb2, stub, auth = grpc_client()
+    outname = args.output if args.output else args.file
+    partname = outname + ".part"  # a local file of the same name is only replaced by a complete, verified download
+    digest = hashlib.sha256()
+    expected = None
+    try:
+        with open(partname, "wb") as f:
+            for chunk in stub.Download(pb2.DownloadRequest(filename=args.file), metadata=auth):
+                if expected is None:
+                    expected = chunk.sha256
+                f.write(chunk.data)
+                digest.update(chunk.data)
+        if expected and digest.hexdigest() != expected:
+            os.remove(partname)
+            print("Download failed: content does not match its sha256")
+            return
+        os.replace(partname, outname)
+    except grpc.RpcError as e:
+        os.remove(partname)
+        print("Download failed:", e.code().name, e.details())
+        return
+    except BaseException:
+        if os.path.exists(partname):
+            os.remove(partname)
+        raise
+    print(f"Downloaded to {outname}")
+
+# delete file over the gRPC FileService
+def grpc_delete(args):
+    import grpc
+    pb2, stub, auth = grpc_client()
+    try:
+        stub.Delete(pb2.DeleteRequest(filename=args.file), metadata=auth)
+        print(f"Deletion successful")
+    except grpc.RpcError as e:
+        print("Delete failed:", e.code().name, e.details())
+
+# list all files over the gRPC FileService, one page at a time
+def grpc_list_files(args):
+    import grpc
+    pb2, stub, auth = grpc_client()
+    files = []
+    page_token = ""
+    try:
+        while True:
+            resp = stub.List(pb2.ListRequest(page_token=page_token), metadata=auth)
+            files.extend({"filename": f.filename, "size": f.size, "version": f.version, "sha256": f.sha256}
+                         for f in resp.files)
+            page_token = resp.next_page_token
+            if not page_token:
+                break
+    except grpc.RpcError as e:
+        print("List failed:", e.code().name, e.details())
+        return
+    print(files)
+
 # upload file to the storage service - requires token for auth
 def upload(args):
+    if args.grpc:
+        return grpc_upload(args)
     file_name = args.file
-    files = {'file': open(file_name, 'rb')}
-    data = {}
     token = load_token()
     headers = {}
     if token:
         headers["Authorization"] = f"Bearer {token}"
-    resp = requests.post(f"{UPLOAD_URL}/files/upload", files=files, data=data, headers=headers)
+    session = requests.Session()
+    session.headers.update(headers)
+    resp = upload_by_hash(session, os.path.basename(file_name), hash_file(file_name) if UPLOAD_DEDUP else None)
+    if resp is not None:
+        return print_response(resp)
+    body = MultipartUpload(file_name, progress=transfer_progress("Uploading"))
+    resp = session.post(f"{UPLOAD_URL}/files/upload", data=body, headers={"Content-Type": body.content_type})
     print_response(resp)
     
 # download file from the storage service - requires token for auth
 def download(args):
+    if args.grpc:
+        return grpc_download(args)
     file_name = args.file
     token = load_token()
     headers = {}
     if token:
         headers["Authorization"] = f"Bearer {token}"
     params = {"filename": file_name}
+    outname = args.output if args.output else file_name
+
+    # revalidate the local copy instead of downloading it again
+    validators = load_validators()
+    key = f"{file_name}:{os.path.abspath(outname)}"
+    headers.update(download_conditions(validators["downloads"].get(key), outname))
+
     resp = requests.get(f"{DOWNLOAD_URL}/files/download", params=params, headers=headers, stream=True)
-    if resp.status_code == 200:
-        outname = args.output if args.output else file_name
+    if resp.status_code == 304:
+        print(f"{outname} is up to date")
+    elif resp.status_code == 200:
         with open(outname, 'wb') as f:
             for chunk in resp.iter_content(chunk_size=8192):
                 f.write(chunk)
         print(f"Downloaded to {outname}")
+
+        # remember the validators (and the local copy they belong to) for the next download
+        if "ETag" in resp.headers or "Last-Modified" in resp.headers:
+            stat = os.stat(outname)
+            validators["downloads"][key] = {
+                "etag": resp.headers.get("ETag"),
+                "last_modified": resp.headers.get("Last-Modified"),
+                "size": stat.st_size,
+                "mtime": stat.st_mtime
+            }
+            save_validators(validators)
     else:
         print("Download failed:", resp.text)  # or use print_response(resp)
 
 # delete file from the storage service - requires token for auth
 def delete(args):
+    if args.grpc:
+        return grpc_delete(args)
     file_name = args.file
     headers = {}
     token = load_token()
@@ -94,16 +588,347 @@ def delete(args):
 
 # list all files from the metadata service - requires token for auth
 def list_files(args):
-    params = {}
-    headers = {}
-    token = load_token()
-    if token:
-        headers["Authorization"] = f"Bearer {token}"
-    resp = requests.get(f"{UPLOAD_URL}/files", params=params, headers=headers)
-    print_response(resp)
+    if args.grpc:
+        return grpc_list_files(args)
+    # the listing is served from the local metadata cache, refreshed first with the changes since the last
+    # refresh (one small request); --offline, or an unreachable server, lists the cache as it is
+    db = open_metadata_cache()
+    if not args.offline:
+        session = requests.Session()
+        token = load_token()
+        if token:
+            session.headers["Authorization"] = f"Bearer {token}"
+        try:
+            refresh_metadata_cache(db, session)
+        except (RuntimeError, requests.exceptions.ConnectionError) as e:
+            print(f"Cannot refresh the listing ({e}), showing the cached one", file=sys.stderr)
+
+    query = "SELECT filename, size, version, sha256, modified_at FROM remote_files"
+    params = []
+    if args.prefix:
+        # a range over the primary key, so a prefix is found without scanning the whole cache
+        query += " WHERE filename >= ? AND filename < ?"
+        params += [args.prefix, args.prefix + chr(0x10FFFF)]
+    order = {"name": "filename", "size": "size", "modified": "modified_at", "version": "version"}[args.sort]
+    query += f" ORDER BY {order} {'DESC' if args.reverse else 'ASC'}, filename"
+    if args.limit:
+        query += " LIMIT ?"
+        params.append(args.limit)
+    rows = db.execute(query, params)
+    if args.json:
+        print(json.dumps([dict(zip(("filename", "size", "version", "sha256", "modified_at"), row)) for row in rows]))
+    else:
+        for filename, size, version, sha256, modified_at in rows:
+            modified = time.strftime("%Y-%m-%d %H:%M", time.localtime(modified_at)) if modified_at else "-"
+            print(f"{human_bytes(size or 0):>10}  v{version or 1:<4} {modified}  {filename}")
+    db.close()
+
+# mirror a local directory: upload new or changed files, and with --delete remove remote copies of deleted ones
+def sync(args):
+    root = os.path.abspath(args.dir)
+    prefix = args.prefix.strip("/") + "/" if args.prefix else ""
+    start = time.time()
+    session = bulk_session(args.workers)
+
+    # the remote listing (the metadata cache, refreshed) says which files exist and their content hashes
+    try:
+        remote = remote_hashes(session)
+    except RuntimeError as e:
+        print("Sync failed: cannot list remote files:", e)
+        return
+
+    # only files whose size or mtime changed since the last sync are hashed again
+    db = open_manifest()
+    manifest = {path: (size, mtime_ns, sha256) for path, size, mtime_ns, sha256
+                in db.execute("SELECT path, size, mtime_ns, sha256 FROM files WHERE root = ?", (root,))}
+    racy_ns = int((start - SYNC_RACY_SECONDS) * 1e9)
+    seen = set()
+    to_upload = {}
+    hashed = unchanged = 0
+    for path, stat in walk_files(root):
+        seen.add(path)
+        entry = manifest.get(path)
+        if entry and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+            sha256 = entry[2]
+        else:
+            sha256 = hash_file(os.path.join(root, path))
+            hashed += 1
+            # a file still being written keeps an impossible size, so it is hashed again next time
+            size = stat.st_size if stat.st_mtime_ns < racy_ns else -1
+            db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)",
+                       (root, path, size, stat.st_mtime_ns, sha256))
+
+        if remote.get(prefix + path) == sha256:
+            unchanged += 1
+        else:
+            to_upload[path] = sha256
+    db.commit()
+    uploads, failures = run_many("Uploaded", list(to_upload), lambda path: upload_one(
+        session, os.path.join(root, path), prefix + path, args.retries, to_upload[path]), args.workers)
+
+    # deleted locally: with --delete remove the remote copy, then forget the file
+    gone = [path for path in manifest.keys() - seen if prefix + path not in remote]
+    to_delete = [path for path in manifest.keys() - seen if prefix + path in remote]
+    deletes, delete_failures = run_many("Deleted", to_delete if args.delete else [], lambda path: delete_one(
+        session, prefix + path, args.retries), args.workers)
+    failed_deletes = {path for path, _ in delete_failures}
+    # without --delete the files stay in the manifest, so a later sync --delete still removes them
+    forget = gone + [path for path in to_delete if args.delete and path not in failed_deletes]
+    db.executemany("DELETE FROM files WHERE root = ? AND path = ?", [(root, path) for path in forget])
+    db.commit()
+    db.close()
+
+    print(f"Synced {root}: {uploads.done - uploads.failed} uploaded, {deletes.done - deletes.failed} deleted, "
+          f"{unchanged} unchanged, {uploads.failed + deletes.failed} failed ({hashed} hashed) "
+          f"in {time.time() - start:.1f}s")
+    print_failures(failures + delete_failures)
+
+# inotify event bits (linux/inotify.h)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+
+# recursive inotify watch of a directory tree, through libc so no extra package is needed (Linux only);
+# events are reported as (path relative to root, mask)
+class Inotify:
+    MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+            | IN_ONLYDIR | IN_DONT_FOLLOW | IN_EXCL_UNLINK)
+    EVENT = struct.Struct("iIII")
+
+    def __init__(self, root):
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        if not hasattr(self.libc, "inotify_init1"):
+            raise OSError(errno.ENOSYS, "inotify is not available on this platform")
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.root = root
+        self.dirs = {}  # watch descriptor -> directory relative to root
+
+    # watch rel and every directory under it; returns the files found there (they may be new to us)
+    def add_tree(self, rel=""):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(os.path.join(self.root, rel)), self.MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err in (errno.ENOENT, errno.ENOTDIR):
+                return []  # already gone again
+            raise OSError(err, f"cannot watch {os.path.join(self.root, rel)} (fs.inotify.max_user_watches?)")
+        self.dirs[wd] = rel
+        files = []
+        try:
+            with os.scandir(os.path.join(self.root, rel)) as entries:
+                for entry in entries:
+                    path = f"{rel}/{entry.name}" if rel else entry.name
+                    if entry.is_dir(follow_symlinks=False):
+                        files.extend(self.add_tree(path))
+                    elif entry.is_file(follow_symlinks=False):
+                        files.append(path)
+        except FileNotFoundError:
+            pass
+        return files
+
+    # stop watching rel and the directories under it (moved away or deleted)
+    def remove_tree(self, rel):
+        for wd, path in list(self.dirs.items()):
+            if path == rel or path.startswith(rel + "/"):
+                self.libc.inotify_rm_watch(self.fd, wd)
+                del self.dirs[wd]
+
+    def read(self):
+        try:
+            data = os.read(self.fd, 256 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = self.EVENT.unpack_from(data, offset)
+            name = data[offset + self.EVENT.size:offset + self.EVENT.size + length].rstrip(b"\0")
+            offset += self.EVENT.size + length
+            if mask & IN_Q_OVERFLOW:
+                events.append(("", mask))
+            elif mask & IN_IGNORED:
+                self.dirs.pop(wd, None)
+            elif wd in self.dirs:
+                rel = self.dirs[wd]
+                name = os.fsdecode(name)
+                events.append((f"{rel}/{name}" if rel else name, mask))
+        return events
+
+# push the current state of changed paths under root: upload new or modified files and, with --delete, remove
+# the remote copies of deleted ones in one 2PC batch; returns the paths that failed (to be pushed again)
+def push_changes(session, db, root, prefix, paths, args):
+    start = time.time()
+    racy_ns = int((start - SYNC_RACY_SECONDS) * 1e9)
+    to_upload, to_delete, stats = {}, [], {}
+    for path in sorted(paths):
+        entry = db.execute("SELECT size, mtime_ns, sha256 FROM files WHERE root = ? AND path = ?",
+                           (root, path)).fetchone()
+        try:
+            stat = os.stat(os.path.join(root, path), follow_symlinks=False)
+            if not stat_mode.S_ISREG(stat.st_mode):
+                raise FileNotFoundError(path)
+            if entry and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+                continue
+            sha256 = hash_file(os.path.join(root, path))
+        except (FileNotFoundError, NotADirectoryError):
+            if entry:
+                to_delete.append(path)
+            continue
+        # a file still being written keeps an impossible size, so it is hashed again next time
+        stats[path] = (stat.st_size if stat.st_mtime_ns < racy_ns else -1, stat.st_mtime_ns, sha256)
+        if entry and entry[2] == sha256:
+            db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)", (root, path, *stats[path]))
+        else:
+            to_upload[path] = sha256
+
+    uploads, failures = run_many("Uploaded", list(to_upload), lambda path: upload_one(
+        session, os.path.join(root, path), prefix + path, args.retries, to_upload[path]), args.workers)
+    failed = {path for path, _ in failures}
+    # the manifest only records what reached the server, so a failed file is still "changed" when retried
+    db.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)",
+                   [(root, path, *stats[path]) for path in to_upload if path not in failed])
+
+    deleted = 0
+    if args.delete and to_delete:
+        remote = {}  # nothing is known to be on the server when the listing fails
+        try:
+            remote = remote_hashes(session)
+        except (RuntimeError, requests.exceptions.ConnectionError):
+            failed.update(to_delete)
+            to_delete = []
+        on_server = [path for path in to_delete if prefix + path in remote]
+        if on_server:
+            resp = send_with_retry(lambda: session.post(f"{UPLOAD_URL}/files/batch", json={"operations": [
+                {"operation": "delete", "filename": prefix + path} for path in on_server]}), args.retries)
+            if resp.status_code == 200:
+                deleted = len(on_server)
+            else:
+                # one bad name aborts the whole batch: fall back to one transaction per file
+                progress, delete_failures = run_many("Deleted", on_server, lambda path: delete_one(
+                    session, prefix + path, args.retries), args.workers)
+                deleted = progress.done - progress.failed
+                failures += delete_failures
+                failed.update(path for path, _ in delete_failures)
+        db.executemany("DELETE FROM files WHERE root = ? AND path = ?",
+                       [(root, path) for path in to_delete if path not in failed])
+    db.commit()
+
+    if to_upload or deleted or failures:
+        if to_upload:
+            print(file=sys.stderr)
+        print(f"{time.strftime('%H:%M:%S')} {len(to_upload) - uploads.failed} uploaded, {deleted} deleted, "
+              f"{len(failures)} failed in {time.time() - start:.2f}s")
+        print_failures(failures)
+    return failed
+
+# keep a directory synced: reconcile once like sync, then push changes as inotify reports them, a debounced
+# burst at a time; idle it blocks in poll() and uses no CPU
+def watch(args):
+    root = os.path.abspath(args.dir)
+    prefix = args.prefix.strip("/") + "/" if args.prefix else ""
+    debounce, max_delay = args.debounce_ms / 1000, WATCH_MAX_DELAY_MS / 1000
+    try:
+        notify = Inotify(root)
+    except OSError as e:
+        print("Watch failed:", e.strerror or e)
+        return
+    # watching starts before the reconcile, so nothing changed meanwhile is missed
+    notify.add_tree()
+    sync(args)
+
+    session = bulk_session(args.workers)
+    db = open_manifest()
+    poller = select.poll()
+    poller.register(notify.fd, select.POLLIN)
+    dirty, retry = set(), set()
+    first = last = retry_at = None
+    print(f"Watching {root} (Ctrl-C to stop)")
+    try:
+        while True:
+            deadlines = ([min(last + debounce, first + max_delay)] if dirty else []) + ([retry_at] if retry else [])
+            timeout = max(0, min(deadlines) - time.monotonic()) * 1000 if deadlines else None
+            if poller.poll(timeout):
+                rescan = False
+                for path, mask in notify.read():
+                    if mask & IN_Q_OVERFLOW:
+                        rescan = True
+                    elif mask & IN_ISDIR:
+                        if mask & (IN_CREATE | IN_MOVED_TO):
+                            dirty.update(notify.add_tree(path))
+                        else:
+                            # deleted or moved away: everything synced from under it is gone
+                            notify.remove_tree(path)
+                            dirty.update(row[0] for row in db.execute(
+                                "SELECT path FROM files WHERE root = ? AND substr(path, 1, ?) = ?",
+                                (root, len(path) + 1, path + "/")))
+                    elif not mask & IN_CREATE:
+                        # a new file is pushed once it is closed after writing (IN_CLOSE_WRITE)
+                        dirty.add(path)
+                if rescan:
+                    # the kernel queue overflowed and events were lost: reconcile the whole tree again
+                    print("Too many changes at once, rescanning")
+                    sync(args)
+                    dirty.clear()
+                elif dirty:
+                    last = time.monotonic()
+                    first = first or last
+
+            now = time.monotonic()
+            if retry and now >= retry_at:
+                dirty |= retry
+                retry.clear()
+                first = first or now
+                last = last or now
+            if dirty and now >= min(last + debounce, first + max_delay):
+                failed = push_changes(session, db, root, prefix, dirty, args)
+                dirty.clear()
+                first = last = None
+                if failed:
+                    retry |= failed
+                    retry_at = time.monotonic() + WATCH_RETRY_SECONDS
+    except KeyboardInterrupt:
+        pass
+    finally:
+        db.close()
+
+# upload many files in parallel (stored under their base names)
+def upload_many(args):
+    paths = expand_paths(args.files)
+    session = bulk_session(args.workers)
+    progress, failures = run_many("Uploaded", paths, lambda path: upload_one(
+        session, path, os.path.basename(path), args.retries), args.workers)
+    print(progress.summary())
+    print_failures(failures)
+
+# download many files in parallel into --output-dir
+def download_many(args):
+    session = bulk_session(args.workers)
+    progress, failures = run_many("Downloaded", args.files, lambda name: download_one(
+        session, name, os.path.join(args.output_dir, name), args.retries), args.workers)
+    print(progress.summary())
+    print_failures(failures)
+
+# delete many files in parallel
+def delete_many(args):
+    session = bulk_session(args.workers)
+    progress, failures = run_many("Deleted", args.files, lambda name: delete_one(session, name, args.retries),
+                                  args.workers)
+    print(progress.summary())
+    print_failures(failures)
 
 def main():
     parser = argparse.ArgumentParser(description="Mini-Dropbox CLI Client")
+    parser.add_argument("--grpc", action="store_true",
+                        help="upload/download/list/delete over the gRPC FileService instead of REST")
     subparsers = parser.add_subparsers(dest="command")
 
     # Signup
@@ -129,8 +954,14 @@ def main():
     parser_download.add_argument("--output", help="Output file name")
     parser_download.set_defaults(func=download)
 
-    # List files
+    # List files (from the local metadata cache)
     parser_list = subparsers.add_parser("list")
+    parser_list.add_argument("--prefix", default="", help="only files whose name starts with this")
+    parser_list.add_argument("--sort", choices=("name", "size", "modified", "version"), default="name")
+    parser_list.add_argument("--reverse", action="store_true", help="sort descending")
+    parser_list.add_argument("--limit", type=int, default=0, help="print at most this many files")
+    parser_list.add_argument("--offline", action="store_true", help="list the cache without contacting the server")
+    parser_list.add_argument("--json", action="store_true", help="print the files as a JSON array")
     parser_list.set_defaults(func=list_files)
 
     # Delete
@@ -138,6 +969,42 @@ def main():
     parser_upload.add_argument("file")
     parser_upload.set_defaults(func=delete)
 
+    # Bulk transfers on a bounded worker pool
+    parser_upload_many = subparsers.add_parser("upload-many")
+    parser_upload_many.add_argument("files", nargs="+", help="files or glob patterns")
+    parser_download_many = subparsers.add_parser("download-many")
+    parser_download_many.add_argument("files", nargs="+", help="remote file names")
+    parser_download_many.add_argument("--output-dir", default=".", help="directory to download into")
+    parser_delete_many = subparsers.add_parser("delete-many")
+    parser_delete_many.add_argument("files", nargs="+", help="remote file names")
+    for bulk_parser, func in ((parser_upload_many, upload_many), (parser_download_many, download_many),
+                              (parser_delete_many, delete_many)):
+        bulk_parser.add_argument("--workers", type=int, default=BULK_WORKERS, help="transfers in flight")
+        bulk_parser.add_argument("--retries", type=int, default=BULK_RETRIES, help="extra attempts per file")
+        bulk_parser.set_defaults(func=func)
+
+    # Sync a directory
+    parser_sync = subparsers.add_parser("sync")
+    parser_sync.add_argument("dir")
+    parser_sync.add_argument("--prefix", default="", help="remote name prefix for the directory's files")
+    parser_sync.add_argument("--delete", action="store_true",
+                             help="delete remote copies of files that were synced before and are gone locally")
+    parser_sync.add_argument("--workers", type=int, default=BULK_WORKERS, help="transfers in flight")
+    parser_sync.add_argument("--retries", type=int, default=BULK_RETRIES, help="extra attempts per file")
+    parser_sync.set_defaults(func=sync)
+
+    # Watch a directory and push changes as they happen
+    parser_watch = subparsers.add_parser("watch")
+    parser_watch.add_argument("dir")
+    parser_watch.add_argument("--prefix", default="", help="remote name prefix for the directory's files")
+    parser_watch.add_argument("--delete", action="store_true",
+                              help="delete remote copies of files deleted locally")
+    parser_watch.add_argument("--debounce-ms", type=int, default=WATCH_DEBOUNCE_MS,
+                              help="quiet time that ends a burst of changes")
+    parser_watch.add_argument("--workers", type=int, default=BULK_WORKERS, help="transfers in flight")
+    parser_watch.add_argument("--retries", type=int, default=BULK_RETRIES, help="extra attempts per file")
+    parser_watch.set_defaults(func=watch)
+
     args = parser.parse_args()
     if hasattr(args, "func"):
         args.func(args)
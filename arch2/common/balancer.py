@@ -0,0 +1,170 @@
+"""
+Client-side load balancing over replicated service endpoints
+A service URL such as http://storage:5006 can be backed by a list of replicas
+(e.g. STORAGE_ENDPOINTS=http://storage-1:5006,http://storage-2:5006). Calls made through
+the internal HTTP clients to that URL are sent to one replica, chosen by power of two
+choices on outstanding requests among the available ones. Replicas are health-checked
+in the background (GET /health) and ejected for a while after consecutive failures,
+so a dead replica is skipped before any request has to time out on it. Pinned calls go to
+the first available replica in the configured order instead, for reads whose answers only
+make sense against the same replica as last time (delta-listing cursors, listing ETags).
+"""
+
+import logging
+import os
+import random
+import threading
+import time
+from urllib.parse import urlsplit, urlunsplit
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+BALANCER_HEALTH_INTERVAL = float(os.environ.get('BALANCER_HEALTH_INTERVAL', '2.0'))  # seconds between health checks
+BALANCER_HEALTH_TIMEOUT = float(os.environ.get('BALANCER_HEALTH_TIMEOUT', '1.0'))  # seconds a health check may take
+BALANCER_EJECT_FAILURES = int(os.environ.get('BALANCER_EJECT_FAILURES', '3'))  # consecutive failures that eject
+BALANCER_EJECT_TIME = float(os.environ.get('BALANCER_EJECT_TIME', '10.0'))  # base seconds ejected (grows per ejection)
+BALANCER_MAX_EJECT_RATIO = float(os.environ.get('BALANCER_MAX_EJECT_RATIO', '0.5'))  # most replicas ejected at once
+
+
+class Endpoint:
+    def __init__(self, url):
+        self.url = url.rstrip("/")
+        self.outstanding = 0
+        self.healthy = True
+        self.failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+
+    def available(self, now):
+        return self.healthy and now >= self.ejected_until
+
+
+class EndpointPool:
+    """Replicas behind one service URL"""
+
+    def __init__(self, urls, health_path="/health", health_interval=BALANCER_HEALTH_INTERVAL,
+                 health_timeout=BALANCER_HEALTH_TIMEOUT, eject_failures=BALANCER_EJECT_FAILURES,
+                 eject_time=BALANCER_EJECT_TIME, max_eject_ratio=BALANCER_MAX_EJECT_RATIO):
+        self.endpoints = [Endpoint(url) for url in urls]
+        self.health_path = health_path
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self.eject_failures = eject_failures
+        self.eject_time = eject_time
+        self.max_ejected = max(1, int(len(self.endpoints) * max_eject_ratio)) if len(self.endpoints) > 1 else 0
+        self._lock = threading.Lock()
+        self._health_thread = None
+
+    def pick(self, exclude=(), pinned=False):
+        """
+        Choose a replica (power of two choices on outstanding requests, or the first available one
+        if pinned) and count the request against it
+        """
+        now = time.monotonic()
+        with self._lock:
+            candidates = [e for e in self.endpoints if e.available(now) and e not in exclude]
+            if not candidates:
+                # every replica looks down: try the ones not yet tried by this call rather than fail outright
+                candidates = [e for e in self.endpoints if e not in exclude] or self.endpoints
+            if len(candidates) == 1 or pinned:
+                chosen = candidates[0]
+            else:
+                first, second = random.sample(candidates, 2)
+                chosen = first if first.outstanding <= second.outstanding else second
+            chosen.outstanding += 1
+            return chosen
+
+    def cancel(self, endpoint):
+        """A picked replica was not used after all"""
+        with self._lock:
+            endpoint.outstanding -= 1
+
+    def done(self, endpoint, ok):
+        """A request to endpoint finished; failures count towards ejecting it"""
+        with self._lock:
+            endpoint.outstanding -= 1
+            if ok:
+                endpoint.failures = 0
+                return
+            endpoint.failures += 1
+            now = time.monotonic()
+            ejected = sum(1 for e in self.endpoints if now < e.ejected_until)
+            if endpoint.failures >= self.eject_failures and now >= endpoint.ejected_until and \
+                    ejected < self.max_ejected:
+                endpoint.ejections += 1
+                endpoint.ejected_until = now + self.eject_time * min(endpoint.ejections, 10)
+                endpoint.failures = 0
+                logger.warning(f"Ejected {endpoint.url} for {endpoint.ejected_until - now:.0f}s after repeated failures")
+
+    def start_health_checks(self):
+        if self._health_thread is None and len(self.endpoints) > 1:
+            self._health_thread = threading.Thread(target=self._health_loop, daemon=True,
+                                                   name="balancer-health")
+            self._health_thread.start()
+
+    def check_health(self):
+        """One round of active health checks"""
+        for endpoint in self.endpoints:
+            try:
+                healthy = requests.get(endpoint.url + self.health_path, timeout=self.health_timeout).status_code == 200
+            except requests.exceptions.RequestException:
+                healthy = False
+            with self._lock:
+                if healthy != endpoint.healthy:
+                    logger.warning(f"Replica {endpoint.url} is {'up' if healthy else 'down'}")
+                endpoint.healthy = healthy
+                if healthy and time.monotonic() >= endpoint.ejected_until:
+                    endpoint.ejections = 0
+
+    def _health_loop(self):
+        while True:
+            self.check_health()
+            time.sleep(self.health_interval)
+
+
+_pools = {}  # (scheme, netloc) of a service URL -> EndpointPool
+
+
+def _base(url):
+    parts = urlsplit(url)
+    return parts.scheme, parts.netloc
+
+
+def register_replicas(service_url, endpoints):
+    """
+    Spread calls to service_url over a comma-separated list of replica base URLs
+    (no-op when endpoints is empty, so a single hostname keeps working unchanged)
+    """
+    urls = [url.strip() for url in (endpoints or "").split(",") if url.strip()]
+    if not urls:
+        return None
+    if any(_base(url) == _base(service_url) for url in urls):
+        # calls to a replica URL must not be balanced again (see replicas())
+        raise ValueError(f"Replicas of {service_url} need their own hostnames")
+    pool = EndpointPool(urls)
+    _pools[_base(service_url)] = pool
+    pool.start_health_checks()
+    return pool
+
+
+def resolve(url, exclude=(), pinned=False):
+    """(url rewritten to a chosen replica, pool, endpoint), or (url, None, None) if url is not balanced"""
+    pool = _pools.get(_base(url))
+    if pool is None:
+        return url, None, None
+    endpoint = pool.pick(exclude, pinned)
+    replica = urlsplit(endpoint.url)
+    parts = urlsplit(url)
+    path = replica.path.rstrip("/") + parts.path
+    return urlunsplit((replica.scheme, replica.netloc, path, parts.query, parts.fragment)), pool, endpoint
+
+
+def replicas(service_url):
+    """Every replica base URL behind service_url (for writes that must reach all of them)"""
+    pool = _pools.get(_base(service_url))
+    if pool is None:
+        return [service_url]
+    path = urlsplit(service_url).path
+    return [endpoint.url + path for endpoint in pool.endpoints]
@@ -0,0 +1,29 @@
+"""
+HTTP validators for the gateways
+Strong ETags come from the content hash stored in metadata (sha256) and Last-Modified
+from the commit time (modified_at), so a conditional GET of an unchanged file is
+answered with 304 without touching storage
+"""
+
+from werkzeug.http import http_date, parse_date, parse_etags, quote_etag
+
+
+def file_validators(metadata):
+    """ETag / Last-Modified headers for a file's metadata (empty for files stored before content hashes)"""
+    headers = {}
+    if metadata.get("sha256"):
+        headers["ETag"] = quote_etag(metadata["sha256"])
+    if metadata.get("modified_at"):
+        headers["Last-Modified"] = http_date(metadata["modified_at"])
+    return headers
+
+
+def not_modified(request_headers, metadata):
+    """True if the request's If-None-Match / If-Modified-Since still match (If-None-Match takes precedence)"""
+    if_none_match = request_headers.get("If-None-Match")
+    if if_none_match:
+        return bool(metadata.get("sha256")) and parse_etags(if_none_match).contains_weak(metadata["sha256"])
+    if_modified_since = parse_date(request_headers.get("If-Modified-Since"))
+    if if_modified_since and metadata.get("modified_at"):
+        return int(metadata["modified_at"]) <= if_modified_since.timestamp()
+    return False
@@ -0,0 +1,199 @@
+"""
+Shared internal HTTP client for service-to-service calls
+Per-host keepalive connection pools, per-call deadlines, bounded retries with jitter
+and a per-host circuit breaker (mounted into each service at /app/common). Calls to a
+service URL with registered replicas are load balanced over them (see balancer.py)
+"""
+
+import logging
+import os
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from common.balancer import resolve
+
+logger = logging.getLogger(__name__)
+
+HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', '32'))  # keepalive connections kept per host
+HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', '2.0'))  # seconds to establish a connection
+HTTP_READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT', '30.0'))  # seconds between bytes of a response
+HTTP_DEADLINE = float(os.environ.get('HTTP_DEADLINE', '60.0'))  # total seconds for one call, retries included
+HTTP_RETRIES = int(os.environ.get('HTTP_RETRIES', '2'))  # extra attempts for idempotent requests
+HTTP_RETRY_BACKOFF = float(os.environ.get('HTTP_RETRY_BACKOFF', '0.1'))  # base of the jittered exponential backoff
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get('HTTP_BREAKER_FAILURES', '5'))  # consecutive failures that open it
+BREAKER_RESET_TIMEOUT = float(os.environ.get('HTTP_BREAKER_RESET', '10.0'))  # seconds open before a trial request
+
+IDEMPOTENT_METHODS = frozenset(("GET", "HEAD", "PUT", "DELETE", "OPTIONS"))
+RETRYABLE_STATUS = frozenset((502, 503, 504))
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised without touching the network while a host's circuit breaker is open"""
+
+
+class CircuitBreaker:
+    """Closed -> open after consecutive failures -> half-open trial after a cool-down"""
+
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_timeout=BREAKER_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow_request(self):
+        with self._lock:
+            if self.state == "open":
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    return False
+                # Let one trial request through; its outcome closes or re-opens the breaker
+                self.state = "half_open"
+                return True
+            return self.state == "closed"
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+    def release(self):
+        """
+        Give back a half-open trial that got no answer from the host (deadline already passed,
+        or a local error): the breaker stays open and the next request becomes the trial
+        """
+        with self._lock:
+            if self.state == "half_open":
+                self.state = "open"
+
+
+def choose_target(url, tried, breaker_for, pinned=False):
+    """
+    (url, breaker, pool, replica) for the next attempt of a call: a balanced url is rewritten to a
+    replica not yet tried whose breaker admits a request. Raises CircuitOpenError if no breaker does
+    """
+    skipped = []
+    while True:
+        target, pool, endpoint = resolve(url, exclude=tried + skipped, pinned=pinned)
+        host = urlsplit(target).netloc
+        breaker = breaker_for(host)
+        if breaker.allow_request():
+            return target, breaker, pool, endpoint
+        if pool is not None:
+            pool.cancel(endpoint)
+        if pool is None or endpoint in skipped:
+            raise CircuitOpenError(f"Circuit breaker open for {host}")
+        skipped.append(endpoint)
+
+
+class InternalHTTPClient:
+    """requests.Session wrapper used for every call between services"""
+
+    def __init__(self, pool_size=HTTP_POOL_SIZE, connect_timeout=HTTP_CONNECT_TIMEOUT, read_timeout=HTTP_READ_TIMEOUT,
+                 deadline=HTTP_DEADLINE, retries=HTTP_RETRIES, retry_backoff=HTTP_RETRY_BACKOFF):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.deadline = deadline
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._breakers = {}
+        self._breakers_lock = threading.Lock()
+
+    def _breaker(self, host):
+        with self._breakers_lock:
+            if host not in self._breakers:
+                self._breakers[host] = CircuitBreaker()
+            return self._breakers[host]
+
+    def _backoff(self, attempt, remaining):
+        # Full jitter: sleep a random time up to base * 2^attempt, never past the deadline
+        time.sleep(min(remaining, random.uniform(0, self.retry_backoff * (2 ** attempt))))
+
+    def request(self, method, url, deadline=None, retries=None, pinned=False, **kwargs):
+        """
+        Send a request with a total deadline; idempotent methods are retried on connection
+        errors, timeouts and 502/503/504 (on another replica at once if url is balanced, else
+        after a backoff). pinned sends a balanced url to the first available replica (see
+        balancer.py). Raises CircuitOpenError while the host's breaker is open
+        """
+        method = method.upper()
+        deadline_at = time.monotonic() + (deadline or self.deadline)
+        if retries is None:
+            retries = self.retries if method in IDEMPOTENT_METHODS else 0
+        tried = []
+
+        for attempt in range(retries + 1):
+            last_attempt = attempt == retries
+            target, breaker, pool, endpoint = choose_target(url, tried, self._breaker, pinned)
+            remaining = deadline_at - time.monotonic()
+            if remaining <= 0:
+                breaker.release()
+                if pool is not None:
+                    pool.cancel(endpoint)
+                raise requests.exceptions.Timeout(f"Deadline exceeded calling {method} {url}")
+            timeout = (min(self.connect_timeout, remaining), min(self.read_timeout, remaining))
+            try:
+                resp = self.session.request(method, target, timeout=timeout, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                breaker.record_failure()
+                if pool is not None:
+                    pool.done(endpoint, ok=False)
+                    tried.append(endpoint)
+                if last_attempt:
+                    raise
+                logger.warning(f"{method} {target} failed ({e}), retrying")
+                if pool is None:
+                    self._backoff(attempt, deadline_at - time.monotonic())
+                continue
+            except BaseException:
+                breaker.release()
+                if pool is not None:
+                    pool.cancel(endpoint)
+                raise
+
+            failed = resp.status_code in RETRYABLE_STATUS
+            if pool is not None:
+                pool.done(endpoint, ok=not failed)
+            if failed:
+                breaker.record_failure()
+                if not last_attempt:
+                    resp.close()
+                    if pool is not None:
+                        tried.append(endpoint)
+                    else:
+                        self._backoff(attempt, deadline_at - time.monotonic())
+                    continue
+            else:
+                breaker.record_success()
+            return resp
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request("HEAD", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request("PUT", url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request("DELETE", url, **kwargs)
@@ -0,0 +1,140 @@
+"""
+Streaming multipart helpers for the upload path
+MultipartFileReader reads the file field of an incoming multipart/form-data body in
+fixed-size chunks straight off the request stream; MultipartBody re-encodes a chunk
+iterator as an outgoing multipart body, so a file is never held whole in memory.
+Sha256Verifier checks the streamed bytes against the checksum a client sends after them
+"""
+
+import hashlib
+import os
+import uuid
+
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+
+UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE', str(256 * 1024)))  # bytes read/forwarded per chunk
+
+
+class MultipartFileReader:
+    """
+    Iterate over the bytes of one file field of a multipart/form-data request body
+    The part headers are parsed on construction (filename, mimetype); iterating yields
+    chunks of at most chunk_size bytes. Raises ValueError if the body has no such field.
+    Form fields sent after the file part (e.g. "sha256") are in `fields` once iteration ends
+    """
+
+    def __init__(self, stream, boundary, field="file", chunk_size=UPLOAD_CHUNK_SIZE):
+        if not boundary:
+            raise ValueError("Missing multipart boundary")
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.decoder = MultipartDecoder(boundary.encode())
+        self.events = self._events()
+        self.filename = None
+        self.mimetype = None
+        self.fields = {}
+        for event in self.events:
+            if isinstance(event, File) and event.name == field:
+                self.filename = event.filename
+                self.mimetype = event.headers.get("Content-Type", "application/octet-stream")
+                break
+        else:
+            raise ValueError(f"No '{field}' file part in request body")
+
+    def _events(self):
+        """Decoder events up to the epilogue, reading the request stream one chunk at a time"""
+        while True:
+            event = self.decoder.next_event()
+            if isinstance(event, NeedData):
+                # An empty read marks the end of the body; a truncated body raises ValueError
+                self.decoder.receive_data(self.stream.read(self.chunk_size) or None)
+            elif isinstance(event, Epilogue):
+                return
+            else:
+                yield event
+
+    def __iter__(self):
+        buffer = bytearray()
+        for event in self.events:
+            if not isinstance(event, Data):
+                raise ValueError("Unexpected multipart part inside file data")
+            buffer += event.data
+            while len(buffer) >= self.chunk_size:
+                yield bytes(buffer[:self.chunk_size])
+                del buffer[:self.chunk_size]
+            if not event.more_data:
+                break
+        else:
+            raise ValueError("Request body ended inside file part")
+        if buffer:
+            yield bytes(buffer)
+        self._read_trailing_fields()
+
+    def _read_trailing_fields(self):
+        """Collect the (small) form fields after the file part; other file parts are skipped"""
+        name = None
+        for event in self.events:
+            if isinstance(event, Field):
+                name = event.name
+                self.fields[name] = b""
+            elif isinstance(event, File):
+                name = None
+            elif isinstance(event, Data) and name is not None:
+                self.fields[name] += event.data
+        self.fields = {name: value.decode(errors="replace") for name, value in self.fields.items()}
+
+
+class ChecksumMismatch(ValueError):
+    """The bytes of an upload do not match the checksum the client sent with them"""
+
+
+class Sha256Verifier:
+    """
+    Pass upload chunks through while hashing them
+    expected() is called after the last chunk and returns the client's hex sha256, or None
+    if the client sent none; on a mismatch ChecksumMismatch is raised instead of ending the
+    iteration, so the consumer (the 2PC vote stream) aborts rather than keeping the bytes.
+    `sha256` is the hex digest of the bytes once they have all passed
+    """
+
+    def __init__(self, chunks, expected):
+        self.chunks = chunks
+        self.expected = expected
+        self.mismatch = False
+        self.sha256 = None
+
+    def __iter__(self):
+        digest = hashlib.sha256()
+        for chunk in self.chunks:
+            digest.update(chunk)
+            yield chunk
+        self.sha256 = digest.hexdigest()
+        expected = self.expected()
+        if expected and expected.strip().lower() != self.sha256:
+            self.mismatch = True
+            raise ChecksumMismatch(f"Upload sha256 {self.sha256} does not match the client's {expected}")
+
+
+class MultipartBody:
+    """
+    multipart/form-data request body with a single file field, encoded lazily from a chunk iterator
+    Pass as `data=` with headers={"Content-Type": body.content_type}; requests sends it with
+    chunked transfer encoding, one chunk at a time
+    """
+
+    def __init__(self, field, filename, mimetype, chunks):
+        self.boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={self.boundary}"
+        self.field = field
+        self.filename = filename
+        self.mimetype = mimetype or "application/octet-stream"
+        self.chunks = chunks
+
+    def __iter__(self):
+        yield (f'--{self.boundary}\r\n'
+               f'Content-Disposition: form-data; name="{self.field}"; filename="{self.filename}"\r\n'
+               f'Content-Type: {self.mimetype}\r\n\r\n').encode()
+        for chunk in self.chunks:
+            if chunk:
+                yield chunk
+        yield f'\r\n--{self.boundary}--\r\n'.encode()
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+# Generated by the protocol buffer compiler.  DO NOT EDIT!
+# NO CHECKED-IN PROTOBUF GENCODE
+# source: fileservice.proto
+# Protobuf Python Version: 6.31.1
+"""Generated protocol buffer code."""
+from google.protobuf import descriptor as _descriptor
+from google.protobuf import descriptor_pool as _descriptor_pool
+from google.protobuf import runtime_version as _runtime_version
+from google.protobuf import symbol_database as _symbol_database
+from google.protobuf.internal import builder as _builder
+_runtime_version.ValidateProtobufRuntimeVersion(
+    _runtime_version.Domain.PUBLIC,
+    6,
+    31,
+    1,
+    '',
+    'fileservice.proto'
+)
+# @@protoc_insertion_point(imports)
+
+_sym_db = _symbol_database.Default()
+
+
+
+
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x11\x66ileservice.proto\x12\x0b\x66ileservice\"-\n\x0bUploadChunk\x12\x10\n\x08\x66ilename\x18\x01 \x01(\t\x12\x0c\n\x04\x64\x61ta\x18\x02 \x01(\x0c\"X\n\x0eUploadResponse\x12\x16\n\x0etransaction_id\x18\x01 \x01(\t\x12\x10\n\x08\x66ilename\x18\x02 \x01(\t\x12\x0c\n\x04size\x18\x03 \x01(\x03\x12\x0e\n\x06sha256\x18\x04 \x01(\t\"#\n\x0f\x44ownloadRequest\x12\x10\n\x08\x66ilename\x18\x01 \x01(\t\";\n\rDownloadChunk\x12\x0c\n\x04\x64\x61ta\x18\x01 \x01(\x0c\x12\x0c\n\x04size\x18\x02 \x01(\x03\x12\x0e\n\x06sha256\x18\x03 \x01(\t\"`\n\x08\x46ileInfo\x12\x10\n\x08\x66ilename\x18\x01 \x01(\t\x12\x0c\n\x04size\x18\x02 \x01(\x03\x12\x0f\n\x07version\x18\x03 \x01(\x05\x12\x0e\n\x06sha256\x18\x04 \x01(\t\x12\x13\n\x0bmodified_at\x18\x05 \x01(\x01\"4\n\x0bListRequest\x12\x11\n\tpage_size\x18\x01 \x01(\x05\x12\x12\n\npage_token\x18\x02 \x01(\t\"M\n\x0cListResponse\x12$\n\x05\x66iles\x18\x01 \x03(\x0b\x32\x15.fileservice.FileInfo\x12\x17\n\x0fnext_page_token\x18\x02 \x01(\t\"!\n\rDeleteRequest\x12\x10\n\x08\x66ilename\x18\x01 \x01(\t\":\n\x0e\x44\x65leteResponse\x12\x16\n\x0etransaction_id\x18\x01 \x01(\t\x12\x10\n\x08\x66ilename\x18\x02 \x01(\t2\x98\x02\n\x0b\x46ileService\x12\x41\n\x06Upload\x12\x18.fileservice.UploadChunk\x1a\x1b.fileservice.UploadResponse(\x01\x12\x46\n\x08\x44ownload\x12\x1c.fileservice.DownloadRequest\x1a\x1a.fileservice.DownloadChunk0\x01\x12;\n\x04List\x12\x18.fileservice.ListRequest\x1a\x19.fileservice.ListResponse\x12\x41\n\x06\x44\x65lete\x12\x1a.fileservice.DeleteRequest\x1a\x1b.fileservice.DeleteResponseb\x06proto3')
+
+_globals = globals()
+_builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
+_builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'fileservice_pb2', _globals)
+if not _descriptor._USE_C_DESCRIPTORS:
+  DESCRIPTOR._loaded_options = None
+  _globals['_UPLOADCHUNK']._serialized_start=34
+  _globals['_UPLOADCHUNK']._serialized_end=79
+  _globals['_UPLOADRESPONSE']._serialized_start=81
+  _globals['_UPLOADRESPONSE']._serialized_end=169
+  _globals['_DOWNLOADREQUEST']._serialized_start=171
+  _globals['_DOWNLOADREQUEST']._serialized_end=206
+  _globals['_DOWNLOADCHUNK']._serialized_start=208
+  _globals['_DOWNLOADCHUNK']._serialized_end=267
+  _globals['_FILEINFO']._serialized_start=269
+  _globals['_FILEINFO']._serialized_end=365
+  _globals['_LISTREQUEST']._serialized_start=367
+  _globals['_LISTREQUEST']._serialized_end=419
+  _globals['_LISTRESPONSE']._serialized_start=421
+  _globals['_LISTRESPONSE']._serialized_end=498
+  _globals['_DELETEREQUEST']._serialized_start=500
+  _globals['_DELETEREQUEST']._serialized_end=533
+  _globals['_DELETERESPONSE']._serialized_start=535
+  _globals['_DELETERESPONSE']._serialized_end=593
+  _globals['_FILESERVICE']._serialized_start=596
+  _globals['_FILESERVICE']._serialized_end=876
+# @@protoc_insertion_point(module_scope)
@@ -1,9 +1,148 @@
-from flask import Flask, request, jsonify
+import bisect
+import gzip
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from flask import Flask, request, jsonify, Response
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
 
 app = Flask(__name__)
 
+METADATA_TOMBSTONES = int(os.environ.get('METADATA_TOMBSTONES', '100000'))  # deletes remembered for delta listings
+METADATA_RESTORE = os.environ.get('METADATA_RESTORE', '')  # snapshot (GET /snapshot output, may be gzipped) loaded at startup
+
+class FileStore(dict):
+    """
+    filename -> metadata, with an index of filenames by content hash (sha256) for dedup lookups
+    and a change log for delta listings: every change gets the next sequence number, so a client
+    holding cursor "<epoch>:<seq>" only needs the files changed or deleted after seq. Filenames are
+    also kept sorted for paged listings (see page())
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.by_hash = {}
+        self.epoch = uuid.uuid4().hex[:12]  # new on every start: cursors of an earlier process are void
+        self.seq = 0
+        self.changes = OrderedDict()  # filename -> seq of its last change, oldest first
+        self.tombstones = OrderedDict()  # deleted filename -> seq of the delete, oldest first
+        self.horizon = 0  # deletes up to this seq are forgotten; older cursors get a full listing
+        self._sorted = []  # filenames in order, as of the last page()
+        self._added = set()  # filenames created since, merged into _sorted by the next page()
+        self._removed = False  # whether _sorted may hold deleted filenames
+        self._lock = threading.RLock()
+
+    def __setitem__(self, filename, metadata):
+        with self._lock:
+            if filename not in self:
+                self._added.add(filename)
+            self._unindex(filename)
+            super().__setitem__(filename, metadata)
+            self._log_change(filename)
+            if metadata.get("sha256"):
+                self.by_hash.setdefault(metadata["sha256"], set()).add(filename)
+
+    def __delitem__(self, filename):
+        with self._lock:
+            self._unindex(filename)
+            super().__delitem__(filename)
+            self._log_delete(filename)
+
+    def pop(self, filename, *default):
+        with self._lock:
+            if filename in self:
+                self._unindex(filename)
+                self._log_delete(filename)
+            return super().pop(filename, *default)
+
+    def _log_change(self, filename):
+        self.seq += 1
+        self.changes.pop(filename, None)
+        self.changes[filename] = self.seq
+        self.tombstones.pop(filename, None)
+
+    def _log_delete(self, filename):
+        self._added.discard(filename)
+        self._removed = True
+        self.seq += 1
+        self.changes.pop(filename, None)
+        self.tombstones[filename] = self.seq
+        while len(self.tombstones) > METADATA_TOMBSTONES:
+            _, self.horizon = self.tombstones.popitem(last=False)
+
+    def changes_since(self, cursor):
+        """(new cursor, reset, changed records, deleted filenames) since cursor; reset means a full listing"""
+        with self._lock:
+            epoch, _, seq = (cursor or "").partition(":")
+            since = int(seq) if seq.isdigit() else -1
+            current = f"{self.epoch}:{self.seq}"
+            if epoch != self.epoch or not self.horizon <= since <= self.seq:
+                return current, True, list(self.values()), []
+            changed = []
+            for filename in reversed(self.changes):
+                if self.changes[filename] <= since:
+                    break
+                changed.append(self[filename])
+            deleted = []
+            for filename in reversed(self.tombstones):
+                if self.tombstones[filename] <= since:
+                    break
+                deleted.append(filename)
+            return current, False, changed, deleted
+
+    def page(self, after, limit):
+        """
+        (records, last filename) of up to limit files after the filename after, in filename order;
+        the last filename is "" when no files follow. Names created or deleted since the previous
+        call are merged in first: one pass over a sorted list, not a sort of the namespace per page
+        """
+        with self._lock:
+            if self._removed or self._added:
+                if self._removed:
+                    self._sorted = [n for n in self._sorted if n in self and n not in self._added]
+                self._sorted.extend(self._added)
+                self._sorted.sort()  # a sorted run plus the new names: timsort merges rather than re-sorts
+                self._added.clear()
+                self._removed = False
+            start = bisect.bisect_right(self._sorted, after)
+            names = self._sorted[start:start + limit]
+            more = start + limit < len(self._sorted)
+            return [self[n] for n in names], names[-1] if names and more else ""
+
+    def snapshot(self):
+        """
+        (cursor, records) as of one point in time. Records are replaced, never changed in place,
+        so copying the references is a consistent view; writers wait only for that copy
+        """
+        with self._lock:
+            return f"{self.epoch}:{self.seq}", list(dict.values(self))
+
+    def atomic(self):
+        """Lock held while applying several changes, so snapshots and delta listings see all or none"""
+        return self._lock
+
+    def _unindex(self, filename):
+        previous = self.get(filename)
+        if previous and previous.get("sha256") in self.by_hash:
+            names = self.by_hash[previous["sha256"]]
+            names.discard(filename)
+            if not names:
+                del self.by_hash[previous["sha256"]]
+
+    def find_by_hash(self, sha256, prefer=None):
+        """Metadata of a file with this content (prefer's own if it has it), or None"""
+        with self._lock:
+            names = self.by_hash.get(sha256)
+            if not names:
+                return None
+            return self[prefer if prefer in names else next(iter(names))]
+
+
 # In-memory metadata store
-FILES = {}
+FILES = FileStore()
 USERS = {}
 
 # ---------------- Add / Upload Metadata ----------------
@@ -17,12 +156,15 @@ def add_file():
     if not filename:
         return jsonify({"error": "Filename is required"}), 400
 
-    # Store metadata including password
+    # Store metadata including password (overwriting bumps the version)
+    previous = FILES.get(filename)
     FILES[filename] = {
         "filename": filename,
         "path": data.get("path"),
         "size": data.get("size"),
-        "version": data.get("version", 1),
+        "version": previous["version"] + 1 if previous else data.get("version", 1),
+        "sha256": data.get("sha256"),
+        "modified_at": time.time(),
         "user": data.get("user"),
         "password": data.get("password", "")
     }
@@ -31,15 +173,61 @@ def add_file():
 
 
 # ---------------- Get Metadata ----------------
-@app.route("/files/<filename>", methods=["GET"])
+@app.route("/files/<path:filename>", methods=["GET"])
 def get_file(filename):
     if filename not in FILES:
         return jsonify({"error": "File not found"}), 404
     return jsonify(FILES[filename])
 
 
+# ---------------- Find by Content Hash (upload dedup) ----------------
+@app.route("/hashes/<sha256>", methods=["GET"])
+def find_by_hash(sha256):
+    metadata = FILES.find_by_hash(sha256, prefer=request.args.get("filename"))
+    if metadata is None:
+        return jsonify({"error": "Content not found"}), 404
+    return jsonify(metadata)
+
+
+# ---------------- Snapshot (backups) ----------------
+@app.route("/snapshot", methods=["GET"])
+def snapshot():
+    # Point-in-time dump as NDJSON: a header line with the delta-listing cursor it corresponds to,
+    # then one line per file and per user. Encoding and sending happen outside the store lock
+    cursor, records = FILES.snapshot()
+    users = list(USERS.items())
+
+    def lines():
+        yield json.dumps({"snapshot": {"cursor": cursor, "taken_at": time.time(), "files": len(records),
+                                       "users": len(users)}}) + "\n"
+        batch = []
+        for record in records:
+            batch.append(json.dumps({"file": record}))
+            if len(batch) == 1000:
+                yield "\n".join(batch) + "\n"
+                batch = []
+        batch += [json.dumps({"user": username, "password": password}) for username, password in users]
+        if batch:
+            yield "\n".join(batch) + "\n"
+
+    return Response(lines(), mimetype="application/x-ndjson")
+
+
+def load_snapshot(path):
+    """Fill FILES and USERS from a snapshot file (a backup's metadata_<timestamp>.ndjson.gz)"""
+    with (gzip.open if path.endswith(".gz") else open)(path, "rt", encoding="utf-8") as f:
+        with FILES.atomic():
+            for line in f:
+                entry = json.loads(line)
+                if "file" in entry:
+                    FILES[entry["file"]["filename"]] = entry["file"]
+                elif "user" in entry:
+                    USERS[entry["user"]] = entry["password"]
+    print(f"Restored {len(FILES)} files and {len(USERS)} users from {path}")
+
+
 # ---------------- Delete Metadata ----------------
-@app.route("/files/<filename>", methods=["DELETE"])
+@app.route("/files/<path:filename>", methods=["DELETE"])
 def delete_file(filename):
     if filename not in FILES:
         return jsonify({"error": "File not found"}), 404
@@ -51,7 +239,23 @@ def delete_file(filename):
 # ---------------- List All Files (Optional) ----------------
 @app.route("/files", methods=["GET"])
 def list_files():
-    return jsonify(list(FILES.values())), 200
+    # ?since=<cursor>: only what changed after the cursor of an earlier call (cost follows the changes,
+    # not the namespace); since= (empty) starts with a full listing
+    if "since" in request.args:
+        cursor, reset, changed, deleted = FILES.changes_since(request.args["since"])
+        return jsonify({"cursor": cursor, "reset": reset, "files": changed, "deleted": deleted})
+    # ?limit=<n>[&after=<filename>]: one page in filename order, next_after continues it ("" at the end)
+    if "limit" in request.args:
+        try:
+            limit = int(request.args["limit"])
+        except ValueError:
+            return jsonify({"error": "limit must be an integer"}), 400
+        files, next_after = FILES.page(request.args.get("after", ""), max(limit, 1))
+        return jsonify({"files": files, "next_after": next_after})
+    # ETag over the listing itself, so unchanged listings are answered with 304 (If-None-Match)
+    resp = jsonify(list(FILES.values()))
+    resp.add_etag()
+    return resp.make_conditional(request)
 
 # ---------------- User Registration ----------------
 @app.route("/users", methods=["POST"])
@@ -77,11 +281,24 @@ def get_user(username):
         "username": username,
         "password": USERS[username]
     }), 200
+
+# ---------------- Health (polled by the gateways' replica balancer) ----------------
+@app.route("/health", methods=["GET"])
+def health():
+    return jsonify({"status": "ok"}), 200
+
+# ---------------- Metrics ----------------
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(generate_latest(), mimetype=CONTENT_TYPE_LATEST)
+
 # ---------------- Main ---------------- 
 if __name__ == "__main__":
     import sys
     import threading
     sys.stdout.reconfigure(line_buffering=True)  # flush prints immediately
+    if METADATA_RESTORE:
+        load_snapshot(METADATA_RESTORE)
     
     # Start 2PC participant server in background thread
     try:
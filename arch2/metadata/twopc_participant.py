@@ -1,14 +1,19 @@
 """
 2PC Participant for Metadata Node
-Vote phase: prepare metadata (but don't update)
-Decision phase: commit (update FILES) or abort (discard)
+Vote phase: prepare metadata operations (but don't update)
+Decision phase: commit (update/delete/move/link entries in FILES) or abort (discard)
 """
 
+import asyncio
+import contextlib
 import grpc
 import logging
 import os
 import json
+import threading
+import time
 from concurrent import futures
+from prometheus_client import Counter, Gauge, Histogram
 
 try:
     from protos import twopc_pb2
@@ -22,126 +27,352 @@ logger = logging.getLogger(__name__)
 
 NODE_ID = os.environ.get('NODE_ID', 'metadata')
 
+# Participant server settings
+PARTICIPANT_SERVER_MODE = os.environ.get('PARTICIPANT_SERVER_MODE', 'thread')  # "thread" or "aio"
+PARTICIPANT_MAX_WORKERS = int(os.environ.get('PARTICIPANT_MAX_WORKERS', '10'))  # thread mode: RPCs served at once
+PARTICIPANT_MAX_CONCURRENT_RPCS = int(os.environ.get('PARTICIPANT_MAX_CONCURRENT_RPCS', '0')) or None  # 0 = unlimited
+
+# Metrics (exposed on this service's Flask /metrics endpoint)
+PHASE_LATENCY = Histogram('twopc_participant_rpc_seconds', 'Time this participant spends handling 2PC RPCs', ['phase'])
+VOTES = Counter('twopc_participant_votes_total', 'Votes cast by this participant', ['outcome'])
+DECISIONS = Counter('twopc_participant_decisions_total', 'Decisions received by this participant', ['decision'])
+PENDING_TRANSACTIONS = Gauge('twopc_participant_pending_transactions', 'Prepared transactions waiting for a decision')
+
 # Shared pending transactions and metadata store reference
 pending_transactions = {}
+PENDING_TRANSACTIONS.set_function(lambda: len(pending_transactions))
+
+# Names held by prepared transactions until their decision, so two pending transactions never
+# change one file: a name a transaction writes (upload/link target, delete, move source and target)
+# is exclusive; the source of a link is only read, so links from one source do not conflict
+_reservations_lock = threading.Lock()
+_writers = {}  # name -> id of the transaction writing it
+_readers = {}  # name -> ids of the transactions reading it
+
+
+def _names_of(operation, filename, new_filename=""):
+    """(names written, names read) by one operation"""
+    if operation == "link":
+        return [new_filename], [filename]
+    return [filename] + ([new_filename] if new_filename else []), []
+
+
+def _reserve(transaction_id, written, read):
+    """Hold names for a transaction being prepared; ValueError (vote abort) if another holds one"""
+    with _reservations_lock:
+        for name in written:
+            if _writers.get(name, transaction_id) != transaction_id or _readers.get(name, set()) - {transaction_id}:
+                raise ValueError(f"{name} is being changed by another transaction")
+        for name in read:
+            if _writers.get(name, transaction_id) != transaction_id:
+                raise ValueError(f"{name} is being changed by another transaction")
+        for name in written:
+            _writers[name] = transaction_id
+        for name in read:
+            _readers.setdefault(name, set()).add(transaction_id)
+
+
+def _release(transaction_id, written, read):
+    with _reservations_lock:
+        for name in written:
+            if _writers.get(name) == transaction_id:
+                del _writers[name]
+        for name in read:
+            holders = _readers.get(name)
+            if holders is not None:
+                holders.discard(transaction_id)
+                if not holders:
+                    del _readers[name]
+
+
+def _finish_transaction(transaction_id):
+    """Drop a decided transaction and release its names"""
+    transaction = pending_transactions.pop(transaction_id)
+    _release(transaction_id, *transaction['names'])
 metadata_store = None  # Will be set by serve() function
 
 
-class MetadataVotePhaseService(twopc_pb2_grpc.VotePhaseServiceServicer):
-    """Vote phase service - prepare metadata but don't commit"""
+def _prepare_operation(operation, filename, metadata_json="", new_filename=""):
+    """Validate a single metadata operation and return what the decision phase needs to apply it"""
+    if operation == "upload":
+        # Parse metadata
+        return {
+            'operation': operation,
+            'metadata': json.loads(metadata_json)
+        }
+    if operation in ("delete", "move"):
+        if metadata_store is None or filename not in metadata_store:
+            raise FileNotFoundError(f"File not found: {filename}")
+        if operation == "delete":
+            return {
+                'operation': operation,
+                'filename': filename
+            }
+        if not new_filename:
+            raise ValueError(f"Missing target filename for move of {filename}")
+        return {
+            'operation': operation,
+            'filename': filename,
+            'new_filename': new_filename,
+            'metadata': json.loads(metadata_json) if metadata_json else {}
+        }
+    if operation == "link":
+        # a new name for existing content: the source must still hold the bytes the client hashed
+        source = metadata_store.get(filename) if metadata_store is not None else None
+        if source is None:
+            raise FileNotFoundError(f"File not found: {filename}")
+        requested = json.loads(metadata_json) if metadata_json else {}
+        expected = requested.get('sha256')
+        if not new_filename or not expected or source.get('sha256') != expected:
+            raise ValueError(f"Content of {filename} does not match the requested hash")
+        return {
+            'operation': operation,
+            'new_filename': new_filename,
+            'metadata': dict(source),
+            'modified_at': requested.get('modified_at')
+        }
+    raise ValueError(f"Unknown operation: {operation}")
+
+
+def _apply_operation(prepared, transaction_id):
+    """Execute a prepared metadata operation (decision phase, global-commit)"""
+    if metadata_store is None:
+        logger.error(f"Phase decision of Node {NODE_ID}: metadata_store is None! Cannot update metadata for transaction {transaction_id}")
+        return
+    operation = prepared['operation']
+    if operation == "upload":
+        metadata = prepared['metadata']
+        filename = metadata.get('filename')
+        if filename:
+            # overwriting bumps the version, so readers keyed on (filename, version) see the new bytes
+            previous = metadata_store.get(filename)
+            if previous:
+                metadata['version'] = previous.get('version', 1) + 1
+            # commit time, served as Last-Modified; stamped by the coordinator so replicas agree
+            metadata['modified_at'] = metadata.get('modified_at') or time.time()
+            metadata_store[filename] = metadata
+            logger.info(f"Phase decision of Node {NODE_ID} committed transaction {transaction_id} - metadata updated for {filename} (store id: {id(metadata_store)})")
+    elif operation == "delete":
+        metadata_store.pop(prepared['filename'], None)
+        logger.info(f"Phase decision of Node {NODE_ID} committed transaction {transaction_id} - metadata deleted for {prepared['filename']}")
+    elif operation == "move":
+        metadata = dict(metadata_store.pop(prepared['filename']))
+        metadata.update(prepared['metadata'])
+        metadata['filename'] = prepared['new_filename']
+        metadata_store[prepared['new_filename']] = metadata
+        logger.info(f"Phase decision of Node {NODE_ID} committed transaction {transaction_id} - metadata moved from {prepared['filename']} to {prepared['new_filename']}")
+    elif operation == "link":
+        filename = prepared['new_filename']
+        previous = metadata_store.get(filename)
+        metadata = dict(prepared['metadata'])
+        metadata.update(filename=filename, path=f"/storage/{filename}", modified_at=prepared['modified_at'] or time.time(),
+                        version=previous.get('version', 1) + 1 if previous else 1)
+        metadata_store[filename] = metadata
+        logger.info(f"Phase decision of Node {NODE_ID} committed transaction {transaction_id} - metadata for {filename} linked to existing content")
+
+
+def _observe_vote(response):
+    VOTES.labels(outcome='commit' if response.vote_commit else 'abort').inc()
+    return response
+
+
+@PHASE_LATENCY.labels(phase='vote').time()
+def handle_vote(request):
+    """Prepare the metadata operations of a VoteRequest and return this node's vote"""
+    logger.info(f"Phase vote of Node {NODE_ID} runs RPC VoteRequest called by Phase coordinator of Node {request.node_id}")
     
-    def Vote(self, request, context):
-        """Handle vote request from coordinator - prepare metadata"""
-        logger.info(f"Phase vote of Node {NODE_ID} runs RPC VoteRequest called by Phase coordinator of Node {request.node_id}")
-        
-        transaction_id = request.transaction_id
-        operation = request.operation
-        
+    transaction_id = request.transaction_id
+    operation = request.operation
+    
+    names = None
+    try:
+        if operation == "batch":
+            touched = [op.filename for op in request.operations]
+            touched += [op.new_filename for op in request.operations if op.new_filename]
+            if len(set(touched)) != len(touched):
+                raise ValueError("Batch touches the same file more than once")
+            names = ([], [])
+            for op in request.operations:
+                written, read = _names_of(op.operation, op.filename, op.new_filename)
+                names[0].extend(written)
+                names[1].extend(read)
+        else:
+            names = _names_of(operation, request.filename)
+        # Reserved before the checks below, so what they find still holds when the decision comes
+        _reserve(transaction_id, *names)
         try:
-            if operation == "upload":
-                # Parse metadata
-                metadata_json = request.metadata_json
-                metadata = json.loads(metadata_json)
-                
-                # Store transaction data for decision phase (prepare but don't commit)
-                pending_transactions[transaction_id] = {
-                    'operation': operation,
-                    'metadata': metadata
-                }
-                
-                logger.info(f"Phase vote of Node {NODE_ID} prepared transaction {transaction_id}")
-                return twopc_pb2.VoteResponse(
-                    vote_commit=True,
-                    message="Ready to commit",
-                    node_id=NODE_ID
-                )
+            if operation == "batch":
+                prepared = [
+                    _prepare_operation(op.operation, op.filename, op.metadata_json, op.new_filename)
+                    for op in request.operations
+                ]
             else:
-                return twopc_pb2.VoteResponse(
-                    vote_commit=False,
-                    message=f"Unknown operation: {operation}",
-                    node_id=NODE_ID
-                )
-        except Exception as e:
-            logger.error(f"Error in vote phase: {e}")
-            return twopc_pb2.VoteResponse(
-                vote_commit=False,
-                message=f"Error: {str(e)}",
-                node_id=NODE_ID
-            )
+                prepared = [_prepare_operation(operation, request.filename, request.metadata_json)]
+        except Exception:
+            _release(transaction_id, *names)
+            raise
+        
+        # Store transaction data for decision phase (prepare but don't commit)
+        pending_transactions[transaction_id] = {
+            'operation': operation,
+            'operations': prepared,
+            'names': names
+        }
+        
+        logger.info(f"Phase vote of Node {NODE_ID} prepared transaction {transaction_id} ({len(prepared)} operation(s))")
+        return twopc_pb2.VoteResponse(
+            vote_commit=True,
+            message="Ready to commit",
+            node_id=NODE_ID
+        )
+    except (FileNotFoundError, ValueError) as e:
+        logger.warning(f"Phase vote of Node {NODE_ID} votes abort for transaction {transaction_id}: {e}")
+        return twopc_pb2.VoteResponse(
+            vote_commit=False,
+            message=str(e),
+            node_id=NODE_ID
+        )
+    except Exception as e:
+        logger.error(f"Error in vote phase: {e}")
+        return twopc_pb2.VoteResponse(
+            vote_commit=False,
+            message=f"Error: {str(e)}",
+            node_id=NODE_ID
+        )
 
 
-class MetadataDecisionPhaseService(twopc_pb2_grpc.DecisionPhaseServiceServicer):
-    """Decision phase service - commit or abort based on coordinator decision"""
+@PHASE_LATENCY.labels(phase='decision').time()
+def handle_decision(request):
+    """Commit or abort a prepared transaction and return the outcome"""
+    decision_type = "global-commit" if request.global_commit else "global-abort"
+    DECISIONS.labels(decision=decision_type).inc()
+    logger.info(f"Phase decision of Node {NODE_ID} runs RPC DecisionRequest called by Phase decision of Node {request.node_id}")
     
-    def Decision(self, request, context):
-        """Handle decision request from coordinator - execute or abort"""
-        decision_type = "global-commit" if request.global_commit else "global-abort"
-        logger.info(f"Phase decision of Node {NODE_ID} runs RPC DecisionRequest called by Phase decision of Node {request.node_id}")
+    transaction_id = request.transaction_id
+    
+    try:
+        if transaction_id not in pending_transactions:
+            return twopc_pb2.DecisionResponse(
+                success=False,
+                message="Transaction not found",
+                node_id=NODE_ID
+            )
         
-        transaction_id = request.transaction_id
+        transaction = pending_transactions[transaction_id]
         
-        try:
-            if transaction_id not in pending_transactions:
-                return twopc_pb2.DecisionResponse(
-                    success=False,
-                    message="Transaction not found",
-                    node_id=NODE_ID
-                )
+        if request.global_commit:
+            # Commit: actually update metadata (execute original HTTP API operations), as one step
+            # for metadata snapshots (a plain dict store, as in the benchmarks, has no atomic())
+            with getattr(metadata_store, 'atomic', contextlib.nullcontext)():
+                for prepared in transaction['operations']:
+                    _apply_operation(prepared, transaction_id)
             
-            transaction = pending_transactions[transaction_id]
+            # Remove from pending and release its names
+            _finish_transaction(transaction_id)
             
-            if request.global_commit:
-                # Commit: actually update metadata (execute original HTTP API operation)
-                if transaction['operation'] == "upload":
-                    if metadata_store is not None:
-                        metadata = transaction['metadata']
-                        filename = metadata.get('filename')
-                        if filename:
-                            metadata_store[filename] = metadata
-                            logger.info(f"Phase decision of Node {NODE_ID} committed transaction {transaction_id} - metadata updated for {filename} (store id: {id(metadata_store)})")
-                    else:
-                        logger.error(f"Phase decision of Node {NODE_ID}: metadata_store is None! Cannot update metadata for transaction {transaction_id}")
-                
-                # Remove from pending
-                del pending_transactions[transaction_id]
-                
-                return twopc_pb2.DecisionResponse(
-                    success=True,
-                    message="Transaction committed",
-                    node_id=NODE_ID
-                )
-            else:
-                # Abort: discard the prepared transaction
-                logger.info(f"Phase decision of Node {NODE_ID} aborted transaction {transaction_id}")
-                del pending_transactions[transaction_id]
-                
-                return twopc_pb2.DecisionResponse(
-                    success=True,
-                    message="Transaction aborted",
-                    node_id=NODE_ID
-                )
-        except Exception as e:
-            logger.error(f"Error in decision phase: {e}")
             return twopc_pb2.DecisionResponse(
-                success=False,
-                message=f"Error: {str(e)}",
+                success=True,
+                message="Transaction committed",
+                node_id=NODE_ID
+            )
+        else:
+            # Abort: discard the prepared transaction
+            logger.info(f"Phase decision of Node {NODE_ID} aborted transaction {transaction_id}")
+            _finish_transaction(transaction_id)
+            
+            return twopc_pb2.DecisionResponse(
+                success=True,
+                message="Transaction aborted",
                 node_id=NODE_ID
             )
+    except Exception as e:
+        logger.error(f"Error in decision phase: {e}")
+        return twopc_pb2.DecisionResponse(
+            success=False,
+            message=f"Error: {str(e)}",
+            node_id=NODE_ID
+        )
+
+
+class MetadataVotePhaseService(twopc_pb2_grpc.VotePhaseServiceServicer):
+    """Vote phase service - prepare metadata but don't commit"""
+    
+    def Vote(self, request, context):
+        """Handle vote request from coordinator - prepare metadata"""
+        return _observe_vote(handle_vote(request))
+
+
+class MetadataDecisionPhaseService(twopc_pb2_grpc.DecisionPhaseServiceServicer):
+    """Decision phase service - commit or abort based on coordinator decision"""
+    
+    def Decision(self, request, context):
+        """Handle decision request from coordinator - execute or abort"""
+        return handle_decision(request)
+
+
+class MetadataHeartbeatService(twopc_pb2_grpc.HeartbeatServiceServicer):
+    """Liveness check used by the coordinator's membership view"""
+    
+    def Heartbeat(self, request, context):
+        return twopc_pb2.HeartbeatResponse(node_id=NODE_ID, pending_transactions=len(pending_transactions))
+
+
+class AsyncMetadataHeartbeatService(twopc_pb2_grpc.HeartbeatServiceServicer):
+    """Liveness check for the grpc.aio server - answered on the event loop, never queued behind disk I/O"""
+    
+    async def Heartbeat(self, request, context):
+        return twopc_pb2.HeartbeatResponse(node_id=NODE_ID, pending_transactions=len(pending_transactions))
+
+
+class AsyncMetadataVotePhaseService(twopc_pb2_grpc.VotePhaseServiceServicer):
+    """Vote phase service for the grpc.aio server - metadata work is in-memory, so it runs on the event loop"""
+    
+    async def Vote(self, request, context):
+        return _observe_vote(handle_vote(request))
+
+
+class AsyncMetadataDecisionPhaseService(twopc_pb2_grpc.DecisionPhaseServiceServicer):
+    """Decision phase service for the grpc.aio server - metadata work is in-memory, so it runs on the event loop"""
+    
+    async def Decision(self, request, context):
+        return handle_decision(request)
+
+
+async def serve_aio():
+    """Run the metadata participant as a grpc.aio server until terminated"""
+    server = grpc.aio.server(maximum_concurrent_rpcs=PARTICIPANT_MAX_CONCURRENT_RPCS)
+    
+    twopc_pb2_grpc.add_VotePhaseServiceServicer_to_server(AsyncMetadataVotePhaseService(), server)
+    twopc_pb2_grpc.add_DecisionPhaseServiceServicer_to_server(AsyncMetadataDecisionPhaseService(), server)
+    twopc_pb2_grpc.add_HeartbeatServiceServicer_to_server(AsyncMetadataHeartbeatService(), server)
+    
+    port = os.environ.get('PARTICIPANT_PORT', '6002')
+    server.add_insecure_port(f'[::]:{port}')
+    await server.start()
+    logger.info(f"Metadata participant aio server started on port {port} (max concurrent RPCs: {PARTICIPANT_MAX_CONCURRENT_RPCS or 'unlimited'})")
+    await server.wait_for_termination()
 
 
 def serve(metadata_store_ref=None):
-    """Start the metadata participant gRPC server"""
+    """Start the metadata participant gRPC server (PARTICIPANT_SERVER_MODE selects thread or aio)"""
     global metadata_store
     metadata_store = metadata_store_ref  # Set reference to FILES dict from app.py
     logger.info(f"Metadata store reference set: {metadata_store is not None}, id: {id(metadata_store) if metadata_store is not None else None}, type: {type(metadata_store)}")
     
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+    if PARTICIPANT_SERVER_MODE == 'aio':
+        # Blocks running the event loop (serve() is called from a background thread in app.py)
+        asyncio.run(serve_aio())
+        return None
+    
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=PARTICIPANT_MAX_WORKERS),
+                         maximum_concurrent_rpcs=PARTICIPANT_MAX_CONCURRENT_RPCS)
     
     vote_service = MetadataVotePhaseService()
     decision_service = MetadataDecisionPhaseService()
     
     twopc_pb2_grpc.add_VotePhaseServiceServicer_to_server(vote_service, server)
     twopc_pb2_grpc.add_DecisionPhaseServiceServicer_to_server(decision_service, server)
+    twopc_pb2_grpc.add_HeartbeatServiceServicer_to_server(MetadataHeartbeatService(), server)
     
     port = os.environ.get('PARTICIPANT_PORT', '6002')
     server.add_insecure_port(f'[::]:{port}')
@@ -1,21 +1,42 @@
 import os
 import jwt
 import datetime
+import json
+import sys
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask import Flask, request, jsonify, Response
-import requests, os
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
+from common.auth import VerifiedTokenCache
+from common.conditional import file_validators, not_modified
+from common.balancer import register_replicas
+from common.http_client import InternalHTTPClient
+from disk_cache import DiskCache
+from single_flight import SingleFlight
 
 app = Flask(__name__)
 
 METADATA_API = "http://metadata:5005" # metadata service URL
 STORAGE_API = "http://storage:5006" # storage service URL
+register_replicas(METADATA_API, os.environ.get("METADATA_ENDPOINTS")) # e.g. http://metadata-1:5005,http://metadata-2:5005
+register_replicas(STORAGE_API, os.environ.get("STORAGE_ENDPOINTS")) # e.g. http://storage-1:5006,http://storage-2:5006
+UPLOAD_API = "http://upload:5003" # upload service URL (2PC coordinator)
 SECRET_KEY = os.environ.get("SECRET_KEY", "supersecretkey") # secret key for JWT - in more secure setup, use env variable
+http_client = InternalHTTPClient() # pooled keepalive client for calls to other services
+token_cache = VerifiedTokenCache() # tokens whose signature was already verified
+cache = DiskCache() # local SLRU disk cache of hot files, validated against the metadata sha256
+flights = SingleFlight(cache=cache) # concurrent downloads of one file content share one storage fetch
+GATEWAY_SERVER_MODE = os.environ.get("GATEWAY_SERVER_MODE", "flask") # "flask" or "async" (aiohttp, see app_async.py)
 
 
 # --- JWT Helpers ---
 def decode_token(token):
+    # tokens verified before are answered from the cache until they expire
+    username = token_cache.get(token)
+    if username:
+        return username
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
+        token_cache.put(token, payload["sub"], payload.get("exp"))
         return payload["sub"]
     except Exception:
         return None
@@ -41,6 +62,19 @@ def require_auth(f):
     return wrapper
 
 
+def current_metadata(filename):
+    """
+    Committed metadata of a file ({} if unknown): its sha256 keys the cache and in-flight
+    fetches, so a re-upload never joins a fetch of the old bytes (versions start over after a
+    delete, content hashes do not); sha256/modified_at are also its validators
+    """
+    try:
+        resp = http_client.get(f"{METADATA_API}/files/{filename}")
+        return resp.json() if resp.status_code == 200 else {}
+    except Exception:
+        return {}
+
+
 # download file endpoint
 @app.route("/files/download", methods=["GET"])
 @require_auth
@@ -50,22 +84,44 @@ def download():
     if not filename:
         return jsonify({"error": "No filename provided"}), 400
 
-    # forward request to storage service via GET
+    # answer conditional requests for unchanged files with 304, without touching storage
+    metadata = current_metadata(filename)
+    sha256 = metadata.get("sha256")
+    validators = file_validators(metadata)
+    if not_modified(request.headers, metadata):
+        return Response(status=304, headers=validators)
+
+    # serve hot files from the local disk cache while the cached content is still current
+    cached = cache.open(filename, sha256)
+    if cached is not None:
+        return Response(
+            cached,
+            content_type=cached.content_type,
+            headers={"Content-Disposition": f"attachment; filename={filename}", **validators}
+        )
+
+    # forward request to storage service via GET, joining any fetch of the same content already in flight
     params = {"filename": filename}
-    resp = requests.get(f"{STORAGE_API}/download", params=params, stream=True)
+    reader = flights.join((filename, sha256),
+                          lambda: http_client.get(f"{STORAGE_API}/download", params=params, stream=True))
+    status, content_type, body, verified = reader.response()
+    # the validators describe the metadata's content: send them only with those bytes (storage commits an
+    # overwrite before metadata, so a fetch can return newer bytes than the record it was keyed on)
+    validators = validators if verified else {}
 
     # check response from storage service
-    if resp.status_code == 200:
+    if status == 200:
         return Response(
-            resp.iter_content(chunk_size=8192),
-            content_type=resp.headers.get('Content-Type'),
-            headers={"Content-Disposition": f"attachment; filename={filename}"}
+            reader,
+            content_type=content_type,
+            headers={"Content-Disposition": f"attachment; filename={filename}", **validators}
         )
     else:
+        reader.close()
         try:
-            return jsonify(resp.json()), resp.status_code
+            return jsonify(json.loads(body)), status
         except Exception:
-            return jsonify({"error": "File not found - " + resp.text}), 404
+            return jsonify({"error": "File not found - " + body.decode(errors="replace")}), 404
 
 # delete file endpoint
 @app.route("/files/delete", methods=["DELETE"])
@@ -76,14 +132,27 @@ def delete_file():
     if not filename:
         return jsonify({"error": "No filename provided"}), 400
     
-    # forward request to storage service via DELETE
+    # forward request to the upload service, which deletes file and metadata atomically via 2PC
     params = {"filename": filename}
-    resp = requests.delete(f"{STORAGE_API}/delete", params=params)
-    # check response from metadata service
+    headers = {"Authorization": request.headers.get("Authorization")}
+    resp = http_client.delete(f"{UPLOAD_API}/files/delete", params=params, headers=headers)
+    # check response from upload service
     if resp.status_code == 200:
+        cache.invalidate(filename)
         return resp.json(), resp.status_code
     else:
         return jsonify({"error": "Delete error - " + resp.text}), 500
 
+# metrics endpoint (Prometheus text format: upstream fetches, coalesced downloads, cache hit rate)
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(generate_latest(), mimetype=CONTENT_TYPE_LATEST)
+
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5004)
\ No newline at end of file
+    # app_async imports this module as "app": share it rather than load a second copy
+    sys.modules["app"] = sys.modules[__name__]
+    if GATEWAY_SERVER_MODE == "async":
+        import app_async
+        app_async.main()
+    else:
+        app.run(host="0.0.0.0", port=5004)
\ No newline at end of file
@@ -0,0 +1,157 @@
+"""
+Download service - asyncio serving mode (aiohttp)
+Same routes and auth as app.py, but each in-flight download is a coroutine instead of a
+thread: bodies are relayed from storage chunk by chunk over a pooled async client.
+Started by app.py when GATEWAY_SERVER_MODE=async
+"""
+
+import json
+
+from aiohttp import web
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
+
+from app import METADATA_API, STORAGE_API, UPLOAD_API, cache, decode_token # same settings and disk cache as the Flask app
+from common.async_http_client import AsyncInternalHTTPClient
+from common.conditional import file_validators, not_modified
+from single_flight import AsyncSingleFlight
+
+http_client = AsyncInternalHTTPClient() # pooled keepalive client for calls to other services
+flights = AsyncSingleFlight(cache=cache) # concurrent downloads of one file content share one storage fetch
+
+
+# auth decorator
+def require_auth(handler):
+    async def wrapper(request):
+        # grab the header
+        auth_header = request.headers.get("Authorization")
+
+        # check if auth header is present and valid
+        if not auth_header or not auth_header.startswith("Bearer "):
+            return web.json_response({"error": "Missing or invalid token"}, status=401)
+
+        # decode the token
+        token = auth_header.split(" ", 1)[1]
+        username = decode_token(token)
+        if not username:
+            return web.json_response({"error": "Invalid or expired token"}, status=401)
+        request["username"] = username
+        return await handler(request)
+    wrapper.__name__ = handler.__name__
+    return wrapper
+
+
+async def current_metadata(filename):
+    """Committed metadata of a file ({} if unknown): sha256 for the cache and in-flight fetches, plus validators"""
+    try:
+        resp = await http_client.get(f"{METADATA_API}/files/{filename}")
+        if resp.status != 200:
+            resp.release()
+            return {}
+        return await resp.json(content_type=None)
+    except Exception:
+        return {}
+
+
+# download file endpoint
+@require_auth
+async def download(request):
+    # get the filename from query parameters
+    filename = request.query.get("filename")
+    if not filename:
+        return web.json_response({"error": "No filename provided"}, status=400)
+
+    # answer conditional requests for unchanged files with 304, without touching storage
+    metadata = await current_metadata(filename)
+    sha256 = metadata.get("sha256")
+    validators = file_validators(metadata)
+    if not_modified(request.headers, metadata):
+        return web.Response(status=304, headers=validators)
+
+    # serve hot files from the local disk cache while the cached content is still current
+    cached = cache.open(filename, sha256)
+    if cached is not None:
+        response = web.StreamResponse(headers={
+            "Content-Type": cached.content_type or "application/octet-stream",
+            "Content-Disposition": f"attachment; filename={filename}",
+            **validators
+        })
+        await response.prepare(request)
+        try:
+            for chunk in cached:
+                await response.write(chunk)
+        finally:
+            cached.close()
+        await response.write_eof()
+        return response
+
+    # forward request to storage service via GET, joining any fetch of the same content already in flight
+    params = {"filename": filename}
+    reader = flights.join((filename, sha256),
+                          lambda: http_client.get(f"{STORAGE_API}/download", params=params))
+    status, content_type, body, verified = await reader.response()
+    # the validators describe the metadata's content: send them only with those bytes (storage commits an
+    # overwrite before metadata, so a fetch can return newer bytes than the record it was keyed on)
+    validators = validators if verified else {}
+
+    # check response from storage service
+    if status == 200:
+        response = web.StreamResponse(headers={
+            "Content-Type": content_type or "application/octet-stream",
+            "Content-Disposition": f"attachment; filename={filename}",
+            **validators
+        })
+        await response.prepare(request)
+        async for chunk in reader.chunks():
+            await response.write(chunk)
+        await response.write_eof()
+        return response
+    else:
+        reader.close()
+        try:
+            return web.json_response(json.loads(body), status=status)
+        except Exception:
+            return web.json_response({"error": "File not found - " + body.decode(errors="replace")}, status=404)
+
+# delete file endpoint
+@require_auth
+async def delete_file(request):
+    # get the filename from query parameters
+    filename = request.query.get("filename")
+    if not filename:
+        return web.json_response({"error": "No filename provided"}, status=400)
+
+    # forward request to the upload service, which deletes file and metadata atomically via 2PC
+    params = {"filename": filename}
+    headers = {"Authorization": request.headers.get("Authorization")}
+    resp = await http_client.delete(f"{UPLOAD_API}/files/delete", params=params, headers=headers)
+    # check response from upload service
+    if resp.status == 200:
+        cache.invalidate(filename)
+        return web.json_response(await resp.json(content_type=None), status=resp.status)
+    else:
+        return web.json_response({"error": "Delete error - " + await resp.text()}, status=500)
+
+# metrics endpoint (Prometheus text format: upstream fetches, coalesced downloads, cache hit rate)
+async def metrics(request):
+    return web.Response(body=generate_latest(), headers={"Content-Type": CONTENT_TYPE_LATEST})
+
+
+async def close_http_client(app):
+    await http_client.close()
+
+
+def create_app():
+    app = web.Application()
+    app.router.add_get("/files/download", download)
+    app.router.add_delete("/files/delete", delete_file)
+    app.router.add_get("/metrics", metrics)
+    app.on_cleanup.append(close_http_client)
+    return app
+
+
+def main():
+    web.run_app(create_app(), host="0.0.0.0", port=5004)
+
+
+if __name__ == "__main__":
+    main()
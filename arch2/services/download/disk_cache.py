@@ -0,0 +1,173 @@
+"""
+Local on-disk cache of hot files for the download service
+Entries are keyed on (filename, sha256 of the content): a lookup with another sha256
+drops the stale entry, so an overwrite, or a delete and re-upload (which starts the
+version over at 1), invalidates it. Eviction is segmented LRU - new entries
+go to a probation segment and move to the protected segment on their second hit, so a
+burst of one-off downloads cannot flush the files that are downloaded again and again.
+Entries are filled from completed single-flight fetches (see single_flight.py).
+"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+from prometheus_client import Counter, Gauge
+
+DOWNLOAD_CACHE_DIR = os.environ.get('DOWNLOAD_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'download-cache'))
+DOWNLOAD_CACHE_MAX_BYTES = int(os.environ.get('DOWNLOAD_CACHE_MAX_BYTES', str(1024 ** 3)))  # 0 disables the cache
+DOWNLOAD_CACHE_MAX_ENTRIES = int(os.environ.get('DOWNLOAD_CACHE_MAX_ENTRIES', '10000'))  # files kept at most
+DOWNLOAD_CACHE_PROTECTED_RATIO = float(os.environ.get('DOWNLOAD_CACHE_PROTECTED_RATIO', '0.8'))  # share of bytes for re-read files
+DOWNLOAD_CHUNK_SIZE = 64 * 1024  # bytes relayed per write
+
+# Metrics (exposed on the download service's /metrics endpoint)
+CACHE_REQUESTS = Counter('download_cache_requests_total', 'Download cache lookups', ['result'])
+CACHE_HIT_BYTES = Counter('download_cache_hit_bytes_total', 'Bytes served from the download cache instead of storage')
+CACHE_EVICTIONS = Counter('download_cache_evictions_total', 'Download cache entries removed', ['reason'])
+CACHE_BYTES = Gauge('download_cache_bytes', 'Bytes held in the download cache')
+CACHE_ENTRIES = Gauge('download_cache_entries', 'Files held in the download cache')
+CACHE_HIT_RATIO = Gauge('download_cache_hit_ratio', 'Download cache hits / lookups since start')
+
+
+class _Entry:
+    def __init__(self, filename, sha256, path, size, content_type):
+        self.filename = filename
+        self.sha256 = sha256
+        self.path = path
+        self.size = size
+        self.content_type = content_type
+
+
+class CachedFile:
+    """An open cache entry; iterate for its chunks (the file is closed at the end)"""
+
+    def __init__(self, entry):
+        self.size = entry.size
+        self.content_type = entry.content_type
+        self._file = open(entry.path, "rb")
+
+    def __iter__(self):
+        try:
+            while True:
+                chunk = self._file.read(DOWNLOAD_CHUNK_SIZE)
+                if not chunk:
+                    return
+                yield chunk
+        finally:
+            self.close()
+
+    def close(self):
+        self._file.close()
+
+
+class DiskCache:
+    """Size- and count-bounded SLRU of downloaded files, one content (sha256) per filename"""
+
+    def __init__(self, root=DOWNLOAD_CACHE_DIR, max_bytes=DOWNLOAD_CACHE_MAX_BYTES,
+                 max_entries=DOWNLOAD_CACHE_MAX_ENTRIES, protected_ratio=DOWNLOAD_CACHE_PROTECTED_RATIO):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.protected_bytes_limit = int(max_bytes * protected_ratio)
+        self._probation = OrderedDict()  # filename -> _Entry, least recently used first
+        self._protected = OrderedDict()
+        self._bytes = 0
+        self._protected_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if self.enabled:
+            # the index lives in memory, so files left by a previous process are unreachable
+            shutil.rmtree(root, ignore_errors=True)
+            os.makedirs(root, exist_ok=True)
+        CACHE_BYTES.set_function(lambda: self._bytes)
+        CACHE_ENTRIES.set_function(lambda: len(self._probation) + len(self._protected))
+        CACHE_HIT_RATIO.set_function(lambda: self.hits / (self.hits + self.misses) if self.hits + self.misses else 0)
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0 and self.max_entries > 0
+
+    def open(self, filename, sha256):
+        """CachedFile for filename holding this sha256, or None on a miss (stale content is dropped)"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._probation.get(filename) or self._protected.get(filename)
+            if entry is not None and (sha256 is None or entry.sha256 != sha256):
+                # overwritten or deleted since it was cached
+                self._remove(entry)
+                CACHE_EVICTIONS.labels(reason='stale').inc()
+                entry = None
+            if entry is None:
+                self.misses += 1
+                CACHE_REQUESTS.labels(result='miss').inc()
+                return None
+            self._touch(entry)
+            # opened under the lock, so eviction cannot unlink it first
+            cached = CachedFile(entry)
+            self.hits += 1
+        CACHE_REQUESTS.labels(result='hit').inc()
+        CACHE_HIT_BYTES.inc(entry.size)
+        return cached
+
+    def put(self, filename, sha256, path, size, content_type):
+        """Take ownership of a complete downloaded file at path; returns False if it was not kept"""
+        if not self.enabled or not sha256 or size > self.max_bytes:
+            return False
+        dest = os.path.join(self.root, f"{hashlib.sha256(filename.encode()).hexdigest()}-{sha256}")
+        try:
+            shutil.move(path, dest)
+        except OSError:
+            return False
+        with self._lock:
+            previous = self._probation.get(filename) or self._protected.get(filename)
+            if previous is not None:
+                self._remove(previous, unlink=previous.path != dest)
+            self._probation[filename] = _Entry(filename, sha256, dest, size, content_type)
+            self._bytes += size
+            self._evict()
+        return True
+
+    def invalidate(self, filename):
+        with self._lock:
+            entry = self._probation.get(filename) or self._protected.get(filename)
+            if entry is not None:
+                self._remove(entry)
+                CACHE_EVICTIONS.labels(reason='stale').inc()
+
+    def _touch(self, entry):
+        """A hit: probation entries are promoted, protected ones move to the MRU end"""
+        if entry.filename in self._protected:
+            self._protected.move_to_end(entry.filename)
+            return
+        del self._probation[entry.filename]
+        self._protected[entry.filename] = entry
+        self._protected_bytes += entry.size
+        # demote the protected segment's least recently used entries back to probation
+        while self._protected_bytes > self.protected_bytes_limit and len(self._protected) > 1:
+            _, demoted = self._protected.popitem(last=False)
+            self._protected_bytes -= demoted.size
+            self._probation[demoted.filename] = demoted
+
+    def _evict(self):
+        while self._bytes > self.max_bytes or len(self._probation) + len(self._protected) > self.max_entries:
+            segment = self._probation or self._protected
+            _, entry = next(iter(segment.items()))
+            self._remove(entry)
+            CACHE_EVICTIONS.labels(reason='capacity').inc()
+
+    def _remove(self, entry, unlink=True):
+        if self._protected.pop(entry.filename, None) is not None:
+            self._protected_bytes -= entry.size
+        else:
+            self._probation.pop(entry.filename, None)
+        self._bytes -= entry.size
+        if unlink:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
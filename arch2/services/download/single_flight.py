@@ -0,0 +1,269 @@
+"""
+Single-flight coalescing of downloads for the download service
+Concurrent downloads of the same (filename, sha256) share one upstream fetch from
+storage. The fetch is spooled to a temp file and hashed as it arrives, and every waiting
+client streams from the spool at its own pace, so a hot object costs storage one stream
+however many clients are reading it. Responses start once the fetch is complete: only then
+is it known whether the bytes are the ones the key's sha256 names (storage commits an
+overwrite before metadata does, so a fetch can race it), and only verified bodies are sent
+with validators or cached. A flight ends with its fetch: later requests start a new one, or
+are served from the disk cache once a verified fetch has been handed over to it (see disk_cache.py).
+"""
+
+import asyncio
+import hashlib
+import os
+import tempfile
+import threading
+
+from prometheus_client import Counter, Gauge
+
+DOWNLOAD_SPOOL_DIR = os.environ.get('DOWNLOAD_SPOOL_DIR', tempfile.gettempdir())  # where in-flight downloads are spooled
+DOWNLOAD_CHUNK_SIZE = 64 * 1024  # bytes relayed per write
+
+# Metrics (exposed on the download service's /metrics endpoint)
+UPSTREAM_FETCHES = Counter('download_upstream_fetches_total', 'Downloads fetched from storage (one per flight)')
+COALESCED_REQUESTS = Counter('download_coalesced_requests_total', 'Downloads that joined a fetch already in flight')
+FLIGHTS_IN_PROGRESS = Gauge('download_flights_in_progress', 'Upstream fetches from storage in progress')
+
+
+class _Flight:
+    """One upstream fetch: response status/headers plus the spool file its body is written to"""
+
+    def __init__(self, spool_dir, cond, expected_sha256):
+        fd, self.path = tempfile.mkstemp(prefix="download-", dir=spool_dir)
+        self.spool = os.fdopen(fd, "wb")
+        self.cond = cond
+        self.status = None
+        self.content_type = None
+        self.body = b""  # upstream body for non-200 responses
+        self.size = 0  # bytes written to the spool so far
+        self.expected_sha256 = expected_sha256  # from the metadata record the download was keyed on
+        self.digest = hashlib.sha256()  # of the bytes spooled
+        self.sha256 = None  # digest of a complete body
+        self.done = False
+        self.error = None
+        self.task = None
+
+    def write(self, chunk):
+        self.spool.write(chunk)
+        self.spool.flush()
+        self.digest.update(chunk)
+
+    def complete(self):
+        """The fetch ended: record the digest of a complete 200 body"""
+        if self.status == 200 and self.error is None:
+            self.sha256 = self.digest.hexdigest()
+
+    @property
+    def verified(self):
+        """Whether the complete body is the content the metadata record describes"""
+        return self.sha256 is not None and self.sha256 == self.expected_sha256
+
+    def finish(self, key, cache):
+        """Hand a verified body to the cache, else drop the spool"""
+        # readers hold their own descriptors, so the spool can be moved or removed as soon as the fetch ends
+        self.spool.close()
+        filename, sha256 = key
+        if cache is not None and self.verified and \
+                cache.put(filename, sha256, self.path, self.size, self.content_type):
+            return
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class SingleFlight:
+    """
+    Coalesces blocking downloads (Flask mode); keys are (filename, sha256) and fetch()
+    returns a streamed requests.Response. Complete fetches are offered to cache
+    """
+
+    def __init__(self, spool_dir=DOWNLOAD_SPOOL_DIR, cache=None):
+        self.spool_dir = spool_dir
+        self.cache = cache
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def join(self, key, fetch):
+        """FlightReader for key; the first caller starts fetch() on a background thread"""
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight(self.spool_dir, threading.Condition(), key[1])
+                self._flights[key] = flight
+            # opened under the lock, before the fetch can finish and unlink the spool
+            reader = FlightReader(flight)
+        if leader:
+            UPSTREAM_FETCHES.inc()
+            flight.task = threading.Thread(target=self._fetch, args=(key, flight, fetch), daemon=True)
+            flight.task.start()
+        else:
+            COALESCED_REQUESTS.inc()
+        return reader
+
+    def _fetch(self, key, flight, fetch):
+        FLIGHTS_IN_PROGRESS.inc()
+        try:
+            resp = fetch()
+            try:
+                body = resp.content if resp.status_code != 200 else b""
+                with flight.cond:
+                    flight.status = resp.status_code
+                    flight.content_type = resp.headers.get('Content-Type')
+                    flight.body = body
+                    flight.cond.notify_all()
+                if resp.status_code == 200:
+                    for chunk in resp.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        flight.write(chunk)
+                        with flight.cond:
+                            flight.size += len(chunk)
+                            flight.cond.notify_all()
+            finally:
+                resp.close()
+        except Exception as e:
+            flight.error = e
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.complete()
+            with flight.cond:
+                flight.done = True
+                flight.cond.notify_all()
+            flight.finish(key, self.cache)
+            FLIGHTS_IN_PROGRESS.dec()
+
+
+class FlightReader:
+    """One client's view of a flight: the upstream response, then the body read from the spool"""
+
+    def __init__(self, flight):
+        self.flight = flight
+        self._file = open(flight.path, "rb")
+
+    def response(self):
+        """
+        (status, content_type, body, verified) once the fetch is complete; body is only set for
+        non-200, verified says whether a 200 body matches the key's sha256
+        """
+        flight = self.flight
+        with flight.cond:
+            flight.cond.wait_for(lambda: flight.done)
+        if flight.error is not None:
+            self.close()
+            raise flight.error
+        return flight.status, flight.content_type, flight.body, flight.verified
+
+    def __iter__(self):
+        flight = self.flight
+        offset = 0
+        try:
+            while True:
+                with flight.cond:
+                    flight.cond.wait_for(lambda: flight.size > offset or flight.done)
+                    size, done, error = flight.size, flight.done, flight.error
+                while offset < size:
+                    chunk = self._file.read(min(DOWNLOAD_CHUNK_SIZE, size - offset))
+                    offset += len(chunk)
+                    yield chunk
+                if done:
+                    if error:
+                        raise error
+                    return
+        finally:
+            self.close()
+
+    def close(self):
+        self._file.close()
+
+
+class AsyncSingleFlight:
+    """Coalesces downloads on the event loop (async mode); fetch() is a coroutine returning an aiohttp response"""
+
+    def __init__(self, spool_dir=DOWNLOAD_SPOOL_DIR, cache=None):
+        self.spool_dir = spool_dir
+        self.cache = cache
+        self._flights = {}
+
+    def join(self, key, fetch):
+        """AsyncFlightReader for key; the first caller starts fetch() as a task"""
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight(self.spool_dir, asyncio.Condition(), key[1])
+            self._flights[key] = flight
+            UPSTREAM_FETCHES.inc()
+            flight.task = asyncio.get_running_loop().create_task(self._fetch(key, flight, fetch))
+        else:
+            COALESCED_REQUESTS.inc()
+        return AsyncFlightReader(flight)
+
+    async def _fetch(self, key, flight, fetch):
+        FLIGHTS_IN_PROGRESS.inc()
+        try:
+            resp = await fetch()
+            try:
+                body = await resp.read() if resp.status != 200 else b""
+                async with flight.cond:
+                    flight.status = resp.status
+                    flight.content_type = resp.headers.get('Content-Type')
+                    flight.body = body
+                    flight.cond.notify_all()
+                if resp.status == 200:
+                    async for chunk in resp.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                        flight.write(chunk)
+                        async with flight.cond:
+                            flight.size += len(chunk)
+                            flight.cond.notify_all()
+            finally:
+                resp.release()
+        except Exception as e:
+            flight.error = e
+        finally:
+            self._flights.pop(key, None)
+            flight.complete()
+            async with flight.cond:
+                flight.done = True
+                flight.cond.notify_all()
+            flight.finish(key, self.cache)
+            FLIGHTS_IN_PROGRESS.dec()
+
+
+class AsyncFlightReader:
+    """Async counterpart of FlightReader"""
+
+    def __init__(self, flight):
+        self.flight = flight
+        self._file = open(flight.path, "rb")
+
+    async def response(self):
+        flight = self.flight
+        async with flight.cond:
+            await flight.cond.wait_for(lambda: flight.done)
+        if flight.error is not None:
+            self.close()
+            raise flight.error
+        return flight.status, flight.content_type, flight.body, flight.verified
+
+    async def chunks(self):
+        flight = self.flight
+        offset = 0
+        try:
+            while True:
+                async with flight.cond:
+                    await flight.cond.wait_for(lambda: flight.size > offset or flight.done)
+                    size, done, error = flight.size, flight.done, flight.error
+                while offset < size:
+                    chunk = self._file.read(min(DOWNLOAD_CHUNK_SIZE, size - offset))
+                    offset += len(chunk)
+                    yield chunk
+                if done:
+                    if error:
+                        raise error
+                    return
+        finally:
+            self.close()
+
+    def close(self):
+        self._file.close()
@@ -0,0 +1,242 @@
+"""
+Admission control for the upload service's 2PC routes
+- Global and per-user limits on transactions in flight
+- Requests over a limit wait in a per-user queue; freed slots are handed out
+  round-robin across users, so one user's parallel script cannot starve everyone else
+- A per-user byte-rate token bucket on upload bodies
+Requests that cannot be queued, wait too long or find their byte bucket empty are
+rejected with AdmissionRejected (the routes answer 429 + Retry-After)
+"""
+
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import deque
+
+from prometheus_client import Counter, Gauge, Histogram
+
+UPLOAD_MAX_INFLIGHT = int(os.environ.get('UPLOAD_MAX_INFLIGHT', '32'))  # 2PC transactions in flight, all users
+UPLOAD_MAX_INFLIGHT_PER_USER = int(os.environ.get('UPLOAD_MAX_INFLIGHT_PER_USER', '4'))  # in flight for one user
+UPLOAD_MAX_QUEUED_PER_USER = int(os.environ.get('UPLOAD_MAX_QUEUED_PER_USER', '16'))  # waiting for one user
+UPLOAD_MAX_QUEUED = int(os.environ.get('UPLOAD_MAX_QUEUED', '256'))  # waiting, all users
+UPLOAD_QUEUE_TIMEOUT = float(os.environ.get('UPLOAD_QUEUE_TIMEOUT', '30'))  # seconds a request may wait for a slot
+UPLOAD_USER_BYTES_PER_SEC = float(os.environ.get('UPLOAD_USER_BYTES_PER_SEC', str(64 * 1024 * 1024)))  # 0 disables
+UPLOAD_USER_BURST_BYTES = float(os.environ.get('UPLOAD_USER_BURST_BYTES', str(256 * 1024 * 1024)))  # bucket size
+UPLOAD_RETRY_AFTER = int(os.environ.get('UPLOAD_RETRY_AFTER', '1'))  # seconds sent with 429 for in-flight limits
+
+# Metrics (exposed on the upload service's /metrics endpoint)
+ADMISSIONS = Counter('gateway_admission_total', 'Admission decisions for 2PC routes', ['outcome'])
+QUEUE_WAIT = Histogram('gateway_admission_wait_seconds', 'Time requests waited for an in-flight slot')
+INFLIGHT = Gauge('gateway_admission_inflight', '2PC route requests holding an in-flight slot')
+QUEUED = Gauge('gateway_admission_queued', '2PC route requests waiting for an in-flight slot')
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, message, retry_after=UPLOAD_RETRY_AFTER):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    def __init__(self, user, notify):
+        self.user = user
+        self.notify = notify
+        self.granted = False
+
+
+class Slot:
+    """An in-flight slot; release() is idempotent"""
+
+    def __init__(self, admission, user):
+        self._admission = admission
+        self.user = user
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._admission._release(self.user)
+
+
+class UploadAdmission:
+    def __init__(self, max_inflight=UPLOAD_MAX_INFLIGHT, max_inflight_per_user=UPLOAD_MAX_INFLIGHT_PER_USER,
+                 max_queued_per_user=UPLOAD_MAX_QUEUED_PER_USER, max_queued=UPLOAD_MAX_QUEUED,
+                 queue_timeout=UPLOAD_QUEUE_TIMEOUT, bytes_per_sec=UPLOAD_USER_BYTES_PER_SEC,
+                 burst_bytes=UPLOAD_USER_BURST_BYTES):
+        self.max_inflight = max_inflight
+        self.max_inflight_per_user = max_inflight_per_user
+        self.max_queued_per_user = max_queued_per_user
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.bytes_per_sec = bytes_per_sec
+        self.burst_bytes = burst_bytes
+        self._lock = threading.Lock()
+        self._inflight = 0
+        self._inflight_by_user = {}
+        self._queues = {}  # user -> deque of _Waiter
+        self._turns = deque()  # users with waiters, in round-robin order
+        self._queued = 0
+        self._buckets = {}  # user -> [tokens, last refill]
+        INFLIGHT.set_function(lambda: self._inflight)
+        QUEUED.set_function(lambda: self._queued)
+
+    # --- byte-rate token bucket ---
+    def _bucket(self, user):
+        now = time.monotonic()
+        bucket = self._buckets.get(user)
+        if bucket is None:
+            if len(self._buckets) > 10000:
+                # forget users whose bucket has refilled completely
+                self._buckets = {u: b for u, b in self._buckets.items()
+                                 if b[0] + (now - b[1]) * self.bytes_per_sec < self.burst_bytes}
+            bucket = self._buckets[user] = [self.burst_bytes, now]
+        bucket[0] = min(self.burst_bytes, bucket[0] + (now - bucket[1]) * self.bytes_per_sec)
+        bucket[1] = now
+        return bucket
+
+    def _check_bytes(self, user):
+        """Reject while the user's bucket is in debt (bytes are debited as they stream, see metered())"""
+        if self.bytes_per_sec <= 0:
+            return
+        with self._lock:
+            tokens = self._bucket(user)[0]
+        if tokens <= 0:
+            ADMISSIONS.labels(outcome='rejected_bytes').inc()
+            raise AdmissionRejected("Upload byte rate limit exceeded",
+                                    retry_after=max(1, math.ceil(-tokens / self.bytes_per_sec)))
+
+    def metered(self, user, chunks):
+        """Iterate chunks, debiting each from the user's byte bucket"""
+        for chunk in chunks:
+            if self.bytes_per_sec > 0:
+                with self._lock:
+                    self._bucket(user)[0] -= len(chunk)
+            yield chunk
+
+    async def metered_async(self, user, chunks):
+        """metered() for an async chunk iterator"""
+        async for chunk in chunks:
+            if self.bytes_per_sec > 0:
+                with self._lock:
+                    self._bucket(user)[0] -= len(chunk)
+            yield chunk
+
+    # --- in-flight slots ---
+    def _can_run(self, user):
+        return self._inflight < self.max_inflight and \
+            self._inflight_by_user.get(user, 0) < self.max_inflight_per_user
+
+    def _grant(self, user):
+        self._inflight += 1
+        self._inflight_by_user[user] = self._inflight_by_user.get(user, 0) + 1
+
+    def _enqueue(self, user, notify):
+        """Grant a slot now or queue a waiter; must be called with the lock held"""
+        waiter = _Waiter(user, notify)
+        if user not in self._queues and self._can_run(user):
+            self._grant(user)
+            waiter.granted = True
+            return waiter
+        queue = self._queues.get(user)
+        if self._queued >= self.max_queued or (queue is not None and len(queue) >= self.max_queued_per_user):
+            ADMISSIONS.labels(outcome='rejected_queue_full').inc()
+            raise AdmissionRejected("Too many uploads in progress")
+        if queue is None:
+            queue = self._queues[user] = deque()
+            self._turns.append(user)
+        queue.append(waiter)
+        self._queued += 1
+        return waiter
+
+    def _dispatch(self):
+        """Hand free slots to waiting users round-robin; returns the waiters to notify (lock held)"""
+        granted = []
+        skipped = 0
+        while self._turns and self._inflight < self.max_inflight and skipped < len(self._turns):
+            user = self._turns[0]
+            self._turns.rotate(-1)
+            if not self._can_run(user):
+                skipped += 1
+                continue
+            skipped = 0
+            queue = self._queues[user]
+            waiter = queue.popleft()
+            self._queued -= 1
+            if not queue:
+                del self._queues[user]
+                self._turns.remove(user)
+            self._grant(user)
+            waiter.granted = True
+            granted.append(waiter)
+        return granted
+
+    def _release(self, user):
+        with self._lock:
+            self._inflight -= 1
+            remaining = self._inflight_by_user[user] - 1
+            if remaining:
+                self._inflight_by_user[user] = remaining
+            else:
+                del self._inflight_by_user[user]
+            granted = self._dispatch()
+        for waiter in granted:
+            waiter.notify()
+
+    def _abandon(self, waiter):
+        """A waiter timed out: drop it from its queue, or return True if it was granted meanwhile"""
+        with self._lock:
+            if waiter.granted:
+                return True
+            queue = self._queues[waiter.user]
+            queue.remove(waiter)
+            self._queued -= 1
+            if not queue:
+                del self._queues[waiter.user]
+                self._turns.remove(waiter.user)
+            return False
+
+    def _admitted(self, waiter, start):
+        ADMISSIONS.labels(outcome='admitted').inc()
+        QUEUE_WAIT.observe(time.perf_counter() - start)
+        return Slot(self, waiter.user)
+
+    def acquire(self, user, check_bytes=False):
+        """Block until user may start a transaction; returns a Slot or raises AdmissionRejected"""
+        if check_bytes:
+            self._check_bytes(user)
+        start = time.perf_counter()
+        event = threading.Event()
+        with self._lock:
+            waiter = self._enqueue(user, event.set)
+        if not waiter.granted and not event.wait(self.queue_timeout) and not self._abandon(waiter):
+            ADMISSIONS.labels(outcome='rejected_timeout').inc()
+            raise AdmissionRejected("Timed out waiting for an upload slot")
+        return self._admitted(waiter, start)
+
+    async def acquire_async(self, user, check_bytes=False):
+        """acquire() for the event loop: waits without blocking it"""
+        if check_bytes:
+            self._check_bytes(user)
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def notify():
+            loop.call_soon_threadsafe(lambda: granted.done() or granted.set_result(True))
+        with self._lock:
+            waiter = self._enqueue(user, notify)
+        if not waiter.granted:
+            try:
+                await asyncio.wait_for(asyncio.shield(granted), self.queue_timeout)
+            except asyncio.TimeoutError:
+                if not self._abandon(waiter):
+                    ADMISSIONS.labels(outcome='rejected_timeout').inc()
+                    raise AdmissionRejected("Timed out waiting for an upload slot")
+            except asyncio.CancelledError:
+                # client went away while queued: give back a slot granted meanwhile
+                if self._abandon(waiter):
+                    Slot(self, user).release()
+                raise
+        return self._admitted(waiter, start)
@@ -2,16 +2,31 @@ import os
 import jwt
 import datetime
 import logging
-from werkzeug.security import generate_password_hash, check_password_hash
-from flask import Flask, request, jsonify, Response
+import sys
 import requests
+from flask import Flask, request, jsonify, Response
+from common.auth import HashPoolFull, PasswordHasher, UserCache, VerifiedTokenCache
+from common.balancer import register_replicas, replicas
+from common.http_client import InternalHTTPClient
+from common.streaming import MultipartBody, MultipartFileReader, Sha256Verifier
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
+from admission import AdmissionRejected, UploadAdmission
 
 app = Flask(__name__)
 logger = logging.getLogger(__name__)
 
 METADATA_API = "http://metadata:5005" # metadata service URL
 STORAGE_API = "http://storage:5006" # storage service URL
+register_replicas(METADATA_API, os.environ.get("METADATA_ENDPOINTS")) # e.g. http://metadata-1:5005,http://metadata-2:5005
+register_replicas(STORAGE_API, os.environ.get("STORAGE_ENDPOINTS")) # e.g. http://storage-1:5006,http://storage-2:5006
+SIGNUP_RETRIES = int(os.environ.get("SIGNUP_RETRIES", "2")) # extra attempts per metadata replica before a signup fails
 SECRET_KEY = os.environ.get("SECRET_KEY", "supersecretkey") # secret key for JWT - in more secure setup, use env variable
+http_client = InternalHTTPClient() # pooled keepalive client for calls to other services
+token_cache = VerifiedTokenCache() # tokens whose signature was already verified
+password_hasher = PasswordHasher() # bounded pool for password hashing, sheds login storms
+user_cache = UserCache() # short-TTL cache of user records looked up at login
+admission = UploadAdmission() # per-user/global in-flight limits, fair queueing and byte bucket for 2PC routes
+GATEWAY_SERVER_MODE = os.environ.get("GATEWAY_SERVER_MODE", "flask") # "flask" or "async" (aiohttp, see app_async.py)
 
 
 # --- JWT Helpers ---
@@ -25,8 +40,13 @@ def encode_token(username):
     return jwt.encode(payload, SECRET_KEY, algorithm="HS256")
 
 def decode_token(token):
+    # tokens verified before are answered from the cache until they expire
+    username = token_cache.get(token)
+    if username:
+        return username
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
+        token_cache.put(token, payload["sub"], payload.get("exp"))
         return payload["sub"]
     except Exception:
         return None
@@ -44,22 +64,42 @@ def signup():
     if not username or not password:
         return jsonify({"error": "Missing username or password"}), 400
 
-    # hash password before sending to metadata service
-    hashed_password = generate_password_hash(password)
     try:
-        # send to metadata service
-        resp = requests.post(f"{METADATA_API}/users", json={
-            "username": username,
-            "password": hashed_password
-        })
+        # hash password before sending to metadata service (on the bounded hash pool)
+        hashed_password = password_hasher.generate(password)
+        # send to metadata service: every replica keeps its own user table, so each one must take the user
+        metadata_apis = replicas(METADATA_API)
+        statuses = {}
+        for metadata_api in metadata_apis:
+            for attempt in range(SIGNUP_RETRIES + 1):
+                try:
+                    resp = http_client.post(f"{metadata_api}/users", json={
+                        "username": username,
+                        "password": hashed_password
+                    })
+                except requests.exceptions.RequestException:
+                    continue
+                statuses[metadata_api] = resp.status_code
+                if resp.status_code in (201, 409):
+                    break
 
         # check response from metadata service
-        if resp.status_code == 201:
-            return jsonify({"message": "Signup successful!"}), 201
-        elif resp.status_code == 409:
+        if any(statuses.get(metadata_api) not in (201, 409) for metadata_api in metadata_apis):
+            # some replicas may have the user now: a retry with the same password completes the signup
+            return jsonify({"error": "Signup did not reach every metadata replica, retry it"}), 503
+        if 201 not in statuses.values():
             return jsonify({"error": "Username already exists"}), 409
-        else:
-            return jsonify({"error": "Metadata service error"}), 500
+        # a replica that already had the user kept it from an earlier partial signup only if the password matches
+        for metadata_api, status in statuses.items():
+            if status == 409:
+                resp = http_client.get(f"{metadata_api}/users/{username}")
+                stored_hash = resp.json().get("password") if resp.status_code == 200 else None
+                if not stored_hash or not password_hasher.check(stored_hash, password):
+                    return jsonify({"error": "Username already exists"}), 409
+        return jsonify({"message": "Signup successful!"}), 201
+    except HashPoolFull as e:
+        # hash pool saturated (login storm): shed instead of queueing
+        return jsonify({"error": str(e)}), 503, {"Retry-After": str(e.retry_after)}
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -75,23 +115,29 @@ def login():
         return jsonify({"error": "Missing username or password"}), 400
 
     try:
-        # fetch user from metadata service
-        resp = requests.get(f"{METADATA_API}/users/{username}")
+        # fetch user from metadata service (records are reused for AUTH_USER_CACHE_TTL seconds)
+        user = user_cache.get(username)
+        if user is None:
+            resp = http_client.get(f"{METADATA_API}/users/{username}")
 
-        # check the response
-        if resp.status_code != 200:
-            return jsonify({"error": "Invalid credentials"}), 401
+            # check the response
+            if resp.status_code != 200:
+                return jsonify({"error": "Invalid credentials"}), 401
+            user = resp.json()
+            user_cache.put(username, user)
 
-        # if user is found, check password
-        user = resp.json()
+        # if user is found, check password (on the bounded hash pool)
         stored_hash = user.get("password")
-        if stored_hash and check_password_hash(stored_hash, password):
+        if stored_hash and password_hasher.check(stored_hash, password):
             token = encode_token(username)
 
             # store the token in the user's session
             return jsonify({"token": token})
         else:
             return jsonify({"error": "Invalid credentials"}), 401
+    except HashPoolFull as e:
+        # hash pool saturated (login storm): shed instead of queueing
+        return jsonify({"error": str(e)}), 503, {"Retry-After": str(e.retry_after)}
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -115,35 +161,59 @@ def require_auth(f):
     wrapper.__name__ = f.__name__
     return wrapper
 
+# admission decorator (goes under require_auth): wait for a fair share of the in-flight slots, or 429
+def admission_control(check_bytes=False):
+    def decorator(f):
+        def wrapper(*args, **kwargs):
+            try:
+                slot = admission.acquire(request.username, check_bytes=check_bytes)
+            except AdmissionRejected as e:
+                return jsonify({"error": str(e)}), 429, {"Retry-After": str(e.retry_after)}
+            try:
+                return f(*args, **kwargs)
+            finally:
+                slot.release()
+        wrapper.__name__ = f.__name__
+        return wrapper
+    return decorator
+
+def load_coordinator():
+    """Import the 2PC coordinator lazily (raises ImportError if gRPC code is not available)"""
+    import sys
+    sys.path.insert(0, '/app')
+    sys.path.insert(0, '/app/..')
+    from twopc_coordinator import TwoPhaseCommitCoordinator
+    return TwoPhaseCommitCoordinator
+
 # upload file endpoint (uses 2PC to verify all nodes are alive, then executes original HTTP operations)
+# the multipart body is read in UPLOAD_CHUNK_SIZE chunks and streamed on, never held whole in memory;
+# a "sha256" form field after the file part is checked against the bytes before the transaction commits
 @app.route("/files/upload", methods=["POST"])
 @require_auth
+@admission_control(check_bytes=True)
 def upload():
-    """Upload file with 2PC: verify all nodes are alive via gRPC, then execute original HTTP operations"""
-    if "file" not in request.files:
+    """Upload file with 2PC: stream the file to the storage nodes' prepare, then commit on all nodes"""
+    try:
+        file = MultipartFileReader(request.stream, request.mimetype_params.get("boundary"))
+    except ValueError:
         return jsonify({"error": "No file part"}), 400
-    
-    file = request.files["file"]
     filename = file.filename
-    file_data = file.read()
+    verified = Sha256Verifier(file, lambda: file.fields.get("sha256"))
     
     try:
-        import sys
-        sys.path.insert(0, '/app')
-        sys.path.insert(0, '/app/..')
-        from twopc_coordinator import TwoPhaseCommitCoordinator
+        TwoPhaseCommitCoordinator = load_coordinator()
         
-        # Prepare metadata
+        # Prepare metadata (the coordinator adds size and sha256 to the committed record once the file has been streamed)
         metadata = {
             "filename": filename,
             "path": f"/storage/{filename}",
-            "size": len(file_data),
             "version": 1
         }
         
-        # Execute 2PC: verify nodes alive, then execute original HTTP operations
+        # Execute 2PC: stream file to storage nodes in the vote phase, then commit on all nodes
         coordinator = TwoPhaseCommitCoordinator()
-        result = coordinator.execute_2pc_upload(filename, file_data, metadata)
+        chunks = admission.metered(request.username, verified)
+        result = coordinator.execute_2pc_upload_stream(filename, chunks, metadata)
         
         if result['success']:
             # 2PC validated nodes and operations executed in decision phase
@@ -151,8 +221,15 @@ def upload():
                 "message": "File uploaded successfully using 2PC",
                 "transaction_id": result['transaction_id'],
                 "filename": filename,
-                "path": metadata["path"]
+                "path": metadata["path"],
+                "sha256": verified.sha256
             }), 201
+        elif verified.mismatch:
+            return jsonify({
+                "error": "Upload checksum mismatch",
+                "message": result['message'],
+                "transaction_id": result['transaction_id']
+            }), 422
         else:
             return jsonify({
                 "error": "2PC transaction failed",
@@ -161,11 +238,10 @@ def upload():
             }), 500
             
     except ImportError as e:
-        # Fallback to original behavior if 2PC not available
+        # Fallback to original behavior if 2PC not available (file re-encoded and streamed to storage)
         logger.warning(f"2PC not available: {e}, using original upload")
-        file.seek(0)
-        files = {'file': (filename, file.stream, file.mimetype)}
-        resp = requests.post(f"{STORAGE_API}/upload", files=files)
+        body = MultipartBody("file", filename, file.mimetype, admission.metered(request.username, verified))
+        resp = http_client.post(f"{STORAGE_API}/upload", data=body, headers={"Content-Type": body.content_type})
         if resp.status_code != 200:
             return jsonify({"error": "Storage error"}), 500
         try:
@@ -175,18 +251,164 @@ def upload():
     except Exception as e:
         return jsonify({"error": f"Upload failed: {str(e)}"}), 500
 
+# upload-by-hash endpoint: the client sends the sha256 of its file before the bytes; if that content is
+# already stored, the new name is linked to it in one 2PC transaction and nothing is transferred
+# body: {"filename": "a.txt", "sha256": "<hex digest>"}; 404 means "unknown content, upload the file"
+@app.route("/files/upload-by-hash", methods=["POST"])
+@require_auth
+@admission_control()
+def upload_by_hash():
+    data = request.get_json(silent=True) or {}
+    filename, sha256 = data.get("filename"), str(data.get("sha256", "")).lower()
+    if not filename or len(sha256) != 64:
+        return jsonify({"error": "Missing filename or sha256"}), 400
+
+    resp = http_client.get(f"{METADATA_API}/hashes/{sha256}", params={"filename": filename})
+    if resp.status_code == 404:
+        return jsonify({"error": "Content not found"}), 404
+    if resp.status_code != 200:
+        return jsonify({"error": "Metadata error - " + resp.text}), 500
+    source = resp.json()["filename"]
+    if source == filename:
+        return jsonify({"message": "File already up to date", "filename": filename,
+                        "path": f"/storage/{filename}"}), 200
+
+    try:
+        result = load_coordinator()().execute_2pc_link(source, filename, sha256)
+        if result['success']:
+            return jsonify({
+                "message": "File uploaded by content hash using 2PC",
+                "transaction_id": result['transaction_id'],
+                "filename": filename,
+                "path": f"/storage/{filename}",
+                "linked_to": source
+            }), 201
+        else:
+            # e.g. the source was deleted or overwritten after the lookup: the client uploads the bytes instead
+            return jsonify({
+                "error": "2PC transaction failed",
+                "message": result['message'],
+                "transaction_id": result['transaction_id']
+            }), 409
+    except ImportError as e:
+        return jsonify({"error": f"2PC not available: {e}"}), 501
+    except Exception as e:
+        return jsonify({"error": f"Upload by hash failed: {str(e)}"}), 500
+
+# delete file endpoint (uses 2PC so file bytes and metadata are removed atomically)
+@app.route("/files/delete", methods=["DELETE"])
+@require_auth
+@admission_control()
+def delete_file():
+    filename = request.args.get("filename")
+    if not filename:
+        return jsonify({"error": "No filename provided"}), 400
+
+    try:
+        TwoPhaseCommitCoordinator = load_coordinator()
+    except ImportError as e:
+        # Fallback to original behavior if 2PC not available
+        logger.warning(f"2PC not available: {e}, using original delete")
+        resp = http_client.delete(f"{STORAGE_API}/delete", params={"filename": filename})
+        if resp.status_code == 200:
+            return resp.json(), resp.status_code
+        return jsonify({"error": "Delete error - " + resp.text}), 500
+
+    try:
+        result = TwoPhaseCommitCoordinator().execute_2pc_delete(filename)
+        if result['success']:
+            return jsonify({
+                "status": "deleted",
+                "transaction_id": result['transaction_id'],
+                "filename": filename
+            }), 200
+        else:
+            return jsonify({
+                "error": "2PC transaction failed",
+                "message": result['message'],
+                "transaction_id": result['transaction_id']
+            }), 500
+    except Exception as e:
+        return jsonify({"error": f"Delete failed: {str(e)}"}), 500
+
+# batch endpoint: delete/move many files as one atomic 2PC transaction
+# body: {"operations": [{"operation": "delete", "filename": "a.txt"},
+#                       {"operation": "move", "filename": "b.txt", "new_filename": "c.txt"}]}
+@app.route("/files/batch", methods=["POST"])
+@require_auth
+@admission_control()
+def batch():
+    data = request.get_json(silent=True) or {}
+    operations = data.get("operations")
+    if not operations or not isinstance(operations, list):
+        return jsonify({"error": "Missing operations list"}), 400
+    for op in operations:
+        if not isinstance(op, dict) or op.get("operation") not in ("delete", "move") or not op.get("filename"):
+            return jsonify({"error": f"Invalid operation: {op}"}), 400
+        if op["operation"] == "move" and not op.get("new_filename"):
+            return jsonify({"error": f"Move requires new_filename: {op}"}), 400
+
+    try:
+        TwoPhaseCommitCoordinator = load_coordinator()
+        result = TwoPhaseCommitCoordinator().execute_2pc_batch(operations)
+        if result['success']:
+            return jsonify({
+                "status": "committed",
+                "transaction_id": result['transaction_id'],
+                "operations": len(operations)
+            }), 200
+        else:
+            return jsonify({
+                "error": "2PC transaction failed",
+                "message": result['message'],
+                "transaction_id": result['transaction_id']
+            }), 500
+    except ImportError as e:
+        return jsonify({"error": f"2PC not available: {e}"}), 501
+    except Exception as e:
+        return jsonify({"error": f"Batch failed: {str(e)}"}), 500
+
 # list files endpoint
 @app.route("/files", methods=["GET"])
 @require_auth
 def list_files():
-    # forward request to metadata service via GET
-    resp = requests.get(f"{METADATA_API}/files")
+    # forward request to metadata service via GET (with the client's If-None-Match, so an unchanged listing is a 304)
+    # ?since=<cursor> asks for a delta listing, see metadata's GET /files
+    # pinned to one metadata replica: cursors (epoch:seq) and listing ETags differ between replicas
+    headers = {"If-None-Match": request.headers["If-None-Match"]} if "If-None-Match" in request.headers else {}
+    params = {"since": request.args["since"]} if "since" in request.args else {}
+    resp = http_client.get(f"{METADATA_API}/files", headers=headers, params=params, pinned=True)
 
     # check response from metadata service
-    if resp.status_code == 200:
-        return resp.json(), resp.status_code
+    validators = {"ETag": resp.headers["ETag"]} if "ETag" in resp.headers else {}
+    if resp.status_code == 304:
+        return Response(status=304, headers=validators)
+    elif resp.status_code == 200:
+        return Response(resp.content, status=200, mimetype="application/json", headers=validators)
     else:
         return jsonify({"error": "Metadata error - " + resp.text}), 500
 
+# metrics endpoint (Prometheus text format: 2PC phase latencies, votes, timeouts, in-flight transactions)
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(generate_latest(), mimetype=CONTENT_TYPE_LATEST)
+
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5003)
\ No newline at end of file
+    # app_async and file_service import this module as "app": share it rather than load a second copy
+    sys.modules["app"] = sys.modules[__name__]
+    try:
+        # register the coordinator's metrics before the first upload
+        load_coordinator()
+    except ImportError as e:
+        logger.warning(f"2PC not available: {e}")
+    try:
+        # client-facing gRPC FileService, next to the REST routes
+        import file_service
+        grpc_server = file_service.serve() if file_service.FILESERVICE_PORT else None
+    except ImportError as e:
+        logger.warning(f"gRPC FileService not available: {e}")
+    if GATEWAY_SERVER_MODE == "async":
+        import app_async
+        app_async.main()
+    else:
+        app.run(host="0.0.0.0", port=5003)
\ No newline at end of file
@@ -0,0 +1,434 @@
+"""
+Upload service - asyncio serving mode (aiohttp)
+Same routes and auth as app.py, but requests are coroutines instead of threads. The 2PC
+coordinator is blocking gRPC, so transactions run on a bounded worker pool while the
+request body is still read on the event loop and handed over chunk by chunk.
+Started by app.py when GATEWAY_SERVER_MODE=async
+"""
+
+import asyncio
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+from aiohttp import web
+from werkzeug.security import generate_password_hash, check_password_hash
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
+
+from app import (METADATA_API, SIGNUP_RETRIES, STORAGE_API, admission, decode_token, encode_token,
+                 load_coordinator, password_hasher, user_cache) # same settings, token cache, hash pool and admission as the Flask app
+from admission import AdmissionRejected
+from common.auth import HashPoolFull
+from common.http_client import CircuitOpenError
+from common.balancer import replicas
+from common.async_http_client import AsyncInternalHTTPClient, iter_field_chunks, multipart_body
+from common.streaming import UPLOAD_CHUNK_SIZE, Sha256Verifier
+
+logger = logging.getLogger(__name__)
+
+COORDINATOR_WORKERS = int(os.environ.get("COORDINATOR_WORKERS", "256")) # 2PC transactions run at once
+http_client = AsyncInternalHTTPClient() # pooled keepalive client for calls to other services
+coordinator_executor = ThreadPoolExecutor(max_workers=COORDINATOR_WORKERS, thread_name_prefix="2pc")
+
+
+# --- Routes ---
+async def signup(request):
+    # grab the username and password
+    data = await request.json()
+    username = data.get("username")
+    password = data.get("password")
+
+    # validate input
+    if not username or not password:
+        return web.json_response({"error": "Missing username or password"}, status=400)
+
+    try:
+        # hash password before sending to metadata service (on the bounded hash pool, off the event loop)
+        hashed_password = await asyncio.wrap_future(password_hasher.submit(generate_password_hash, password))
+        # send to metadata service: every replica keeps its own user table, so each one must take the user
+        metadata_apis = replicas(METADATA_API)
+        statuses = {}
+        for metadata_api in metadata_apis:
+            for attempt in range(SIGNUP_RETRIES + 1):
+                try:
+                    resp = await http_client.post(f"{metadata_api}/users", json={
+                        "username": username,
+                        "password": hashed_password
+                    })
+                except (aiohttp.ClientError, asyncio.TimeoutError, CircuitOpenError):
+                    continue
+                resp.release()
+                statuses[metadata_api] = resp.status
+                if resp.status in (201, 409):
+                    break
+
+        # check response from metadata service
+        if any(statuses.get(metadata_api) not in (201, 409) for metadata_api in metadata_apis):
+            # some replicas may have the user now: a retry with the same password completes the signup
+            return web.json_response({"error": "Signup did not reach every metadata replica, retry it"}, status=503)
+        if 201 not in statuses.values():
+            return web.json_response({"error": "Username already exists"}, status=409)
+        # a replica that already had the user kept it from an earlier partial signup only if the password matches
+        for metadata_api, status in statuses.items():
+            if status == 409:
+                resp = await http_client.get(f"{metadata_api}/users/{username}")
+                if resp.status != 200:
+                    resp.release()
+                    return web.json_response({"error": "Username already exists"}, status=409)
+                stored_hash = (await resp.json()).get("password")
+                if not stored_hash or not await asyncio.wrap_future(
+                        password_hasher.submit(check_password_hash, stored_hash, password)):
+                    return web.json_response({"error": "Username already exists"}, status=409)
+        return web.json_response({"message": "Signup successful!"}, status=201)
+    except HashPoolFull as e:
+        # hash pool saturated (login storm): shed instead of queueing
+        return web.json_response({"error": str(e)}, status=503, headers={"Retry-After": str(e.retry_after)})
+    except Exception as e:
+        return web.json_response({"error": str(e)}, status=500)
+
+async def login(request):
+    # grab the username and password
+    data = await request.json()
+    username = data.get("username")
+    password = data.get("password")
+
+    # validate input
+    if not username or not password:
+        return web.json_response({"error": "Missing username or password"}, status=400)
+
+    try:
+        # fetch user from metadata service (records are reused for AUTH_USER_CACHE_TTL seconds)
+        user = user_cache.get(username)
+        if user is None:
+            resp = await http_client.get(f"{METADATA_API}/users/{username}")
+
+            # check the response
+            if resp.status != 200:
+                resp.release()
+                return web.json_response({"error": "Invalid credentials"}, status=401)
+            user = await resp.json()
+            user_cache.put(username, user)
+
+        # if user is found, check password (on the bounded hash pool, off the event loop)
+        stored_hash = user.get("password")
+        if stored_hash and await asyncio.wrap_future(
+                password_hasher.submit(check_password_hash, stored_hash, password)):
+            return web.json_response({"token": encode_token(username)})
+        else:
+            return web.json_response({"error": "Invalid credentials"}, status=401)
+    except HashPoolFull as e:
+        # hash pool saturated (login storm): shed instead of queueing
+        return web.json_response({"error": str(e)}, status=503, headers={"Retry-After": str(e.retry_after)})
+    except Exception as e:
+        return web.json_response({"error": str(e)}, status=500)
+
+# auth decorator
+def require_auth(handler):
+    async def wrapper(request):
+        # grab the header
+        auth_header = request.headers.get("Authorization")
+
+        # check if auth header is present and valid
+        if not auth_header or not auth_header.startswith("Bearer "):
+            return web.json_response({"error": "Missing or invalid token"}, status=401)
+
+        # decode the token
+        token = auth_header.split(" ", 1)[1]
+        username = decode_token(token)
+        if not username:
+            return web.json_response({"error": "Invalid or expired token"}, status=401)
+        request["username"] = username
+        return await handler(request)
+    wrapper.__name__ = handler.__name__
+    return wrapper
+
+# admission decorator (goes under require_auth): wait for a fair share of the in-flight slots, or 429
+def admission_control(check_bytes=False):
+    def decorator(handler):
+        async def wrapper(request):
+            try:
+                slot = await admission.acquire_async(request["username"], check_bytes=check_bytes)
+            except AdmissionRejected as e:
+                return web.json_response({"error": str(e)}, status=429, headers={"Retry-After": str(e.retry_after)})
+            try:
+                return await handler(request)
+            finally:
+                slot.release()
+        wrapper.__name__ = handler.__name__
+        return wrapper
+    return decorator
+
+async def run_2pc(method, *args):
+    """Run a blocking coordinator call on the 2PC worker pool"""
+    TwoPhaseCommitCoordinator = load_coordinator()
+    coordinator = TwoPhaseCommitCoordinator()
+    return await asyncio.get_running_loop().run_in_executor(coordinator_executor, getattr(coordinator, method), *args)
+
+def blocking_chunks(field, loop):
+    """Iterator over an upload's chunks for the coordinator thread; each chunk is read on the event loop"""
+    while True:
+        chunk = asyncio.run_coroutine_threadsafe(field.read_chunk(UPLOAD_CHUNK_SIZE), loop).result()
+        if not chunk:
+            return
+        yield chunk
+
+async def file_part(request):
+    """The multipart reader and its 'file' part, positioned at the start of its body (part None if missing)"""
+    try:
+        reader = await request.multipart()
+        part = await reader.next()
+        while part is not None and part.name != "file":
+            part = await reader.next()
+    except Exception:
+        return None, None
+    if part is None or not part.filename:
+        return reader, None
+    return reader, part
+
+async def trailing_fields(reader):
+    """Form fields after the file part (e.g. the client's "sha256"), read once the file has been consumed"""
+    fields = {}
+    try:
+        part = await reader.next()
+        while part is not None:
+            if part.filename:
+                await part.release()
+            else:
+                fields[part.name] = await part.text()
+            part = await reader.next()
+    except Exception:
+        pass
+    return fields
+
+# upload file endpoint (file streamed to the storage nodes' 2PC prepare, never held whole in memory;
+# a "sha256" form field after the file part is checked against the bytes before the transaction commits)
+@require_auth
+@admission_control(check_bytes=True)
+async def upload(request):
+    reader, field = await file_part(request)
+    if field is None:
+        return web.json_response({"error": "No file part"}, status=400)
+    filename = field.filename
+    loop = asyncio.get_running_loop()
+
+    try:
+        load_coordinator()
+    except ImportError as e:
+        # Fallback to original behavior if 2PC not available (file streamed on to storage)
+        logger.warning(f"2PC not available: {e}, using original upload")
+        # the fallback streams to storage from the event loop, so the checksum is not verified here
+        chunks = admission.metered_async(request["username"], iter_field_chunks(field, UPLOAD_CHUNK_SIZE))
+        body = multipart_body("file", filename, field.headers.get("Content-Type"), chunks)
+        resp = await http_client.post(f"{STORAGE_API}/upload", data=body)
+        if resp.status != 200:
+            resp.release()
+            return web.json_response({"error": "Storage error"}, status=500)
+        try:
+            return web.json_response(await resp.json(content_type=None), status=resp.status)
+        except Exception:
+            return web.json_response({"error": "Non-JSON response from storage", "raw": await resp.text()},
+                                     status=resp.status)
+
+    try:
+        # Prepare metadata (the coordinator adds size and sha256 to the committed record once the file has been streamed)
+        metadata = {
+            "filename": filename,
+            "path": f"/storage/{filename}",
+            "version": 1
+        }
+        verified = Sha256Verifier(blocking_chunks(field, loop), lambda: asyncio.run_coroutine_threadsafe(
+            trailing_fields(reader), loop).result().get("sha256"))
+        chunks = admission.metered(request["username"], verified)
+        result = await run_2pc("execute_2pc_upload_stream", filename, chunks, metadata)
+
+        if result['success']:
+            return web.json_response({
+                "message": "File uploaded successfully using 2PC",
+                "transaction_id": result['transaction_id'],
+                "filename": filename,
+                "path": metadata["path"],
+                "sha256": verified.sha256
+            }, status=201)
+        elif verified.mismatch:
+            return web.json_response({
+                "error": "Upload checksum mismatch",
+                "message": result['message'],
+                "transaction_id": result['transaction_id']
+            }, status=422)
+        else:
+            return web.json_response({
+                "error": "2PC transaction failed",
+                "message": result['message'],
+                "transaction_id": result['transaction_id']
+            }, status=500)
+    except Exception as e:
+        return web.json_response({"error": f"Upload failed: {str(e)}"}, status=500)
+
+# upload-by-hash endpoint: link the name to already-stored content instead of transferring it (same body as app.py)
+@require_auth
+@admission_control()
+async def upload_by_hash(request):
+    try:
+        data = await request.json()
+    except Exception:
+        data = {}
+    if not isinstance(data, dict):
+        data = {}
+    filename, sha256 = data.get("filename"), str(data.get("sha256", "")).lower()
+    if not filename or len(sha256) != 64:
+        return web.json_response({"error": "Missing filename or sha256"}, status=400)
+
+    resp = await http_client.get(f"{METADATA_API}/hashes/{sha256}", params={"filename": filename})
+    if resp.status == 404:
+        resp.release()
+        return web.json_response({"error": "Content not found"}, status=404)
+    if resp.status != 200:
+        return web.json_response({"error": "Metadata error - " + await resp.text()}, status=500)
+    source = (await resp.json(content_type=None))["filename"]
+    if source == filename:
+        return web.json_response({"message": "File already up to date", "filename": filename,
+                                  "path": f"/storage/{filename}"}, status=200)
+
+    try:
+        result = await run_2pc("execute_2pc_link", source, filename, sha256)
+        if result['success']:
+            return web.json_response({
+                "message": "File uploaded by content hash using 2PC",
+                "transaction_id": result['transaction_id'],
+                "filename": filename,
+                "path": f"/storage/{filename}",
+                "linked_to": source
+            }, status=201)
+        else:
+            return web.json_response({
+                "error": "2PC transaction failed",
+                "message": result['message'],
+                "transaction_id": result['transaction_id']
+            }, status=409)
+    except ImportError as e:
+        return web.json_response({"error": f"2PC not available: {e}"}, status=501)
+    except Exception as e:
+        return web.json_response({"error": f"Upload by hash failed: {str(e)}"}, status=500)
+
+# delete file endpoint (uses 2PC so file bytes and metadata are removed atomically)
+@require_auth
+@admission_control()
+async def delete_file(request):
+    filename = request.query.get("filename")
+    if not filename:
+        return web.json_response({"error": "No filename provided"}, status=400)
+
+    try:
+        load_coordinator()
+    except ImportError as e:
+        # Fallback to original behavior if 2PC not available
+        logger.warning(f"2PC not available: {e}, using original delete")
+        resp = await http_client.delete(f"{STORAGE_API}/delete", params={"filename": filename})
+        if resp.status == 200:
+            return web.json_response(await resp.json(content_type=None), status=resp.status)
+        return web.json_response({"error": "Delete error - " + await resp.text()}, status=500)
+
+    try:
+        result = await run_2pc("execute_2pc_delete", filename)
+        if result['success']:
+            return web.json_response({
+                "status": "deleted",
+                "transaction_id": result['transaction_id'],
+                "filename": filename
+            }, status=200)
+        else:
+            return web.json_response({
+                "error": "2PC transaction failed",
+                "message": result['message'],
+                "transaction_id": result['transaction_id']
+            }, status=500)
+    except Exception as e:
+        return web.json_response({"error": f"Delete failed: {str(e)}"}, status=500)
+
+# batch endpoint: delete/move many files as one atomic 2PC transaction (same body as app.py)
+@require_auth
+@admission_control()
+async def batch(request):
+    try:
+        data = await request.json()
+    except Exception:
+        data = {}
+    operations = data.get("operations") if isinstance(data, dict) else None
+    if not operations or not isinstance(operations, list):
+        return web.json_response({"error": "Missing operations list"}, status=400)
+    for op in operations:
+        if not isinstance(op, dict) or op.get("operation") not in ("delete", "move") or not op.get("filename"):
+            return web.json_response({"error": f"Invalid operation: {op}"}, status=400)
+        if op["operation"] == "move" and not op.get("new_filename"):
+            return web.json_response({"error": f"Move requires new_filename: {op}"}, status=400)
+
+    try:
+        result = await run_2pc("execute_2pc_batch", operations)
+        if result['success']:
+            return web.json_response({
+                "status": "committed",
+                "transaction_id": result['transaction_id'],
+                "operations": len(operations)
+            }, status=200)
+        else:
+            return web.json_response({
+                "error": "2PC transaction failed",
+                "message": result['message'],
+                "transaction_id": result['transaction_id']
+            }, status=500)
+    except ImportError as e:
+        return web.json_response({"error": f"2PC not available: {e}"}, status=501)
+    except Exception as e:
+        return web.json_response({"error": f"Batch failed: {str(e)}"}, status=500)
+
+# list files endpoint
+@require_auth
+async def list_files(request):
+    # forward request to metadata service via GET (with the client's If-None-Match, so an unchanged listing is a 304)
+    # ?since=<cursor> asks for a delta listing, see metadata's GET /files
+    # pinned to one metadata replica: cursors (epoch:seq) and listing ETags differ between replicas
+    headers = {"If-None-Match": request.headers["If-None-Match"]} if "If-None-Match" in request.headers else {}
+    params = {"since": request.query["since"]} if "since" in request.query else {}
+    resp = await http_client.get(f"{METADATA_API}/files", headers=headers, params=params, pinned=True)
+
+    # check response from metadata service
+    validators = {"ETag": resp.headers["ETag"]} if "ETag" in resp.headers else {}
+    if resp.status == 304:
+        resp.release()
+        return web.Response(status=304, headers=validators)
+    elif resp.status == 200:
+        return web.Response(body=await resp.read(), status=200, content_type="application/json",
+                            headers=validators)
+    else:
+        return web.json_response({"error": "Metadata error - " + await resp.text()}, status=500)
+
+# metrics endpoint (Prometheus text format: 2PC phase latencies, votes, timeouts, in-flight transactions)
+async def metrics(request):
+    return web.Response(body=generate_latest(), headers={"Content-Type": CONTENT_TYPE_LATEST})
+
+
+async def close_http_client(app):
+    await http_client.close()
+
+
+def create_app():
+    app = web.Application()
+    app.router.add_post("/auth/signup", signup)
+    app.router.add_post("/auth/login", login)
+    app.router.add_post("/files/upload", upload)
+    app.router.add_post("/files/upload-by-hash", upload_by_hash)
+    app.router.add_delete("/files/delete", delete_file)
+    app.router.add_post("/files/batch", batch)
+    app.router.add_get("/files", list_files)
+    app.router.add_get("/metrics", metrics)
+    app.on_cleanup.append(close_http_client)
+    return app
+
+
+def main():
+    web.run_app(create_app(), host="0.0.0.0", port=5003)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+Client-facing gRPC FileService (protos/fileservice.proto), served next to the REST routes
+Upload is client-streaming and goes through the same 2PC streamed upload, admission control
+and byte bucket as POST /files/upload, without multipart framing; Download streams the file
+from storage; List pages through the metadata listing; Delete runs a 2PC delete.
+Calls are authenticated with the REST JWT, sent as "authorization: Bearer <token>" metadata
+"""
+
+import grpc
+import logging
+import os
+from concurrent import futures
+
+try:
+    from protos import fileservice_pb2
+    from protos import fileservice_pb2_grpc
+except ImportError:
+    import fileservice_pb2
+    import fileservice_pb2_grpc
+
+from app import METADATA_API, STORAGE_API, admission, decode_token, http_client, load_coordinator
+from admission import AdmissionRejected
+from common.streaming import UPLOAD_CHUNK_SIZE
+
+logger = logging.getLogger(__name__)
+
+FILESERVICE_PORT = int(os.environ.get('FILESERVICE_PORT', '6003'))  # gRPC port of the FileService, 0 disables
+FILESERVICE_MAX_WORKERS = int(os.environ.get('FILESERVICE_MAX_WORKERS', '64'))  # RPCs served at once
+FILESERVICE_PAGE_SIZE = int(os.environ.get('FILESERVICE_PAGE_SIZE', '100'))  # List page size when none is asked for
+FILESERVICE_MAX_PAGE_SIZE = int(os.environ.get('FILESERVICE_MAX_PAGE_SIZE', '1000'))  # largest List page
+
+
+def _chunk_data(first, request_iterator):
+    """File bytes of an Upload stream, starting with the first (already read) message"""
+    if first.data:
+        yield first.data
+    for chunk in request_iterator:
+        if chunk.data:
+            yield chunk.data
+
+
+class FileServiceServicer(fileservice_pb2_grpc.FileServiceServicer):
+    def _authenticate(self, context):
+        """Username from the call's bearer token; aborts with UNAUTHENTICATED otherwise"""
+        auth_header = dict(context.invocation_metadata()).get("authorization", "")
+        username = decode_token(auth_header.split(" ", 1)[1]) if auth_header.startswith("Bearer ") else None
+        if not username:
+            context.abort(grpc.StatusCode.UNAUTHENTICATED, "Missing, invalid or expired token")
+        return username
+
+    def _admit(self, username, context, check_bytes=False):
+        """An admission slot, or RESOURCE_EXHAUSTED with retry-after trailing metadata (the REST 429)"""
+        try:
+            return admission.acquire(username, check_bytes=check_bytes)
+        except AdmissionRejected as e:
+            context.set_trailing_metadata((("retry-after", str(e.retry_after)),))
+            context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, str(e))
+
+    def _coordinator(self, context):
+        try:
+            return load_coordinator()()
+        except ImportError as e:
+            context.abort(grpc.StatusCode.UNIMPLEMENTED, f"2PC not available: {e}")
+
+    def Upload(self, request_iterator, context):
+        username = self._authenticate(context)
+        first = next(request_iterator, None)
+        if first is None or not first.filename:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, "The first chunk must name the file")
+        filename = first.filename
+
+        slot = self._admit(username, context, check_bytes=True)
+        try:
+            coordinator = self._coordinator(context)
+            # the coordinator adds size and sha256 to the record, and returns them, once the file has been streamed
+            metadata = {"filename": filename, "path": f"/storage/{filename}", "version": 1}
+            chunks = admission.metered(username, _chunk_data(first, request_iterator))
+            result = coordinator.execute_2pc_upload_stream(filename, chunks, metadata)
+        finally:
+            slot.release()
+        if not result['success']:
+            context.abort(grpc.StatusCode.ABORTED, f"2PC transaction failed: {result['message']}")
+        return fileservice_pb2.UploadResponse(transaction_id=result['transaction_id'], filename=filename,
+                                              size=result.get('size') or 0, sha256=result.get('sha256') or "")
+
+    def Download(self, request, context):
+        self._authenticate(context)
+        resp = http_client.get(f"{METADATA_API}/files/{request.filename}")
+        if resp.status_code == 404:
+            context.abort(grpc.StatusCode.NOT_FOUND, "File not found")
+        elif resp.status_code != 200:
+            context.abort(grpc.StatusCode.UNAVAILABLE, f"Metadata error - {resp.text}")
+        metadata = resp.json()
+
+        resp = http_client.get(f"{STORAGE_API}/download", params={"filename": request.filename}, stream=True)
+        try:
+            if resp.status_code == 404:
+                context.abort(grpc.StatusCode.NOT_FOUND, "File not found")
+            elif resp.status_code != 200:
+                context.abort(grpc.StatusCode.UNAVAILABLE, f"Storage error - {resp.text}")
+            # the first message carries the file's size and hash, so empty files still get one
+            yield fileservice_pb2.DownloadChunk(size=int(resp.headers.get("Content-Length") or 0),
+                                                sha256=metadata.get("sha256") or "")
+            for data in resp.iter_content(chunk_size=UPLOAD_CHUNK_SIZE):
+                yield fileservice_pb2.DownloadChunk(data=data)
+        finally:
+            resp.close()
+
+    def List(self, request, context):
+        self._authenticate(context)
+        # page_token is the last filename of the previous page; the metadata service pages in filename order
+        page_size = min(request.page_size or FILESERVICE_PAGE_SIZE, FILESERVICE_MAX_PAGE_SIZE)
+        resp = http_client.get(f"{METADATA_API}/files", params={"after": request.page_token, "limit": page_size})
+        if resp.status_code != 200:
+            context.abort(grpc.StatusCode.UNAVAILABLE, f"Metadata error - {resp.text}")
+        page = resp.json()
+        return fileservice_pb2.ListResponse(
+            files=[fileservice_pb2.FileInfo(filename=f["filename"], size=f.get("size") or 0,
+                                            version=f.get("version") or 0, sha256=f.get("sha256") or "",
+                                            modified_at=f.get("modified_at") or 0)
+                   for f in page["files"]],
+            next_page_token=page["next_after"])
+
+    def Delete(self, request, context):
+        username = self._authenticate(context)
+        if not request.filename:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, "No filename provided")
+
+        slot = self._admit(username, context)
+        try:
+            result = self._coordinator(context).execute_2pc_delete(request.filename)
+        finally:
+            slot.release()
+        if not result['success']:
+            context.abort(grpc.StatusCode.ABORTED, f"2PC transaction failed: {result['message']}")
+        return fileservice_pb2.DeleteResponse(transaction_id=result['transaction_id'], filename=request.filename)
+
+
+def serve(port=FILESERVICE_PORT):
+    """Start the FileService gRPC server in the background; returns the server (keep a reference to it)"""
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=FILESERVICE_MAX_WORKERS,
+                                                    thread_name_prefix='fileservice'))
+    fileservice_pb2_grpc.add_FileServiceServicer_to_server(FileServiceServicer(), server)
+    server.add_insecure_port(f'[::]:{port}')
+    server.start()
+    logger.info(f"FileService gRPC server started on port {port} (workers: {FILESERVICE_MAX_WORKERS})")
+    return server
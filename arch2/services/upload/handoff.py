@@ -0,0 +1,121 @@
+"""
+Hinted handoff for storage replicas the coordinator routed around
+When a transaction commits without a down storage replica, the names it wrote are kept as hints for
+that replica. The replica stays out of the write set until a background thread has repaired every
+hinted name on it (once the membership view sees it up again) and no transaction that skipped it is
+still in flight. Hints live in the coordinator's memory, so a coordinator restart loses them
+"""
+
+import logging
+import os
+import threading
+from typing import Callable, Dict, List
+from prometheus_client import Gauge
+
+from membership import HEARTBEAT_INTERVAL, MembershipView
+
+logger = logging.getLogger(__name__)
+
+NODE_ID = os.environ.get('NODE_ID', 'coordinator')
+HANDOFF_INTERVAL = float(os.environ.get('HANDOFF_INTERVAL', str(HEARTBEAT_INTERVAL)))  # seconds between replay rounds
+
+HINTS = Gauge('twopc_handoff_hints', 'Names a storage replica missed while routed around, not yet repaired',
+              ['participant'])
+
+
+class HintedHandoff:
+    """Per-replica hints of missed writes, replayed to the replica by repair(endpoint, filename) -> bool"""
+
+    def __init__(self, membership: MembershipView, repair: Callable[[str, str], bool],
+                 interval: float = HANDOFF_INTERVAL):
+        self.membership = membership
+        self.repair = repair
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._hints: Dict[str, Dict[str, int]] = {}  # endpoint -> hinted names (oldest first) and their versions
+        self._skipping: Dict[str, int] = {}  # endpoint -> transactions in flight without it
+        self._catching_up = set()  # endpoints kept out of the write set
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='hinted-handoff', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def skip(self, endpoints: List[str]) -> List[str]:
+        """Storage endpoints a new transaction must route around: down, or still catching up"""
+        with self._lock:
+            skipped = [e for e in endpoints if e in self._catching_up or not self.membership.is_alive(e)]
+            for endpoint in skipped:
+                self._catching_up.add(endpoint)
+                self._skipping[endpoint] = self._skipping.get(endpoint, 0) + 1
+            return skipped
+
+    def finish(self, skipped: List[str], names: List[str], committed: bool):
+        """Record the names a transaction wrote as hints for the replicas it skipped"""
+        with self._lock:
+            for endpoint in skipped:
+                self._skipping[endpoint] -= 1
+                if committed:
+                    hints = self._hints.setdefault(endpoint, {})
+                    for name in names:
+                        # a new version keeps the hint when a repair of the name is already under way
+                        hints[name] = hints.get(name, 0) + 1
+                    HINTS.labels(participant=self._node_id(endpoint)).set(len(self._hints[endpoint]))
+
+    def sources(self, endpoints: List[str]) -> List[str]:
+        """Storage endpoints that are up and caught up, to copy repaired files from"""
+        with self._lock:
+            return [e for e in endpoints if e not in self._catching_up and self.membership.is_alive(e)]
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.replay_round()
+            except Exception as e:
+                logger.error(f"Hinted handoff of Node {NODE_ID} failed: {e}")
+
+    def replay_round(self):
+        """Repair the hinted names of every replica that is up again, oldest first, until one fails"""
+        with self._lock:
+            endpoints = [e for e in self._catching_up if self.membership.is_alive(e)]
+        for endpoint in endpoints:
+            while True:
+                with self._lock:
+                    names = self._hints.get(endpoint)
+                    if not names:
+                        if not self._skipping.get(endpoint):
+                            self._catching_up.discard(endpoint)
+                            logger.info(f"Hinted handoff of Node {NODE_ID}: Node {self._node_id(endpoint)} caught up, back in the write set")
+                        break
+                    filename, version = next(iter(names.items()))
+                if not self.repair(endpoint, filename):
+                    logger.warning(f"Hinted handoff of Node {NODE_ID}: repair of {filename} on Node {self._node_id(endpoint)} failed, retrying next round")
+                    break
+                with self._lock:
+                    if names.get(filename) == version:
+                        del names[filename]
+                    HINTS.labels(participant=self._node_id(endpoint)).set(len(names))
+
+    @staticmethod
+    def _node_id(endpoint: str) -> str:
+        return endpoint.split(':')[0] if ':' in endpoint else endpoint
+
+
+_hinted_handoff = None
+_handoff_lock = threading.Lock()
+
+
+def get_hinted_handoff(membership: MembershipView, repair: Callable[[str, str], bool]) -> HintedHandoff:
+    """Process-wide hinted handoff (started on first use)"""
+    global _hinted_handoff
+    with _handoff_lock:
+        if _hinted_handoff is None:
+            _hinted_handoff = HintedHandoff(membership, repair)
+            _hinted_handoff.start()
+        return _hinted_handoff
@@ -0,0 +1,139 @@
+"""
+Membership view for the 2PC coordinator
+A background thread sends lightweight Heartbeat RPCs to every participant and keeps
+an alive/down view, so uploads can fail fast (or route around a down storage replica)
+instead of waiting for a Vote RPC to time out
+"""
+
+import grpc
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+from prometheus_client import Gauge
+
+try:
+    from protos import twopc_pb2
+    from protos import twopc_pb2_grpc
+except ImportError:
+    import twopc_pb2
+    import twopc_pb2_grpc
+
+logger = logging.getLogger(__name__)
+
+NODE_ID = os.environ.get('NODE_ID', 'coordinator')
+HEARTBEAT_INTERVAL = float(os.environ.get('HEARTBEAT_INTERVAL', '1.0'))  # seconds between heartbeat rounds, 0 disables
+HEARTBEAT_TIMEOUT = float(os.environ.get('HEARTBEAT_TIMEOUT', '0.5'))  # deadline of one heartbeat RPC
+HEARTBEAT_FAILURE_THRESHOLD = int(os.environ.get('HEARTBEAT_FAILURE_THRESHOLD', '3'))  # consecutive misses before down
+HEARTBEAT_RECOVERY_THRESHOLD = int(os.environ.get('HEARTBEAT_RECOVERY_THRESHOLD', '1'))  # consecutive replies before up
+
+PARTICIPANT_UP = Gauge('twopc_membership_participant_up', 'Participant liveness as seen by the coordinator (1 = up)',
+                       ['participant'])
+
+
+class MemberState:
+    """Liveness of one participant endpoint; nodes start up until heartbeats say otherwise"""
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.node_id = endpoint.split(':')[0] if ':' in endpoint else endpoint
+        self.channel = grpc.insecure_channel(endpoint)
+        self.stub = twopc_pb2_grpc.HeartbeatServiceStub(self.channel)
+        self.alive = True
+        self.consecutive_failures = 0
+        self.consecutive_successes = 0
+        self.last_seen = None
+        self.pending_transactions = 0
+
+
+class MembershipView:
+    """Heartbeat-driven alive/down view of the participants, refreshed on a background thread"""
+
+    def __init__(self, endpoints: List[str], interval: float = HEARTBEAT_INTERVAL, timeout: float = HEARTBEAT_TIMEOUT,
+                 failure_threshold: int = HEARTBEAT_FAILURE_THRESHOLD,
+                 recovery_threshold: int = HEARTBEAT_RECOVERY_THRESHOLD):
+        self.interval = interval
+        self.timeout = timeout
+        self.failure_threshold = failure_threshold
+        self.recovery_threshold = recovery_threshold
+        self.members: Dict[str, MemberState] = {endpoint: MemberState(endpoint) for endpoint in endpoints}
+        self._stop = threading.Event()
+        self._thread = None
+        for member in self.members.values():
+            PARTICIPANT_UP.labels(participant=member.node_id).set(1)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='membership-heartbeat', daemon=True)
+        self._thread.start()
+        logger.info(f"Membership view of Node {NODE_ID} started (interval {self.interval}s, timeout {self.timeout}s, "
+                    f"down after {self.failure_threshold} missed heartbeats)")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        for member in self.members.values():
+            member.channel.close()
+
+    def _run(self):
+        while not self._stop.is_set():
+            started = time.monotonic()
+            self.heartbeat_round()
+            self._stop.wait(max(0.0, self.interval - (time.monotonic() - started)))
+
+    def heartbeat_round(self):
+        """Ping every participant in parallel and update the view"""
+        request = twopc_pb2.HeartbeatRequest(node_id=NODE_ID)
+        calls = [(member, member.stub.Heartbeat.future(request, timeout=self.timeout))
+                 for member in self.members.values()]
+        for member, call in calls:
+            try:
+                response = call.result()
+                self._record_success(member, response)
+            except grpc.RpcError:
+                self._record_failure(member)
+
+    def _record_success(self, member: MemberState, response: twopc_pb2.HeartbeatResponse):
+        member.consecutive_failures = 0
+        member.consecutive_successes += 1
+        member.last_seen = time.time()
+        member.pending_transactions = response.pending_transactions
+        if not member.alive and member.consecutive_successes >= self.recovery_threshold:
+            member.alive = True
+            PARTICIPANT_UP.labels(participant=member.node_id).set(1)
+            logger.info(f"Membership view of Node {NODE_ID}: Node {member.node_id} is up")
+
+    def _record_failure(self, member: MemberState):
+        member.consecutive_successes = 0
+        member.consecutive_failures += 1
+        if member.alive and member.consecutive_failures >= self.failure_threshold:
+            member.alive = False
+            PARTICIPANT_UP.labels(participant=member.node_id).set(0)
+            logger.warning(f"Membership view of Node {NODE_ID}: Node {member.node_id} is down "
+                           f"({member.consecutive_failures} missed heartbeats)")
+
+    def is_alive(self, endpoint: str) -> bool:
+        member = self.members.get(endpoint)
+        return member.alive if member else True
+
+    def channel(self, endpoint: str) -> Optional[grpc.Channel]:
+        """Long-lived channel to a participant, shared by heartbeats and 2PC RPCs"""
+        member = self.members.get(endpoint)
+        return member.channel if member else None
+
+
+_membership_view = None
+_membership_lock = threading.Lock()
+
+
+def get_membership_view(endpoints: List[str]) -> Optional[MembershipView]:
+    """Process-wide membership view (started on first use); None when HEARTBEAT_INTERVAL is 0"""
+    global _membership_view
+    if HEARTBEAT_INTERVAL <= 0:
+        return None
+    with _membership_lock:
+        if _membership_view is None:
+            _membership_view = MembershipView(endpoints)
+            _membership_view.start()
+        return _membership_view
@@ -3,5 +3,8 @@
 if [ -f "/app/protos/twopc.proto" ]; then
     python -m grpc_tools.protoc -I/app/protos --python_out=/app --grpc_python_out=/app /app/protos/twopc.proto
 fi
+if [ -f "/app/protos/fileservice.proto" ]; then
+    python -m grpc_tools.protoc -I/app/protos --python_out=/app --grpc_python_out=/app /app/protos/fileservice.proto
+fi
 # Start the application
 python app.py
@@ -1,5 +1,6 @@
 """
 2PC Coordinator - Integrated into Upload Service
+Handles uploads, deletes and multi-file batches (delete/move) as atomic transactions
 Vote phase: verify all nodes are alive and prepare operations
 Decision phase: send decision to participants, they execute operations directly in their decision phase
 """
@@ -9,8 +10,13 @@ import logging
 import os
 import json
 import base64
+import hashlib
+import queue
+import time
 import uuid
-from typing import List, Optional
+from typing import Iterable, List, Optional
+import requests
+from prometheus_client import Counter, Gauge, Histogram
 
 try:
     from protos import twopc_pb2
@@ -18,6 +24,9 @@ try:
 except ImportError:
     import twopc_pb2
     import twopc_pb2_grpc
+from membership import get_membership_view
+from handoff import get_hinted_handoff
+from common.http_client import InternalHTTPClient
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -25,12 +34,37 @@ logger = logging.getLogger(__name__)
 NODE_ID = os.environ.get('NODE_ID', 'coordinator')
 STORAGE_NODES = os.environ.get('STORAGE_NODES', 'storage:6001').split(',')
 METADATA_NODES = os.environ.get('METADATA_NODES', 'metadata:6002').split(',')
+# Storage replicas that must take each write; with fewer nodes than this alive, uploads fail fast
+STORAGE_WRITE_QUORUM = int(os.environ.get('STORAGE_WRITE_QUORUM', '0')) or len(STORAGE_NODES)
+STREAM_VOTE_TIMEOUT = float(os.environ.get('STREAM_VOTE_TIMEOUT', '3600'))  # deadline of a streamed upload prepare
+STREAM_QUEUE_DEPTH = int(os.environ.get('STREAM_QUEUE_DEPTH', '4'))  # chunks buffered per storage node
+METADATA_API = "http://metadata:5005" # metadata service URL, read when repairing a storage replica
+STORAGE_HTTP_PORT = int(os.environ.get('STORAGE_HTTP_PORT', '5006'))  # storage nodes' HTTP port, repairs copy files from it
+REPAIR_CHUNK_SIZE = 256 * 1024  # bytes per VoteStream chunk when copying a file to a repaired replica
+
+_END_OF_STREAM = object()
+
+http_client = InternalHTTPClient() # pooled keepalive client for repair reads
+
+# Metrics (exposed on the upload service's /metrics endpoint)
+PHASE_LATENCY = Histogram('twopc_coordinator_rpc_seconds', 'Latency of 2PC RPCs sent by the coordinator',
+                          ['participant', 'phase'])
+VOTE_OUTCOMES = Counter('twopc_coordinator_votes_total', 'Votes received by the coordinator',
+                        ['participant', 'outcome'])
+RPC_TIMEOUTS = Counter('twopc_coordinator_rpc_timeouts_total', 'Coordinator RPCs that hit their deadline',
+                       ['participant', 'phase'])
+TRANSACTIONS = Counter('twopc_transactions_total', 'Finished 2PC transactions', ['operation', 'decision'])
+TRANSACTION_LATENCY = Histogram('twopc_transaction_seconds', 'End-to-end 2PC transaction latency', ['operation'])
+TRANSACTIONS_IN_FLIGHT = Gauge('twopc_transactions_in_flight', 'Transactions between vote phase start and decision end')
 
 
 class TwoPhaseCommitCoordinator:
     """Simple 2PC Coordinator: verify all nodes are alive, then execute operation"""
     
     def __init__(self):
+        self.membership = get_membership_view(STORAGE_NODES + METADATA_NODES)
+        # storage replicas routed around are repaired from hints once they are back (see handoff.py)
+        self.handoff = get_hinted_handoff(self.membership, self.repair_replica) if self.membership else None
         logger.info(f"Phase coordinator of Node {NODE_ID} initialized")
     
     def _create_channel(self, endpoint: str) -> Optional[grpc.Channel]:
@@ -45,18 +79,25 @@ class TwoPhaseCommitCoordinator:
     def _send_vote_request(self, stub: twopc_pb2_grpc.VotePhaseServiceStub,
                           request: twopc_pb2.VoteRequest, node_id: str) -> Optional[twopc_pb2.VoteResponse]:
         """Send vote request to a participant"""
+        start = time.perf_counter()
         try:
             logger.info(f"Phase coordinator of Node {NODE_ID} sends RPC VoteRequest to Phase vote of Node {node_id}")
             response = stub.Vote(request, timeout=5)
             logger.info(f"Phase vote of Node {node_id} sends RPC VoteResponse to Phase coordinator of Node {NODE_ID}: {response.message} (Vote: {response.vote_commit})")
+            VOTE_OUTCOMES.labels(participant=node_id, outcome='commit' if response.vote_commit else 'abort').inc()
             return response
         except grpc.RpcError as e:
             logger.error(f"RPC error from {node_id}: {e.code()} - {e.details()}")
+            self._record_rpc_error(e, node_id, 'vote')
+            VOTE_OUTCOMES.labels(participant=node_id, outcome='error').inc()
             return None
+        finally:
+            PHASE_LATENCY.labels(participant=node_id, phase='vote').observe(time.perf_counter() - start)
     
     def _send_decision(self, stub: twopc_pb2_grpc.DecisionPhaseServiceStub,
                       request: twopc_pb2.DecisionRequest, node_id: str) -> Optional[twopc_pb2.DecisionResponse]:
         """Send decision to a participant"""
+        start = time.perf_counter()
         try:
             decision_type = "global-commit" if request.global_commit else "global-abort"
             logger.info(f"Phase decision of Node {NODE_ID} sends RPC DecisionRequest to Phase decision of Node {node_id}")
@@ -65,64 +106,199 @@ class TwoPhaseCommitCoordinator:
             return response
         except grpc.RpcError as e:
             logger.error(f"RPC error from {node_id}: {e.code()} - {e.details()}")
+            self._record_rpc_error(e, node_id, 'decision')
             return None
+        finally:
+            PHASE_LATENCY.labels(participant=node_id, phase='decision').observe(time.perf_counter() - start)
     
-    def execute_2pc_upload(self, filename: str, file_data: bytes, metadata: dict) -> dict:
+    def _send_vote_streams(self, targets: list, transaction_id: str, filename: str,
+                           chunks: Iterable[bytes]) -> tuple:
         """
-        Execute 2PC protocol for file upload
-        Phase 1: Vote - verify all nodes are alive and prepare operations
-        Phase 2: Decision - send decision to all participants, they execute operations directly
+        Relay upload chunks to the VoteStream of every storage node at once
+        Each node is fed from a queue of STREAM_QUEUE_DEPTH chunks, so the coordinator holds
+        only a few chunks per node and the slowest node paces the reader.
+        Returns ([(node_id, response or None)], bytes streamed, SHA-256 hex digest of them, error or None)
         """
-        transaction_id = str(uuid.uuid4())
-        logger.info(f"Phase coordinator of Node {NODE_ID} starting 2PC transaction {transaction_id}")
+        start = time.perf_counter()
+        streams = []
+        for node_id, stub in targets:
+            logger.info(f"Phase coordinator of Node {NODE_ID} sends RPC VoteStream to Phase vote of Node {node_id}")
+            chunk_queue = queue.Queue(maxsize=STREAM_QUEUE_DEPTH)
+            call = stub.VoteStream.future(self._queued_chunks(chunk_queue), timeout=STREAM_VOTE_TIMEOUT)
+            streams.append((node_id, chunk_queue, call))
         
-        # Encode file data to base64
-        file_data_b64 = base64.b64encode(file_data).decode('utf-8')
-        metadata_json = json.dumps(metadata)
+        size = 0
+        digest = hashlib.sha256()
+        error = None
+        try:
+            sent = False
+            for data in chunks:
+                size += len(data)
+                digest.update(data)
+                self._feed_streams(streams, twopc_pb2.VoteChunk(
+                    transaction_id=transaction_id, filename=filename, node_id=NODE_ID, data=data))
+                sent = True
+            if not sent:
+                # Storage nodes only prepare once they have seen a chunk, so empty files send one empty chunk
+                self._feed_streams(streams, twopc_pb2.VoteChunk(
+                    transaction_id=transaction_id, filename=filename, node_id=NODE_ID))
+            self._feed_streams(streams, _END_OF_STREAM)
+        except Exception as e:
+            # Upload body could not be read (client went away, malformed body): cancel the streams
+            # so no storage node prepares a partial file
+            logger.error(f"Phase coordinator of Node {NODE_ID} cancels VoteStream of transaction {transaction_id}: {e}")
+            error = f"Upload stream interrupted: {e}"
+            for node_id, chunk_queue, call in streams:
+                call.cancel()
         
-        # Prepare vote request
-        vote_request = twopc_pb2.VoteRequest(
-            transaction_id=transaction_id,
-            operation="upload",
-            filename=filename,
-            file_data=file_data_b64,
-            metadata_json=metadata_json,
-            node_id=NODE_ID
-        )
+        responses = []
+        for node_id, chunk_queue, call in streams:
+            response = None
+            if not error:
+                try:
+                    response = call.result()
+                    logger.info(f"Phase vote of Node {node_id} sends RPC VoteResponse to Phase coordinator of Node {NODE_ID}: {response.message} (Vote: {response.vote_commit})")
+                    VOTE_OUTCOMES.labels(participant=node_id, outcome='commit' if response.vote_commit else 'abort').inc()
+                except grpc.RpcError as e:
+                    logger.error(f"RPC error from {node_id}: {e.code()} - {e.details()}")
+                    self._record_rpc_error(e, node_id, 'vote_stream')
+                    VOTE_OUTCOMES.labels(participant=node_id, outcome='error').inc()
+            PHASE_LATENCY.labels(participant=node_id, phase='vote_stream').observe(time.perf_counter() - start)
+            responses.append((node_id, response))
+            # Release the request iterator of a stream that ended early (it may be waiting on an empty queue)
+            try:
+                chunk_queue.put_nowait(_END_OF_STREAM)
+            except queue.Full:
+                pass
+        return responses, size, digest.hexdigest(), error
+    
+    def _feed_streams(self, streams: list, item):
+        """Queue one chunk for every open stream; a stream that already ended (failed) is skipped"""
+        for node_id, chunk_queue, call in streams:
+            while not call.done():
+                try:
+                    chunk_queue.put(item, timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+    
+    @staticmethod
+    def _queued_chunks(chunk_queue: queue.Queue):
+        """Request iterator of one VoteStream call, consumed by gRPC on its own thread"""
+        while True:
+            item = chunk_queue.get()
+            if item is _END_OF_STREAM:
+                return
+            yield item
+    
+    def _record_rpc_error(self, error: grpc.RpcError, node_id: str, phase: str):
+        """Count RPCs that failed because the participant did not answer before the deadline"""
+        if error.code() == grpc.StatusCode.DEADLINE_EXCEEDED:
+            RPC_TIMEOUTS.labels(participant=node_id, phase=phase).inc()
+    
+    def _execute_2pc(self, transaction_id: str, storage_vote_request: twopc_pb2.VoteRequest,
+                     metadata_vote_request: twopc_pb2.VoteRequest, upload_chunks: Iterable[bytes] = None) -> dict:
+        """
+        Run both 2PC phases for an already prepared pair of role-specific vote requests
+        Phase 1: Vote - verify all nodes are alive and prepare operations
+        Phase 2: Decision - send decision to all participants, they execute operations directly
+        With upload_chunks, storage nodes are prepared over VoteStream instead of Vote
+        """
+        operation = storage_vote_request.operation
+        start = time.perf_counter()
+        TRANSACTIONS_IN_FLIGHT.inc()
+        skipped = self.handoff.skip(STORAGE_NODES) if self.handoff else []
+        result = None
+        try:
+            result = self._run_phases(transaction_id, storage_vote_request, metadata_vote_request, upload_chunks,
+                                      skipped)
+        finally:
+            if skipped:
+                # an unknown outcome is hinted too: repairing a name that did not change is harmless
+                self.handoff.finish(skipped, self._written_names(storage_vote_request),
+                                    committed=result is None or result['success'])
+            TRANSACTIONS_IN_FLIGHT.dec()
+            TRANSACTION_LATENCY.labels(operation=operation).observe(time.perf_counter() - start)
+        TRANSACTIONS.labels(operation=operation, decision='commit' if result['success'] else 'abort').inc()
+        return result
+    
+    @staticmethod
+    def _written_names(storage_vote_request: twopc_pb2.VoteRequest) -> List[str]:
+        """Names whose stored bytes a transaction changes (link sources are only read)"""
+        if storage_vote_request.operation != "batch":
+            return [storage_vote_request.filename]
+        names = []
+        for op in storage_vote_request.operations:
+            if op.operation in ("delete", "move"):
+                names.append(op.filename)
+            if op.operation in ("move", "link"):
+                names.append(op.new_filename)
+        return names
+    
+    def _run_phases(self, transaction_id: str, storage_vote_request: twopc_pb2.VoteRequest,
+                    metadata_vote_request: twopc_pb2.VoteRequest, upload_chunks: Iterable[bytes] = None,
+                    skipped: List[str] = ()) -> dict:
+        """Vote phase followed by decision phase, without the skipped storage nodes; returns the transaction result"""
+        # Consult the membership view first: fail fast when a participant is known to be down, routing
+        # around down (or still catching up) storage replicas as long as the write quorum can still be met
+        storage_nodes = [e for e in STORAGE_NODES if e not in skipped]
+        if self.membership:
+            down = [e for e in METADATA_NODES if not self.membership.is_alive(e)]
+            if len(storage_nodes) < STORAGE_WRITE_QUORUM or down:
+                unavailable = ', '.join(list(skipped) + down)
+                logger.warning(f"Phase coordinator of Node {NODE_ID} aborts transaction {transaction_id} without voting - participants down or catching up: {unavailable}")
+                return {
+                    'success': False,
+                    'message': f"Participants down or catching up: {unavailable}",
+                    'transaction_id': transaction_id
+                }
+            if skipped:
+                logger.info(f"Phase coordinator of Node {NODE_ID} routes transaction {transaction_id} around storage nodes down or catching up: {', '.join(skipped)}")
         
         # Phase 1: Vote Phase - verify all participants are alive (gRPC)
         logger.info(f"Phase coordinator of Node {NODE_ID} starting vote phase for transaction {transaction_id}")
         all_votes_commit = True
+        abort_reasons = []
         channels = []
         participants = []  # Store (node_type, node_id, channel) tuples
+        streamed = {}  # size and sha256 of a streamed upload, returned with the result
         
-        # Vote with storage nodes
-        for endpoint in STORAGE_NODES:
-            node_id = endpoint.split(':')[0] if ':' in endpoint else endpoint
-            channel = self._create_channel(endpoint)
-            if not channel:
-                all_votes_commit = False
-                continue
-            channels.append(channel)
-            stub = twopc_pb2_grpc.VotePhaseServiceStub(channel)
-            participants.append(('storage', node_id, channel))
-            response = self._send_vote_request(stub, vote_request, node_id)
-            if not response or not response.vote_commit:
-                all_votes_commit = False
-        
-        # Vote with metadata nodes
-        for endpoint in METADATA_NODES:
-            node_id = endpoint.split(':')[0] if ':' in endpoint else endpoint
-            channel = self._create_channel(endpoint)
-            if not channel:
-                all_votes_commit = False
-                continue
-            channels.append(channel)
-            stub = twopc_pb2_grpc.VotePhaseServiceStub(channel)
-            participants.append(('metadata', node_id, channel))
-            response = self._send_vote_request(stub, vote_request, node_id)
-            if not response or not response.vote_commit:
-                all_votes_commit = False
+        for node_type, endpoints, vote_request in (('storage', storage_nodes, storage_vote_request),
+                                                   ('metadata', METADATA_NODES, metadata_vote_request)):
+            targets = []
+            for endpoint in endpoints:
+                node_id = endpoint.split(':')[0] if ':' in endpoint else endpoint
+                # Reuse the membership view's long-lived channel when there is one
+                shared_channel = self.membership.channel(endpoint) if self.membership else None
+                channel = shared_channel or self._create_channel(endpoint)
+                if not channel:
+                    all_votes_commit = False
+                    continue
+                if not shared_channel:
+                    channels.append(channel)
+                participants.append((node_type, node_id, channel))
+                targets.append((node_id, twopc_pb2_grpc.VotePhaseServiceStub(channel)))
+            
+            if node_type == 'storage' and upload_chunks is not None:
+                # Streamed upload: storage votes first, so the metadata vote carries the streamed size and hash
+                responses, size, sha256, stream_error = self._send_vote_streams(
+                    targets, transaction_id, vote_request.filename, upload_chunks)
+                if stream_error:
+                    all_votes_commit = False
+                    abort_reasons.append(stream_error)
+                streamed = {'size': size, 'sha256': sha256}
+                metadata_vote_request.metadata_json = json.dumps(
+                    dict(json.loads(metadata_vote_request.metadata_json), **streamed, modified_at=time.time()))
+            else:
+                responses = [(node_id, self._send_vote_request(stub, vote_request, node_id))
+                             for node_id, stub in targets]
+            
+            for node_id, response in responses:
+                if not response:
+                    all_votes_commit = False
+                elif not response.vote_commit:
+                    all_votes_commit = False
+                    abort_reasons.append(f"{node_id}: {response.message}")
         
         # Phase 2: Decision Phase
         logger.info(f"Phase coordinator of Node {NODE_ID} starting decision phase for transaction {transaction_id}")
@@ -139,7 +315,7 @@ class TwoPhaseCommitCoordinator:
             decision_stub = twopc_pb2_grpc.DecisionPhaseServiceStub(channel)
             self._send_decision(decision_stub, decision_request, node_id)
         
-        # Close channels
+        # Close per-transaction channels (shared membership channels stay open)
         for channel in channels:
             channel.close()
         
@@ -149,12 +325,197 @@ class TwoPhaseCommitCoordinator:
             return {
                 'success': True,
                 'message': 'All nodes validated and operations executed',
-                'transaction_id': transaction_id
+                'transaction_id': transaction_id,
+                **streamed
             }
         else:
-            logger.warning(f"Transaction {transaction_id} aborted - some nodes not alive")
+            logger.warning(f"Transaction {transaction_id} aborted - {'; '.join(abort_reasons) or 'some nodes not alive'}")
             return {
                 'success': False,
-                'message': 'Some nodes not alive',
+                'message': '; '.join(abort_reasons) or 'Some nodes not alive',
                 'transaction_id': transaction_id
             }
+    
+    def repair_replica(self, endpoint: str, filename: str) -> bool:
+        """
+        Bring one hinted name on a storage replica in line with the committed state, as a transaction
+        with that replica alone: the file is copied from a caught-up replica, or deleted if it is gone.
+        Returns whether the name is repaired
+        """
+        node_id = endpoint.split(':')[0] if ':' in endpoint else endpoint
+        try:
+            resp = http_client.get(f"{METADATA_API}/files/{filename}", pinned=True)
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"Phase coordinator of Node {NODE_ID} cannot read the record of {filename} to repair Node {node_id}: {e}")
+            return False
+        if resp.status_code not in (200, 404):
+            return False
+        record = resp.json() if resp.status_code == 200 else None
+        
+        transaction_id = str(uuid.uuid4())
+        logger.info(f"Phase coordinator of Node {NODE_ID} starting repair transaction {transaction_id} of {filename} on Node {node_id}")
+        channel = self.membership.channel(endpoint)
+        vote_stub = twopc_pb2_grpc.VotePhaseServiceStub(channel)
+        if record is None:
+            response = self._send_vote_request(vote_stub, twopc_pb2.VoteRequest(
+                transaction_id=transaction_id, operation="delete", filename=filename, node_id=NODE_ID), node_id)
+            # a replica without the file votes abort, which leaves it as repaired as the delete would
+            commit = bool(response and response.vote_commit)
+            repaired = response is not None
+        else:
+            sources = self.handoff.sources(STORAGE_NODES)
+            if not sources:
+                return False
+            source = sources[0].split(':')[0]
+            try:
+                download = http_client.get(f"http://{source}:{STORAGE_HTTP_PORT}/download",
+                                           params={"filename": filename}, stream=True)
+            except requests.exceptions.RequestException as e:
+                logger.warning(f"Phase coordinator of Node {NODE_ID} cannot copy {filename} from Node {source}: {e}")
+                return False
+            with download:
+                if download.status_code != 200:
+                    return False
+                responses, size, sha256, error = self._send_vote_streams(
+                    [(node_id, vote_stub)], transaction_id, filename, download.iter_content(REPAIR_CHUNK_SIZE))
+            response = responses[0][1]
+            # bytes that no longer match the record changed meanwhile; that change left a new hint
+            commit = repaired = bool(not error and response and response.vote_commit
+                                     and sha256 == record.get('sha256', sha256))
+        
+        self._send_decision(twopc_pb2_grpc.DecisionPhaseServiceStub(channel), twopc_pb2.DecisionRequest(
+            transaction_id=transaction_id, global_commit=commit, node_id=NODE_ID), node_id)
+        return repaired
+    
+    def execute_2pc_upload(self, filename: str, file_data: bytes, metadata: dict) -> dict:
+        """Execute 2PC protocol for file upload"""
+        transaction_id = str(uuid.uuid4())
+        logger.info(f"Phase coordinator of Node {NODE_ID} starting 2PC transaction {transaction_id}")
+        
+        # Encode file data to base64
+        file_data_b64 = base64.b64encode(file_data).decode('utf-8')
+        # content hash for ETags and integrity checks; the commit time is stamped here, once, so every
+        # metadata replica serves the same Last-Modified
+        metadata_json = json.dumps(dict(metadata, sha256=hashlib.sha256(file_data).hexdigest(), modified_at=time.time()))
+        
+        # Prepare role-specific vote requests: file bytes only go to storage nodes,
+        # metadata only goes to metadata nodes
+        storage_vote_request = twopc_pb2.VoteRequest(
+            transaction_id=transaction_id,
+            operation="upload",
+            filename=filename,
+            file_data=file_data_b64,
+            node_id=NODE_ID
+        )
+        metadata_vote_request = twopc_pb2.VoteRequest(
+            transaction_id=transaction_id,
+            operation="upload",
+            filename=filename,
+            metadata_json=metadata_json,
+            node_id=NODE_ID
+        )
+        return self._execute_2pc(transaction_id, storage_vote_request, metadata_vote_request)
+    
+    def execute_2pc_upload_stream(self, filename: str, chunks: Iterable[bytes], metadata: dict) -> dict:
+        """
+        Execute 2PC protocol for a file upload read from an iterable of byte chunks
+        Chunks are relayed to the storage nodes' VoteStream as they arrive, so memory per upload stays
+        at a few chunks whatever the file size. The committed record gets the size and sha256 of the
+        bytes streamed, and so does the result of a committed transaction (metadata is not modified)
+        """
+        transaction_id = str(uuid.uuid4())
+        logger.info(f"Phase coordinator of Node {NODE_ID} starting 2PC streamed upload transaction {transaction_id}")
+        
+        storage_vote_request = twopc_pb2.VoteRequest(
+            transaction_id=transaction_id,
+            operation="upload",
+            filename=filename,
+            node_id=NODE_ID
+        )
+        metadata_vote_request = twopc_pb2.VoteRequest(
+            transaction_id=transaction_id,
+            operation="upload",
+            filename=filename,
+            metadata_json=json.dumps(metadata),
+            node_id=NODE_ID
+        )
+        return self._execute_2pc(transaction_id, storage_vote_request, metadata_vote_request, upload_chunks=chunks)
+    
+    def execute_2pc_delete(self, filename: str) -> dict:
+        """Execute 2PC protocol for deleting a single file (bytes and metadata atomically)"""
+        transaction_id = str(uuid.uuid4())
+        logger.info(f"Phase coordinator of Node {NODE_ID} starting 2PC delete transaction {transaction_id}")
+        
+        vote_request = twopc_pb2.VoteRequest(
+            transaction_id=transaction_id,
+            operation="delete",
+            filename=filename,
+            node_id=NODE_ID
+        )
+        return self._execute_2pc(transaction_id, vote_request, vote_request)
+    
+    def execute_2pc_batch(self, operations: List[dict]) -> dict:
+        """
+        Execute 2PC protocol for a multi-file batch as one atomic transaction
+        Each operation is a dict: {"operation": "delete"|"move", "filename": ..., "new_filename": ...}
+        """
+        transaction_id = str(uuid.uuid4())
+        logger.info(f"Phase coordinator of Node {NODE_ID} starting 2PC batch transaction {transaction_id} ({len(operations)} operations)")
+        
+        storage_operations = []
+        metadata_operations = []
+        for op in operations:
+            operation = op.get('operation')
+            filename = op.get('filename')
+            new_filename = op.get('new_filename', '')
+            storage_operations.append(twopc_pb2.FileOperation(
+                operation=operation,
+                filename=filename,
+                new_filename=new_filename
+            ))
+            metadata_json = ''
+            if operation == "move":
+                metadata_json = json.dumps({"filename": new_filename, "path": f"/storage/{new_filename}"})
+            metadata_operations.append(twopc_pb2.FileOperation(
+                operation=operation,
+                filename=filename,
+                new_filename=new_filename,
+                metadata_json=metadata_json
+            ))
+        
+        storage_vote_request = twopc_pb2.VoteRequest(
+            transaction_id=transaction_id,
+            operation="batch",
+            node_id=NODE_ID,
+            operations=storage_operations
+        )
+        metadata_vote_request = twopc_pb2.VoteRequest(
+            transaction_id=transaction_id,
+            operation="batch",
+            node_id=NODE_ID,
+            operations=metadata_operations
+        )
+        return self._execute_2pc(transaction_id, storage_vote_request, metadata_vote_request)
+    
+    def execute_2pc_link(self, source: str, target: str, sha256: str) -> dict:
+        """
+        Execute 2PC protocol for an upload whose content is already stored under another name:
+        storage links target to source's bytes, metadata copies source's record (checked against sha256)
+        """
+        transaction_id = str(uuid.uuid4())
+        logger.info(f"Phase coordinator of Node {NODE_ID} starting 2PC link transaction {transaction_id}")
+        
+        storage_vote_request = twopc_pb2.VoteRequest(
+            transaction_id=transaction_id,
+            operation="batch",
+            node_id=NODE_ID,
+            operations=[twopc_pb2.FileOperation(operation="link", filename=source, new_filename=target)]
+        )
+        metadata_vote_request = twopc_pb2.VoteRequest(
+            transaction_id=transaction_id,
+            operation="batch",
+            node_id=NODE_ID,
+            operations=[twopc_pb2.FileOperation(operation="link", filename=source, new_filename=target,
+                                                metadata_json=json.dumps({"sha256": sha256, "modified_at": time.time()}))]
+        )
+        return self._execute_2pc(transaction_id, storage_vote_request, metadata_vote_request)
@@ -1,6 +1,11 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, Response
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
 import os
-import requests
+import sys
+import hashlib
+from common.balancer import register_replicas
+from common.http_client import InternalHTTPClient
+from common.load import install_load_report
 
 app = Flask(__name__)
 
@@ -9,6 +14,8 @@ NODE_ID = os.environ.get('NODE_ID', 'storage')
 
 STORAGE_PATH = "/storage"
 METADATA_API = "http://metadata:5005/files"
+http_client = InternalHTTPClient() # pooled keepalive client for calls to other services
+register_replicas(METADATA_API, os.environ.get("METADATA_ENDPOINTS")) # balance metadata calls over its replicas, if listed
 
 os.makedirs(STORAGE_PATH, exist_ok=True)
 
@@ -32,24 +39,32 @@ def upload_file():
     # Save file
     save_path = os.path.join(STORAGE_PATH, f.filename)
     try:
-        f.save(save_path)
+        os.makedirs(os.path.dirname(save_path), exist_ok=True)  # names may contain "/" (synced directories)
+        # saved aside and renamed: the old file may be hard-linked under another name (upload dedup)
+        f.save(save_path + ".tmp")
+        os.replace(save_path + ".tmp", save_path)
     except Exception as e:
         return jsonify({"error": f"Failed to save file: {e}"}), 500
 
-    # Build metadata
+    # Build metadata (content hash is served as the file's ETag)
     size = os.path.getsize(save_path)
+    digest = hashlib.sha256()
+    with open(save_path, "rb") as saved:
+        for block in iter(lambda: saved.read(1024 * 1024), b""):
+            digest.update(block)
     metadata = {
         "filename": f.filename,
         "path": save_path,
         "size": size,
         "version": 1,
+        "sha256": digest.hexdigest(),
         # "user": username,
         # "password": password
     }
 
     # Send metadata to metadata container
     try:
-        r = requests.post(METADATA_API, json=metadata)
+        r = http_client.post(METADATA_API, json=metadata)
         r.raise_for_status()
     except Exception as e:
         return jsonify({"error": f"Failed to save metadata: {e}"}), 500
@@ -68,7 +83,7 @@ def download_file():
 
     # Fetch metadata
     try:
-        r = requests.get(f"{METADATA_API}/{filename}")
+        r = http_client.get(f"{METADATA_API}/{filename}")
         r.raise_for_status()
         metadata = r.json()
     except Exception as e:
@@ -83,7 +98,10 @@ def download_file():
     if not os.path.exists(file_path):
         return jsonify({"error": "File not found"}), 404
 
-    return send_file(file_path, as_attachment=True)
+    # strong ETag from the content hash and Last-Modified from the commit time; If-None-Match /
+    # If-Modified-Since are answered with 304
+    return send_file(file_path, as_attachment=True, etag=metadata.get("sha256") or True,
+                     last_modified=metadata.get("modified_at"), conditional=True)
 
 # ---------------- Delete ----------------
 @app.route("/delete", methods=["DELETE"])
@@ -97,7 +115,7 @@ def delete_file():
 
     # Fetch metadata
     try:
-        r = requests.get(f"{METADATA_API}/{filename}")
+        r = http_client.get(f"{METADATA_API}/{filename}")
         r.raise_for_status()
         metadata = r.json()
     except Exception as e:
@@ -117,13 +135,33 @@ def delete_file():
 
     # Delete metadata
     try:
-        r = requests.delete(f"{METADATA_API}/{filename}")
+        r = http_client.delete(f"{METADATA_API}/{filename}")
         r.raise_for_status()
     except Exception as e:
         return jsonify({"error": f"Failed to delete metadata: {e}"}), 500
 
     return jsonify({"status": "deleted"}), 200
 
+# ---------------- Load (GET /load, polled by the backup service to throttle itself) ----------------
+def _transactions_in_progress():
+    # 2PC uploads and deletes arrive over gRPC, not HTTP: count the ones prepared and not decided yet
+    participant = sys.modules.get("twopc_participant")
+    return {"pending_transactions": len(participant.pending_transactions)} if participant else {}
+
+install_load_report(app, _transactions_in_progress)
+
+# ---------------- Health (polled by the gateways' replica balancer) ----------------
+@app.route("/health", methods=["GET"])
+def health():
+    if not os.access(STORAGE_PATH, os.W_OK):
+        return jsonify({"status": "storage path not writable"}), 503
+    return jsonify({"status": "ok"}), 200
+
+# ---------------- Metrics ----------------
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(generate_latest(), mimetype=CONTENT_TYPE_LATEST)
+
 # ---------------- Main ---------------- 
 if __name__ == "__main__":
     import sys
@@ -1,14 +1,19 @@
 """
 2PC Participant for Storage Node
-Vote phase: prepare file data (but don't save)
-Decision phase: commit (save file) or abort (discard)
+Vote phase: prepare file operations (but don't save/delete/move)
+Decision phase: commit (apply file operations) or abort (discard)
 """
 
+import asyncio
 import grpc
 import logging
 import os
+import threading
+import time
 import base64
+import shutil
 from concurrent import futures
+from prometheus_client import Counter, Gauge, Histogram
 
 try:
     from protos import twopc_pb2
@@ -22,59 +27,368 @@ logger = logging.getLogger(__name__)
 
 NODE_ID = os.environ.get('NODE_ID', 'storage')
 STORAGE_PATH = os.environ.get('STORAGE_PATH', '/storage')
-os.makedirs(STORAGE_PATH, exist_ok=True)
+# Streamed uploads are staged here and renamed into place on commit (same filesystem as STORAGE_PATH)
+STAGING_PATH = os.path.join(STORAGE_PATH, '.staging')
+os.makedirs(STAGING_PATH, exist_ok=True)
+
+# Participant server settings
+PARTICIPANT_SERVER_MODE = os.environ.get('PARTICIPANT_SERVER_MODE', 'thread')  # "thread" or "aio"
+PARTICIPANT_MAX_WORKERS = int(os.environ.get('PARTICIPANT_MAX_WORKERS', '10'))  # thread mode: RPCs served at once
+PARTICIPANT_MAX_CONCURRENT_RPCS = int(os.environ.get('PARTICIPANT_MAX_CONCURRENT_RPCS', '0')) or None  # 0 = unlimited
+PARTICIPANT_IO_WORKERS = int(os.environ.get('PARTICIPANT_IO_WORKERS', '8'))  # aio mode: threads for disk I/O
+
+# Metrics (exposed on this service's Flask /metrics endpoint)
+PHASE_LATENCY = Histogram('twopc_participant_rpc_seconds', 'Time this participant spends handling 2PC RPCs', ['phase'])
+VOTES = Counter('twopc_participant_votes_total', 'Votes cast by this participant', ['outcome'])
+DECISIONS = Counter('twopc_participant_decisions_total', 'Decisions received by this participant', ['decision'])
+PENDING_TRANSACTIONS = Gauge('twopc_participant_pending_transactions', 'Prepared transactions waiting for a decision')
 
 # Shared pending transactions between vote and decision phases
 pending_transactions = {}
+PENDING_TRANSACTIONS.set_function(lambda: len(pending_transactions))
 
+# Names held by prepared transactions until their decision, so two pending transactions never
+# change one file: a name a transaction writes (upload/link target, delete, move source and target)
+# is exclusive; the source of a link is only read, so links from one source do not conflict
+_reservations_lock = threading.Lock()
+_writers = {}  # name -> id of the transaction writing it
+_readers = {}  # name -> ids of the transactions reading it
 
-class StorageVotePhaseService(twopc_pb2_grpc.VotePhaseServiceServicer):
-    """Vote phase service - prepare file data but don't commit"""
+
+def _names_of(operation, filename, new_filename=""):
+    """(names written, names read) by one operation"""
+    if operation == "link":
+        return [new_filename], [filename]
+    return [filename] + ([new_filename] if new_filename else []), []
+
+
+def _reserve(transaction_id, written, read):
+    """Hold names for a transaction being prepared; ValueError (vote abort) if another holds one"""
+    with _reservations_lock:
+        for name in written:
+            if _writers.get(name, transaction_id) != transaction_id or _readers.get(name, set()) - {transaction_id}:
+                raise ValueError(f"{name} is being changed by another transaction")
+        for name in read:
+            if _writers.get(name, transaction_id) != transaction_id:
+                raise ValueError(f"{name} is being changed by another transaction")
+        for name in written:
+            _writers[name] = transaction_id
+        for name in read:
+            _readers.setdefault(name, set()).add(transaction_id)
+
+
+def _release(transaction_id, written, read):
+    with _reservations_lock:
+        for name in written:
+            if _writers.get(name) == transaction_id:
+                del _writers[name]
+        for name in read:
+            holders = _readers.get(name)
+            if holders is not None:
+                holders.discard(transaction_id)
+                if not holders:
+                    del _readers[name]
+
+
+def _finish_transaction(transaction_id):
+    """Drop a decided transaction and release its names"""
+    transaction = pending_transactions.pop(transaction_id)
+    _release(transaction_id, *transaction['names'])
+
+
+def _storage_path(filename):
+    """Where a file is stored; names may contain "/" (synced directories) but must stay inside STORAGE_PATH"""
+    root = os.path.abspath(STORAGE_PATH)
+    path = os.path.normpath(os.path.join(root, filename))
+    if not path.startswith(root + os.sep) or os.path.relpath(path, root).split(os.sep)[0] == '.staging':
+        raise ValueError(f"Invalid filename: {filename}")
+    return path
+
+
+def _prepare_operation(operation, filename, file_data_b64="", new_filename=""):
+    """Validate a single file operation and return what the decision phase needs to apply it"""
+    file_path = _storage_path(filename)
+    if operation == "upload":
+        # Prepare to save file (but don't commit yet)
+        return {
+            'operation': operation,
+            'filename': filename,
+            'file_data': base64.b64decode(file_data_b64),
+            'save_path': file_path
+        }
+    if operation == "delete":
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(f"File not found: {filename}")
+        return {
+            'operation': operation,
+            'filename': filename,
+            'file_path': file_path
+        }
+    if operation == "move":
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(f"File not found: {filename}")
+        if not new_filename:
+            raise ValueError(f"Missing target filename for move of {filename}")
+        return {
+            'operation': operation,
+            'filename': filename,
+            'file_path': file_path,
+            'new_path': _storage_path(new_filename)
+        }
+    if operation == "link":
+        # a new name for existing bytes (upload dedup by content hash)
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(f"File not found: {filename}")
+        if not new_filename:
+            raise ValueError(f"Missing target filename for link of {filename}")
+        return {
+            'operation': operation,
+            'filename': filename,
+            'file_path': file_path,
+            'new_path': _storage_path(new_filename)
+        }
+    raise ValueError(f"Unknown operation: {operation}")
+
+
+def _apply_operation(prepared, transaction_id):
+    """Execute a prepared file operation (decision phase, global-commit)"""
+    operation = prepared['operation']
+    if operation in ("upload", "move", "link"):
+        target = prepared['save_path'] if operation == "upload" else prepared['new_path']
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+    if operation == "upload":
+        if 'staging_path' in prepared:
+            os.replace(prepared['staging_path'], prepared['save_path'])
+        else:
+            # written aside and renamed: the old file may be hard-linked under another name
+            temp_path = f"{prepared['save_path']}.{transaction_id}.tmp"
+            with open(temp_path, 'wb') as f:
+                f.write(prepared['file_data'])
+            os.replace(temp_path, prepared['save_path'])
+        logger.info(f"Phase decision of Node {NODE_ID} committed transaction {transaction_id} - file saved to {prepared['save_path']}")
+    elif operation == "delete":
+        if os.path.exists(prepared['file_path']):
+            os.remove(prepared['file_path'])
+        logger.info(f"Phase decision of Node {NODE_ID} committed transaction {transaction_id} - file deleted from {prepared['file_path']}")
+    elif operation == "move":
+        os.replace(prepared['file_path'], prepared['new_path'])
+        logger.info(f"Phase decision of Node {NODE_ID} committed transaction {transaction_id} - file moved to {prepared['new_path']}")
+    elif operation == "link":
+        # a hard link shares the bytes; uploads always rename a new file into place, so neither name
+        # changes when the other is overwritten (copy where the filesystem has no hard links)
+        temp_path = f"{prepared['new_path']}.{transaction_id}.tmp"
+        try:
+            os.link(prepared['file_path'], temp_path)
+        except OSError:
+            shutil.copyfile(prepared['file_path'], temp_path)
+        os.replace(temp_path, prepared['new_path'])
+        logger.info(f"Phase decision of Node {NODE_ID} committed transaction {transaction_id} - {prepared['new_path']} linked to {prepared['file_path']}")
+
+
+def _discard_operation(prepared):
+    """Drop a prepared file operation (decision phase, global-abort)"""
+    staging_path = prepared.get('staging_path')
+    if staging_path and os.path.exists(staging_path):
+        os.remove(staging_path)
+
+
+def _observe_vote(response):
+    VOTES.labels(outcome='commit' if response.vote_commit else 'abort').inc()
+    return response
+
+
+@PHASE_LATENCY.labels(phase='vote').time()
+def handle_vote(request):
+    """Prepare the file operations of a VoteRequest and return this node's vote"""
+    logger.info(f"Phase vote of Node {NODE_ID} runs RPC VoteRequest called by Phase coordinator of Node {request.node_id}")
     
-    def Vote(self, request, context):
-        """Handle vote request from coordinator - prepare file data"""
-        logger.info(f"Phase vote of Node {NODE_ID} runs RPC VoteRequest called by Phase coordinator of Node {request.node_id}")
-        
-        transaction_id = request.transaction_id
-        operation = request.operation
-        
+    transaction_id = request.transaction_id
+    operation = request.operation
+    
+    names = None
+    try:
+        if operation == "batch":
+            touched = [op.filename for op in request.operations]
+            touched += [op.new_filename for op in request.operations if op.new_filename]
+            if len(set(touched)) != len(touched):
+                raise ValueError("Batch touches the same file more than once")
+            names = ([], [])
+            for op in request.operations:
+                written, read = _names_of(op.operation, op.filename, op.new_filename)
+                names[0].extend(written)
+                names[1].extend(read)
+        else:
+            names = _names_of(operation, request.filename)
+        # Reserved before the checks below, so what they find still holds when the decision comes
+        _reserve(transaction_id, *names)
         try:
-            if operation == "upload":
-                # Prepare to save file (but don't commit yet)
-                filename = request.filename
-                file_data_b64 = request.file_data
-                file_data = base64.b64decode(file_data_b64)
-                
-                # Check if we can save the file
-                save_path = os.path.join(STORAGE_PATH, filename)
-                
-                # Store transaction data for decision phase (prepare but don't commit)
-                pending_transactions[transaction_id] = {
-                    'operation': operation,
-                    'filename': filename,
-                    'file_data': file_data,
-                    'save_path': save_path
-                }
-                
-                logger.info(f"Phase vote of Node {NODE_ID} prepared transaction {transaction_id}")
-                return twopc_pb2.VoteResponse(
-                    vote_commit=True,
-                    message="Ready to commit",
-                    node_id=NODE_ID
-                )
+            if operation == "batch":
+                prepared = [
+                    _prepare_operation(op.operation, op.filename, op.file_data, op.new_filename)
+                    for op in request.operations
+                ]
             else:
-                return twopc_pb2.VoteResponse(
-                    vote_commit=False,
-                    message=f"Unknown operation: {operation}",
-                    node_id=NODE_ID
-                )
-        except Exception as e:
-            logger.error(f"Error in vote phase: {e}")
-            return twopc_pb2.VoteResponse(
-                vote_commit=False,
-                message=f"Error: {str(e)}",
+                prepared = [_prepare_operation(operation, request.filename, request.file_data)]
+        except Exception:
+            _release(transaction_id, *names)
+            raise
+        
+        # Store transaction data for decision phase (prepare but don't commit)
+        pending_transactions[transaction_id] = {
+            'operation': operation,
+            'operations': prepared,
+            'names': names
+        }
+        
+        logger.info(f"Phase vote of Node {NODE_ID} prepared transaction {transaction_id} ({len(prepared)} operation(s))")
+        return twopc_pb2.VoteResponse(
+            vote_commit=True,
+            message="Ready to commit",
+            node_id=NODE_ID
+        )
+    except (FileNotFoundError, ValueError) as e:
+        logger.warning(f"Phase vote of Node {NODE_ID} votes abort for transaction {transaction_id}: {e}")
+        return twopc_pb2.VoteResponse(
+            vote_commit=False,
+            message=str(e),
+            node_id=NODE_ID
+        )
+    except Exception as e:
+        logger.error(f"Error in vote phase: {e}")
+        return twopc_pb2.VoteResponse(
+            vote_commit=False,
+            message=f"Error: {str(e)}",
+            node_id=NODE_ID
+        )
+
+
+@PHASE_LATENCY.labels(phase='decision').time()
+def handle_decision(request):
+    """Commit or abort a prepared transaction and return the outcome"""
+    decision_type = "global-commit" if request.global_commit else "global-abort"
+    DECISIONS.labels(decision=decision_type).inc()
+    logger.info(f"Phase decision of Node {NODE_ID} runs RPC DecisionRequest called by Phase decision of Node {request.node_id}")
+    
+    transaction_id = request.transaction_id
+    
+    try:
+        if transaction_id not in pending_transactions:
+            return twopc_pb2.DecisionResponse(
+                success=False,
+                message="Transaction not found",
+                node_id=NODE_ID
+            )
+        
+        transaction = pending_transactions[transaction_id]
+        
+        if request.global_commit:
+            # Commit: actually apply the file operations (execute original HTTP API operations)
+            for prepared in transaction['operations']:
+                _apply_operation(prepared, transaction_id)
+            
+            # Remove from pending and release its names
+            _finish_transaction(transaction_id)
+            
+            return twopc_pb2.DecisionResponse(
+                success=True,
+                message="Transaction committed",
+                node_id=NODE_ID
+            )
+        else:
+            # Abort: discard the prepared transaction
+            for prepared in transaction['operations']:
+                _discard_operation(prepared)
+            logger.info(f"Phase decision of Node {NODE_ID} aborted transaction {transaction_id}")
+            _finish_transaction(transaction_id)
+            
+            return twopc_pb2.DecisionResponse(
+                success=True,
+                message="Transaction aborted",
                 node_id=NODE_ID
             )
+    except Exception as e:
+        logger.error(f"Error in decision phase: {e}")
+        return twopc_pb2.DecisionResponse(
+            success=False,
+            message=f"Error: {str(e)}",
+            node_id=NODE_ID
+        )
+
+
+class StagedUpload:
+    """Upload prepared through VoteStream - file bytes are written to the staging area as they arrive"""
+    
+    def __init__(self, first_chunk):
+        logger.info(f"Phase vote of Node {NODE_ID} runs RPC VoteStream called by Phase coordinator of Node {first_chunk.node_id}")
+        self.transaction_id = first_chunk.transaction_id
+        self.filename = first_chunk.filename
+        self.save_path = _storage_path(self.filename)
+        self.staging_path = os.path.join(STAGING_PATH, self.transaction_id)
+        self.file = open(self.staging_path, 'wb')
+    
+    def write(self, data):
+        self.file.write(data)
+    
+    def finish(self):
+        """Close the staged file and register the prepared upload for the decision phase"""
+        self.file.close()
+        names = _names_of("upload", self.filename)
+        _reserve(self.transaction_id, *names)  # ValueError: the caller discards the staged file and votes abort
+        pending_transactions[self.transaction_id] = {
+            'operation': "upload",
+            'operations': [{
+                'operation': "upload",
+                'filename': self.filename,
+                'staging_path': self.staging_path,
+                'save_path': self.save_path
+            }],
+            'names': names
+        }
+        logger.info(f"Phase vote of Node {NODE_ID} prepared transaction {self.transaction_id} (streamed upload)")
+        return twopc_pb2.VoteResponse(
+            vote_commit=True,
+            message="Ready to commit",
+            node_id=NODE_ID
+        )
+    
+    def discard(self):
+        self.file.close()
+        if os.path.exists(self.staging_path):
+            os.remove(self.staging_path)
+
+
+def _stream_vote_abort(staged, error):
+    logger.error(f"Error in streamed vote phase: {error}")
+    return twopc_pb2.VoteResponse(
+        vote_commit=False,
+        message=f"Error: {str(error)}" if staged or isinstance(error, Exception) else "Empty upload stream",
+        node_id=NODE_ID
+    )
+
+
+class StorageVotePhaseService(twopc_pb2_grpc.VotePhaseServiceServicer):
+    """Vote phase service - prepare file operations but don't commit"""
+    
+    def Vote(self, request, context):
+        """Handle vote request from coordinator - prepare file operations"""
+        return _observe_vote(handle_vote(request))
+    
+    @PHASE_LATENCY.labels(phase='vote_stream').time()
+    def VoteStream(self, request_iterator, context):
+        """Handle streamed upload prepare from coordinator - stage file bytes chunk by chunk"""
+        staged = None
+        try:
+            for chunk in request_iterator:
+                if staged is None:
+                    staged = StagedUpload(chunk)
+                staged.write(chunk.data)
+            if staged is None:
+                return _observe_vote(_stream_vote_abort(None, "empty stream"))
+            return _observe_vote(staged.finish())
+        except Exception as e:
+            if staged:
+                staged.discard()
+            return _observe_vote(_stream_vote_abort(staged, e))
 
 
 class StorageDecisionPhaseService(twopc_pb2_grpc.DecisionPhaseServiceServicer):
@@ -82,64 +396,106 @@ class StorageDecisionPhaseService(twopc_pb2_grpc.DecisionPhaseServiceServicer):
     
     def Decision(self, request, context):
         """Handle decision request from coordinator - execute or abort"""
-        decision_type = "global-commit" if request.global_commit else "global-abort"
-        logger.info(f"Phase decision of Node {NODE_ID} runs RPC DecisionRequest called by Phase decision of Node {request.node_id}")
-        
-        transaction_id = request.transaction_id
-        
+        return handle_decision(request)
+
+
+class StorageHeartbeatService(twopc_pb2_grpc.HeartbeatServiceServicer):
+    """Liveness check used by the coordinator's membership view"""
+    
+    def Heartbeat(self, request, context):
+        return twopc_pb2.HeartbeatResponse(node_id=NODE_ID, pending_transactions=len(pending_transactions))
+
+
+class AsyncStorageHeartbeatService(twopc_pb2_grpc.HeartbeatServiceServicer):
+    """Liveness check for the grpc.aio server - answered on the event loop, never queued behind disk I/O"""
+    
+    async def Heartbeat(self, request, context):
+        return twopc_pb2.HeartbeatResponse(node_id=NODE_ID, pending_transactions=len(pending_transactions))
+
+
+class AsyncStorageVotePhaseService(twopc_pb2_grpc.VotePhaseServiceServicer):
+    """Vote phase service for the grpc.aio server - disk work runs on a bounded executor"""
+    
+    def __init__(self, io_executor):
+        self.io_executor = io_executor
+    
+    async def Vote(self, request, context):
+        loop = asyncio.get_running_loop()
+        return _observe_vote(await loop.run_in_executor(self.io_executor, handle_vote, request))
+    
+    async def VoteStream(self, request_iterator, context):
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        staged = None
         try:
-            if transaction_id not in pending_transactions:
-                return twopc_pb2.DecisionResponse(
-                    success=False,
-                    message="Transaction not found",
-                    node_id=NODE_ID
-                )
-            
-            transaction = pending_transactions[transaction_id]
-            
-            if request.global_commit:
-                # Commit: actually save the file (execute original HTTP API operation)
-                if transaction['operation'] == "upload":
-                    with open(transaction['save_path'], 'wb') as f:
-                        f.write(transaction['file_data'])
-                    logger.info(f"Phase decision of Node {NODE_ID} committed transaction {transaction_id} - file saved to {transaction['save_path']}")
-                
-                # Remove from pending
-                del pending_transactions[transaction_id]
-                
-                return twopc_pb2.DecisionResponse(
-                    success=True,
-                    message="Transaction committed",
-                    node_id=NODE_ID
-                )
-            else:
-                # Abort: discard the prepared transaction
-                logger.info(f"Phase decision of Node {NODE_ID} aborted transaction {transaction_id}")
-                del pending_transactions[transaction_id]
-                
-                return twopc_pb2.DecisionResponse(
-                    success=True,
-                    message="Transaction aborted",
-                    node_id=NODE_ID
-                )
+            async for chunk in request_iterator:
+                if staged is None:
+                    staged = await loop.run_in_executor(self.io_executor, StagedUpload, chunk)
+                # The next chunk is only read once this one is on disk, so unread chunks stay in the
+                # HTTP/2 flow-control window and a fast sender is paced by this node's disk
+                await loop.run_in_executor(self.io_executor, staged.write, chunk.data)
+            if staged is None:
+                return _observe_vote(_stream_vote_abort(None, "empty stream"))
+            return _observe_vote(await loop.run_in_executor(self.io_executor, staged.finish))
+        except asyncio.CancelledError:
+            # Coordinator cancelled the stream (client upload interrupted) - nothing was prepared
+            if staged:
+                staged.discard()
+            raise
         except Exception as e:
-            logger.error(f"Error in decision phase: {e}")
-            return twopc_pb2.DecisionResponse(
-                success=False,
-                message=f"Error: {str(e)}",
-                node_id=NODE_ID
-            )
+            if staged:
+                await loop.run_in_executor(self.io_executor, staged.discard)
+            return _observe_vote(_stream_vote_abort(staged, e))
+        finally:
+            PHASE_LATENCY.labels(phase='vote_stream').observe(time.perf_counter() - start)
+
+
+class AsyncStorageDecisionPhaseService(twopc_pb2_grpc.DecisionPhaseServiceServicer):
+    """Decision phase service for the grpc.aio server - disk work runs on a bounded executor"""
+    
+    def __init__(self, io_executor):
+        self.io_executor = io_executor
+    
+    async def Decision(self, request, context):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.io_executor, handle_decision, request)
+
+
+async def serve_aio():
+    """Start the storage participant as a grpc.aio server with disk I/O on a bounded executor"""
+    io_executor = futures.ThreadPoolExecutor(max_workers=PARTICIPANT_IO_WORKERS, thread_name_prefix='storage-io')
+    server = grpc.aio.server(maximum_concurrent_rpcs=PARTICIPANT_MAX_CONCURRENT_RPCS)
+    
+    twopc_pb2_grpc.add_VotePhaseServiceServicer_to_server(AsyncStorageVotePhaseService(io_executor), server)
+    twopc_pb2_grpc.add_DecisionPhaseServiceServicer_to_server(AsyncStorageDecisionPhaseService(io_executor), server)
+    twopc_pb2_grpc.add_HeartbeatServiceServicer_to_server(AsyncStorageHeartbeatService(), server)
+    
+    port = os.environ.get('PARTICIPANT_PORT', '6001')
+    server.add_insecure_port(f'[::]:{port}')
+    await server.start()
+    logger.info(f"Storage participant aio server started on port {port} (io workers: {PARTICIPANT_IO_WORKERS}, max concurrent RPCs: {PARTICIPANT_MAX_CONCURRENT_RPCS or 'unlimited'})")
+    
+    try:
+        await server.wait_for_termination()
+    finally:
+        io_executor.shutdown(wait=False)
 
 
 def serve():
-    """Start the storage participant gRPC server"""
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+    """Start the storage participant gRPC server (PARTICIPANT_SERVER_MODE selects thread or aio)"""
+    if PARTICIPANT_SERVER_MODE == 'aio':
+        asyncio.run(serve_aio())
+        return
+    
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=PARTICIPANT_MAX_WORKERS),
+                         maximum_concurrent_rpcs=PARTICIPANT_MAX_CONCURRENT_RPCS)
     
     vote_service = StorageVotePhaseService()
     decision_service = StorageDecisionPhaseService()
     
     twopc_pb2_grpc.add_VotePhaseServiceServicer_to_server(vote_service, server)
     twopc_pb2_grpc.add_DecisionPhaseServiceServicer_to_server(decision_service, server)
+    twopc_pb2_grpc.add_HeartbeatServiceServicer_to_server(StorageHeartbeatService(), server)
     
     port = os.environ.get('PARTICIPANT_PORT', '6001')
     server.add_insecure_port(f'[::]:{port}')
@@ -24,23 +24,33 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x0btwopc.proto\x12\x05twopc\"\x85\x01\n\x0bVoteRequest\x12\x16\n\x0etransaction_id\x18\x01 \x01(\t\x12\x11\n\toperation\x18\x02 \x01(\t\x12\x10\n\x08\x66ilename\x18\x03 \x01(\t\x12\x11\n\tfile_data\x18\x04 \x01(\t\x12\x15\n\rmetadata_json\x18\x05 \x01(\t\x12\x0f\n\x07node_id\x18\x06 \x01(\t\"E\n\x0cVoteResponse\x12\x13\n\x0bvote_commit\x18\x01 \x01(\x08\x12\x0f\n\x07message\x18\x02 \x01(\t\x12\x0f\n\x07node_id\x18\x03 \x01(\t\"Q\n\x0f\x44\x65\x63isionRequest\x12\x16\n\x0etransaction_id\x18\x01 \x01(\t\x12\x15\n\rglobal_commit\x18\x02 \x01(\x08\x12\x0f\n\x07node_id\x18\x03 \x01(\t\"E\n\x10\x44\x65\x63isionResponse\x12\x0f\n\x07success\x18\x01 \x01(\x08\x12\x0f\n\x07message\x18\x02 \x01(\t\x12\x0f\n\x07node_id\x18\x03 \x01(\t2C\n\x10VotePhaseService\x12/\n\x04Vote\x12\x12.twopc.VoteRequest\x1a\x13.twopc.VoteResponse2S\n\x14\x44\x65\x63isionPhaseService\x12;\n\x08\x44\x65\x63ision\x12\x16.twopc.DecisionRequest\x1a\x17.twopc.DecisionResponseb\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x0btwopc.proto\x12\x05twopc\"t\n\rFileOperation\x12\x11\n\toperation\x18\x01 \x01(\t\x12\x10\n\x08\x66ilename\x18\x02 \x01(\t\x12\x14\n\x0cnew_filename\x18\x03 \x01(\t\x12\x11\n\tfile_data\x18\x04 \x01(\t\x12\x15\n\rmetadata_json\x18\x05 \x01(\t\"\xaf\x01\n\x0bVoteRequest\x12\x16\n\x0etransaction_id\x18\x01 \x01(\t\x12\x11\n\toperation\x18\x02 \x01(\t\x12\x10\n\x08\x66ilename\x18\x03 \x01(\t\x12\x11\n\tfile_data\x18\x04 \x01(\t\x12\x15\n\rmetadata_json\x18\x05 \x01(\t\x12\x0f\n\x07node_id\x18\x06 \x01(\t\x12(\n\noperations\x18\x07 \x03(\x0b\x32\x14.twopc.FileOperation\"T\n\tVoteChunk\x12\x16\n\x0etransaction_id\x18\x01 \x01(\t\x12\x10\n\x08\x66ilename\x18\x02 \x01(\t\x12\x0f\n\x07node_id\x18\x03 \x01(\t\x12\x0c\n\x04\x64\x61ta\x18\x04 \x01(\x0c\"E\n\x0cVoteResponse\x12\x13\n\x0bvote_commit\x18\x01 \x01(\x08\x12\x0f\n\x07message\x18\x02 \x01(\t\x12\x0f\n\x07node_id\x18\x03 \x01(\t\"Q\n\x0f\x44\x65\x63isionRequest\x12\x16\n\x0etransaction_id\x18\x01 \x01(\t\x12\x15\n\rglobal_commit\x18\x02 \x01(\x08\x12\x0f\n\x07node_id\x18\x03 \x01(\t\"E\n\x10\x44\x65\x63isionResponse\x12\x0f\n\x07success\x18\x01 \x01(\x08\x12\x0f\n\x07message\x18\x02 \x01(\t\x12\x0f\n\x07node_id\x18\x03 \x01(\t\"#\n\x10HeartbeatRequest\x12\x0f\n\x07node_id\x18\x01 \x01(\t\"B\n\x11HeartbeatResponse\x12\x0f\n\x07node_id\x18\x01 \x01(\t\x12\x1c\n\x14pending_transactions\x18\x02 \x01(\x05\x32z\n\x10VotePhaseService\x12/\n\x04Vote\x12\x12.twopc.VoteRequest\x1a\x13.twopc.VoteResponse\x12\x35\n\nVoteStream\x12\x10.twopc.VoteChunk\x1a\x13.twopc.VoteResponse(\x01\x32S\n\x14\x44\x65\x63isionPhaseService\x12;\n\x08\x44\x65\x63ision\x12\x16.twopc.DecisionRequest\x1a\x17.twopc.DecisionResponse2R\n\x10HeartbeatService\x12>\n\tHeartbeat\x12\x17.twopc.HeartbeatRequest\x1a\x18.twopc.HeartbeatResponseb\x06proto3')
 
 _globals = globals()
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
 _builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'twopc_pb2', _globals)
 if not _descriptor._USE_C_DESCRIPTORS:
   DESCRIPTOR._loaded_options = None
-  _globals['_VOTEREQUEST']._serialized_start=23
-  _globals['_VOTEREQUEST']._serialized_end=156
-  _globals['_VOTERESPONSE']._serialized_start=158
-  _globals['_VOTERESPONSE']._serialized_end=227
-  _globals['_DECISIONREQUEST']._serialized_start=229
-  _globals['_DECISIONREQUEST']._serialized_end=310
-  _globals['_DECISIONRESPONSE']._serialized_start=312
-  _globals['_DECISIONRESPONSE']._serialized_end=381
-  _globals['_VOTEPHASESERVICE']._serialized_start=383
-  _globals['_VOTEPHASESERVICE']._serialized_end=450
-  _globals['_DECISIONPHASESERVICE']._serialized_start=452
-  _globals['_DECISIONPHASESERVICE']._serialized_end=535
+  _globals['_FILEOPERATION']._serialized_start=22
+  _globals['_FILEOPERATION']._serialized_end=138
+  _globals['_VOTEREQUEST']._serialized_start=141
+  _globals['_VOTEREQUEST']._serialized_end=316
+  _globals['_VOTECHUNK']._serialized_start=318
+  _globals['_VOTECHUNK']._serialized_end=402
+  _globals['_VOTERESPONSE']._serialized_start=404
+  _globals['_VOTERESPONSE']._serialized_end=473
+  _globals['_DECISIONREQUEST']._serialized_start=475
+  _globals['_DECISIONREQUEST']._serialized_end=556
+  _globals['_DECISIONRESPONSE']._serialized_start=558
+  _globals['_DECISIONRESPONSE']._serialized_end=627
+  _globals['_HEARTBEATREQUEST']._serialized_start=629
+  _globals['_HEARTBEATREQUEST']._serialized_end=664
+  _globals['_HEARTBEATRESPONSE']._serialized_start=666
+  _globals['_HEARTBEATRESPONSE']._serialized_end=732
+  _globals['_VOTEPHASESERVICE']._serialized_start=734
+  _globals['_VOTEPHASESERVICE']._serialized_end=856
+  _globals['_DECISIONPHASESERVICE']._serialized_start=858
+  _globals['_DECISIONPHASESERVICE']._serialized_end=941
+  _globals['_HEARTBEATSERVICE']._serialized_start=943
+  _globals['_HEARTBEATSERVICE']._serialized_end=1025
 # @@protoc_insertion_point(module_scope)
@@ -5,7 +5,7 @@ import warnings
 
 import twopc_pb2 as twopc__pb2
 
-GRPC_GENERATED_VERSION = '1.74.0'
+GRPC_GENERATED_VERSION = '1.75.1'
 GRPC_VERSION = grpc.__version__
 _version_not_supported = False
 
@@ -40,6 +40,11 @@ class VotePhaseServiceStub(object):
                 request_serializer=twopc__pb2.VoteRequest.SerializeToString,
                 response_deserializer=twopc__pb2.VoteResponse.FromString,
                 _registered_method=True)
+        self.VoteStream = channel.stream_unary(
+                '/twopc.VotePhaseService/VoteStream',
+                request_serializer=twopc__pb2.VoteChunk.SerializeToString,
+                response_deserializer=twopc__pb2.VoteResponse.FromString,
+                _registered_method=True)
 
 
 class VotePhaseServiceServicer(object):
@@ -52,6 +57,13 @@ class VotePhaseServiceServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def VoteStream(self, request_iterator, context):
+        """Upload prepare with file bytes streamed in chunks
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
 
 def add_VotePhaseServiceServicer_to_server(servicer, server):
     rpc_method_handlers = {
@@ -60,6 +72,11 @@ def add_VotePhaseServiceServicer_to_server(servicer, server):
                     request_deserializer=twopc__pb2.VoteRequest.FromString,
                     response_serializer=twopc__pb2.VoteResponse.SerializeToString,
             ),
+            'VoteStream': grpc.stream_unary_rpc_method_handler(
+                    servicer.VoteStream,
+                    request_deserializer=twopc__pb2.VoteChunk.FromString,
+                    response_serializer=twopc__pb2.VoteResponse.SerializeToString,
+            ),
     }
     generic_handler = grpc.method_handlers_generic_handler(
             'twopc.VotePhaseService', rpc_method_handlers)
@@ -99,6 +116,33 @@ class VotePhaseService(object):
             metadata,
             _registered_method=True)
 
+    @staticmethod
+    def VoteStream(request_iterator,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.stream_unary(
+            request_iterator,
+            target,
+            '/twopc.VotePhaseService/VoteStream',
+            twopc__pb2.VoteChunk.SerializeToString,
+            twopc__pb2.VoteResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
 
 class DecisionPhaseServiceStub(object):
     """Service for Decision Phase
@@ -173,3 +217,78 @@ class DecisionPhaseService(object):
             timeout,
             metadata,
             _registered_method=True)
+
+
+class HeartbeatServiceStub(object):
+    """Service for liveness checks by the coordinator
+    """
+
+    def __init__(self, channel):
+        """Constructor.
+
+        Args:
+            channel: A grpc.Channel.
+        """
+        self.Heartbeat = channel.unary_unary(
+                '/twopc.HeartbeatService/Heartbeat',
+                request_serializer=twopc__pb2.HeartbeatRequest.SerializeToString,
+                response_deserializer=twopc__pb2.HeartbeatResponse.FromString,
+                _registered_method=True)
+
+
+class HeartbeatServiceServicer(object):
+    """Service for liveness checks by the coordinator
+    """
+
+    def Heartbeat(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+
+def add_HeartbeatServiceServicer_to_server(servicer, server):
+    rpc_method_handlers = {
+            'Heartbeat': grpc.unary_unary_rpc_method_handler(
+                    servicer.Heartbeat,
+                    request_deserializer=twopc__pb2.HeartbeatRequest.FromString,
+                    response_serializer=twopc__pb2.HeartbeatResponse.SerializeToString,
+            ),
+    }
+    generic_handler = grpc.method_handlers_generic_handler(
+            'twopc.HeartbeatService', rpc_method_handlers)
+    server.add_generic_rpc_handlers((generic_handler,))
+    server.add_registered_method_handlers('twopc.HeartbeatService', rpc_method_handlers)
+
+
+ # This class is part of an EXPERIMENTAL API.
+class HeartbeatService(object):
+    """Service for liveness checks by the coordinator
+    """
+
+    @staticmethod
+    def Heartbeat(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/twopc.HeartbeatService/Heartbeat',
+            twopc__pb2.HeartbeatRequest.SerializeToString,
+            twopc__pb2.HeartbeatResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)